@@ -0,0 +1,56 @@
+from dataclasses import dataclass
+from typing import List, Dict, Optional, Tuple, Type
+
+import ray
+from ray import ObjectRef
+
+from backtester.loop.vectorized_loop import VectorizedLoop, VectorizedLoopState
+from backtester.models.instrument import Instrument
+from backtester.models.portfolio import Portfolio
+from backtester.strategy.base import BaseStrategy
+from common.pandas.df_utils import concat
+
+
+@dataclass
+class ShardRunSummary:
+    shard_id: int
+    final_balance: Optional[float]
+    num_trades: int
+
+
+# Holds one time shard of featurizer result blocks and runs VectorizedLoop over it, continuing from state of the
+# previous shard's run with the same params. Blocks are read from object store once, featurization is not repeated
+@ray.remote
+class VectorizedShardWorkerActor:
+
+    def __init__(
+        self,
+        shard_id: int,
+        block_refs: List[ObjectRef],
+        portfolio: Portfolio,
+        mid_price_columns: Dict[Instrument, str]
+    ):
+        self.shard_id = shard_id
+        self.loop: Optional[VectorizedLoop] = None
+        if len(block_refs) > 0:
+            loop = VectorizedLoop(concat(ray.get(block_refs)), portfolio, mid_price_columns)
+            if len(loop.timestamps) > 0:
+                self.loop = loop
+        print(f'[Shard {shard_id}] Loaded {0 if self.loop is None else len(self.loop.timestamps)} rows')
+
+    def run(
+        self,
+        strategy_class: Type[BaseStrategy],
+        params: Optional[Dict],
+        state: Optional[VectorizedLoopState]
+    ) -> Tuple[ShardRunSummary, Optional[VectorizedLoopState]]:
+        if self.loop is None:
+            # nothing to trade on, state is passed to next shard as is
+            return ShardRunSummary(shard_id=self.shard_id, final_balance=None, num_trades=0), state
+        res = self.loop.run(strategy_class.vectorized_signals, params, state)
+        summary = ShardRunSummary(
+            shard_id=self.shard_id,
+            final_balance=res.final_balance(),
+            num_trades=sum(len(trades.rows) for trades in res.trades.values())
+        )
+        return summary, res.state
@@ -1,12 +1,14 @@
-import copy
 import uuid
-from dataclasses import dataclass
-from typing import List, Dict
+from typing import List, Dict, Set, Tuple, Union
+
+import numpy as np
+
 from backtester.clock import Clock
 from backtester.models.instrument import Instrument, AssetInstrument
 from backtester.models.order import Order, OrderStatus, OrderType, OrderSide
 from backtester.models.portfolio import Portfolio, PortfolioBalanceRecord
 from backtester.models.trade import Trade
+from backtester.models.wallet import WalletBalance
 from featurizer.feature_stream.feature_stream_generator import FeatureStreamGenerator
 
 COMMISSION = 0.005 # TODO make dynamic
@@ -16,29 +18,50 @@ COMMISSION = 0.005 # TODO make dynamic
 
 
 class ExecutionSimulator:
-    @dataclass
-    class _State:
-        portfolio: Portfolio
-        mid_prices: Dict[Instrument, float]
-        timestamp: float
-        total_balance: float
 
     def __init__(self, clock: Clock, portfolio: Portfolio, feature_generator: FeatureStreamGenerator):
         self.clock = clock
         self.orders: List[Order] = []
         self.portfolio: Portfolio = portfolio
         self.feature_generator = feature_generator
-        self.state_snapshots: List[ExecutionSimulator._State] = []
         self.executed_trades: Dict[Instrument, List[Trade]] = {}
 
+        # state history is kept as columns instead of portfolio copies: a row per changed wallet balance
+        # and a row per wallet mid price for each snapshot
+        self._snapshot_timestamps: List[float] = []
+        self._balance_snapshot_ids: List[int] = []
+        self._balance_wallet_ids: List[int] = []
+        self._balance_free: List[float] = []
+        self._balance_locked: List[float] = []
+        self._price_snapshot_ids: List[int] = []
+        self._price_wallet_ids: List[int] = []
+        self._price_mid_prices: List[float] = []
+        self._dirty_wallet_ids: Set[int] = set()
+        self._initial_free = np.array([wallet.free_balance() for wallet in portfolio.wallets])
+        self._initial_locked = np.array([wallet.locked_balance() for wallet in portfolio.wallets])
+
+        self._quote_wallet_id = portfolio.get_wallet_id(portfolio.quote)
+        # (wallet_id, instrument quoted in portfolio quote) for all non-quote wallets
+        self._priced_wallets: List[Tuple[int, Instrument]] = [
+            (wallet_id, Instrument.from_asset_instruments(base=wallet.asset_instrument, quote=portfolio.quote))
+            for wallet_id, wallet in enumerate(portfolio.wallets)
+            if wallet_id != self._quote_wallet_id
+        ]
+
     def stage_for_execution(self, orders: List[Order]):
         if len(orders) > 0:
-            self.orders.extend(orders)
+            self._add_staged_orders(orders)
+            # quantities were locked when orders were made
+            self._mark_dirty(orders)
             self._record_state_snapshot()
 
+    def _add_staged_orders(self, orders: List[Order]):
+        self.orders.extend(orders)
+
     def update_state(self):
         trades = self._execute_staged_orders()
         if len(trades) > 0:
+            self._mark_dirty(trades)
             for trade in trades:
                 if trade.instrument in self.executed_trades:
                     self.executed_trades[trade.instrument].append(trade)
@@ -75,6 +98,8 @@ class ExecutionSimulator:
                     if order.price >= mid_prices[order.instrument]:
                         res.append(self._execute_order(order))
 
+        # filled and cancelled orders are not rescanned on next updates
+        self.orders = [order for order in self.orders if order.status != OrderStatus.CANCELLED and order.status != OrderStatus.FILLED]
         return res
 
     def _execute_order(self, order: Order) -> Trade:
@@ -137,44 +162,77 @@ class ExecutionSimulator:
         order.status = OrderStatus.FILLED
         return trade
 
+    def _mark_dirty(self, orders_or_trades: List[Union[Order, Trade]]):
+        for order in orders_or_trades:
+            base_asset_instr, quote_asset_instr = order.instrument.to_asset_instruments()
+            self._dirty_wallet_ids.add(self.portfolio.get_wallet_id(base_asset_instr))
+            self._dirty_wallet_ids.add(self.portfolio.get_wallet_id(quote_asset_instr))
+
+    # appends balances of wallets changed since previous snapshot and mid prices of all priced wallets,
+    # totals are computed from these columns only when requested
     def _record_state_snapshot(self):
-        quote_wallet = self.portfolio.get_wallet(self.portfolio.quote)
-        total_balance = quote_wallet.total_balance()
+        snapshot_id = len(self._snapshot_timestamps)
+        self._snapshot_timestamps.append(self.clock.now)
+        for wallet_id in self._dirty_wallet_ids:
+            wallet = self.portfolio.wallets[wallet_id]
+            self._balance_snapshot_ids.append(snapshot_id)
+            self._balance_wallet_ids.append(wallet_id)
+            self._balance_free.append(wallet.free_balance())
+            self._balance_locked.append(wallet.locked_balance())
+        self._dirty_wallet_ids.clear()
 
         mid_prices = self.feature_generator.get_cur_mid_prices()
-        for wallet in self.portfolio.wallets:
-            asset_instrument = wallet.asset_instrument
-            if asset_instrument == self.portfolio.quote:
-                continue
-            instrument = Instrument.from_asset_instruments(base=asset_instrument, quote=self.portfolio.quote)
+        for wallet_id, instrument in self._priced_wallets:
             if instrument not in mid_prices:
                 # TODO why?
-                # raise ValueError(f'Can not find mid_price for {instrument}, prices: {mid_prices}')
                 continue
-            mid_price = mid_prices[instrument]
-            wallet = self.portfolio.get_wallet(asset_instrument)
-            total_balance += (wallet.total_balance() * mid_price)
-
-        snapshot = ExecutionSimulator._State(
-            portfolio=copy.deepcopy(self.portfolio),
-            # TODO this records different mid_price for same ts, why?
-            mid_prices=copy.deepcopy(mid_prices),
-            timestamp=self.clock.now,
-            total_balance=total_balance
-        )
-        self.state_snapshots.append(snapshot)
+            self._price_snapshot_ids.append(snapshot_id)
+            self._price_wallet_ids.append(wallet_id)
+            self._price_mid_prices.append(mid_prices[instrument])
+
+    # free and locked balances per snapshot and wallet, shape (num_snapshots, num_wallets)
+    def _get_balances_per_snapshot(self) -> Tuple[np.ndarray, np.ndarray]:
+        num_snapshots = len(self._snapshot_timestamps)
+        num_wallets = len(self.portfolio.wallets)
+        # last balance change row per snapshot and wallet, -1 is initial balance
+        change_rows = np.full((num_snapshots, num_wallets), -1)
+        change_rows[self._balance_snapshot_ids, self._balance_wallet_ids] = np.arange(len(self._balance_snapshot_ids))
+        change_rows = np.maximum.accumulate(change_rows, axis=0)
+
+        free = np.append(self._balance_free, 0.0)[change_rows]
+        locked = np.append(self._balance_locked, 0.0)[change_rows]
+        initial = change_rows == -1
+        free[initial] = np.broadcast_to(self._initial_free, free.shape)[initial]
+        locked[initial] = np.broadcast_to(self._initial_locked, locked.shape)[initial]
+        return free, locked
+
+    def get_total_balances(self) -> Tuple[np.ndarray, np.ndarray]:
+        free, locked = self._get_balances_per_snapshot()
+        return np.asarray(self._snapshot_timestamps), self._get_totals(free, locked)
+
+    def _get_totals(self, free: np.ndarray, locked: np.ndarray) -> np.ndarray:
+        # quote wallet is worth its balance, others are worth their balance at mid price of snapshot,
+        # wallets without mid price in a snapshot are not counted
+        mid_prices = np.zeros(free.shape)
+        mid_prices[:, self._quote_wallet_id] = 1.0
+        mid_prices[self._price_snapshot_ids, self._price_wallet_ids] = self._price_mid_prices
+        return ((free + locked) * mid_prices).sum(axis=1)
 
     def get_portfolio_balances(self) -> List[PortfolioBalanceRecord]:
+        free, locked = self._get_balances_per_snapshot()
+        timestamps = self._snapshot_timestamps
+        totals = self._get_totals(free, locked)
+        asset_instruments = [wallet.asset_instrument for wallet in self.portfolio.wallets]
         records = []
-        for s in self.state_snapshots:
-            record = PortfolioBalanceRecord(
-                timestamp=s.timestamp,
-                total=s.total_balance,
-                per_wallet={}
-            )
-            for wallet in s.portfolio.wallets:
-                record.per_wallet[wallet.asset_instrument] = wallet.get_free_and_locked_balance()
-            records.append(record)
+        for i in range(len(timestamps)):
+            records.append(PortfolioBalanceRecord(
+                timestamp=timestamps[i],
+                total=float(totals[i]),
+                per_wallet={
+                    asset_instrument: WalletBalance(float(free[i, wallet_id]), float(locked[i, wallet_id]))
+                    for wallet_id, asset_instrument in enumerate(asset_instruments)
+                }
+            ))
         return records
 
     def get_executed_trades(self) -> Dict[Instrument, List[Trade]]:
@@ -0,0 +1,243 @@
+import heapq
+import itertools
+import uuid
+from collections import deque
+from typing import List, Dict, Tuple, Optional, Deque
+
+from backtester.clock import Clock
+from backtester.execution.execution_simulator import ExecutionSimulator, COMMISSION
+from backtester.models.instrument import Instrument
+from backtester.models.order import Order, OrderStatus, OrderType, OrderSide
+from backtester.models.portfolio import Portfolio
+from backtester.models.trade import Trade
+from featurizer.data_definitions.data_definition import Event
+from featurizer.feature_stream.feature_stream_generator import FeatureStreamGenerator
+from featurizer.features.definitions.l2_book.l2_snapshot_fd.l2_snapshot_fd import L2SnapshotFD, level_column
+from featurizer.features.feature_tree.feature_tree import Feature
+
+# relative remaining quantity below which order is considered filled
+_FILL_EPS = 1e-9
+
+
+class _InstrumentOrderBook:
+
+    def __init__(self):
+        # market orders are matched first, in arrival order
+        self.market_orders: Deque[Order] = deque()
+        # best limit first: (-price, seq, order) for buys, (price, seq, order) for sells
+        self.buy_limit_orders: List[Tuple[float, int, Order]] = []
+        self.sell_limit_orders: List[Tuple[float, int, Order]] = []
+        # size taken from levels of current snapshot by previous fills, per side, so same liquidity is not used twice
+        self.consumed_snapshot: Optional[Event] = None
+        self.consumed: Dict[str, Dict[int, float]] = {'bid': {}, 'ask': {}}
+
+    def is_empty(self) -> bool:
+        return len(self.market_orders) == 0 and len(self.buy_limit_orders) == 0 and len(self.sell_limit_orders) == 0
+
+
+# Execution against L2 snapshots (L2SnapshotFD) of the feature stream instead of mid price with infinite liquidity.
+# Orders become matchable latency_s after they are staged. Matchable orders are kept in an open order book per
+# instrument: a queue of market orders and price-ordered heaps of limit orders, so on each update only the best
+# limit orders of each side are checked for crossing and matching stops at the first one which does not cross.
+# Fills walk book levels from best price until order quantity, limit price or locked quote (for buys) is reached,
+# so matching is O(levels touched); VWAP of touched levels is the fill price. Orders not fully filled by current
+# snapshot stay open as partially filled. Fills are in base quantity with commission as in ExecutionSimulator
+class L2ExecutionSimulator(ExecutionSimulator):
+
+    def __init__(self, clock: Clock, portfolio: Portfolio, feature_generator: FeatureStreamGenerator, latency_s: float = 0.0):
+        super(L2ExecutionSimulator, self).__init__(clock, portfolio, feature_generator)
+        self.latency_s = latency_s
+        # (activation_ts, seq, order) of staged orders not yet matchable
+        self._pending_orders: List[Tuple[float, int, Order]] = []
+        self._books: Dict[Instrument, _InstrumentOrderBook] = {}
+        self._open_orders: Dict[str, Order] = {}
+        self._seq = itertools.count()
+        self._l2_features: Dict[Instrument, Feature] = {}
+
+    def _add_staged_orders(self, orders: List[Order]):
+        activation_ts = self.clock.now + self.latency_s
+        for order in orders:
+            if order.type == OrderType.LIMIT and order.price is None:
+                raise ValueError(f'Limit order {order.order_id} should have price')
+            self._open_orders[order.order_id] = order
+            heapq.heappush(self._pending_orders, (activation_ts, next(self._seq), order))
+
+    def cancel_order(self, order_id: str):
+        order = self._open_orders.pop(order_id, None)
+        if order is None:
+            raise ValueError(f'Can not cancel {order_id}: not open')
+        order.status = OrderStatus.CANCELLED
+        self._release_lock(order)
+        # cancelled orders are dropped from book heaps lazily, when they reach the top
+        self._mark_dirty([order])
+        self._record_state_snapshot()
+
+    def _execute_staged_orders(self) -> List[Trade]:
+        while len(self._pending_orders) > 0 and self._pending_orders[0][0] <= self.clock.now:
+            _, seq, order = heapq.heappop(self._pending_orders)
+            if order.status == OrderStatus.CANCELLED:
+                continue
+            book = self._books.get(order.instrument)
+            if book is None:
+                book = _InstrumentOrderBook()
+                self._books[order.instrument] = book
+            if order.type == OrderType.MARKET:
+                book.market_orders.append(order)
+            elif order.side == OrderSide.BUY:
+                heapq.heappush(book.buy_limit_orders, (-order.price, seq, order))
+            else:
+                heapq.heappush(book.sell_limit_orders, (order.price, seq, order))
+
+        res = []
+        for instrument, book in self._books.items():
+            if book.is_empty():
+                continue
+            snap = self._get_cur_snapshot(instrument)
+            if snap is None:
+                continue
+            if snap is not book.consumed_snapshot:
+                book.consumed_snapshot = snap
+                book.consumed = {'bid': {}, 'ask': {}}
+
+            while len(book.market_orders) > 0:
+                order = book.market_orders[0]
+                if order.status == OrderStatus.CANCELLED:
+                    book.market_orders.popleft()
+                    continue
+                trade = self._match_order(order, book, snap)
+                if trade is not None:
+                    res.append(trade)
+                if order.status != OrderStatus.FILLED:
+                    # no liquidity left in this snapshot
+                    break
+                book.market_orders.popleft()
+
+            for orders in [book.buy_limit_orders, book.sell_limit_orders]:
+                while len(orders) > 0:
+                    order = orders[0][2]
+                    if order.status == OrderStatus.CANCELLED:
+                        heapq.heappop(orders)
+                        continue
+                    trade = self._match_order(order, book, snap)
+                    if trade is not None:
+                        res.append(trade)
+                    if order.status != OrderStatus.FILLED:
+                        # does not cross or no liquidity left, worse orders do not cross either
+                        break
+                    heapq.heappop(orders)
+
+        return res
+
+    def _get_cur_snapshot(self, instrument: Instrument) -> Optional[Event]:
+        data_event = self.feature_generator.cur_out_event
+        if data_event is None:
+            return None
+        feature = self._l2_features.get(instrument)
+        if feature is None:
+            feature = FeatureStreamGenerator.get_feature_for_instrument(data_event, instrument, feature_definition=L2SnapshotFD)
+            if feature is None:
+                return None
+            self._l2_features[instrument] = feature
+        return data_event.feature_values.get(feature)
+
+    # fills as much of order as current snapshot allows, returns None if nothing was filled
+    def _match_order(self, order: Order, book: _InstrumentOrderBook, snap: Event) -> Optional[Trade]:
+        base_asset_instr, quote_asset_instr = order.instrument.to_asset_instruments()
+        remaining_qty = order.quantity - order.filled_quantity
+        if remaining_qty <= _FILL_EPS * order.quantity:
+            self._complete_order(order)
+            return None
+
+        if order.side == OrderSide.BUY:
+            # buys are limited by quote locked when order was made
+            quote_wallet = self.portfolio.get_wallet(quote_asset_instr)
+            quote_budget = quote_wallet.locked.get(order.order_id, 0.0)
+            base_qty, quote_qty, budget_exhausted = self._take_liquidity(book, snap, 'ask', remaining_qty, order.price, quote_budget)
+        else:
+            base_qty, quote_qty, budget_exhausted = self._take_liquidity(book, snap, 'bid', remaining_qty, order.price, None)
+
+        if base_qty > 0:
+            order.filled_quantity += base_qty
+            price = quote_qty / base_qty
+            if order.side == OrderSide.BUY:
+                self.portfolio.get_wallet(quote_asset_instr).unlock_partial(order.order_id, quote_qty)
+                commission = base_qty * COMMISSION
+                trade_qty = base_qty - commission
+                self.portfolio.get_wallet(base_asset_instr).deposit(trade_qty)
+            else:
+                self.portfolio.get_wallet(base_asset_instr).unlock_partial(order.order_id, base_qty)
+                commission = quote_qty * COMMISSION
+                trade_qty = base_qty
+                self.portfolio.get_wallet(quote_asset_instr).deposit(quote_qty - commission)
+            trade = Trade(
+                trade_id=str(uuid.uuid4()),
+                order_id=order.order_id,
+                timestamp=self.clock.now,
+                instrument=order.instrument,
+                side=order.side,
+                trade_type=order.type,
+                quantity=trade_qty,
+                price=price,
+                commission=commission
+            )
+        else:
+            trade = None
+
+        if budget_exhausted or order.quantity - order.filled_quantity <= _FILL_EPS * order.quantity:
+            self._complete_order(order)
+        elif base_qty > 0:
+            order.status = OrderStatus.PARTIALLY_FILLED
+        return trade
+
+    # walks levels of a snapshot side from best price, returns (base qty, quote qty, whether quote budget is exhausted)
+    def _take_liquidity(
+        self,
+        book: _InstrumentOrderBook,
+        snap: Event,
+        side: str,
+        qty: float,
+        limit_price: Optional[float],
+        quote_budget: Optional[float]
+    ) -> Tuple[float, float, bool]:
+        consumed = book.consumed[side]
+        base_qty = 0.0
+        quote_qty = 0.0
+        # levels are walked lazily so cost does not depend on snapshot depth (full book snapshots included)
+        for level in itertools.count():
+            px_col, sz_col = level_column(level, side)
+            price = snap.get(px_col)
+            if price is None or price != price:
+                # past snapshot depth or nan padding, no more levels
+                break
+            if limit_price is not None and (price > limit_price if side == 'ask' else price < limit_price):
+                break
+            available = snap[sz_col] - consumed.get(level, 0.0)
+            if available <= 0:
+                continue
+            take = min(available, qty - base_qty)
+            budget_exhausted = False
+            if quote_budget is not None and take * price >= quote_budget - quote_qty:
+                take = (quote_budget - quote_qty) / price
+                budget_exhausted = True
+            consumed[level] = consumed.get(level, 0.0) + take
+            base_qty += take
+            quote_qty += take * price
+            if budget_exhausted:
+                return base_qty, quote_qty, True
+            if base_qty >= qty:
+                break
+        return base_qty, quote_qty, False
+
+    def _complete_order(self, order: Order):
+        order.status = OrderStatus.FILLED
+        self._open_orders.pop(order.order_id, None)
+        self._release_lock(order)
+        # released lock is recorded with next snapshot even if there was no fill
+        self._mark_dirty([order])
+
+    # returns quantity left locked by order back to balance
+    def _release_lock(self, order: Order):
+        base_asset_instr, quote_asset_instr = order.instrument.to_asset_instruments()
+        wallet = self.portfolio.get_wallet(quote_asset_instr if order.side == OrderSide.BUY else base_asset_instr)
+        if order.order_id in wallet.locked:
+            wallet.unlock_to_balance(order.order_id)
@@ -0,0 +1,139 @@
+import unittest
+import uuid
+from typing import List
+
+import numpy as np
+import pandas as pd
+
+from backtester.clock import Clock
+from backtester.execution.execution_simulator import ExecutionSimulator
+from backtester.models.instrument import AssetInstrument
+from backtester.models.order import Order, OrderSide, OrderType, OrderStatus
+from backtester.models.portfolio import Portfolio
+from backtester.models.wallet import Wallet
+from backtester.testing_utils import MOCK_INSTRUMENTS, FrameFeatureStreamGenerator, mock_mid_price_feature
+
+
+class TestExecutionSimulator(unittest.TestCase):
+
+    def _portfolio(self) -> Portfolio:
+        quote = AssetInstrument('BINANCE', 'spot', 'USDT')
+        wallets = [
+            Wallet(asset_instrument=AssetInstrument('BINANCE', 'spot', 'BTC'), balance=1),
+            Wallet(asset_instrument=quote, balance=10000),
+            Wallet(asset_instrument=AssetInstrument('BINANCE', 'spot', 'ETH'), balance=0),
+            # no prices for this one, not counted in totals
+            Wallet(asset_instrument=AssetInstrument('BINANCE', 'spot', 'SOL'), balance=5),
+        ]
+        return Portfolio(wallets=wallets, quote=quote)
+
+    def _make_order(self, portfolio: Portfolio, side: OrderSide, instrument, qty: float, price: float) -> Order:
+        order_id = str(uuid.uuid4())
+        base, quote = instrument.to_asset_instruments()
+        if side == OrderSide.BUY:
+            portfolio.get_wallet(quote).lock_from_balance(order_id, qty * price)
+        else:
+            portfolio.get_wallet(base).lock_from_balance(order_id, qty)
+        return Order(order_id=order_id, type=OrderType.MARKET, side=side, instrument=instrument, price=price, quantity=qty, status=OrderStatus.OPEN)
+
+    def test_portfolio_balances(self):
+        num_rows = 500
+        rng = np.random.default_rng(2)
+        features = [mock_mid_price_feature(instrument) for instrument in MOCK_INSTRUMENTS]
+        data = {'timestamp': np.arange(num_rows, dtype=float)}
+        for feature in features:
+            data[f'{feature}-mid_price'] = 100 + rng.normal(0, 1, num_rows).cumsum()
+        generator = FrameFeatureStreamGenerator(pd.DataFrame(data), features)
+
+        clock = Clock(-1)
+        portfolio = self._portfolio()
+        simulator = ExecutionSimulator(clock, portfolio, generator)
+        expected = []
+
+        def _record_expected():
+            mid_prices = generator.get_cur_mid_prices()
+            total = portfolio.get_wallet(portfolio.quote).total_balance()
+            for instrument in MOCK_INSTRUMENTS:
+                base, _ = instrument.to_asset_instruments()
+                total += portfolio.get_wallet(base).total_balance() * mid_prices[instrument]
+            per_wallet = {w.asset_instrument: w.get_free_and_locked_balance() for w in portfolio.wallets}
+            expected.append((clock.now, total, per_wallet))
+
+        while generator.has_next():
+            event = generator.next()
+            clock.set(event.timestamp)
+            orders: List[Order] = []
+            row = int(event.timestamp)
+            mid_prices = generator.get_cur_mid_prices()
+            for i, instrument in enumerate(MOCK_INSTRUMENTS):
+                if (row + i) % 7 == 0:
+                    base, quote = instrument.to_asset_instruments()
+                    if row % 2 == 0:
+                        qty = 0.1 * portfolio.get_wallet(quote).free_balance() / mid_prices[instrument]
+                        orders.append(self._make_order(portfolio, OrderSide.BUY, instrument, qty, mid_prices[instrument]))
+                    else:
+                        orders.append(self._make_order(portfolio, OrderSide.SELL, instrument, 0.5 * portfolio.get_wallet(base).free_balance(), mid_prices[instrument]))
+            if len(orders) > 0:
+                simulator.stage_for_execution(orders)
+                _record_expected()
+            num_trades = sum(len(t) for t in simulator.executed_trades.values())
+            simulator.update_state()
+            if sum(len(t) for t in simulator.executed_trades.values()) > num_trades:
+                _record_expected()
+
+        records = simulator.get_portfolio_balances()
+        self.assertGreater(len(records), 100)
+        self.assertEqual(len(records), len(expected))
+        for record, (ts, total, per_wallet) in zip(records, expected):
+            self.assertEqual(record.timestamp, ts)
+            self.assertAlmostEqual(record.total, total, places=6)
+            self.assertEqual(set(record.per_wallet.keys()), set(per_wallet.keys()))
+            for asset_instrument, balance in per_wallet.items():
+                self.assertAlmostEqual(record.per_wallet[asset_instrument].free, balance.free, places=9)
+                self.assertAlmostEqual(record.per_wallet[asset_instrument].locked, balance.locked, places=9)
+
+        timestamps, totals = simulator.get_total_balances()
+        self.assertEqual(list(timestamps), [r.timestamp for r in records])
+        self.assertEqual(list(totals), [r.total for r in records])
+
+    def test_cancelled_orders_are_pruned(self):
+        features = [mock_mid_price_feature(instrument) for instrument in MOCK_INSTRUMENTS]
+        data = {'timestamp': np.arange(3, dtype=float)}
+        for feature in features:
+            data[f'{feature}-mid_price'] = np.full(3, 100.0)
+        generator = FrameFeatureStreamGenerator(pd.DataFrame(data), features)
+        clock = Clock(-1)
+        portfolio = self._portfolio()
+        simulator = ExecutionSimulator(clock, portfolio, generator)
+
+        clock.set(generator.next().timestamp)
+        # limit buy above mid price is not executed
+        order = self._make_order(portfolio, OrderSide.BUY, MOCK_INSTRUMENTS[0], 1, 150)
+        order.type = OrderType.LIMIT
+        simulator.stage_for_execution([order])
+        simulator.update_state()
+        self.assertEqual(simulator.orders, [order])
+
+        order.status = OrderStatus.CANCELLED
+        clock.set(generator.next().timestamp)
+        simulator.update_state()
+        # pruned even though nothing was filled
+        self.assertEqual(simulator.orders, [])
+        self.assertEqual(simulator.executed_trades, {})
+
+    def test_wallet_index(self):
+        portfolio = self._portfolio()
+        for wallet_id, wallet in enumerate(portfolio.wallets):
+            self.assertEqual(portfolio.get_wallet_id(wallet.asset_instrument), wallet_id)
+            self.assertIs(portfolio.get_wallet(wallet.asset_instrument), wallet)
+        with self.assertRaises(ValueError):
+            portfolio.get_wallet(AssetInstrument('BINANCE', 'spot', 'XRP'))
+        with self.assertRaises(ValueError):
+            Portfolio(wallets=[portfolio.wallets[0], portfolio.wallets[0]], quote=portfolio.quote)
+
+
+if __name__ == '__main__':
+    t = TestExecutionSimulator()
+    t.test_portfolio_balances()
+    t.test_cancelled_orders_are_pruned()
+    t.test_wallet_index()
@@ -0,0 +1,209 @@
+import unittest
+import uuid
+from typing import List, Tuple, Dict, Optional
+from unittest import mock
+
+from frozendict import frozendict
+
+from backtester.clock import Clock
+from backtester.execution.execution_simulator import COMMISSION
+from backtester.execution.l2_execution_simulator import L2ExecutionSimulator
+from backtester.models.instrument import Instrument, AssetInstrument
+from backtester.models.order import Order, OrderSide, OrderType, OrderStatus
+from backtester.models.portfolio import Portfolio
+from backtester.models.wallet import Wallet
+from featurizer.data_definitions.common.l2_book_incremental.cryptotick.cryptotick_l2_book_incremental import \
+    CryptotickL2BookIncrementalData
+from featurizer.feature_stream.feature_stream_generator import DataStreamEvent, FeatureStreamGenerator
+from featurizer.features.definitions.l2_book.l2_snapshot_fd.l2_snapshot_fd import L2SnapshotFD, snapshot_columns
+from featurizer.features.feature_tree.feature_tree import Feature
+
+DEPTH = 5
+INSTRUMENT = Instrument('BINANCE', 'spot', 'BTC-USDT')
+
+
+def _snapshot(ts: float, bids: List[Tuple[float, float]], asks: List[Tuple[float, float]]) -> frozendict:
+    nan = float('nan')
+    pad = lambda levels: levels + [(nan, nan)] * (DEPTH - len(levels))
+    bids, asks = pad(bids), pad(asks)
+    values = [ts, ts] + [p for p, _ in bids] + [s for _, s in bids] + [p for p, _ in asks] + [s for _, s in asks]
+    return frozendict(zip(snapshot_columns(DEPTH), values))
+
+
+# sets current event of a stream of l2 snapshots of one instrument
+class _SnapshotStreamGenerator:
+
+    def __init__(self):
+        data = Feature([], CryptotickL2BookIncrementalData, {
+            'exchange': INSTRUMENT.exchange,
+            'instrument_type': INSTRUMENT.instrument_type,
+            'symbol': INSTRUMENT.symbol
+        })
+        self.feature = Feature([data], L2SnapshotFD, {'depth': DEPTH})
+        self.cur_out_event: Optional[DataStreamEvent] = None
+
+    def set(self, snap: frozendict):
+        self.cur_out_event = DataStreamEvent(timestamp=snap['timestamp'], receipt_timestamp=snap['timestamp'], feature_values={self.feature: snap})
+
+    def get_cur_mid_prices(self) -> Dict[Instrument, float]:
+        return FeatureStreamGenerator.get_mid_prices_from_event(self.cur_out_event)
+
+
+class TestL2ExecutionSimulator(unittest.TestCase):
+
+    def setUp(self):
+        self.clock = Clock(-1)
+        self.quote = AssetInstrument('BINANCE', 'spot', 'USDT')
+        self.base = AssetInstrument('BINANCE', 'spot', 'BTC')
+        self.portfolio = Portfolio(wallets=[
+            Wallet(asset_instrument=self.quote, balance=10000),
+            Wallet(asset_instrument=self.base, balance=10),
+        ], quote=self.quote)
+        self.generator = _SnapshotStreamGenerator()
+
+    def _simulator(self, latency_s: float = 0.0) -> L2ExecutionSimulator:
+        return L2ExecutionSimulator(self.clock, self.portfolio, self.generator, latency_s=latency_s)
+
+    def _tick(self, simulator: L2ExecutionSimulator, snap: frozendict, orders: Optional[List[Order]] = None):
+        self.clock.set(snap['timestamp'])
+        self.generator.set(snap)
+        if orders is not None:
+            simulator.stage_for_execution(orders)
+        simulator.update_state()
+
+    def _order(self, side: OrderSide, order_type: OrderType, qty: float, price: float) -> Order:
+        order_id = str(uuid.uuid4())
+        if side == OrderSide.BUY:
+            self.portfolio.get_wallet(self.quote).lock_from_balance(order_id, qty * price)
+        else:
+            self.portfolio.get_wallet(self.base).lock_from_balance(order_id, qty)
+        return Order(order_id=order_id, type=order_type, side=side, instrument=INSTRUMENT, price=price, quantity=qty, status=OrderStatus.OPEN)
+
+    def _trades(self, simulator: L2ExecutionSimulator, order: Order):
+        return [t for t in simulator.executed_trades.get(INSTRUMENT, []) if t.order_id == order.order_id]
+
+    def test_vwap_fills(self):
+        simulator = self._simulator()
+        snap = _snapshot(0, bids=[(99, 1), (98, 2)], asks=[(101, 1), (102, 2), (103, 5)])
+        first = self._order(OrderSide.BUY, OrderType.MARKET, 2.5, 105)
+        second = self._order(OrderSide.BUY, OrderType.MARKET, 1, 105)
+        self._tick(simulator, snap, [first, second])
+
+        [trade] = self._trades(simulator, first)
+        self.assertAlmostEqual(trade.price, (101 * 1 + 102 * 1.5) / 2.5)
+        self.assertAlmostEqual(trade.quantity, 2.5 * (1 - COMMISSION))
+        # second order takes what is left of the same snapshot
+        [trade] = self._trades(simulator, second)
+        self.assertAlmostEqual(trade.price, (102 * 0.5 + 103 * 0.5) / 1)
+        self.assertEqual(first.status, OrderStatus.FILLED)
+        self.assertEqual(second.status, OrderStatus.FILLED)
+
+        # unused locked quote is returned
+        quote_wallet = self.portfolio.get_wallet(self.quote)
+        self.assertEqual(quote_wallet.locked, {})
+        self.assertAlmostEqual(quote_wallet.balance, 10000 - (101 + 102 * 1.5) - (102 * 0.5 + 103 * 0.5))
+        self.assertAlmostEqual(self.portfolio.get_wallet(self.base).balance, 10 + 3.5 * (1 - COMMISSION))
+
+    def test_partial_fills(self):
+        simulator = self._simulator()
+        order = self._order(OrderSide.SELL, OrderType.MARKET, 4, 90)
+        self._tick(simulator, _snapshot(0, bids=[(99, 1), (98, 2)], asks=[(101, 1)]), [order])
+        self.assertEqual(order.status, OrderStatus.PARTIALLY_FILLED)
+        self.assertAlmostEqual(order.filled_quantity, 3)
+        # rest is filled from next snapshot
+        self._tick(simulator, _snapshot(0.5, bids=[(99, 1), (98, 2)], asks=[(101, 1)]))
+        self.assertAlmostEqual(order.filled_quantity, 4)
+        self.assertEqual(order.status, OrderStatus.FILLED)
+        trades = self._trades(simulator, order)
+        self.assertEqual([t.quantity for t in trades], [3, 1])
+        self.assertAlmostEqual(trades[0].commission, (99 + 98 * 2) * COMMISSION)
+        self.assertEqual(self.portfolio.get_wallet(self.base).locked, {})
+        self.assertAlmostEqual(self.portfolio.get_wallet(self.base).balance, 6)
+
+    def test_latency(self):
+        simulator = self._simulator(latency_s=1)
+        order = self._order(OrderSide.BUY, OrderType.MARKET, 1, 120)
+        self._tick(simulator, _snapshot(0, bids=[(99, 1)], asks=[(101, 5)]), [order])
+        self._tick(simulator, _snapshot(0.5, bids=[(99, 1)], asks=[(102, 5)]))
+        self.assertEqual(self._trades(simulator, order), [])
+        self._tick(simulator, _snapshot(1.2, bids=[(99, 1)], asks=[(110, 5)]))
+        [trade] = self._trades(simulator, order)
+        self.assertEqual(trade.price, 110)
+        self.assertEqual(trade.timestamp, 1.2)
+
+    def test_limit_orders(self):
+        simulator = self._simulator()
+        buy = self._order(OrderSide.BUY, OrderType.LIMIT, 2, 100)
+        cancelled = self._order(OrderSide.BUY, OrderType.LIMIT, 1, 100.5)
+        self._tick(simulator, _snapshot(0, bids=[(99, 1)], asks=[(101, 5)]), [buy, cancelled])
+        self.assertEqual(buy.status, OrderStatus.OPEN)
+        simulator.cancel_order(cancelled.order_id)
+        self.assertNotIn(cancelled.order_id, self.portfolio.get_wallet(self.quote).locked)
+
+        # only levels at or below limit price are taken
+        self._tick(simulator, _snapshot(1, bids=[(99, 1)], asks=[(99.5, 0.4), (100, 1), (100.5, 5)]))
+        self.assertEqual(buy.status, OrderStatus.PARTIALLY_FILLED)
+        self.assertAlmostEqual(buy.filled_quantity, 1.4)
+        self.assertEqual(cancelled.status, OrderStatus.CANCELLED)
+        self._tick(simulator, _snapshot(2, bids=[(99, 1)], asks=[(100, 5)]))
+        self.assertEqual(buy.status, OrderStatus.FILLED)
+        self.assertEqual([t.order_id for t in simulator.executed_trades[INSTRUMENT]], [buy.order_id, buy.order_id])
+        self.assertEqual(self.portfolio.get_wallet(self.quote).locked, {})
+
+    def test_only_crossing_orders_are_touched(self):
+        simulator = self._simulator()
+        resting = [self._order(OrderSide.BUY, OrderType.LIMIT, 0.01, 50 + i * 0.01) for i in range(1000)]
+        self._tick(simulator, _snapshot(0, bids=[(99, 1)], asks=[(101, 5)]), resting)
+        with mock.patch.object(L2ExecutionSimulator, '_match_order', autospec=True, side_effect=L2ExecutionSimulator._match_order) as match_order:
+            for i in range(100):
+                self._tick(simulator, _snapshot(1 + i, bids=[(99, 1)], asks=[(101, 5)]))
+            # only best buy order is checked on each update
+            self.assertEqual(match_order.call_count, 100)
+            # book crosses 10 best orders
+            self._tick(simulator, _snapshot(200, bids=[(45, 1)], asks=[(59.895, 5)]))
+            self.assertEqual(match_order.call_count, 100 + 11)
+        self.assertEqual(sum(order.status == OrderStatus.FILLED for order in resting), 10)
+
+        timestamps, totals = simulator.get_total_balances()
+        self.assertEqual(timestamps[-1], 200)
+        self.assertEqual(len(timestamps), len(totals))
+
+    def test_levels_walked_lazily(self):
+        # full book snapshot without nan padding and with extra columns, records which columns are read
+        class _RecordingSnapshot(dict):
+            read = set()
+
+            def __getitem__(self, key):
+                self.read.add(key)
+                return super().__getitem__(key)
+
+            def get(self, key, default=None):
+                self.read.add(key)
+                return super().get(key, default)
+
+            def __contains__(self, key):
+                self.read.add(key)
+                return super().__contains__(key)
+
+        depth = 1000
+        values = [0, 0] + [99.0 - i for i in range(depth)] + [1.0] * depth + [101.0 + i for i in range(depth)] + [1.0] * depth
+        snap = _RecordingSnapshot(zip(snapshot_columns(depth), values), mid_price=100.0)
+        simulator = self._simulator()
+        order = self._order(OrderSide.BUY, OrderType.MARKET, 2.5, 105)
+        self._tick(simulator, snap, [order])
+        self.assertEqual(order.status, OrderStatus.FILLED)
+        self.assertAlmostEqual(self._trades(simulator, order)[0].price, (101 + 102 + 103 * 0.5) / 2.5)
+        self.assertEqual({c for c in snap.read if c.startswith('ask_') or c.startswith('bid_')},
+                         {'ask_px_0', 'ask_sz_0', 'ask_px_1', 'ask_sz_1', 'ask_px_2', 'ask_sz_2'})
+
+        # snapshot without nan padding ends at its last level
+        sell = self._order(OrderSide.SELL, OrderType.MARKET, 4, 90)
+        self._tick(simulator, _RecordingSnapshot(zip(snapshot_columns(2), [1, 1, 99, 98, 1, 1, 101, 102, 1, 1])), [sell])
+        self.assertEqual(sell.status, OrderStatus.PARTIALLY_FILLED)
+        self.assertAlmostEqual(sell.filled_quantity, 2)
+
+if __name__ == '__main__':
+    t = TestL2ExecutionSimulator()
+    for test in ['test_vwap_fills', 'test_partial_fills', 'test_latency', 'test_limit_orders', 'test_only_crossing_orders_are_touched', 'test_levels_walked_lazily']:
+        t.setUp()
+        getattr(t, test)()
@@ -64,7 +64,7 @@ class Loop:
                     self.execution_simulator.stage_for_execution(orders)
                 self.execution_simulator.update_state()
         self.is_running = False
-        self.strategy.inference_loop.stop()
+        self.strategy.stop_inference_loop()
 
         inference_results = []
         if self.strategy.inference_loop is not None:
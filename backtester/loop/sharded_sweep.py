@@ -0,0 +1,95 @@
+from dataclasses import dataclass
+from typing import List, Dict, Optional, Type
+
+import ray
+from ray import ObjectRef
+
+from backtester.actors.vectorized_shard_worker_actor import VectorizedShardWorkerActor, ShardRunSummary
+from backtester.models.instrument import Instrument
+from backtester.models.portfolio import Portfolio
+from backtester.strategy.base import BaseStrategy
+
+
+@dataclass
+class SweepRunResult:
+    params: Optional[Dict]
+    final_balance: Optional[float]
+    num_trades: int
+    shard_summaries: List[ShardRunSummary]
+
+
+# splits time ordered refs into num_shards contiguous shards, sizes differ by at most one
+def shard_block_refs(block_refs: List[ObjectRef], num_shards: int) -> List[List[ObjectRef]]:
+    if num_shards < 1:
+        raise ValueError('num_shards should be positive')
+    if len(block_refs) == 0:
+        raise ValueError('No featurizer result blocks to shard')
+    num_shards = min(num_shards, len(block_refs))
+    shard_size, rem = divmod(len(block_refs), num_shards)
+    shards = []
+    start = 0
+    for i in range(num_shards):
+        end = start + shard_size + (1 if i < rem else 0)
+        shards.append(block_refs[start: end])
+        start = end
+    return shards
+
+
+# Runs VectorizedLoop for each params over featurizer result blocks already in object store (time ordered, as
+# returned by execute_graph). Blocks are sharded by time between actors of a pipeline, a run over all shards is a
+# chain of actor calls, each continuing from state of the previous shard, so wallets and strategy state carry over
+# shards. Runs of different params go through the same pipeline one after another, so all shards work in parallel
+# once the pipeline is full; more pipelines (each holding its own copy of the shards) add parallelism
+def run_sharded_sweep(
+    block_refs: List[ObjectRef],
+    portfolio: Portfolio,
+    strategy_class: Type[BaseStrategy],
+    params_list: List[Optional[Dict]],
+    mid_price_columns: Dict[Instrument, str],
+    num_shards: int,
+    num_pipelines: int = 1,
+    num_cpus_per_actor: float = 0.9
+) -> List[SweepRunResult]:
+    if num_pipelines < 1:
+        raise ValueError('num_pipelines should be positive')
+    shards = shard_block_refs(block_refs, num_shards)
+    pipelines = [
+        [
+            VectorizedShardWorkerActor.options(num_cpus=num_cpus_per_actor).remote(
+                shard_id=shard_id,
+                block_refs=shard,
+                portfolio=portfolio,
+                mid_price_columns=mid_price_columns
+            ) for shard_id, shard in enumerate(shards)
+        ] for _ in range(num_pipelines)
+    ]
+    print(f'Started {num_pipelines} pipelines of {len(shards)} shards for {len(params_list)} params')
+
+    try:
+        summary_refs = []
+        for i, params in enumerate(params_list):
+            state_ref = None
+            refs = []
+            for actor in pipelines[i % num_pipelines]:
+                summary_ref, state_ref = actor.run.options(num_returns=2).remote(strategy_class, params, state_ref)
+                refs.append(summary_ref)
+            summary_refs.append(refs)
+
+        results = []
+        for params, refs in zip(params_list, summary_refs):
+            summaries = ray.get(refs)
+            final_balance = None
+            for summary in summaries:
+                if summary.final_balance is not None:
+                    final_balance = summary.final_balance
+            results.append(SweepRunResult(
+                params=params,
+                final_balance=final_balance,
+                num_trades=sum(summary.num_trades for summary in summaries),
+                shard_summaries=summaries
+            ))
+        return results
+    finally:
+        for actors in pipelines:
+            for actor in actors:
+                ray.kill(actor)
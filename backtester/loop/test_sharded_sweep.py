@@ -0,0 +1,62 @@
+import unittest
+
+import numpy as np
+import ray
+
+from backtester.loop.sharded_sweep import run_sharded_sweep, shard_block_refs
+from backtester.loop.vectorized_loop import VectorizedLoop, get_mid_price_columns
+from backtester.strategy.buy_and_hold import BuyAndHoldStrategy
+from backtester.strategy.buy_low_sell_high import BuyLowSellHighStrategy
+from backtester.testing_utils import MOCK_INSTRUMENTS, mock_mid_prices_df, mock_portfolio
+
+
+class TestShardedSweep(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        ray.init(num_cpus=8, include_dashboard=False, log_to_driver=False, ignore_reinit_error=True)
+
+    @classmethod
+    def tearDownClass(cls):
+        ray.shutdown()
+
+    def test_shard_block_refs(self):
+        self.assertEqual(shard_block_refs(list(range(10)), 3), [[0, 1, 2, 3], [4, 5, 6], [7, 8, 9]])
+        self.assertEqual(shard_block_refs(list(range(2)), 3), [[0], [1]])
+        with self.assertRaises(ValueError):
+            shard_block_refs(list(range(2)), 0)
+        with self.assertRaises(ValueError):
+            shard_block_refs([], 3)
+
+    def test_sweep(self):
+        df, features = mock_mid_prices_df(20000)
+        mid_price_columns = get_mid_price_columns(features, MOCK_INSTRUMENTS)
+        self.assertEqual(mid_price_columns, {instrument: f'{feature}-mid_price' for instrument, feature in zip(MOCK_INSTRUMENTS, features)})
+
+        params_list = [None]
+        for thresh in np.linspace(0.005, 0.05, 4):
+            params_list.append({'buy_signal_thresh': thresh, 'sell_signal_thresh': thresh})
+
+        # blocks as returned by featurizer, time ordered
+        block_refs = [ray.put(df.iloc[start: start + 1500].reset_index(drop=True)) for start in range(0, len(df), 1500)]
+        for strategy_class, strategy_params_list in [(BuyAndHoldStrategy, params_list[:1]), (BuyLowSellHighStrategy, params_list[1:])]:
+            results = run_sharded_sweep(
+                block_refs=block_refs,
+                portfolio=mock_portfolio(),
+                strategy_class=strategy_class,
+                params_list=strategy_params_list,
+                mid_price_columns=mid_price_columns,
+                num_shards=4,
+                num_pipelines=2
+            )
+            loop = VectorizedLoop(df, mock_portfolio(), mid_price_columns)
+            for params, res in zip(strategy_params_list, results):
+                expected = loop.run(strategy_class.vectorized_signals, params)
+                self.assertEqual(res.params, params)
+                self.assertEqual(len(res.shard_summaries), 4)
+                self.assertEqual(res.num_trades, sum(len(trades.rows) for trades in expected.trades.values()))
+                self.assertEqual(res.final_balance, expected.final_balance())
+
+
+if __name__ == '__main__':
+    unittest.main()
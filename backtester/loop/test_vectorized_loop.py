@@ -0,0 +1,101 @@
+import time
+import unittest
+from typing import List
+
+import numpy as np
+import pandas as pd
+
+from backtester.clock import Clock
+from backtester.execution.execution_simulator import ExecutionSimulator
+from backtester.loop.loop import Loop, LoopRunResult
+from backtester.loop.vectorized_loop import VectorizedLoop
+from backtester.strategy.buy_and_hold import BuyAndHoldStrategy
+from backtester.strategy.buy_low_sell_high import BuyLowSellHighStrategy
+from backtester.testing_utils import MOCK_INSTRUMENTS, FrameFeatureStreamGenerator, mock_mid_prices_df, mock_portfolio
+from featurizer.features.feature_tree.feature_tree import Feature
+
+
+class TestVectorizedLoop(unittest.TestCase):
+
+    def _run_loop(self, df: pd.DataFrame, features: List[Feature], strategy_class, params) -> LoopRunResult:
+        clock = Clock(-1)
+        portfolio = mock_portfolio()
+        generator = FrameFeatureStreamGenerator(df, features)
+        strategy = strategy_class(clock=clock, portfolio=portfolio, params=params, instruments=MOCK_INSTRUMENTS)
+        loop = Loop(
+            clock=clock,
+            feature_generator=generator,
+            portfolio=portfolio,
+            strategy=strategy,
+            execution_simulator=ExecutionSimulator(clock, portfolio, generator)
+        )
+        return loop.run()
+
+    def _assert_same_results(self, strategy_class, params):
+        df, features = mock_mid_prices_df(2000)
+        loop_res = self._run_loop(df, features, strategy_class, params)
+        mid_price_columns = {instrument: f'{feature}-mid_price' for instrument, feature in zip(MOCK_INSTRUMENTS, features)}
+        vectorized_res = VectorizedLoop(df, mock_portfolio(), mid_price_columns).run(strategy_class.vectorized_signals, params)
+
+        vectorized_trades = vectorized_res.get_executed_trades()
+        self.assertGreater(sum(len(trades) for trades in loop_res.executed_trades.values()), 0)
+        self.assertEqual(set(loop_res.executed_trades.keys()), set(vectorized_trades.keys()))
+        for instrument in loop_res.executed_trades:
+            expected = [(t.timestamp, t.side, t.quantity, t.price, t.commission) for t in loop_res.executed_trades[instrument]]
+            actual = [(t.timestamp, t.side, t.quantity, t.price, t.commission) for t in vectorized_trades[instrument]]
+            self.assertEqual(expected, actual)
+
+        # last snapshot of each timestamp is taken after all orders are executed
+        loop_totals = {b.timestamp: b.total for b in loop_res.portfolio_balances}
+        vectorized_totals = {b.timestamp: b.total for b in vectorized_res.to_loop_run_result(mock_portfolio()).portfolio_balances}
+        self.assertEqual(loop_totals.keys(), vectorized_totals.keys())
+        for ts in loop_totals:
+            self.assertAlmostEqual(loop_totals[ts], vectorized_totals[ts], places=6)
+
+    def test_buy_low_sell_high(self):
+        self._assert_same_results(BuyLowSellHighStrategy, {'buy_signal_thresh': 0.01, 'sell_signal_thresh': 0.01})
+
+    def test_buy_and_hold(self):
+        self._assert_same_results(BuyAndHoldStrategy, None)
+
+    def test_time_shards(self):
+        df, features = mock_mid_prices_df(5000)
+        mid_price_columns = {instrument: f'{feature}-mid_price' for instrument, feature in zip(MOCK_INSTRUMENTS, features)}
+        for strategy_class, params in [
+            (BuyLowSellHighStrategy, {'buy_signal_thresh': 0.01, 'sell_signal_thresh': 0.01}),
+            (BuyAndHoldStrategy, None)
+        ]:
+            expected = VectorizedLoop(df, mock_portfolio(), mid_price_columns).run(strategy_class.vectorized_signals, params)
+            state = None
+            trades = []
+            for split in [df.iloc[:1], df.iloc[1:1000], df.iloc[1000:1001], df.iloc[1001:3500], df.iloc[3500:]]:
+                res = VectorizedLoop(split, mock_portfolio(), mid_price_columns).run(strategy_class.vectorized_signals, params, state)
+                state = res.state
+                trades.extend((t.timestamp, t.side, t.quantity) for ts in res.get_executed_trades().values() for t in ts)
+            expected_trades = [(t.timestamp, t.side, t.quantity) for ts in expected.get_executed_trades().values() for t in ts]
+            self.assertEqual(sorted(trades, key=lambda t: t[0]), sorted(expected_trades, key=lambda t: t[0]))
+            self.assertEqual(res.final_balance(), expected.final_balance())
+
+    def test_param_sweep(self):
+        df, features = mock_mid_prices_df(100000)
+        mid_price_columns = {instrument: f'{feature}-mid_price' for instrument, feature in zip(MOCK_INSTRUMENTS, features)}
+        loop = VectorizedLoop(df, mock_portfolio(), mid_price_columns)
+        threshs = np.linspace(0.005, 0.05, 10)
+        start = time.time()
+        final_balances = {}
+        for buy_signal_thresh in threshs:
+            for sell_signal_thresh in threshs:
+                params = {'buy_signal_thresh': buy_signal_thresh, 'sell_signal_thresh': sell_signal_thresh}
+                final_balances[(buy_signal_thresh, sell_signal_thresh)] = loop.run(BuyLowSellHighStrategy.vectorized_signals, params).final_balance()
+        print(f'Ran {len(final_balances)} combinations over {len(df)} rows in {time.time() - start}s')
+        self.assertEqual(len(final_balances), 100)
+        # portfolio is not mutated between runs
+        self.assertEqual(loop.run(BuyLowSellHighStrategy.vectorized_signals, params).final_balance(), final_balances[(threshs[-1], threshs[-1])])
+
+
+if __name__ == '__main__':
+    t = TestVectorizedLoop()
+    t.test_buy_low_sell_high()
+    t.test_buy_and_hold()
+    t.test_time_shards()
+    t.test_param_sweep()
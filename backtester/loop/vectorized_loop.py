@@ -0,0 +1,259 @@
+import uuid
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Any
+
+import numpy as np
+import pandas as pd
+
+from backtester.execution.execution_simulator import COMMISSION
+from backtester.loop.loop import LoopRunResult
+from backtester.models.instrument import Instrument
+from backtester.models.order import OrderSide, OrderType
+from backtester.models.portfolio import Portfolio, PortfolioBalanceRecord
+from backtester.models.trade import Trade
+from backtester.models.wallet import WalletBalance
+from backtester.strategy.base import ORDER_QTY_RATIO, SIGNAL_BUY, SIGNAL_NONE, SignalFunction
+from featurizer.feature_stream.feature_stream_generator import FeatureStreamGenerator
+from featurizer.features.feature_tree.feature_tree import Feature
+
+# everything needed to continue a run on rows following the ones it was run on
+@dataclass
+class VectorizedLoopState:
+    quote_balance: float
+    base_balances: Dict[Instrument, float]
+    signal_states: Dict[Instrument, Any]
+
+
+# columnar trades of an instrument, Trade objects are only made on request as sweeps need balances only
+@dataclass
+class VectorizedTrades:
+    rows: List[int]
+    sides: List[OrderSide]
+    quantities: List[float]
+    prices: List[float]
+    commissions: List[float]
+
+
+@dataclass
+class VectorizedRunResult:
+    timestamps: np.ndarray
+    mid_prices: Dict[Instrument, np.ndarray]
+    # balances after all trades of a row
+    quote_balances: np.ndarray
+    base_balances: Dict[Instrument, np.ndarray]
+    total_balances: np.ndarray
+    trades: Dict[Instrument, VectorizedTrades]
+    state: VectorizedLoopState
+
+    def final_balance(self) -> float:
+        return float(self.total_balances[-1])
+
+    def get_executed_trades(self) -> Dict[Instrument, List[Trade]]:
+        executed_trades = {}
+        for instrument, trades in self.trades.items():
+            executed_trades[instrument] = [
+                Trade(
+                    trade_id=str(uuid.uuid4()),
+                    order_id=str(uuid.uuid4()),
+                    timestamp=float(self.timestamps[row]),
+                    instrument=instrument,
+                    side=side,
+                    trade_type=OrderType.MARKET,
+                    quantity=quantity,
+                    price=price,
+                    commission=commission
+                )
+                for row, side, quantity, price, commission in zip(trades.rows, trades.sides, trades.quantities, trades.prices, trades.commissions)
+            ]
+        return executed_trades
+
+    # portfolio balances are recorded on trade rows only, same as ExecutionSimulator snapshots
+    def to_loop_run_result(self, portfolio: Portfolio) -> LoopRunResult:
+        trade_rows = sorted({row for trades in self.trades.values() for row in trades.rows})
+        portfolio_balances = []
+        for row in trade_rows:
+            per_wallet = {portfolio.quote: WalletBalance(float(self.quote_balances[row]), 0)}
+            for instrument, balances in self.base_balances.items():
+                base, _ = instrument.to_asset_instruments()
+                per_wallet[base] = WalletBalance(float(balances[row]), 0)
+            portfolio_balances.append(PortfolioBalanceRecord(
+                timestamp=float(self.timestamps[row]),
+                total=float(self.total_balances[row]),
+                per_wallet=per_wallet
+            ))
+        return LoopRunResult(
+            executed_trades=self.get_executed_trades(),
+            portfolio_balances=portfolio_balances,
+            sampled_prices={instrument: list(zip(self.timestamps.tolist(), prices.tolist())) for instrument, prices in self.mid_prices.items()},
+            inference_results=[]
+        )
+
+
+# Vectorized counterpart of Loop for strategies which signals depend on prices only (no wallet state), used
+# for parameter sweeps over materialized feature frames (e.g. Featurizer.get_materialized_data).
+# Signals are computed per instrument over the whole series with NumPy, only signal rows are walked to size orders
+# from current wallet balances (same sizing as strategies and same fills and commission as ExecutionSimulator:
+# market orders are filled at mid price of the row they are made on) and balances over all rows are filled
+# forward from trade rows. Rows with any missing mid price are dropped, as events are not emitted by
+# FeatureStreamGenerator until all features have values. Portfolio is not mutated, so one instance runs any number
+# of parameter combinations over the same frame. A run can be continued over following rows from state of previous run,
+# so time shards of a series give the same result as the whole series
+class VectorizedLoop:
+
+    def __init__(
+        self,
+        df: pd.DataFrame,
+        portfolio: Portfolio,
+        mid_price_columns: Dict[Instrument, str]
+    ):
+        self.instruments = list(mid_price_columns.keys())
+        columns = list(mid_price_columns.values())
+        df = df.dropna(subset=columns)
+        self.timestamps = df['timestamp'].to_numpy(dtype=float)
+        self.mid_prices = {instrument: df[column].to_numpy(dtype=float) for instrument, column in mid_price_columns.items()}
+        # plain floats, numpy scalars are much slower in per trade arithmetic
+        self._mid_prices_lists = [self.mid_prices[instrument].tolist() for instrument in self.instruments]
+        self.portfolio = portfolio
+
+        self._quote_wallet_balance = portfolio.get_wallet(portfolio.quote).total_balance()
+        self._base_wallet_balances = {}
+        for instrument in self.instruments:
+            base, quote = instrument.to_asset_instruments()
+            if quote != portfolio.quote:
+                raise ValueError(f'Instrument {instrument} is not quoted in portfolio quote {portfolio.quote}')
+            self._base_wallet_balances[instrument] = portfolio.get_wallet(base).total_balance()
+
+    def initial_state(self) -> VectorizedLoopState:
+        return VectorizedLoopState(
+            quote_balance=self._quote_wallet_balance,
+            base_balances=dict(self._base_wallet_balances),
+            signal_states={instrument: None for instrument in self.instruments}
+        )
+
+    # state is the one of a run over preceding rows (e.g. previous time shard), initial portfolio state if None
+    def run(self, signal_func: SignalFunction, params: Optional[Dict] = None, state: Optional[VectorizedLoopState] = None) -> VectorizedRunResult:
+        num_rows = len(self.timestamps)
+        if num_rows == 0:
+            raise ValueError('No rows with mid prices for all instruments')
+        if state is None:
+            state = self.initial_state()
+        signal_states = {}
+
+        # signal rows of all instruments, in order strategies emit orders: by row, then by instrument
+        signal_rows = []
+        signal_instruments = []
+        signal_sides = []
+        for i, instrument in enumerate(self.instruments):
+            signals, signal_states[instrument] = signal_func(self.mid_prices[instrument], params, state.signal_states[instrument])
+            rows = np.flatnonzero(signals != SIGNAL_NONE)
+            signal_rows.append(rows)
+            signal_instruments.append(np.full(len(rows), i))
+            signal_sides.append(signals[rows])
+        signal_rows = np.concatenate(signal_rows)
+        signal_instruments = np.concatenate(signal_instruments)
+        signal_sides = np.concatenate(signal_sides)
+        by_row = np.lexsort((signal_instruments, signal_rows))
+
+        mid_prices = self._mid_prices_lists
+        quote_allocation = 1 / len(self.instruments)
+        quote_balance = state.quote_balance
+        base_balances = [state.base_balances[instrument] for instrument in self.instruments]
+        quote_balance_rows = []
+        quote_balance_values = []
+        base_balance_values = [[] for _ in self.instruments]
+        trades = [VectorizedTrades(rows=[], sides=[], quantities=[], prices=[], commissions=[]) for _ in self.instruments]
+        # orders of a row are all made (locking balances) before any of them is executed, so sell proceeds
+        # can only be used by orders of later rows
+        cur_row = None
+        quote_proceeds = []
+        for row, i, side in zip(signal_rows[by_row].tolist(), signal_instruments[by_row].tolist(), signal_sides[by_row].tolist()):
+            if row != cur_row:
+                if cur_row is not None:
+                    quote_balance = _deposit(quote_balance, quote_proceeds)
+                    quote_balance_rows.append(cur_row)
+                    quote_balance_values.append(quote_balance)
+                cur_row = row
+                quote_proceeds = []
+            price = mid_prices[i][row]
+            if side == SIGNAL_BUY:
+                qty = ORDER_QTY_RATIO * quote_allocation * quote_balance / price
+                quote_qty = price * qty
+                quote_balance -= quote_qty
+                commission = (quote_qty / price) * COMMISSION
+                base_qty = (quote_qty / price) - commission
+                base_balances[i] += base_qty
+                order_side = OrderSide.BUY
+            else:
+                base_qty = ORDER_QTY_RATIO * base_balances[i]
+                base_balances[i] -= base_qty
+                commission = (base_qty * price) * COMMISSION
+                quote_proceeds.append((base_qty * price) - commission)
+                order_side = OrderSide.SELL
+
+            base_balance_values[i].append(base_balances[i])
+            instrument_trades = trades[i]
+            instrument_trades.rows.append(row)
+            instrument_trades.sides.append(order_side)
+            instrument_trades.quantities.append(base_qty)
+            instrument_trades.prices.append(price)
+            instrument_trades.commissions.append(commission)
+        if cur_row is not None:
+            quote_balance = _deposit(quote_balance, quote_proceeds)
+            quote_balance_rows.append(cur_row)
+            quote_balance_values.append(quote_balance)
+
+        quote_balances = _fill_forward(num_rows, quote_balance_rows, quote_balance_values, state.quote_balance)
+        total_balances = quote_balances.copy()
+        base_balances_per_instrument = {}
+        for i, instrument in enumerate(self.instruments):
+            balances = _fill_forward(num_rows, trades[i].rows, base_balance_values[i], state.base_balances[instrument])
+            base_balances_per_instrument[instrument] = balances
+            total_balances += balances * self.mid_prices[instrument]
+
+        return VectorizedRunResult(
+            timestamps=self.timestamps,
+            mid_prices=self.mid_prices,
+            quote_balances=quote_balances,
+            base_balances=base_balances_per_instrument,
+            total_balances=total_balances,
+            trades={instrument: trades[i] for i, instrument in enumerate(self.instruments) if len(trades[i].rows) > 0},
+            state=VectorizedLoopState(
+                quote_balance=quote_balance,
+                base_balances={instrument: base_balances[i] for i, instrument in enumerate(self.instruments)},
+                signal_states=signal_states
+            )
+        )
+
+
+# mid price column of each instrument in featurizer result frame, columns are prefixed with feature name on join
+def get_mid_price_columns(features: List[Feature], instruments: List[Instrument]) -> Dict[Instrument, str]:
+    res = {}
+    for instrument in instruments:
+        for feature in features:
+            if 'mid_price' not in feature.data_definition.event_schema() or len(feature.get_data_sources()) != 1:
+                continue
+            if FeatureStreamGenerator.get_instrument_for_feature(feature) != instrument:
+                continue
+            if instrument in res:
+                raise ValueError(f'More than one mid_price feature for {instrument}')
+            res[instrument] = f'{feature}-mid_price'
+        if instrument not in res:
+            raise ValueError(f'Can not find mid_price feature for {instrument}')
+    return res
+
+
+# deposits one by one, in order orders are executed
+def _deposit(balance: float, quantities: List[float]) -> float:
+    for qty in quantities:
+        balance += qty
+    return balance
+
+
+# value of each row is the last value set at or before it, initial value before first set row.
+# Several values set on the same row resolve to the last one
+def _fill_forward(num_rows: int, rows: List[int], values: List[float], initial: float) -> np.ndarray:
+    if len(rows) == 0:
+        return np.full(num_rows, initial, dtype=float)
+    values = np.concatenate([[initial], values])
+    positions = np.searchsorted(np.asarray(rows), np.arange(num_rows), side='right')
+    return values[positions]
@@ -32,3 +32,5 @@ class Order:
     price: Optional[float]
     quantity: float
     status: OrderStatus
+    # base quantity filled so far, orders can be filled partially when book liquidity is not enough
+    filled_quantity: float = 0.0
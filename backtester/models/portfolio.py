@@ -12,22 +12,28 @@ class Portfolio:
     wallets: List[Wallet]
     quote: AssetInstrument
 
+    def __post_init__(self):
+        # wallet id is position in wallets list
+        self._wallet_ids: Dict[AssetInstrument, int] = {}
+        for wallet_id, w in enumerate(self.wallets):
+            if w.asset_instrument in self._wallet_ids:
+                raise ValueError(f'Duplicate wallets for {w.asset_instrument}')
+            self._wallet_ids[w.asset_instrument] = wallet_id
+
     @classmethod
     def load_config(cls, path: str) -> 'Portfolio':
         with open(path, 'r') as stream:
             d = yaml.safe_load(stream)
             return Portfolio(**d)
 
-    def get_wallet(self, asset_instrument: AssetInstrument) -> Wallet:
-        wallet = None
-        for w in self.wallets:
-            if w.asset_instrument == asset_instrument:
-                if wallet is not None:
-                    raise ValueError(f'Duplicate wallets for {asset_instrument}')
-                wallet = w
-        if wallet is None:
+    def get_wallet_id(self, asset_instrument: AssetInstrument) -> int:
+        wallet_id = self._wallet_ids.get(asset_instrument)
+        if wallet_id is None:
             raise ValueError(f'Can not find wallet for {asset_instrument}')
-        return wallet
+        return wallet_id
+
+    def get_wallet(self, asset_instrument: AssetInstrument) -> Wallet:
+        return self.wallets[self.get_wallet_id(asset_instrument)]
 
 
 @dataclass
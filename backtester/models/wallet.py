@@ -32,6 +32,17 @@ class Wallet:
         del self.locked[order_id]
         return qty
 
+    # takes up to qty from locked quantity of order, lock is removed once fully taken
+    def unlock_partial(self, order_id: str, qty: float) -> float:
+        if order_id not in self.locked:
+            raise ValueError(f'Can not unlock {order_id}: does not exist')
+        locked = self.locked[order_id]
+        if qty >= locked:
+            del self.locked[order_id]
+            return locked
+        self.locked[order_id] = locked - qty
+        return qty
+
     def unlock_to_balance(self, order_id: str):
         qty = self.unlock(order_id)
         self.balance += qty
@@ -8,13 +8,18 @@ from ray.util import placement_group, remove_placement_group
 from ray.util.scheduling_strategies import PlacementGroupSchedulingStrategy
 
 from common.common_utils import load_class_by_name
+from featurizer.actors.cache_actor import get_cache_actor
 from featurizer.config import FeaturizerConfig, split_featurizer_config
+from featurizer.features.feature_tree.feature_tree import construct_features_from_configs
+from featurizer.runner import Featurizer
 from backtester.actors.backtester_worker_actor import BacktesterWorkerActor
 from backtester.clock import Clock
 from featurizer.feature_stream.feature_stream_generator import FeatureStreamGenerator
 from backtester.execution.execution_simulator import ExecutionSimulator
 from backtester.inference.inference_loop import InferenceConfig
 from backtester.loop.loop import Loop, LoopRunResult
+from backtester.loop.sharded_sweep import run_sharded_sweep, SweepRunResult
+from backtester.loop.vectorized_loop import get_mid_price_columns
 from backtester.models.instrument import Instrument
 from backtester.models.portfolio import Portfolio, PortfolioBalanceRecord
 from backtester.models.trade import Trade
@@ -171,6 +176,48 @@ class Backtester:
             remove_placement_group(pg)
             return self._aggregate_loop_run_results(results)
 
+    # Sweeps strategy params over featurizer result which is computed once (featurize=True runs Featurizer first,
+    # otherwise result of previous Featurizer run is used) and shared via object store, instead of each worker
+    # featurizing its own config split. Only strategies with vectorized_signals are supported
+    def run_sweep_remotely(
+        self,
+        ray_address: str,
+        params_list: List[Optional[Dict]],
+        num_shards: int,
+        num_pipelines: int = 1,
+        featurize: bool = False,
+        parallelism: Optional[int] = None
+    ) -> List[SweepRunResult]:
+        if featurize:
+            if parallelism is None:
+                raise ValueError('parallelism should be provided to featurize')
+            Featurizer.run(self.featurizer_config, ray_address=ray_address, parallelism=parallelism)
+
+        with ray.init(address=ray_address, ignore_reinit_error=True, runtime_env={
+            'pip': ['xgboost', 'xgboost_ray', 'mlflow', 'diskcache', 'pyhumps'],
+            'py_modules': [backtester, common, featurizer, client],
+
+        }):
+            try:
+                cache_actor = get_cache_actor()
+            except ValueError:
+                raise ValueError('No featurizer result, run with featurize=True')
+            refs = ray.get(cache_actor.get_featurizer_result_refs.remote())
+            if refs is None or len(refs) == 0:
+                raise ValueError('No featurizer result, run with featurize=True')
+            features = construct_features_from_configs(self.featurizer_config.feature_configs)
+            mid_price_columns = get_mid_price_columns(features, self.tradable_instruments)
+            print(f'Starting sweep of {len(params_list)} params over {len(refs)} featurized blocks...')
+            return run_sharded_sweep(
+                block_refs=refs,
+                portfolio=self.portfolio,
+                strategy_class=self.strategy_class,
+                params_list=params_list,
+                mid_price_columns=mid_price_columns,
+                num_shards=num_shards,
+                num_pipelines=num_pipelines
+            )
+
     # TODO this should be udf
     # TODO make separate dataclass for distributed run result?
     def _aggregate_loop_run_results(self, results: List[LoopRunResult]) -> LoopRunResult:
@@ -1,5 +1,7 @@
 import uuid
-from typing import List, Optional, Dict, Any
+from typing import List, Optional, Dict, Any, Tuple, Callable
+
+import numpy as np
 
 from backtester.clock import Clock
 from featurizer.feature_stream.feature_stream_generator import DataStreamEvent
@@ -8,6 +10,16 @@ from backtester.models.order import Order, OrderSide, OrderType, OrderStatus
 from backtester.models.portfolio import Portfolio
 from backtester.inference.inference_loop import InferenceLoop, InferenceConfig
 
+# share of free balance used for an order, rest is left so locked quantities never exceed balance
+ORDER_QTY_RATIO = 0.9
+
+SIGNAL_BUY = 1
+SIGNAL_SELL = -1
+SIGNAL_NONE = 0
+
+# (mid prices of an instrument, strategy params, state after previous rows or None at series start) ->
+# (signal per row, one of SIGNAL_BUY, SIGNAL_SELL, SIGNAL_NONE, state after these rows)
+SignalFunction = Callable[[np.ndarray, Optional[Dict], Optional[Any]], Tuple[np.ndarray, Any]]
 
 class BaseStrategy:
 
@@ -55,6 +67,13 @@ class BaseStrategy:
     def on_data_udf(self, data_event: DataStreamEvent) -> Optional[List[Order]]:
         raise NotImplementedError
 
+    # signals over mid price series of an instrument for VectorizedLoop, should produce the same orders
+    # as on_data_udf. Only for strategies which signals do not depend on wallet state. State is returned
+    # so the series can be processed in consecutive parts, it is None for the first part
+    @classmethod
+    def vectorized_signals(cls, mid_prices: np.ndarray, params: Optional[Dict], state: Optional[Any]) -> Tuple[np.ndarray, Any]:
+        raise NotImplementedError
+
     # TODO move to execution engine?
     def make_order(self, side: OrderSide, order_type: OrderType, instrument: Instrument, qty: float, price: float) -> Order:
         order_id = str(uuid.uuid4())
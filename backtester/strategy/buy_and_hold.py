@@ -1,11 +1,63 @@
-from typing import List, Optional
+from typing import List, Optional, Dict, Set, Tuple
 
-from featurizer.feature_stream.feature_stream_generator import DataStreamEvent
-from backtester.models.order import Order
-from backtester.strategy.base import BaseStrategy
+import numpy as np
 
+from backtester.clock import Clock
+from backtester.inference.inference_loop import InferenceConfig
+from backtester.models.instrument import Instrument
+from featurizer.feature_stream.feature_stream_generator import DataStreamEvent, FeatureStreamGenerator
+from backtester.models.order import Order, OrderSide, OrderType
+from backtester.models.portfolio import Portfolio
+from backtester.strategy.base import BaseStrategy, ORDER_QTY_RATIO, SIGNAL_BUY, SIGNAL_NONE
 
+
+# buys each instrument on its first price with equal share of quote and holds it
 class BuyAndHoldStrategy(BaseStrategy):
+    def __init__(
+        self,
+        clock: Clock,
+        portfolio: Portfolio,
+        params: Optional[Dict] = None,
+        instruments: Optional[List[Instrument]] = None,
+        inference_config: Optional[InferenceConfig] = None
+    ):
+        super(BuyAndHoldStrategy, self).__init__(
+            clock=clock,
+            portfolio=portfolio,
+            params=params,
+            instruments=instruments,
+            inference_config=inference_config
+        )
+        self.quote_allocation = 1/len(instruments) # TODO parametrize
+        self.bought: Set[Instrument] = set()
 
     def on_data_udf(self, data_event: DataStreamEvent) -> Optional[List[Order]]:
-        raise NotImplementedError
\ No newline at end of file
+        orders = []
+        for instrument in self.instruments:
+            if instrument in self.bought:
+                continue
+            feature = FeatureStreamGenerator.get_feature_for_instrument(data_event, instrument)
+            if feature is None:
+                continue
+            mid_price = data_event.feature_values[feature]['mid_price']
+            _, quote = instrument.to_asset_instruments()
+            quote_wallet = self.portfolio.get_wallet(quote)
+            orders.append(self.make_order(
+                side=OrderSide.BUY,
+                order_type=OrderType.MARKET,
+                instrument=instrument,
+                qty=ORDER_QTY_RATIO * self.quote_allocation * quote_wallet.free_balance() / mid_price,
+                price=mid_price
+            ))
+            self.bought.add(instrument)
+        return orders
+
+    # state is whether instrument was already bought
+    @classmethod
+    def vectorized_signals(cls, mid_prices: np.ndarray, params: Optional[Dict], state: Optional[bool]) -> Tuple[np.ndarray, bool]:
+        signals = np.full(len(mid_prices), SIGNAL_NONE, dtype=np.int8)
+        bought = state is not None and state
+        if not bought and len(signals) > 0:
+            signals[0] = SIGNAL_BUY
+            bought = True
+        return signals, bought
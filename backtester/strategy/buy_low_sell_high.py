@@ -1,4 +1,8 @@
-from typing import List, Dict, Optional, Callable
+import bisect
+from dataclasses import dataclass
+from typing import List, Dict, Optional, Callable, Tuple
+
+import numpy as np
 
 from backtester.clock import Clock
 from featurizer.feature_stream.feature_stream_generator import FeatureStreamGenerator, DataStreamEvent
@@ -6,7 +10,7 @@ from backtester.inference.inference_loop import InferenceConfig
 from backtester.models.instrument import Instrument
 from backtester.models.order import Order, OrderSide, OrderType
 from backtester.models.portfolio import Portfolio
-from backtester.strategy.base import BaseStrategy
+from backtester.strategy.base import BaseStrategy, ORDER_QTY_RATIO, SIGNAL_BUY, SIGNAL_SELL, SIGNAL_NONE
 
 
 class _StatePerInstrument:
@@ -56,7 +60,7 @@ class _StatePerInstrument:
                     side=OrderSide.BUY,
                     order_type=OrderType.MARKET,
                     instrument=self.instrument,
-                    qty=0.9 * self.quote_allocation * self.quote_wallet.free_balance() / mid_price,
+                    qty=ORDER_QTY_RATIO * self.quote_allocation * self.quote_wallet.free_balance() / mid_price,
                     price=mid_price
                 )]
         else:
@@ -69,11 +73,19 @@ class _StatePerInstrument:
                     side=OrderSide.SELL,
                     order_type=OrderType.MARKET,
                     instrument=self.instrument,
-                    qty=0.9 * self.base_wallet.free_balance(),
+                    qty=ORDER_QTY_RATIO * self.base_wallet.free_balance(),
                     price=mid_price
                 )]
 
 
+@dataclass
+class _VectorizedState:
+    is_buying: bool
+    local_min: Optional[float]
+    local_max: Optional[float]
+    last_prices: List[float]
+
+
 class BuyLowSellHighStrategy(BaseStrategy):
     def __init__(
         self,
@@ -119,3 +131,64 @@ class BuyLowSellHighStrategy(BaseStrategy):
             raise ValueError(f'Unable to find feature for any of the provided instruments, event: {data_event}, instruments: {list(self.states.keys())}')
 
         return all_orders
+
+    # Same state machine as _StatePerInstrument over the whole series: local extremums (middle of three values)
+    # and rows where price moved far enough from the latest one are found with NumPy, then trades alternate between
+    # buy and sell, each using only extremums detected after the previous trade (those are reset on trade).
+    # Detection rows are non-decreasing, so next trade is found with two binary searches. State carries last two
+    # prices and extremums not yet reset, so the series can be processed in consecutive parts
+    @classmethod
+    def vectorized_signals(cls, mid_prices: np.ndarray, params: Optional[Dict], state: Optional[_VectorizedState]) -> Tuple[np.ndarray, _VectorizedState]:
+        buy_signal_thresh = params['buy_signal_thresh']
+        sell_signal_thresh = params['sell_signal_thresh']
+        if state is None:
+            state = _VectorizedState(is_buying=True, local_min=None, local_max=None, last_prices=[])
+        # previous prices are prepended so extremums on the boundary are detected
+        offset = len(state.last_prices)
+        prices = np.concatenate([np.asarray(state.last_prices, dtype=float), mid_prices])
+        num_rows = len(prices)
+        rows = np.arange(num_rows)
+        is_local_min = np.zeros(num_rows, dtype=bool)
+        is_local_max = np.zeros(num_rows, dtype=bool)
+        if num_rows >= 3:
+            prev, mid, cur = prices[:-2], prices[1:-1], prices[2:]
+            is_local_min[2:] = (prev > mid) & (cur > mid)
+            is_local_max[2:] = (prev < mid) & (cur < mid)
+
+        # row where latest extremum was detected, extremum value is price of previous row.
+        # Extremum carried from previous part is detected at row -1, -2 means there is none
+        local_min_rows = np.maximum.accumulate(np.where(is_local_min, rows, -1 if state.local_min is not None else -2))
+        local_max_rows = np.maximum.accumulate(np.where(is_local_max, rows, -1 if state.local_max is not None else -2))
+        local_mins = prices[np.maximum(local_min_rows - 1, 0)]
+        local_maxs = prices[np.maximum(local_max_rows - 1, 0)]
+        if state.local_min is not None:
+            local_mins[local_min_rows == -1] = state.local_min
+        if state.local_max is not None:
+            local_maxs[local_max_rows == -1] = state.local_max
+        buy_rows = np.flatnonzero((local_min_rows >= -1) & (prices - local_mins > sell_signal_thresh * local_mins))
+        sell_rows = np.flatnonzero((local_max_rows >= -1) & (local_maxs - prices > buy_signal_thresh * local_maxs))
+
+        # bisect on lists is much faster than np.searchsorted for single values
+        buy_rows, sell_rows = buy_rows.tolist(), sell_rows.tolist()
+        local_min_rows_list, local_max_rows_list = local_min_rows.tolist(), local_max_rows.tolist()
+        signals = np.full(num_rows, SIGNAL_NONE, dtype=np.int8)
+        last_trade_row = -2
+        is_buying = state.is_buying
+        while True:
+            candidate_rows, detection_rows = (buy_rows, local_min_rows_list) if is_buying else (sell_rows, local_max_rows_list)
+            first_row = max(offset, last_trade_row + 1, bisect.bisect_right(detection_rows, last_trade_row))
+            pos = bisect.bisect_left(candidate_rows, first_row)
+            if pos == len(candidate_rows):
+                break
+            last_trade_row = candidate_rows[pos]
+            signals[last_trade_row] = SIGNAL_BUY if is_buying else SIGNAL_SELL
+            is_buying = not is_buying
+
+        # extremums detected after last trade are kept
+        next_state = _VectorizedState(
+            is_buying=is_buying,
+            local_min=float(local_mins[-1]) if num_rows > 0 and local_min_rows[-1] > last_trade_row else None,
+            local_max=float(local_maxs[-1]) if num_rows > 0 and local_max_rows[-1] > last_trade_row else None,
+            last_prices=prices[-2:].tolist()
+        )
+        return signals[offset:], next_state
@@ -0,0 +1,78 @@
+from typing import List, Dict, Tuple
+
+import numpy as np
+import pandas as pd
+
+from backtester.models.instrument import Instrument, AssetInstrument
+from backtester.models.portfolio import Portfolio
+from backtester.models.wallet import Wallet
+from featurizer.data_definitions.synthetic.synthetic_sine_mid_price.synthetic_sine_mid_price import SyntheticSineMidPrice
+from featurizer.feature_stream.feature_stream_generator import DataStreamEvent, FeatureStreamGenerator
+from featurizer.features.feature_tree.feature_tree import Feature
+
+MOCK_INSTRUMENTS = [
+    Instrument('BINANCE', 'spot', 'BTC-USDT'),
+    Instrument('BINANCE', 'spot', 'ETH-USDT'),
+]
+
+
+# replays rows of materialized frame as events, same interface Loop and ExecutionSimulator use
+class FrameFeatureStreamGenerator:
+
+    def __init__(self, df: pd.DataFrame, features: List[Feature]):
+        self.events = []
+        for row in df.to_dict('records'):
+            self.events.append(DataStreamEvent(
+                timestamp=row['timestamp'],
+                receipt_timestamp=row['timestamp'],
+                feature_values={
+                    feature: {'timestamp': row['timestamp'], 'receipt_timestamp': row['timestamp'], 'mid_price': row[f'{feature}-mid_price']}
+                    for feature in features
+                }
+            ))
+        self.pos = 0
+        self.cur_out_event = None
+
+    def has_next(self) -> bool:
+        return self.pos < len(self.events)
+
+    def next(self) -> DataStreamEvent:
+        self.cur_out_event = self.events[self.pos]
+        self.pos += 1
+        return self.cur_out_event
+
+    def get_cur_mid_prices(self) -> Dict[Instrument, float]:
+        return FeatureStreamGenerator.get_mid_prices_from_event(self.cur_out_event)
+
+    def get_sampled_mid_prices(self) -> Dict[Instrument, List[Tuple[float, float]]]:
+        return {}
+
+
+def mock_mid_price_feature(instrument: Instrument) -> Feature:
+    return Feature([], SyntheticSineMidPrice, {
+        'exchange': instrument.exchange,
+        'instrument_type': instrument.instrument_type,
+        'symbol': instrument.symbol
+    })
+
+
+# joined featurizer result with random walk mid price column per instrument
+def mock_mid_prices_df(num_rows: int, seed: int = 1) -> Tuple[pd.DataFrame, List[Feature]]:
+    rng = np.random.default_rng(seed)
+    features = []
+    data = {'timestamp': np.arange(num_rows, dtype=float)}
+    for instrument in MOCK_INSTRUMENTS:
+        feature = mock_mid_price_feature(instrument)
+        features.append(feature)
+        data[f'{feature}-mid_price'] = 100 * np.exp(np.cumsum(rng.normal(0, 0.01, num_rows)))
+    return pd.DataFrame(data), features
+
+
+# quote wallet with given balance and empty base wallet per instrument
+def mock_portfolio(quote_balance: float = 10000) -> Portfolio:
+    quote = AssetInstrument('BINANCE', 'spot', 'USDT')
+    wallets = [Wallet(asset_instrument=quote, balance=quote_balance)]
+    for instrument in MOCK_INSTRUMENTS:
+        base, _ = instrument.to_asset_instruments()
+        wallets.append(Wallet(asset_instrument=base, balance=0))
+    return Portfolio(wallets=wallets, quote=quote)
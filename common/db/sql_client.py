@@ -7,7 +7,9 @@ from sqlalchemy.orm import sessionmaker
 
 from common.db.base import Base
 
-Session = sessionmaker()
+# sessions are short-lived and return connections to engine pool on close,
+# objects stay usable after session is closed
+Session = sessionmaker(expire_on_commit=False)
 
 SVOE_DB_NAME = 'svoe_db'
 
@@ -73,10 +75,17 @@ class SqlClient:
             self.engine = SqlClient.engine_instance
 
     def _init_engine(self):
-        engine = create_engine(get_conn_str(), echo=False)
+        # pooled connections are checked before reuse, mysql drops idle ones
+        engine = create_engine(get_conn_str(), echo=False, pool_pre_ping=True)
         Session.configure(bind=engine)
         return engine
 
     def create_tables_SCRIPT_ONLY(self):
         # creates if not exists
         Base.metadata.create_all(self.engine)
+
+    def create_indexes_SCRIPT_ONLY(self):
+        # create_all skips existing tables, add indexes declared later to them
+        for table in Base.metadata.sorted_tables:
+            for index in table.indexes:
+                index.create(self.engine, checkfirst=True)
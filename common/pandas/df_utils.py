@@ -2,10 +2,14 @@ import hashlib
 import time
 from pathlib import Path
 
+import numpy as np
 import pandas as pd
 from cache_df import CacheDF
 import functools
-from typing import List, Tuple, Generator, Optional, Callable
+from typing import List, Tuple, Generator, Optional, Callable, Dict, Any
+
+import pyarrow as pa
+import pyarrow.csv as pa_csv
 
 from matplotlib import pyplot as plt
 
@@ -125,29 +129,50 @@ def plot_multi(df: pd.DataFrame, col_names: Optional[List[str]] = None, same_fig
 
 
 # TODO typing
+# number of rows used to estimate per-row size of object columns
+ROW_SIZE_SAMPLE_SIZE = 1000
+
+
+# estimates df.memory_usage(index=True, deep=True) per row without scanning object columns:
+# fixed-width columns are sized by dtype, object columns by a sample of evenly spaced rows
+def estimate_row_size_bytes(df: pd.DataFrame, sample_size: int = ROW_SIZE_SAMPLE_SIZE) -> float:
+    num_rows = len(df)
+    if num_rows == 0:
+        return 0.0
+    shallow = df.memory_usage(index=True, deep=False)
+    object_cols = [col for col in df.columns if df[col].dtype == object]
+    fixed_size = shallow.drop(labels=object_cols).sum()
+    if len(object_cols) == 0:
+        return fixed_size / num_rows
+    sample = df[object_cols].iloc[np.linspace(0, num_rows - 1, min(sample_size, num_rows)).astype(np.int64)]
+    object_size = sample.memory_usage(index=False, deep=True).sum() / len(sample)
+    return fixed_size / num_rows + object_size
+
+
+# split boundaries are computed up front: every chunk_num_rows rows, moved forward to the end of the timestamp group
+# so same ts never gets split. Yields slices of df (no copies)
 def gen_split_df_by_mem(df: pd.DataFrame, chunk_size_kb: int, callback: Optional[Callable] = None) -> Generator:
     # split only ts sorted dfs
     if not is_ts_sorted(df):
         raise ValueError('Only ts-sorted dfs can be split')
 
     num_rows = len(df)
-    df_size_kb = get_size_kb(df)
+    row_size_kb = estimate_row_size_bytes(df) / 1024.0
+    df_size_kb = row_size_kb * num_rows
 
     if chunk_size_kb > df_size_kb:
         raise ValueError(f'Chunk size {chunk_size_kb}kb is larger then df size {df_size_kb}kb')
 
-    row_size_kb = df_size_kb/num_rows
+    chunk_num_rows = max(1, int(chunk_size_kb/row_size_kb))
 
-    chunk_num_rows = int(chunk_size_kb/row_size_kb)
+    timestamps = df['timestamp'].to_numpy()
+    candidate_ends = np.arange(chunk_num_rows, num_rows, chunk_num_rows)
+    ends = np.unique(np.searchsorted(timestamps, timestamps[candidate_ends - 1], side='right'))
+    ends = ends[ends < num_rows].tolist() + [num_rows]
 
     start = 0
-    while start < num_rows:
+    for end in ends:
         t = time.time()
-        end = min(start + chunk_num_rows, num_rows) - 1
-        # move end while we have same ts to make sure we don't split it
-        end_ts = df.iloc[end]['timestamp']
-        while end < num_rows and df.iloc[end]['timestamp'] == end_ts:
-            end += 1
         yield df.iloc[start: end]
         if callback is not None:
             callback(None, time.time() - t)
@@ -156,6 +181,28 @@ def gen_split_df_by_mem(df: pd.DataFrame, chunk_size_kb: int, callback: Optional
         # TODO return num splits?
 
 
+# reads csv in bounded chunks, source is a path (compression is detected from extension) or a file-like object.
+# Types are inferred from the first chunk, column_types should be passed for columns which may be inferred
+# differently in later chunks (e.g. all-null or time-like strings)
+def gen_csv_chunks(
+    source: Any,
+    chunk_size_kb: int,
+    delimiter: str = ',',
+    column_types: Optional[Dict[str, pa.DataType]] = None
+) -> Generator[pd.DataFrame, None, None]:
+    reader = pa_csv.open_csv(
+        source,
+        read_options=pa_csv.ReadOptions(block_size=chunk_size_kb * 1024),
+        parse_options=pa_csv.ParseOptions(delimiter=delimiter),
+        # empty values are nulls, same as pd.read_csv
+        convert_options=pa_csv.ConvertOptions(column_types=column_types, strings_can_be_null=True)
+    )
+    for batch in reader:
+        if batch.num_rows == 0:
+            continue
+        yield batch.to_pandas()
+
+
 def hash_df(df: pd.DataFrame) -> str:
     return hashlib.sha1(pd.util.hash_pandas_object(df).values).hexdigest()
 
@@ -2,6 +2,7 @@ import tempfile
 from pathlib import Path
 
 import joblib
+import pyarrow as pa
 import s3fs
 
 import awswrangler as wr
@@ -9,11 +10,11 @@ import awswrangler as wr
 import common.concurrency.concurrency_utils as cu
 import boto3
 import functools
-from typing import Tuple, List, Optional, Generator
+from typing import Tuple, List, Optional, Generator, Dict
 import pandas as pd
 import os
 
-from common.pandas.df_utils import cache_df_if_needed, get_cached_df, CACHE_DIR
+from common.pandas.df_utils import cache_df_if_needed, get_cached_df, CACHE_DIR, gen_csv_chunks
 
 
 # for progress bar https://github.com/alphatwirl/atpbar
@@ -145,6 +146,19 @@ def inventory() -> Generator[pd.DataFrame, None, None]:
         yield pd.read_parquet(f'{inventory_files_folder}/{f}')
 
 
+# streams csv from s3 without loading whole file in memory, see gen_csv_chunks
+def gen_csv_chunks_s3(
+    path: str,
+    chunk_size_kb: int,
+    delimiter: str = ';',
+    column_types: Optional[Dict[str, pa.DataType]] = None
+) -> Generator[pd.DataFrame, None, None]:
+    s3 = s3fs.S3FileSystem()  # TODO init in container?
+    with s3.open(path, 'rb') as f:
+        source = pa.CompressedInputStream(f, 'gzip') if path.endswith('.gz') else f
+        yield from gen_csv_chunks(source, chunk_size_kb, delimiter, column_types)
+
+
 def store_df_s3(path: str, df: pd.DataFrame, cache_dir: str = CACHE_DIR):
     # TODO add caching
     session = get_session()
@@ -1,5 +1,6 @@
-from typing import List, Optional, Any, Callable, Deque, Tuple, Dict
+from typing import List, Optional, Any, Callable, Deque, Tuple, Dict, Iterable
 
+import numpy as np
 import pandas as pd
 from portion import Interval
 from streamz import Stream
@@ -39,8 +40,25 @@ def lookback_apply(upstream: Stream, window: str, apply: Callable) -> Stream:
     return upstream.accumulate(_deque_and_apply, returns_state=True, start=deque())
 
 
+# batch counterpart of lookback_apply's deque: for each event i returns index of the first event
+# which is still in the lookback window, i.e. first j such that not (ts[i] - ts[j] > window)
+def lookback_window_starts(timestamps: np.ndarray, window: str) -> np.ndarray:
+    window_s = convert_str_to_seconds(window)
+    idx = np.arange(len(timestamps))
+    starts = np.searchsorted(timestamps, timestamps - window_s, side='left')
+    # searchsorted compares ts[j] with ts[i] - window, deque compares ts[i] - ts[j] with window,
+    # adjust for possible float rounding differences so boundaries are exactly the same
+    while True:
+        prev = np.maximum(starts - 1, 0)
+        move_left = (starts > 0) & ~(timestamps - timestamps[prev] > window_s)
+        move_right = (starts < idx) & (timestamps - timestamps[starts] > window_s)
+        if not move_left.any() and not move_right.any():
+            return starts
+        starts = starts - move_left + move_right
+
+
 def run_named_events_stream(
-    named_events: List[Tuple[Any, Event]],
+    named_events: Iterable[Tuple[Any, Event]],
     sources: Dict[Any, Stream],
     out: Stream,
     interval: Optional[Interval] = None
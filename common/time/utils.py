@@ -3,6 +3,7 @@ from datetime import datetime
 from typing import Optional, List, Tuple
 
 import ciso8601
+import numpy as np
 import pytz
 from portion import Interval, closed
 
@@ -51,6 +52,27 @@ def get_sampling_bucket_ts(timestamp: float, bucket: str, return_bucket_start: O
     return bucket_start_ts if return_bucket_start else bucket_start_ts + bucket_s
 
 
+# vectorized get_sampling_bucket_ts, produces exactly the same values
+def get_sampling_buckets_ts(timestamps: np.ndarray, bucket: str, return_bucket_start: Optional[bool] = True) -> np.ndarray:
+    bucket_s = convert_str_to_seconds(bucket)
+    if bucket_s > 24 * 60 * 60 or bucket_s < 0.001:
+        raise ValueError(f'window_s must be between 1ms and 24h')
+
+    # local day start is resolved once per 15 min slot: all tz offsets and DST switches are multiples of 15 mins,
+    # so a slot never crosses local midnight
+    slot_s = 15 * 60
+    slots = np.floor(timestamps / slot_s).astype(np.int64)
+    unique_slots, inverse = np.unique(slots, return_inverse=True)
+    day_starts = np.empty(len(unique_slots), dtype=np.float64)
+    for i in range(len(unique_slots)):
+        dt = datetime.fromtimestamp(float(unique_slots[i] * slot_s))
+        day_starts[i] = dt.replace(hour=0, minute=0, second=0, microsecond=0).timestamp()
+    start_ts = day_starts[inverse.reshape(-1)]
+    num_buckets = np.floor((timestamps - start_ts) / bucket_s)
+    bucket_start_ts = start_ts + num_buckets * bucket_s
+    return bucket_start_ts if return_bucket_start else bucket_start_ts + bucket_s
+
+
 def split_time_range_between_ts(start_ts: float, end_ts: float, num_splits: int, diff_between: float) -> List[Interval]:
     if num_splits == 1:
         return [closed(start_ts, end_ts)]
@@ -1,3 +1,6 @@
+import os
+from collections import OrderedDict
+from dataclasses import dataclass, asdict
 from typing import Dict, Optional, Tuple, Any, List
 
 import ray
@@ -7,42 +10,109 @@ from ray import ObjectRef
 CACHE_ACTOR_NAME = 'CacheActor'
 CACHE_ACTOR_NAMESPACE = 'cache'
 
+# share of cluster object store cached blocks can pin if budget is not set explicitly
+DEFAULT_OBJECT_STORE_FRACTION = 0.5
 
+
+def _default_max_pinned_bytes() -> Optional[int]:
+    max_mb = os.getenv('SVOE_CACHE_ACTOR_MAX_PINNED_MB')
+    if max_mb is not None:
+        return int(float(max_mb) * 1024 * 1024)
+    if ray.is_initialized():
+        object_store_memory = ray.cluster_resources().get('object_store_memory')
+        if object_store_memory is not None:
+            return int(object_store_memory * DEFAULT_OBJECT_STORE_FRACTION)
+    return None
+
+
+@dataclass
+class CacheActorStats:
+    hits: int = 0
+    misses: int = 0
+    bytes_pinned: int = 0
+    releases: int = 0
+    evictions: int = 0
+    bytes_evicted: int = 0
+
+
+@dataclass
+class _CacheEntry:
+    obj_ref: ObjectRef
+    # unknown until first consumer reports block size
+    size_bytes: int = 0
+
+
+# Caches refs of tasks producing blocks shared by multiple consumers in the task graph.
+# `cache` holds planned number of consumers per (feature_key, interval), as counted by bind_and_cache when the graph is built.
+# First consumer submits the task via the actor (so the actor owns the result) and caches the task ref right away,
+# consumers arriving while the task is still running get the same ref, so every block is computed once (single-flight).
+# Entry is released once all planned consumers got it. Pinned bytes are bounded, least recently used entries
+# are dropped when over budget (later consumers of a dropped entry recompute the block)
 @ray.remote
 class CacheActor:
-    def __init__(self, cache: Dict[str, Dict[Interval, Tuple[int, Optional[ObjectRef]]]]):
+    def __init__(
+        self,
+        cache: Dict[str, Dict[Interval, Tuple[int, Optional[ObjectRef]]]],
+        max_pinned_bytes: Optional[int] = None
+    ):
         self.cache = cache
+        self.max_pinned_bytes = _default_max_pinned_bytes() if max_pinned_bytes is None else max_pinned_bytes
+        self.entries: OrderedDict[Tuple[str, Interval], _CacheEntry] = OrderedDict()
+        self.remaining_consumers: Dict[Tuple[str, Interval], int] = {}
+        self.stats = CacheActorStats()
         self.featurizer_result_refs = None
+        self.update_cache(cache)
+
+    # (re)sets planned consumers, graph may be built after the actor is created
+    def update_cache(self, cache: Dict[str, Dict[Interval, Tuple[int, Optional[ObjectRef]]]]):
+        self.cache = cache
+        for feature_key in cache:
+            for interval in cache[feature_key]:
+                self.remaining_consumers[(feature_key, interval)] = cache[feature_key][interval][0]
+
+    # returns ([obj_ref], is_new) for cached/submitted task or (None, False) if block has a single consumer left
+    # and caller should compute it itself. Ref is wrapped in list to avoid de-referencing
+    def get_or_submit(
+        self,
+        context: Dict[str, Any],
+        func: ray.remote_function.RemoteFunction,
+        kwargs: Dict[str, Any],
+        memory: Optional[int] = None
+    ) -> Tuple[Optional[List[ObjectRef]], bool]:
+        key = (context['feature_key'], context['interval'])
+        remaining = self.remaining_consumers.get(key, 1)
+        self.remaining_consumers[key] = remaining - 1
+
+        entry = self.entries.get(key)
+        if entry is not None:
+            self.stats.hits += 1
+            self.entries.move_to_end(key)
+            if remaining <= 1:
+                self._release(key)
+            return [entry.obj_ref], False
+
+        self.stats.misses += 1
+        if remaining <= 1:
+            return None, False
 
-    def check_cache(self, context: Dict[str, Any]) -> Tuple[Optional[ObjectRef], bool]:
-        feature_key = context['feature_key']
-        interval = context['interval']
-        obj_ref = None
-        ref_counter = 1
-        if feature_key in self.cache and interval in self.cache[feature_key]:
-            ref_counter, obj_ref = self.cache[feature_key][interval]
-            if ref_counter == 1:
-                # release obj_ref so it can be GCed
-                # if obj_ref is not None:
-                #     del self.cache[feature_key][interval]
-                # TODO figure out cache invalidation
-                pass
-            else:
-                # decrease ref counter
-                self.cache[feature_key][interval] = (ref_counter - 1, obj_ref)
-
-        # use Plasma Store as cache only if this block is referenced by more than 1 feature
-        should_cache = ref_counter > 1 and obj_ref is None
-        return obj_ref, should_cache
-
-    def cache_obj_ref(self, obj_ref_list: List[ObjectRef], context: Dict[str, Any]):
-        feature_key = context['feature_key']
-        interval = context['interval']
-        if feature_key in self.cache and interval in self.cache[feature_key]:
-            ref_counter, _ = self.cache[feature_key][interval]
-            self.cache[feature_key][interval] = (ref_counter, obj_ref_list[0])
-        else:
-            raise ValueError(f'Unable to locate cache key for {feature_key} {interval}')
+        if memory is not None:
+            func = func.options(memory=memory)
+        obj_ref = func.remote(**kwargs)
+        self.entries[key] = _CacheEntry(obj_ref=obj_ref)
+        return [obj_ref], True
+
+    def record_size(self, context: Dict[str, Any], size_bytes: int):
+        key = (context['feature_key'], context['interval'])
+        entry = self.entries.get(key)
+        if entry is None:
+            # already released
+            return
+        entry.size_bytes = size_bytes
+        self.stats.bytes_pinned += size_bytes
+        self._evict_if_needed()
+
+    def get_stats(self) -> Dict:
+        return asdict(self.stats)
 
     def get_cache(self):
         return self.cache
@@ -53,10 +123,33 @@ class CacheActor:
     def get_featurizer_result_refs(self):
         return self.featurizer_result_refs
 
+    def _release(self, key: Tuple[str, Interval]):
+        entry = self.entries.pop(key)
+        self.stats.bytes_pinned -= entry.size_bytes
+        self.stats.releases += 1
+
+    def _evict_if_needed(self):
+        if self.max_pinned_bytes is None:
+            return
+        # least recently used first, keep running tasks since their consumers are waiting on them
+        for key in list(self.entries.keys()):
+            if self.stats.bytes_pinned <= self.max_pinned_bytes:
+                break
+            entry = self.entries[key]
+            if entry.size_bytes == 0:
+                continue
+            del self.entries[key]
+            self.stats.bytes_pinned -= entry.size_bytes
+            self.stats.evictions += 1
+            self.stats.bytes_evicted += entry.size_bytes
+
 
 def get_cache_actor() -> ray.actor.ActorHandle:
     return ray.get_actor(name=CACHE_ACTOR_NAME, namespace=CACHE_ACTOR_NAMESPACE)
 
 
-def create_cache_actor(cache: Dict[str, Dict[Interval, Tuple[int, Optional[ObjectRef]]]]) -> ray.actor.ActorHandle:
-    return CacheActor.options(name=CACHE_ACTOR_NAME, namespace=CACHE_ACTOR_NAMESPACE, lifetime='detached').remote(cache)
+def create_cache_actor(
+    cache: Dict[str, Dict[Interval, Tuple[int, Optional[ObjectRef]]]],
+    max_pinned_bytes: Optional[int] = None
+) -> ray.actor.ActorHandle:
+    return CacheActor.options(name=CACHE_ACTOR_NAME, namespace=CACHE_ACTOR_NAMESPACE, lifetime='detached').remote(cache, max_pinned_bytes)
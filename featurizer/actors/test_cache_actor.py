@@ -0,0 +1,96 @@
+import time
+import unittest
+
+import pandas as pd
+import ray
+from portion import closed
+
+from featurizer.actors.cache_actor import CacheActor, create_cache_actor
+from featurizer.task_graph.tasks import _get_or_compute
+
+
+@ray.remote
+def _mock_block(i: int) -> int:
+    time.sleep(0.1)
+    return i
+
+
+@ray.remote
+def _mock_assigned_memory(i: int) -> pd.DataFrame:
+    return pd.DataFrame({'memory': [ray.get_runtime_context().get_assigned_resources().get('memory', 0)]})
+
+
+def _context(key: str):
+    return {'feature_key': key, 'interval': closed(0, 1)}
+
+
+class TestCacheActor(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        ray.init(num_cpus=2, include_dashboard=False, log_to_driver=False, ignore_reinit_error=True)
+
+    @classmethod
+    def tearDownClass(cls):
+        ray.shutdown()
+
+    def test_single_flight_and_release(self):
+        cache = {'a': {closed(0, 1): (3, None)}, 'b': {closed(0, 1): (1, None)}}
+        actor = CacheActor.remote(cache, max_pinned_bytes=None)
+
+        # all consumers of 'a' get the same task ref while task is still running
+        res = ray.get([actor.get_or_submit.remote(_context('a'), _mock_block, {'i': 1}) for _ in range(3)])
+        refs = [r[0][0] for r in res]
+        assert [r[1] for r in res] == [True, False, False]
+        assert refs[0] == refs[1] == refs[2]
+        assert ray.get(refs[0]) == 1
+
+        # single consumer computes block itself
+        assert ray.get(actor.get_or_submit.remote(_context('b'), _mock_block, {'i': 2})) == (None, False)
+
+        stats = ray.get(actor.get_stats.remote())
+        assert stats['hits'] == 2
+        assert stats['misses'] == 2
+        assert stats['releases'] == 1
+        assert stats['bytes_pinned'] == 0
+
+    def test_lru_eviction(self):
+        cache = {'a': {closed(0, 1): (2, None)}, 'b': {closed(0, 1): (2, None)}}
+        actor = CacheActor.remote(cache, max_pinned_bytes=150)
+
+        for key in ['a', 'b']:
+            ray.get(actor.get_or_submit.remote(_context(key), _mock_block, {'i': 1}))
+            ray.get(actor.record_size.remote(_context(key), 100))
+
+        stats = ray.get(actor.get_stats.remote())
+        assert stats['evictions'] == 1
+        assert stats['bytes_pinned'] == 100
+
+        # 'a' was evicted, last consumer recomputes it, 'b' is still cached
+        assert ray.get(actor.get_or_submit.remote(_context('a'), _mock_block, {'i': 1})) == (None, False)
+        obj_ref, is_new = ray.get(actor.get_or_submit.remote(_context('b'), _mock_block, {'i': 1}))
+        assert not is_new and obj_ref is not None
+        stats = ray.get(actor.get_stats.remote())
+        assert stats['hits'] == 1
+        assert stats['bytes_pinned'] == 0
+
+    def test_memory_is_reserved_by_computing_task(self):
+        memory = 10 * 1024 * 1024
+        cache = {'a': {closed(0, 1): (2, None)}, 'b': {closed(0, 1): (1, None)}}
+        actor = create_cache_actor(cache)
+        try:
+            # block with multiple consumers is submitted by the actor
+            assert _get_or_compute(_context('a'), _mock_assigned_memory, None, memory=memory, i=1)['memory'][0] == memory
+            # last consumer computes it in a separate task too
+            assert _get_or_compute(_context('b'), _mock_assigned_memory, None, memory=memory, i=1)['memory'][0] == memory
+        finally:
+            ray.kill(actor)
+
+
+if __name__ == '__main__':
+    t = TestCacheActor()
+    t.setUpClass()
+    t.test_single_flight_and_release()
+    t.test_lru_eviction()
+    t.test_memory_is_reserved_by_computing_task()
+    t.tearDownClass()
@@ -1,9 +1,13 @@
-from typing import Dict, List, Any, Tuple
+from bisect import bisect_left
+from typing import Dict, List, Any, Tuple, Optional, Union
+
+import numpy as np
 import pandas as pd
 from portion import Interval, closed, IntervalDict
 
 from common.pandas.df_utils import is_ts_sorted, sub_df_ts
 from common.time.utils import convert_str_to_seconds, round_float
+from featurizer.blocks.interval_index import IntervalIndex
 from featurizer.sql.models.data_source_block_metadata import DataSourceBlockMetadata
 
 # TODO deprecate this, use FeatureBlockMetadata and DataSourceBlockMetadata objects
@@ -14,19 +18,22 @@ Block = pd.DataFrame
 BlockRange = List[Block] # represents consecutive blocks
 
 # TODO common consts for start_ts, end_ts, etc
+# column names resolved once, attribute access on sqlalchemy columns is slow in per block loops
+_START_TS = DataSourceBlockMetadata.start_ts.name
+_END_TS = DataSourceBlockMetadata.end_ts.name
 
 
 def meta_to_interval(meta: BlockMeta) -> Interval:
-    start = round_float(float(meta[DataSourceBlockMetadata.start_ts.name]))
-    end = round_float(float(meta[DataSourceBlockMetadata.end_ts.name]))
+    start = round_float(float(meta[_START_TS]))
+    end = round_float(float(meta[_END_TS]))
     if start > end:
         raise ValueError('start_ts cannot be greater than end_ts')
     return closed(start, end)
 
 
 def range_meta_to_interval(range_meta: BlockRangeMeta) -> Interval:
-    start = round_float(float(range_meta[0][DataSourceBlockMetadata.start_ts.name]))
-    end = round_float(float(range_meta[-1][DataSourceBlockMetadata.end_ts.name]))
+    start = round_float(float(range_meta[0][_START_TS]))
+    end = round_float(float(range_meta[-1][_END_TS]))
     if start > end:
         raise ValueError('start_ts cannot be greater than end_ts')
     return closed(start, end)
@@ -39,11 +46,27 @@ def interval_to_meta(interval: Interval) -> BlockMeta:
     }
 
 
-def ranges_to_interval_dict(ranges: List[BlockRangeMeta]) -> IntervalDict:
-    res = IntervalDict()
+# identifies block contents, used as a cache key for preprocessed blocks
+def data_block_key(meta: BlockMeta) -> str:
+    block_hash = meta.get(DataSourceBlockMetadata.hash.name)
+    if block_hash is not None:
+        return block_hash
+    return meta[DataSourceBlockMetadata.path.name]
+
+
+# in-memory size of a block from its metadata, 0 if unknown
+def block_memory_bytes(meta: BlockMeta) -> float:
+    size_kb = meta.get(DataSourceBlockMetadata.size_in_memory_kb.name)
+    if size_kb is None:
+        return 0
+    return float(size_kb) * 1024
+
+
+def ranges_to_interval_index(ranges: List[BlockRangeMeta]) -> IntervalIndex:
+    res = IntervalIndex()
     for range in ranges:
         interval = range_meta_to_interval(range)
-        if overlaps_keys(interval, res):
+        if res.overlaps(interval):
             raise ValueError(f'Overlapping intervals for {interval}')
 
         res[interval] = range
@@ -51,14 +74,6 @@ def ranges_to_interval_dict(ranges: List[BlockRangeMeta]) -> IntervalDict:
     return res
 
 
-def overlaps_keys(interval: Interval, d: IntervalDict) -> bool:
-    keys = list(d.keys())
-    for i in keys:
-        if i.overlaps(interval):
-            return True
-    return False
-
-
 def mock_meta(start_ts, end_ts, extra=None) -> BlockMeta:
     res = {
         DataSourceBlockMetadata.start_ts.name: float(start_ts),
@@ -90,56 +105,52 @@ def make_ranges(data: List[BlockMeta]) -> List[BlockRangeMeta]:
     return ranges
 
 
-def identity_grouping(ranges: List[BlockMeta]) -> IntervalDict:
+def identity_grouping(ranges: List[BlockMeta]) -> IntervalIndex:
     # groups blocks 1 to 1
-    res = IntervalDict()
+    res = IntervalIndex()
     for meta in ranges:
         res[meta_to_interval(meta)] = [meta]
     return res
 
 
-def windowed_grouping(ranges: List[BlockMeta], window: str) -> IntervalDict:
-    res = IntervalDict()
+def windowed_grouping(ranges: List[BlockMeta], window: str) -> IntervalIndex:
+    res = IntervalIndex()
+    window_s = convert_str_to_seconds(window)
+    # blocks are ts sorted, so are their end_ts
+    end_ts = [float(r['end_ts']) for r in ranges]
     for i in range(len(ranges)):
-        windowed_blocks = [ranges[i]]
         # look back until window limit is reached
-        j = i - 1
-        while j >= 0 and float(ranges[i]['start_ts']) - float(ranges[j]['end_ts']) <= convert_str_to_seconds(window):
-            windowed_blocks.append(ranges[j])
-            j -= 1
-        res[meta_to_interval(ranges[i])] = windowed_blocks
+        first = bisect_left(end_ts, float(ranges[i]['start_ts']) - window_s, 0, i)
+        res[meta_to_interval(ranges[i])] = [ranges[j] for j in range(i, first - 1, -1)]
 
     return res
 
 
-def get_overlaps(key_intervaled_value: Dict[Any, IntervalDict]) -> Dict[Interval, Dict]:
+def get_overlaps(key_intervaled_value: Dict[Any, Union[IntervalIndex, IntervalDict]]) -> Dict[Interval, Dict]:
     # TODO add visualization?
-    # https://github.com/AlexandreDecan/portion
-    # https://stackoverflow.com/questions/40367461/intersection-of-two-lists-of-ranges-in-python
-    d = IntervalDict()
-    # print(key_intervaled_value)
-    first_key = list(key_intervaled_value.keys())[0]
-    for interval, values in key_intervaled_value[first_key].items():
-        d[interval] = {first_key: values}  # named_intervaled_values_dict
-
-    # join intervaled_values_dict for each key with first to find all possible intersecting intervals
-    # and their corresponding values
-    for key, intervaled_values_dict in key_intervaled_value.items():
+    # intersects intervals of first key with overlapping intervals of each next key, overlapping intervals
+    # are looked up in IntervalIndex so this is linear in number of intervals and overlaps
+    indexes = {}
+    for key, intervaled_values in key_intervaled_value.items():
+        indexes[key] = intervaled_values if isinstance(intervaled_values, IntervalIndex) else IntervalIndex.from_interval_dict(intervaled_values)
+
+    first_key = list(indexes.keys())[0]
+    overlaps = [(interval, {first_key: values}) for interval, values in indexes[first_key].items()]
+    for key, index in indexes.items():
         if key == first_key:
             continue
-
-        def concat(named_intervaled_values_dict, values):
-            # TODO copy.deepcopy?
-            res = named_intervaled_values_dict.copy()
-            res[key] = values
-            return res
-
-        combined = d.combine(intervaled_values_dict, how=concat)  # outer join
-        d = combined[d.domain() & intervaled_values_dict.domain()]  # inner join
+        joined = []
+        for interval, named_values in overlaps:
+            for other_interval, values in index.overlapping(interval):
+                # TODO copy.deepcopy?
+                res = named_values.copy()
+                res[key] = values
+                joined.append((interval & other_interval, res))
+        overlaps = joined
 
     # make sure all intervals are closed
     res = {}
-    for interval, value in d.items():
+    for interval, value in overlaps:
         res[closed(interval.lower, interval.upper)] = value
     return res
 
@@ -207,6 +218,94 @@ def merge_asof_multi(dfs: List[pd.DataFrame]) -> pd.DataFrame:
     return res
 
 
+# Streaming version of merge_asof_multi for the join task: base rows are taken within [start_ts, end_ts] and all other
+# sources are as-of (backward) joined onto base timestamps. As-of indices are computed with a single searchsorted
+# per source and each output column is gathered once, no intermediate frames are created.
+# Each source is (block, prev_tail, column_prefix), where prev_tail is an optional last row of the previous block
+# of the same feature, used for timestamps preceding the first row of the block (prev blocks are expected to end
+# before the first base row, which is how the join dag lays out blocks).
+def point_in_time_join(
+    sources: List[Tuple[pd.DataFrame, Optional[pd.DataFrame], str]],
+    start_ts: float,
+    end_ts: float
+) -> pd.DataFrame:
+    base, base_tail, base_prefix = sources[0]
+    base_parts = [base_tail, base] if base_tail is not None else [base]
+    # base rows selection per part
+    base_rows = []
+    for part in base_parts:
+        ts = part['timestamp'].to_numpy()
+        base_rows.append(np.flatnonzero((ts >= start_ts) & (ts <= end_ts)))
+    timestamps = np.concatenate([part['timestamp'].to_numpy()[rows] for part, rows in zip(base_parts, base_rows)])
+    if len(timestamps) == 0:
+        raise ValueError(f'Can not find intersection: {start_ts}, {end_ts}')
+
+    columns = {}
+    has_receipt_ts = 'receipt_timestamp' in base
+    for col in base.columns:
+        if col == 'timestamp':
+            columns[col] = timestamps
+            continue
+        name = 'receipt_timestamp' if col == 'receipt_timestamp' else _prefixed(base_prefix, col)
+        columns[name] = np.concatenate([part[col].to_numpy()[rows] for part, rows in zip(base_parts, base_rows)])
+
+    for block, prev_tail, prefix in sources[1:]:
+        # last row with ts <= base ts, -1 if there is no such row in block
+        indices = np.searchsorted(block['timestamp'].to_numpy(), timestamps, side='right') - 1
+        from_block = indices >= 0
+        from_tail = ~from_block
+        if prev_tail is not None and len(prev_tail) > 0:
+            from_tail &= prev_tail['timestamp'].to_numpy()[-1] <= timestamps
+        else:
+            from_tail[:] = False
+        missing = ~(from_block | from_tail)
+        indices = np.maximum(indices, 0)
+        for col in block.columns:
+            if col == 'timestamp':
+                continue
+            if col == 'receipt_timestamp':
+                if has_receipt_ts:
+                    continue
+                # same as merge_asof_multi: first source with receipt_timestamp provides it
+                name = col
+                has_receipt_ts = True
+            else:
+                name = _prefixed(prefix, col)
+            values = block[col].to_numpy()
+            tail_value = prev_tail[col].to_numpy()[-1] if prev_tail is not None and len(prev_tail) > 0 else None
+            columns[name] = _gather_asof(values, indices, from_tail, tail_value, missing)
+
+    return pd.DataFrame(columns, copy=False)
+
+
+def _prefixed(prefix: str, col: str) -> str:
+    return f'{prefix}-{col}' if prefix is not None else col
+
+
+def _gather_asof(
+    values: np.ndarray,
+    indices: np.ndarray,
+    from_tail: np.ndarray,
+    tail_value: Any,
+    missing: np.ndarray
+) -> np.ndarray:
+    if missing.any():
+        # same as merge_asof: missing values are NaN, ints are upcast to float
+        if values.dtype.kind in 'iuf':
+            values = values.astype(np.float64, copy=False)
+        else:
+            values = values.astype(object, copy=False)
+    if len(values) == 0:
+        res = np.empty(len(indices), dtype=values.dtype)
+    else:
+        res = values[indices]
+    if from_tail.any():
+        res[from_tail] = tail_value
+    if missing.any():
+        res[missing] = np.nan
+    return res
+
+
 def intervals_almost_equal(i1: Interval, i2: Interval, diff=0.15) -> bool:
     return abs(i1.upper - i2.upper) <= diff and abs(i1.lower - i2.lower) <= diff
 
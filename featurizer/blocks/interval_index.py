@@ -0,0 +1,124 @@
+from bisect import bisect_left, bisect_right
+from typing import Any, Iterable, Iterator, List, Optional, Tuple
+
+from portion import Interval, IntervalDict
+
+
+# Sorted array of disjoint atomic intervals with values, drop-in for IntervalDict where items are set
+# in ascending order (block metadata, grouped dep ranges, dag nodes). Lookups bisect over bounds instead
+# of scanning all keys: overlapping entries in O(log n + k), exact and almost equal matches in O(log n).
+# As with IntervalDict, setting an interval which overlaps the last one (e.g. groups sharing a boundary ts)
+# trims the last one, so latest value wins on the overlap
+class IntervalIndex:
+
+    def __init__(self, items: Optional[Iterable[Tuple[Interval, Any]]] = None):
+        self._intervals: List[Interval] = []
+        self._values: List[Any] = []
+        self._lowers: List[float] = []
+        # entries are disjoint and sorted, so are upper bounds
+        self._uppers: List[float] = []
+        if items is not None:
+            for interval, value in items:
+                self[interval] = value
+
+    @classmethod
+    def from_interval_dict(cls, d: IntervalDict) -> 'IntervalIndex':
+        # IntervalDict keys can be unions of atomic intervals
+        atomic = [(a, value) for interval, value in d.items() for a in interval]
+        return IntervalIndex(sorted(atomic, key=lambda e: (e[0].lower, e[0].upper)))
+
+    def __setitem__(self, interval: Interval, value: Any):
+        if interval.empty:
+            return
+        if not interval.atomic:
+            raise ValueError(f'IntervalIndex keys should be atomic intervals, got {interval}')
+        while len(self._intervals) > 0 and self._uppers[-1] >= interval.lower and self._intervals[-1].overlaps(interval):
+            rest = self._intervals[-1] - interval
+            if rest.empty:
+                self._pop()
+            elif rest.atomic and rest.upper <= interval.lower:
+                self._intervals[-1] = rest
+                self._uppers[-1] = rest.upper
+                break
+            else:
+                raise ValueError(f'IntervalIndex items should be set in ascending order, got {interval} after {self._intervals[-1]}')
+        if len(self._intervals) > 0 and interval.lower < self._intervals[-1].upper:
+            raise ValueError(f'IntervalIndex items should be set in ascending order, got {interval} after {self._intervals[-1]}')
+        self._intervals.append(interval)
+        self._values.append(value)
+        self._lowers.append(interval.lower)
+        self._uppers.append(interval.upper)
+
+    def __getitem__(self, interval: Interval) -> Any:
+        pos = self._find(interval)
+        if pos is None:
+            raise KeyError(interval)
+        return self._values[pos]
+
+    def __contains__(self, interval: Interval) -> bool:
+        return self._find(interval) is not None
+
+    def __len__(self) -> int:
+        return len(self._intervals)
+
+    def __iter__(self) -> Iterator[Interval]:
+        return iter(self._intervals)
+
+    def keys(self) -> List[Interval]:
+        return list(self._intervals)
+
+    def values(self) -> List[Any]:
+        return list(self._values)
+
+    def items(self) -> List[Tuple[Interval, Any]]:
+        return list(zip(self._intervals, self._values))
+
+    def overlapping(self, interval: Interval) -> List[Tuple[Interval, Any]]:
+        start, end = self._candidates(interval)
+        return [(self._intervals[i], self._values[i]) for i in range(start, end) if self._overlaps(i, interval)]
+
+    def overlaps(self, interval: Interval) -> bool:
+        start, end = self._candidates(interval)
+        return any(self._overlaps(i, interval) for i in range(start, end))
+
+    # entries whose both bounds are within diff of interval bounds
+    def almost_equal(self, interval: Interval, diff: float) -> List[Tuple[Interval, Any]]:
+        start = bisect_left(self._lowers, interval.lower - diff)
+        end = bisect_right(self._lowers, interval.lower + diff)
+        return [(self._intervals[i], self._values[i]) for i in range(start, end) if abs(self._uppers[i] - interval.upper) <= diff]
+
+    # entry preceding given one, None for the first one
+    def prev(self, interval: Interval) -> Optional[Tuple[Interval, Any]]:
+        pos = self._find(interval)
+        if pos is None:
+            raise KeyError(interval)
+        if pos == 0:
+            return None
+        return self._intervals[pos - 1], self._values[pos - 1]
+
+    def _candidates(self, interval: Interval) -> Tuple[int, int]:
+        # entries with upper >= interval.lower and lower <= interval.upper, bounds openness is checked by caller
+        return bisect_left(self._uppers, interval.lower), bisect_right(self._lowers, interval.upper)
+
+    def _overlaps(self, pos: int, interval: Interval) -> bool:
+        # only entries touching interval bounds need bounds openness check
+        if self._uppers[pos] > interval.lower and self._lowers[pos] < interval.upper:
+            return True
+        return self._intervals[pos].overlaps(interval)
+
+    def _find(self, interval: Interval) -> Optional[int]:
+        pos = bisect_left(self._lowers, interval.lower)
+        while pos < len(self._intervals) and self._lowers[pos] == interval.lower:
+            if self._intervals[pos] == interval:
+                return pos
+            pos += 1
+        return None
+
+    def _pop(self):
+        self._intervals.pop()
+        self._values.pop()
+        self._lowers.pop()
+        self._uppers.pop()
+
+    def __repr__(self) -> str:
+        return f'IntervalIndex({dict(self.items())})'
@@ -0,0 +1,193 @@
+import hashlib
+import os
+import pickle
+import uuid
+from dataclasses import dataclass, asdict
+from typing import Optional, Dict, List, Tuple, Callable
+
+import pandas as pd
+import pyarrow as pa
+
+PREPROCESSED_DATA_BLOCKS_CACHE = '/tmp/svoe/preprocessed_data_blocks_cache'
+DEFAULT_MAX_SIZE_MB = 10 * 1024
+
+
+def _default_max_size_bytes() -> int:
+    return int(float(os.getenv('SVOE_PREPROCESSED_CACHE_MAX_SIZE_MB', DEFAULT_MAX_SIZE_MB)) * 1024 * 1024)
+
+
+@dataclass
+class CacheStats:
+    hits: int = 0
+    misses: int = 0
+    bytes_read: int = 0
+    bytes_written: int = 0
+    evictions: int = 0
+    bytes_evicted: int = 0
+
+
+# Local disk cache for preprocessed data blocks. Entries are keyed by (data definition, definition version, block key),
+# where block key comes from block metadata (content hash or path), so lookups never rehash block contents.
+# Blocks are stored as Arrow IPC files which are memory-mapped on read, so reads do not copy column buffers;
+# data definitions with nested preprocessed data store Arrow tables directly (put_table/get_table, e.g. l2 'orders'
+# as list<struct>), other frames Arrow can not represent fall back to pickle.
+# Total size is bounded, least recently used entries are evicted (recency is tracked via file mtime,
+# so it is shared between worker processes on the same node). Size is tracked incrementally by each process from
+# its own writes and resynced from disk on eviction
+class PreprocessedBlockCache:
+
+    ARROW_EXT = '.arrow'
+    PICKLE_EXT = '.pkl'
+
+    def __init__(self, cache_dir: str = PREPROCESSED_DATA_BLOCKS_CACHE, max_size_bytes: Optional[int] = None):
+        self.cache_dir = cache_dir
+        self.max_size_bytes = _default_max_size_bytes() if max_size_bytes is None else max_size_bytes
+        self.stats = CacheStats()
+        os.makedirs(cache_dir, exist_ok=True)
+        # scanned on first write
+        self._size_bytes: Optional[int] = None
+
+    @classmethod
+    def make_key(cls, data_def_name: str, version: str, block_key: str) -> str:
+        return hashlib.sha1(f'{data_def_name}:{version}:{block_key}'.encode()).hexdigest()
+
+    def get(self, key: str) -> Optional[pd.DataFrame]:
+        table = self._read_table(key)
+        if table is not None:
+            # column buffers stay memory-mapped, split blocks avoid consolidating them into copies
+            return table.to_pandas(split_blocks=True, self_destruct=True)
+        path = self._path(key, self.PICKLE_EXT)
+        try:
+            size = os.path.getsize(path)
+            with open(path, 'rb') as f:
+                df = pickle.load(f)
+            # mark as recently used
+            os.utime(path)
+        except FileNotFoundError:
+            # not cached or evicted concurrently
+            self.stats.misses += 1
+            return None
+        self.stats.hits += 1
+        self.stats.bytes_read += size
+        return df
+
+    def get_table(self, key: str) -> Optional[pa.Table]:
+        table = self._read_table(key)
+        if table is None:
+            self.stats.misses += 1
+        return table
+
+    def put(self, key: str, df: pd.DataFrame):
+        if self._is_arrow_compatible(df):
+            self.put_table(key, pa.Table.from_pandas(df))
+            return
+        def _write_pickle(path: str):
+            with open(path, 'wb') as f:
+                pickle.dump(df, f, protocol=pickle.HIGHEST_PROTOCOL)
+        self._write(self._path(key, self.PICKLE_EXT), _write_pickle)
+
+    def put_table(self, key: str, table: pa.Table):
+        def _write_table(path: str):
+            with pa.OSFile(path, 'wb') as sink:
+                with pa.ipc.new_file(sink, table.schema) as writer:
+                    writer.write_table(table)
+        self._write(self._path(key, self.ARROW_EXT), _write_table)
+
+    def size_bytes(self) -> int:
+        return sum(size for _, size, _ in self._entries())
+
+    def get_stats(self) -> Dict:
+        return asdict(self.stats)
+
+    def clear(self):
+        for path, _, _ in self._entries():
+            os.remove(path)
+        self._size_bytes = 0
+
+    # memory-mapped Arrow IPC entry, None if not cached (miss is counted by caller)
+    def _read_table(self, key: str) -> Optional[pa.Table]:
+        path = self._path(key, self.ARROW_EXT)
+        try:
+            size = os.path.getsize(path)
+            with pa.memory_map(path, 'r') as source:
+                table = pa.ipc.open_file(source).read_all()
+            # mark as recently used
+            os.utime(path)
+        except FileNotFoundError:
+            # not cached or evicted concurrently
+            return None
+        self.stats.hits += 1
+        self.stats.bytes_read += size
+        return table
+
+    def _write(self, path: str, write_func: Callable[[str], None]):
+        if self._size_bytes is None:
+            self._size_bytes = self.size_bytes()
+        # write to tmp file and rename so concurrent readers never see partial files
+        tmp_path = f'{path}.{uuid.uuid4().hex}.tmp'
+        try:
+            write_func(tmp_path)
+            size = os.path.getsize(tmp_path)
+            try:
+                replaced_size = os.path.getsize(path)
+            except FileNotFoundError:
+                replaced_size = 0
+            os.replace(tmp_path, path)
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+        self.stats.bytes_written += size
+        self._size_bytes += size - replaced_size
+        if self._size_bytes > self.max_size_bytes:
+            self._evict()
+
+    def _evict(self):
+        entries = self._entries()
+        total = sum(size for _, size, _ in entries)
+        # least recently used first
+        for path, size, _ in sorted(entries, key=lambda e: e[2]):
+            if total <= self.max_size_bytes:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                # evicted by other process
+                pass
+            total -= size
+            self.stats.evictions += 1
+            self.stats.bytes_evicted += size
+        self._size_bytes = total
+
+    def _entries(self) -> List[Tuple[str, int, float]]:
+        res = []
+        with os.scandir(self.cache_dir) as it:
+            for entry in it:
+                if not (entry.name.endswith(self.ARROW_EXT) or entry.name.endswith(self.PICKLE_EXT)):
+                    continue
+                try:
+                    st = entry.stat()
+                except FileNotFoundError:
+                    continue
+                res.append((entry.path, st.st_size, st.st_mtime))
+        return res
+
+    def _path(self, key: str, ext: str) -> str:
+        return os.path.join(self.cache_dir, f'{key}{ext}')
+
+    @classmethod
+    def _is_arrow_compatible(cls, df: pd.DataFrame) -> bool:
+        for col in df.columns:
+            if df[col].dtype == object and pd.api.types.infer_dtype(df[col], skipna=True) not in ['string', 'empty']:
+                return False
+        return True
+
+
+_cache: Optional[PreprocessedBlockCache] = None
+
+
+# one cache instance per process so stats are accumulated over all blocks processed by a worker
+def get_preprocessed_block_cache() -> PreprocessedBlockCache:
+    global _cache
+    if _cache is None:
+        _cache = PreprocessedBlockCache()
+    return _cache
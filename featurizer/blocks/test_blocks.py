@@ -3,7 +3,10 @@ import unittest
 import pandas as pd
 import portion as P
 
-from featurizer.blocks.blocks import get_overlaps, mock_meta, prune_overlaps, lookahead_shift, merge_asof_multi
+from featurizer.blocks.blocks import get_overlaps, mock_meta, prune_overlaps, lookahead_shift, merge_asof_multi, \
+    point_in_time_join, windowed_grouping, identity_grouping, ranges_to_interval_index
+from featurizer.blocks.interval_index import IntervalIndex
+from common.pandas.df_utils import concat, prefix_cols, sub_df_ts
 from featurizer.featurizer_utils.testing_utils import mock_ts_df
 
 
@@ -79,6 +82,56 @@ class TestBlocks(unittest.TestCase):
         pruned_overlaps = prune_overlaps(get_overlaps(grouped_range))
         self.assertEqual(pruned_overlaps, expected)
 
+    def test_interval_index(self):
+        index = IntervalIndex([(P.closed(i * 10, i * 10 + 5), i) for i in range(1000)])
+        self.assertEqual(index.overlapping(P.closed(12, 31)), [(P.closed(10, 15), 1), (P.closed(20, 25), 2), (P.closed(30, 35), 3)])
+        self.assertEqual(index.overlapping(P.closed(6, 9)), [])
+        self.assertTrue(index.overlaps(P.closed(5, 6)))
+        self.assertFalse(index.overlaps(P.open(5, 10)))
+        self.assertEqual(index[P.closed(50, 55)], 5)
+        self.assertNotIn(P.closed(50, 56), index)
+        self.assertEqual(index.almost_equal(P.closed(50.1, 54.9), 0.15), [(P.closed(50, 55), 5)])
+        self.assertEqual(index.almost_equal(P.closed(50.2, 55), 0.15), [])
+        self.assertEqual(index.prev(P.closed(50, 55)), (P.closed(40, 45), 4))
+        self.assertIsNone(index.prev(P.closed(0, 5)))
+
+        # groups sharing boundary ts, latest wins on the overlap same as IntervalDict
+        index = IntervalIndex([(P.closed(0, 10), 'a'), (P.closed(10, 20), 'b')])
+        self.assertEqual(index.items(), [(P.closedopen(0, 10), 'a'), (P.closed(10, 20), 'b')])
+        self.assertEqual(index.overlapping(P.closed(10, 10)), [(P.closed(10, 20), 'b')])
+        with self.assertRaises(ValueError):
+            index[P.closed(1, 2)] = 'c'
+
+        # same overlaps from IntervalDict and IntervalIndex
+        ranges_a = P.IntervalDict()
+        ranges_a[P.closed(0, 10)] = 'a0'
+        ranges_a[P.closed(10, 20)] = 'a1'
+        ranges_b = P.IntervalDict()
+        ranges_b[P.closed(5, 10)] = 'b0'
+        ranges_b[P.closed(12, 30)] = 'b1'
+        expected = {
+            P.closed(5, 10): {'a': 'a0', 'b': 'b0'},
+            P.singleton(10): {'a': 'a1', 'b': 'b0'},
+            P.closed(12, 20): {'a': 'a1', 'b': 'b1'},
+        }
+        self.assertEqual(get_overlaps({'a': ranges_a, 'b': ranges_b}), expected)
+        self.assertEqual(get_overlaps({'a': IntervalIndex.from_interval_dict(ranges_a), 'b': ranges_b}), expected)
+
+    def test_groupings(self):
+        ranges = [mock_meta(i * 10, i * 10 + 9) for i in range(10)]
+        grouped = windowed_grouping(ranges, '15s')
+        self.assertEqual(grouped[P.closed(0, 9)], [ranges[0]])
+        self.assertEqual(grouped[P.closed(30, 39)], [ranges[3], ranges[2], ranges[1]])
+        self.assertEqual(len(identity_grouping(ranges)), 10)
+
+        # week of 1 minute blocks, linear in number of blocks
+        num_blocks = 7 * 24 * 60
+        ranges = [mock_meta(i * 60, i * 60 + 59.9) for i in range(num_blocks)]
+        index = ranges_to_interval_index([[r] for r in ranges])
+        self.assertEqual(len(get_overlaps({'a': index, 'b': windowed_grouping(ranges, '1m')})), num_blocks)
+        with self.assertRaises(ValueError):
+            ranges_to_interval_index([[mock_meta(0, 10)], [mock_meta(5, 15)]])
+
     def test_merge_asof(self):
         dfs = [
             mock_ts_df([4, 7, 9, 14, 16, 20], 'a'),
@@ -95,6 +148,30 @@ class TestBlocks(unittest.TestCase):
         })
         assert res.equals(expected)
 
+    def test_point_in_time_join(self):
+        # (prev block, cur block) per feature, first one is label
+        blocks = [
+            (mock_ts_df([1, 2, 3], 'a'), mock_ts_df([4, 7, 9, 9, 14, 16, 20], 'a')),
+            (mock_ts_df([0, 2], 'b'), mock_ts_df([5, 6, 8, 10, 11, 12, 18], 'b')),
+            (None, mock_ts_df([1, 3, 7, 10, 19], 'c')),
+            (mock_ts_df([1, 3], 'd'), mock_ts_df([10, 12], 'd')),
+        ]
+        blocks[1][1]['b_num'] = [1, 2, 3, 4, 5, 6, 7]
+        blocks[1][0]['b_num'] = [-1, 0]
+        blocks[0][1]['receipt_timestamp'] = blocks[0][1]['timestamp'] + 0.5
+        blocks[0][0]['receipt_timestamp'] = blocks[0][0]['timestamp'] + 0.5
+        start_ts, end_ts = 3, 19
+
+        # reference: concat prev and cur blocks, merge_asof and cut to interval
+        dfs = []
+        for name, (prev, cur) in zip(['fa', 'fb', 'fc', 'fd'], blocks):
+            dfs.append(prefix_cols(concat([prev, cur] if prev is not None else [cur]), name))
+        expected = sub_df_ts(merge_asof_multi(dfs), start_ts, end_ts).reset_index(drop=True)
+
+        sources = [(cur, prev.tail(1) if prev is not None else None, name)
+                   for name, (prev, cur) in zip(['fa', 'fb', 'fc', 'fd'], blocks)]
+        res = point_in_time_join(sources, start_ts, end_ts)
+        pd.testing.assert_frame_equal(res, expected, check_dtype=False)
 
     def test_look_ahead_shift(self):
         lookahead = '3s'
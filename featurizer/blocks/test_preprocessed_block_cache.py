@@ -0,0 +1,106 @@
+import os
+import tempfile
+import time
+import unittest
+from unittest import mock
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+
+from featurizer.blocks.preprocessed_block_cache import PreprocessedBlockCache
+from featurizer.data_definitions.common.l2_book_incremental.cryptotick.cryptotick_l2_book_incremental import \
+    CryptotickL2BookIncrementalData
+from featurizer.featurizer_utils.testing_utils import mock_ts_df, mock_processed_l2_inc_df
+
+
+class TestPreprocessedBlockCache(unittest.TestCase):
+
+    def test_get_put(self):
+        with tempfile.TemporaryDirectory() as cache_dir:
+            cache = PreprocessedBlockCache(cache_dir=cache_dir, max_size_bytes=100 * 1024 * 1024)
+            key = cache.make_key('Def', '1', 'block_hash')
+            assert key != cache.make_key('Def', '2', 'block_hash')
+            assert cache.get(key) is None
+
+            df = mock_ts_df([1, 2, 3], 'a')
+            cache.put(key, df)
+            assert os.path.exists(os.path.join(cache_dir, f'{key}{PreprocessedBlockCache.ARROW_EXT}'))
+            pd.testing.assert_frame_equal(cache.get(key), df)
+
+            # nested python objects are pickled
+            nested_key = cache.make_key('Def', '1', 'nested_block_hash')
+            nested_df = pd.DataFrame({'timestamp': [1.0, 2.0], 'orders': [[('bid', 1.0, 2.0)], [('ask', 3.0, 4.0)]]})
+            cache.put(nested_key, nested_df)
+            assert os.path.exists(os.path.join(cache_dir, f'{nested_key}{PreprocessedBlockCache.PICKLE_EXT}'))
+            assert cache.get(nested_key)['orders'].tolist() == nested_df['orders'].tolist()
+
+            stats = cache.get_stats()
+            assert stats['hits'] == 2
+            assert stats['misses'] == 1
+            assert stats['bytes_written'] == cache.size_bytes()
+
+    def test_eviction(self):
+        with tempfile.TemporaryDirectory() as cache_dir:
+            df = mock_ts_df(list(range(1000)), 'a')
+            cache = PreprocessedBlockCache(cache_dir=cache_dir, max_size_bytes=10 * 1024 * 1024)
+            cache.put('probe', df)
+            entry_size = cache.size_bytes()
+            cache.clear()
+
+            cache.max_size_bytes = int(2.5 * entry_size)
+            for key in ['k1', 'k2']:
+                cache.put(key, df)
+                time.sleep(0.01)
+            # k1 becomes most recently used, k2 should be evicted
+            assert cache.get('k1') is not None
+            time.sleep(0.01)
+            cache.put('k3', df)
+
+            assert cache.get('k2') is None
+            assert cache.get('k1') is not None
+            assert cache.get('k3') is not None
+            assert cache.size_bytes() <= cache.max_size_bytes
+            assert cache.get_stats()['evictions'] == 1
+
+    def test_zero_copy_read(self):
+        with tempfile.TemporaryDirectory() as cache_dir:
+            cache = PreprocessedBlockCache(cache_dir=cache_dir, max_size_bytes=100 * 1024 * 1024)
+            df = pd.DataFrame({'timestamp': np.arange(1000000, dtype=float), 'price': np.ones(1000000)})
+            cache.put('k', df)
+            allocated = pa.total_allocated_bytes()
+            res = cache.get('k')
+            # columns are read from memory-mapped file
+            assert pa.total_allocated_bytes() - allocated < 1024 * 1024
+            pd.testing.assert_frame_equal(res, df)
+
+    def test_l2_table_entries(self):
+        with tempfile.TemporaryDirectory() as cache_dir:
+            cache = PreprocessedBlockCache(cache_dir=cache_dir, max_size_bytes=100 * 1024 * 1024)
+            df = mock_processed_l2_inc_df(5000, snapshot_size=300)
+            with mock.patch('featurizer.data_definitions.data_definition.get_preprocessed_block_cache', return_value=cache), \
+                    mock.patch.object(cache, '_entries', wraps=cache._entries) as entries:
+                res = CryptotickL2BookIncrementalData.preprocess(df, 'block_key')
+                for i in range(3):
+                    CryptotickL2BookIncrementalData.preprocess(df, f'other_block_key_{i}')
+                # directory is scanned once, size is tracked incrementally
+                assert entries.call_count == 1
+                cached = CryptotickL2BookIncrementalData.get_preprocessed_from_cache('block_key')
+
+            # nested orders are stored as Arrow list<struct>, not pickled
+            files = os.listdir(cache_dir)
+            assert len(files) == 4
+            assert all(f.endswith(PreprocessedBlockCache.ARROW_EXT) for f in files)
+            expected = CryptotickL2BookIncrementalData.preprocess_impl(df)
+            pd.testing.assert_frame_equal(res, expected)
+            pd.testing.assert_frame_equal(cached, expected)
+            assert cache.get_stats()['hits'] == 1
+            assert cache._size_bytes == cache.size_bytes()
+
+
+if __name__ == '__main__':
+    t = TestPreprocessedBlockCache()
+    t.test_get_put()
+    t.test_eviction()
+    t.test_zero_copy_read()
+    t.test_l2_table_entries()
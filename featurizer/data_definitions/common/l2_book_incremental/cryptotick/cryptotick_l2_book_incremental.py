@@ -1,11 +1,29 @@
+from dataclasses import dataclass
+
+import numpy as np
 import pandas as pd
+import pyarrow as pa
 
 from featurizer.data_definitions.data_source_definition import DataSourceDefinition
-from featurizer.data_definitions.data_definition import EventSchema, Event
-from collections import OrderedDict
+from featurizer.data_definitions.data_definition import EventSchema
 from typing import List, Tuple
 
 
+# events in offset-indexed form: orders of event i are sides/prices/sizes[offsets[i]:offsets[i + 1]]
+@dataclass
+class L2IncEventArrays:
+    timestamps: np.ndarray
+    receipt_timestamps: np.ndarray
+    update_types: np.ndarray
+    offsets: np.ndarray
+    sides: np.ndarray
+    prices: np.ndarray
+    sizes: np.ndarray
+
+    def __len__(self) -> int:
+        return len(self.timestamps)
+
+
 class CryptotickL2BookIncrementalData(DataSourceDefinition):
 
     @classmethod
@@ -20,19 +38,68 @@ class CryptotickL2BookIncrementalData(DataSourceDefinition):
 
     @classmethod
     def preprocess_impl(cls, df: pd.DataFrame) -> pd.DataFrame:
-        grouped = df.groupby(['timestamp', 'update_type'])
-        dfs = [grouped.get_group(x) for x in grouped.groups]
-        dfs = sorted(dfs, key=lambda df: df['timestamp'].iloc[0], reverse=False)
-        events = []
-        for i in range(len(dfs)):
-            df = dfs[i]
-            timestamp = df.iloc[0]['timestamp']
-            receipt_timestamp = df.iloc[0]['receipt_timestamp']
-            update_type = df.iloc[0]['update_type']
-            df_dict = df.to_dict(orient='index', into=OrderedDict)  # TODO use df.values.tolist() instead and check perf?
-            orders = []
-            for v in df_dict.values():
-                orders.append((v['side'], v['price'], v['size']))
-            events.append(cls.construct_event(timestamp, receipt_timestamp, update_type, orders))
-
-        return pd.DataFrame(events)
+        return cls.preprocessed_from_table(cls.preprocess_table_impl(df))
+
+    # orders are stored as list<struct<side, price, size>>, which is the offset-indexed form of L2IncEventArrays,
+    # so the table is built from flat arrays without per order python objects
+    @classmethod
+    def preprocess_table_impl(cls, df: pd.DataFrame) -> pa.Table:
+        arrays = cls.preprocess_arrays(df)
+        if len(arrays) == 0:
+            return pa.table({})
+        orders = pa.StructArray.from_arrays(
+            [pa.array(arrays.sides, type=pa.string()), pa.array(arrays.prices, type=pa.float64()), pa.array(arrays.sizes, type=pa.float64())],
+            names=['side', 'price', 'size']
+        )
+        return pa.table({
+            'timestamp': arrays.timestamps,
+            'receipt_timestamp': pa.array(arrays.receipt_timestamps, type=pa.float64()),
+            'update_type': pa.array(arrays.update_types, type=pa.string()),
+            'orders': pa.ListArray.from_arrays(pa.array(arrays.offsets, type=pa.int32()), orders)
+        })
+
+    @classmethod
+    def preprocessed_from_table(cls, table: pa.Table) -> pd.DataFrame:
+        if table.num_rows == 0:
+            return pd.DataFrame([])
+        orders_list = table.column('orders').combine_chunks()
+        orders = orders_list.values
+        orders_flat = list(zip(
+            orders.field('side').to_numpy(zero_copy_only=False).tolist(),
+            orders.field('price').to_numpy().tolist(),
+            orders.field('size').to_numpy().tolist()
+        ))
+        offsets = orders_list.offsets.to_numpy().tolist()
+        df = table.drop_columns(['orders']).to_pandas(split_blocks=True, self_destruct=True)
+        df['orders'] = [orders_flat[offsets[i]: offsets[i + 1]] for i in range(len(df))]
+        return df
+
+    # groups rows into events by (timestamp, update_type), events are ordered by timestamp, then update_type,
+    # rows inside an event keep original order (same as sorted df.groupby(['timestamp', 'update_type']))
+    @classmethod
+    def preprocess_arrays(cls, df: pd.DataFrame) -> L2IncEventArrays:
+        # groupby drops rows with missing keys
+        df = df[df['timestamp'].notna() & df['update_type'].notna()]
+        timestamps = df['timestamp'].to_numpy(dtype=np.float64)
+        update_type_codes, update_types = pd.factorize(df['update_type'], sort=True)
+
+        # lexsort is stable, last key is primary
+        order = np.lexsort((update_type_codes, timestamps))
+        sorted_ts = timestamps[order]
+        sorted_codes = update_type_codes[order]
+        if len(order) == 0:
+            starts = np.empty(0, dtype=np.int64)
+        else:
+            is_new_group = (sorted_ts[1:] != sorted_ts[:-1]) | (sorted_codes[1:] != sorted_codes[:-1])
+            starts = np.concatenate(([0], np.flatnonzero(is_new_group) + 1))
+        first_rows = order[starts]
+
+        return L2IncEventArrays(
+            timestamps=sorted_ts[starts],
+            receipt_timestamps=df['receipt_timestamp'].to_numpy()[first_rows],
+            update_types=np.asarray(update_types, dtype=object)[sorted_codes[starts]],
+            offsets=np.concatenate((starts, [len(order)])).astype(np.int64),
+            sides=df['side'].to_numpy()[order],
+            prices=df['price'].to_numpy()[order],
+            sizes=df['size'].to_numpy()[order],
+        )
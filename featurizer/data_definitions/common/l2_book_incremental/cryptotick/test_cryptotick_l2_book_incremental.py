@@ -0,0 +1,39 @@
+import unittest
+
+import pandas as pd
+
+from featurizer.data_definitions.common.l2_book_incremental.cryptotick.cryptotick_l2_book_incremental import \
+    CryptotickL2BookIncrementalData
+from featurizer.data_definitions.common.l2_book_incremental.cryptotick.utils import run_l2_snapshot_stream
+from featurizer.data_definitions.data_definition import df_to_events
+from featurizer.features.definitions.l2_book.l2_snapshot_fd.l2_snapshot_fd import L2SnapshotFD
+from featurizer.features.definitions.l2_book.l2_snapshot_fd.utils import _State, ArrayOrderBook, \
+    cryptotick_update_state
+from featurizer.featurizer_utils.testing_utils import mock_processed_l2_inc_df, preprocess_impl_grouped
+
+
+class TestCryptotickL2BookIncrementalData(unittest.TestCase):
+
+    def test_preprocess_impl(self):
+        df = mock_processed_l2_inc_df(20000, snapshot_size=300)
+        expected = preprocess_impl_grouped(df)
+        res = CryptotickL2BookIncrementalData.preprocess_impl(df)
+        pd.testing.assert_frame_equal(expected, res)
+
+        # orders should be exactly the same, including element types
+        for expected_orders, orders in zip(expected['orders'], res['orders']):
+            assert [tuple(map(type, o)) for o in expected_orders] == [tuple(map(type, o)) for o in orders]
+            assert expected_orders == orders
+
+    def test_run_l2_snapshot_stream(self):
+        df = mock_processed_l2_inc_df(5000, snapshot_size=300)
+        state = _State(timestamp=-1, receipt_timestamp=-1, order_book=ArrayOrderBook(), data_inconsistencies={})
+        for event in df_to_events(preprocess_impl_grouped(df)):
+            state, _ = cryptotick_update_state(state, event)
+        assert run_l2_snapshot_stream(df) == L2SnapshotFD._state_snapshot(state, 5000)
+
+
+if __name__ == '__main__':
+    t = TestCryptotickL2BookIncrementalData()
+    t.test_preprocess_impl()
+    t.test_run_l2_snapshot_stream()
@@ -1,28 +1,35 @@
 import time
-from typing import Optional, List, Tuple, Any, Generator, Callable
+from typing import Optional, List, Tuple, Any, Generator, Callable, Iterable
 
 import joblib
-from streamz import Stream
+import numpy as np
 
 from common.s3.s3_utils import load_df_s3
 from common.time.utils import round_float
-from featurizer.data_ingest.utils.cryptotick_utils import process_cryptotick_timestamps
-from featurizer.data_definitions.data_definition import df_to_events
+from featurizer.data_ingest.utils.cryptotick_utils import process_cryptotick_timestamps, gen_sorted_cryptotick_chunks, \
+    DEFAULT_REORDER_WINDOW_ROWS
 from featurizer.data_definitions.common.l2_book_incremental.cryptotick.cryptotick_l2_book_incremental import \
-    CryptotickL2BookIncrementalData
+    CryptotickL2BookIncrementalData, L2IncEventArrays
 from featurizer.features.definitions.l2_book.l2_snapshot_fd.l2_snapshot_fd import L2SnapshotFD
-from featurizer.featurizer_utils.testing_utils import mock_feature
+from featurizer.features.definitions.l2_book.l2_snapshot_fd.utils import _State, ArrayOrderBook, \
+    cryptotick_update_state_from_arrays
 from common.pandas.df_utils import concat, gen_split_df_by_mem, get_cached_df, \
-    cache_df_if_needed
+    cache_df_if_needed, estimate_row_size_bytes
 
 import pandas as pd
 
+# cryptotick stores 5000 depth levels
+CRYPTOTICK_BOOK_DEPTH = 5000
+
 
 # see https://www.cryptotick.com/Faq
 # this is a heavy compute operation, 5Gb df takes 4-5 mins
 def preprocess_l2_inc_df(df: pd.DataFrame, date_str: str) -> pd.DataFrame:
     df = process_cryptotick_timestamps(df, date_str)
+    return process_l2_inc_columns(df)
+
 
+def process_l2_inc_columns(df: pd.DataFrame) -> pd.DataFrame:
     # cryptotick l2_inc should not contain any order_id info
     if 'order_id' in df and pd.notna(df['order_id']).sum() != 0:
         raise ValueError('Cryptotick l2_inc df should not contain order_id values')
@@ -46,40 +53,140 @@ def preprocess_l2_inc_df(df: pd.DataFrame, date_str: str) -> pd.DataFrame:
 # splits big L2 inc df into chunks, adding full snapshot to the beginning of each chunk
 def gen_split_l2_inc_df_and_pad_with_snapshot(processed_df: pd.DataFrame, split_size_kb: int, callback: Optional[Callable] = None) -> Generator:
     if split_size_kb < 0:
-        return [processed_df]
+        yield processed_df
+        return
 
     if callback is None:
         def p(i, t):
             print(f'split {i} finished: {t}s')
         callback = p
 
+    # single live book state for the whole df, events are grouped once and state is advanced split by split,
+    # padding snapshot is the state at the end of prev split
+    arrays = CryptotickL2BookIncrementalData.preprocess_arrays(processed_df)
+    state = _new_state()
+    event_start = 0
     gen = gen_split_df_by_mem(processed_df, split_size_kb, callback)
-    prev_snap = None
     i = 0
     for split in gen:
         t = time.time()
         if i > 0:
-            split = prepend_snap(split, prev_snap)
-        snap = run_l2_snapshot_stream(split)
+            split = prepend_snap(split, L2SnapshotFD._state_snapshot(state, CRYPTOTICK_BOOK_DEPTH))
+        # splits never break timestamp groups, so split events are all events up to split's last ts
+        event_end = int(np.searchsorted(arrays.timestamps, split['timestamp'].iloc[-1], side='right'))
+        apply_l2_inc_arrays(state, arrays, event_start, event_end)
+        event_start = event_end
         yield split
-        prev_snap = snap
         callback(i, time.time() - t)
         i += 1
 
 
-# TODO typing
-def run_l2_snapshot_stream(l2_inc_df: pd.DataFrame) -> Any:
-    events = df_to_events(CryptotickL2BookIncrementalData.preprocess(l2_inc_df))
-    source = Stream()
+# Streaming version of preprocess_l2_inc_df + gen_split_l2_inc_df_and_pad_with_snapshot for raw csv chunks
+# (see gen_csv_chunks): chunks are sorted and parsed one by one, order book state is carried across chunks,
+# so memory is bounded by chunk size and split size rather than by file size
+def gen_split_l2_inc_chunks_and_pad_with_snapshot(
+    raw_chunks: Iterable[pd.DataFrame],
+    date_str: str,
+    split_size_kb: int,
+    callback: Optional[Callable] = None,
+    reorder_window_rows: int = DEFAULT_REORDER_WINDOW_ROWS
+) -> Generator:
+    if callback is None:
+        def p(i, t):
+            print(f'split {i} finished: {t}s')
+        callback = p
+
+    state = _new_state()
+    remainder = None
+    # all chunks have the same columns, so bytes per row are estimated once from the first chunk
+    block_num_rows = None
+    i = 0
+    for chunk in gen_sorted_cryptotick_chunks(raw_chunks, date_str, reorder_window_rows):
+        df = process_l2_inc_columns(chunk)
+        if remainder is not None:
+            df = concat([remainder, df])
+        if block_num_rows is None and len(df) > 0:
+            row_size_kb = estimate_row_size_bytes(df) / 1024.0
+            block_num_rows = max(1, int(split_size_kb / row_size_kb)) if row_size_kb > 0 else len(df)
+        splits, remainder = _split_full_blocks(df, block_num_rows)
+        for split in splits:
+            t = time.time()
+            yield _pad_and_apply(state, split, i)
+            callback(i, time.time() - t)
+            i += 1
+
+    if remainder is not None and len(remainder) > 0:
+        t = time.time()
+        yield _pad_and_apply(state, remainder, i)
+        callback(i, time.time() - t)
 
-    # cryptotick stores 5000 depth levels
-    depth = 5000
-    feature_params = {'dep_schema': 'cryptotick', 'depth': depth, 'sampling': 'skip_all'}
-    _, stream_state = L2SnapshotFD.stream({mock_feature(0): source}, feature_params)
-    for event in events:
-        source.emit(event)
 
-    return L2SnapshotFD._state_snapshot(stream_state, depth)
+# cuts df (which has no partial timestamp groups) into blocks of block_num_rows (extended to the end of ts group),
+# last incomplete block is returned separately to be merged with the next chunk
+def _split_full_blocks(df: pd.DataFrame, block_num_rows: int) -> Tuple[List[pd.DataFrame], pd.DataFrame]:
+    if len(df) == 0:
+        return [], df
+    timestamps = df['timestamp'].to_numpy()
+    res = []
+    start = 0
+    while len(df) - start >= block_num_rows:
+        # move end while we have same ts to make sure we don't split it
+        end = int(np.searchsorted(timestamps, timestamps[start + block_num_rows - 1], side='right'))
+        res.append(df.iloc[start: end].reset_index(drop=True))
+        start = end
+    return res, df.iloc[start:].reset_index(drop=True)
+
+
+def _pad_and_apply(state: _State, split: pd.DataFrame, i: int) -> pd.DataFrame:
+    if i > 0:
+        padded = prepend_snap(split, L2SnapshotFD._state_snapshot(state, CRYPTOTICK_BOOK_DEPTH))
+    else:
+        padded = split
+    # prepended snapshot is the current state, only new rows need to be applied
+    apply_l2_inc_df(state, split)
+    return padded
+
+
+# TODO typing
+def run_l2_snapshot_stream(l2_inc_df: pd.DataFrame) -> Any:
+    # only the final book state is needed here, so offset-indexed events are applied directly to the state
+    # instead of emitting event dicts through L2SnapshotFD stream
+    state = _new_state()
+    apply_l2_inc_df(state, l2_inc_df)
+    return L2SnapshotFD._state_snapshot(state, CRYPTOTICK_BOOK_DEPTH)
+
+
+def _new_state() -> _State:
+    return _State(
+        timestamp=-1,
+        receipt_timestamp=-1,
+        order_book=ArrayOrderBook(),
+        data_inconsistencies={},
+    )
+
+
+def apply_l2_inc_df(state: _State, l2_inc_df: pd.DataFrame):
+    arrays = CryptotickL2BookIncrementalData.preprocess_arrays(l2_inc_df)
+    apply_l2_inc_arrays(state, arrays, 0, len(arrays))
+
+
+# applies events [start, end) to the state
+def apply_l2_inc_arrays(state: _State, arrays: L2IncEventArrays, start: int, end: int):
+    if start >= end:
+        return
+    orders_start = arrays.offsets[start]
+    orders_end = arrays.offsets[end]
+    timestamps = arrays.timestamps[start: end].tolist()
+    receipt_timestamps = arrays.receipt_timestamps[start: end].tolist()
+    update_types = arrays.update_types[start: end].tolist()
+    offsets = (arrays.offsets[start: end + 1] - orders_start).tolist()
+    sides = arrays.sides[orders_start: orders_end].tolist()
+    prices = arrays.prices[orders_start: orders_end].tolist()
+    sizes = arrays.sizes[orders_start: orders_end].tolist()
+    for i in range(end - start):
+        cryptotick_update_state_from_arrays(
+            state, timestamps, receipt_timestamps, update_types, offsets, sides, prices, sizes, i
+        )
 
 
 def prepend_snap(df: pd.DataFrame, snap) -> pd.DataFrame:
@@ -94,9 +201,9 @@ def prepend_snap(df: pd.DataFrame, snap) -> pd.DataFrame:
     if ts >= df.iloc[0]['timestamp'] or receipt_ts >= df.iloc[0]['receipt_timestamp']:
         raise ValueError('Unable to shift snapshot ts when prepending')
 
-    df_bids = pd.DataFrame(snap['bids'], columns=['price', 'size'])
+    df_bids = pd.DataFrame(L2SnapshotFD.snapshot_levels(snap, 'bid'), columns=['price', 'size'])
     df_bids['side'] = 'bid'
-    df_asks = pd.DataFrame(snap['asks'], columns=['price', 'size'])
+    df_asks = pd.DataFrame(L2SnapshotFD.snapshot_levels(snap, 'ask'), columns=['price', 'size'])
     df_asks['side'] = 'ask'
     df_snap = concat([df_bids, df_asks])
     df_snap['update_type'] = 'SNAPSHOT'
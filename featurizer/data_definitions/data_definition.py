@@ -1,16 +1,15 @@
-from typing import Type, List, Dict, Any
+from typing import Type, List, Dict, Any, Optional
 
 import pandas as pd
+import pyarrow as pa
 from pandas import DataFrame
 from frozendict import frozendict
 from portion import Interval
 
 from common.pandas.df_utils import is_ts_sorted, hash_df
-from diskcache import Cache
 
 from featurizer.blocks.blocks import BlockRangeMeta
-
-PREPROCESSED_DATA_BLOCKS_CACHE = '/tmp/svoe/preprocessed_data_blocks_cache'
+from featurizer.blocks.preprocessed_block_cache import get_preprocessed_block_cache
 
 Event = Dict[str, Any] # note that this corresponds to raw grouped events by timestamp (only for some data_types, e.g. l2_book_inc)
 EventSchema = Dict[str, Type]
@@ -48,27 +47,70 @@ class DataDefinition:
     def params(cls):
         raise NotImplemented
 
+    # preprocessed blocks are cached per (definition, version, block key), bump version when
+    # preprocess_impl output changes so stale cached blocks are not reused
+    @classmethod
+    def version(cls) -> str:
+        return '1'
+
+    @classmethod
+    def needs_preprocessing(cls) -> bool:
+        return cls.preprocess_impl.__func__ is not DataDefinition.preprocess_impl.__func__
+
+    # block_key should identify block contents, e.g. hash or path from block metadata,
+    # if not provided contents are hashed
     @classmethod
-    def preprocess(cls, df: DataFrame) -> DataFrame:
-        key = hash_df(df)
-        cache = Cache(PREPROCESSED_DATA_BLOCKS_CACHE)
-        if key in cache:
-            print(f'[{cls.__name__}] Reading preprocessed df from cache')
-            cached_df = cache[key]
-            # TODO temp bug fix
-            if not isinstance(cached_df, pd.DataFrame):
-                print(f'[{cls.__name__}] Malformed df in cache, clearing')
-                del cache[key]
-            else:
-                return cached_df
+    def preprocess(cls, df: DataFrame, block_key: Optional[str] = None) -> DataFrame:
+        if not cls.needs_preprocessing():
+            return df
+        if block_key is None:
+            block_key = hash_df(df)
+        cached_df = cls.get_preprocessed_from_cache(block_key)
+        if cached_df is not None:
+            return cached_df
+        cache = get_preprocessed_block_cache()
+        if cls.has_preprocess_table():
+            table = cls.preprocess_table_impl(df)
+            cache.put_table(cls._preprocessed_cache_key(block_key), table)
+            return cls.preprocessed_from_table(table)
         res = cls.preprocess_impl(df)
-        cache[key] = res
+        cache.put(cls._preprocessed_cache_key(block_key), res)
         return res
 
+    @classmethod
+    def get_preprocessed_from_cache(cls, block_key: str) -> Optional[DataFrame]:
+        cache = get_preprocessed_block_cache()
+        if cls.has_preprocess_table():
+            table = cache.get_table(cls._preprocessed_cache_key(block_key))
+            df = None if table is None else cls.preprocessed_from_table(table)
+        else:
+            df = cache.get(cls._preprocessed_cache_key(block_key))
+        if df is not None:
+            print(f'[{cls.__name__}] Reading preprocessed df from cache, stats: {cache.get_stats()}')
+        return df
+
+    @classmethod
+    def _preprocessed_cache_key(cls, block_key: str) -> str:
+        return get_preprocessed_block_cache().make_key(f'{cls.__module__}.{cls.__qualname__}', cls.version(), block_key)
+
     @classmethod
     def preprocess_impl(cls, df: DataFrame) -> DataFrame:
         raise NotImplementedError
 
+    # definitions which preprocessed frames have columns Arrow can not convert from pandas (e.g. nested python
+    # objects) can produce the Arrow table directly, it is cached as is and memory-mapped on read
+    @classmethod
+    def has_preprocess_table(cls) -> bool:
+        return cls.preprocess_table_impl.__func__ is not DataDefinition.preprocess_table_impl.__func__
+
+    @classmethod
+    def preprocess_table_impl(cls, df: DataFrame) -> pa.Table:
+        raise NotImplementedError
+
+    @classmethod
+    def preprocessed_from_table(cls, table: pa.Table) -> DataFrame:
+        return table.to_pandas(split_blocks=True, self_destruct=True)
+
     @classmethod
     def construct_event(cls, *args) -> Event:
         # TODO validate schema here?
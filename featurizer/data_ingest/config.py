@@ -16,11 +16,25 @@ class FeaturizerDataSourceFiles(BaseModel):
     files_and_sizes: Optional[Union[List, Tuple[str, int]]]
 
 
+# per-file ingest is run as a pipeline: split -> hash/metadata -> store -> batched db commit,
+# each stage has its own worker pool and a bounded input queue
+class IngestStagesConfig(BaseModel):
+    metadata_parallelism: int = 2
+    store_parallelism: int = 10
+    # max splits waiting in each stage's input queue
+    queue_size: int = 8
+    # metadata items per db commit
+    db_commit_batch_size: int = 50
+
+
 class FeaturizerDataIngestConfig(BaseModel):
     provider_name: str
     batch_size: int
     max_executing_tasks: int
     data_source_files: List[FeaturizerDataSourceFiles]
+    # read raw files in chunks of this size instead of loading whole files in memory
+    streaming_chunk_size_kb: Optional[int] = None
+    stages: IngestStagesConfig = IngestStagesConfig()
 
     def num_files(self) -> int:
         res = 0
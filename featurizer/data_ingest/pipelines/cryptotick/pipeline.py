@@ -2,11 +2,12 @@ import asyncio
 import functools
 import math
 import time
-from typing import Dict
+from typing import Dict, Optional
 
 import ray
 from tqdm import tqdm
 
+from featurizer.data_ingest.config import IngestStagesConfig
 from featurizer.sql.db_actor import DbActor
 from featurizer.data_ingest.models import InputItemBatch
 from featurizer.data_ingest.pipelines.cryptotick.tasks import load_split_catalog_store_df
@@ -87,8 +88,11 @@ def poll_to_tqdm(total_files, chunk_size, max_bars=10):
             elif status == 'splitting':
                 pbar.set_description(f'Splitting {task_id}/{total_files}...')
                 extras['split'] = round(stats['time_split'], 2)
+                extras['hash'] = round(stats['time_hash'], 2)
                 extras['store'] = round(stats['time_store'], 2)
                 extras['n_stored'] = stats['num_stored']
+                if 'time_load' in stats:
+                    extras['load'] = round(stats['time_load'], 2)
                 pbar.set_postfix(extras)
                 pbar.n = stats['num_splits']
             pbar.total = approx_num_chunks
@@ -104,7 +108,15 @@ def poll_to_tqdm(total_files, chunk_size, max_bars=10):
 @ray.remote
 class CatalogCryptotickPipeline:
 
-    def __init__(self, max_executing_tasks: int, db_actor: DbActor, data_store_adapter: DataStoreAdapter = LocalDataStoreAdapter(), split_chunk_size_kb: int = SPLIT_CHUNK_SIZE_KB):
+    def __init__(
+        self,
+        max_executing_tasks: int,
+        db_actor: DbActor,
+        data_store_adapter: DataStoreAdapter = LocalDataStoreAdapter(),
+        split_chunk_size_kb: int = SPLIT_CHUNK_SIZE_KB,
+        streaming_chunk_size_kb: Optional[int] = None,
+        stages_config: Optional[IngestStagesConfig] = None
+    ):
         self.is_running = True
 
         self.input_queue = asyncio.Queue()
@@ -112,7 +124,11 @@ class CatalogCryptotickPipeline:
         self.db_actor = db_actor
         self.max_executing_tasks = max_executing_tasks
         self.split_chunk_size_kb = split_chunk_size_kb
+        # if set, raw files are read in chunks of this size instead of loading the whole file
+        self.streaming_chunk_size_kb = streaming_chunk_size_kb
         self.data_store_adapter = data_store_adapter
+        # worker pools and queue sizes of per-file ingest stages
+        self.stages_config = stages_config
 
         self.results_refs = []
         self.stats = {}
@@ -174,7 +190,9 @@ class CatalogCryptotickPipeline:
 
                 self.results_refs.append(
                     load_split_catalog_store_df.remote(
-                        item, self.split_chunk_size_kb, item['day'], self.db_actor, self.data_store_adapter, functools.partial(callback, task_id=task_id)
+                        item, self.split_chunk_size_kb, item['day'], self.db_actor, self.data_store_adapter,
+                        functools.partial(callback, task_id=task_id), self.streaming_chunk_size_kb,
+                        self.stages_config
                     )
                 )
                 # wait = 1 if task_id%2 == 0 else 2
@@ -227,26 +245,41 @@ class CatalogCryptotickPipeline:
         await asyncio.sleep(0)
         t = event.get('time', None)
         if event['name'] == 'load_finished':
+            # in streaming mode loading finishes after splitting has started, keep splitting status
+            if self.stats[task_id]['status'] == 'splitting':
+                self.stats[task_id]['time_load'] = t
+                return
             self.stats[task_id]['status'] = 'load_finished'
             self.stats[task_id]['time'] = t
         elif event['name'] == 'preproc_finished':
             self.stats[task_id]['status'] = 'preproc_finished'
             self.stats[task_id]['time'] = t
         elif event['name'] == 'split_finished':
-            if self.stats[task_id]['status'] != 'splitting':
-                self.stats[task_id]['status'] = 'splitting'
-                self.stats[task_id]['num_splits'] = 0
-                self.stats[task_id]['num_stored'] = 0
-                self.stats[task_id]['time_split'] = 0
-                self.stats[task_id]['time_store'] = 0
-            else:
-                self.stats[task_id]['time_split'] = (self.stats[task_id]['time_split'] * self.stats[task_id]['num_splits'] + t) / (
-                            self.stats[task_id]['num_splits'] + 1)
-                self.stats[task_id]['num_splits'] += 1
+            self._init_split_stats(task_id)
+            self._update_avg(task_id, 'time_split', 'num_splits', t)
+        elif event['name'] == 'hash_finished':
+            self._init_split_stats(task_id)
+            self._update_avg(task_id, 'time_hash', 'num_hashed', t)
         elif event['name'] == 'store_finished':
-            self.stats[task_id]['time_store'] = (self.stats[task_id]['time_store'] * (self.stats[task_id]['num_stored']) + t) / (
-            self.stats[task_id]['num_stored'] + 1)
-            self.stats[task_id]['num_stored'] += 1
+            self._init_split_stats(task_id)
+            self._update_avg(task_id, 'time_store', 'num_stored', t)
+        elif event['name'] == 'commit_finished':
+            self._init_split_stats(task_id)
+            self._update_avg(task_id, 'time_commit', 'num_commits', t)
         elif event['name'] == 'write_finished':
             self.stats[task_id]['time_write'] = t
             self.stats[task_id]['status'] = 'done'
+
+    # stages run concurrently, so events of later stages may arrive before first split_finished
+    def _init_split_stats(self, task_id: int):
+        if self.stats[task_id]['status'] == 'splitting':
+            return
+        self.stats[task_id]['status'] = 'splitting'
+        for key in ['num_splits', 'num_hashed', 'num_stored', 'num_commits', 'time_split', 'time_hash', 'time_store', 'time_commit']:
+            self.stats[task_id][key] = 0
+
+    # running average of stage time
+    def _update_avg(self, task_id: int, time_key: str, count_key: str, t: float):
+        stats = self.stats[task_id]
+        stats[time_key] = (stats[time_key] * stats[count_key] + t) / (stats[count_key] + 1)
+        stats[count_key] += 1
@@ -1,8 +1,8 @@
-import concurrent
-import functools
+import queue
+import threading
 import time
 from datetime import datetime
-from typing import Dict, Callable, Optional
+from typing import Dict, Callable, Optional, List, Iterator, Tuple, Generator
 
 import pandas as pd
 import pytz
@@ -12,14 +12,19 @@ from featurizer.data_definitions.common.l2_book_incremental.cryptotick.cryptotic
     CryptotickL2BookIncrementalData
 from featurizer.data_definitions.common.trades.cryptotick.utils import preprocess_trades_df
 from featurizer.data_definitions.common.trades.trades import TradesData
+from featurizer.data_ingest.config import IngestStagesConfig
 from featurizer.sql.db_actor import DbActor
 from featurizer.data_ingest.models import InputItem
 from featurizer.sql.models.data_source_block_metadata import DataSourceBlockMetadata
 from featurizer.data_definitions.common.l2_book_incremental.cryptotick.utils import preprocess_l2_inc_df, \
-    gen_split_l2_inc_df_and_pad_with_snapshot, get_snapshot_ts
+    gen_split_l2_inc_df_and_pad_with_snapshot, get_snapshot_ts, gen_split_l2_inc_chunks_and_pad_with_snapshot
+from featurizer.data_ingest.utils.cryptotick_utils import CRYPTOTICK_CSV_COLUMN_TYPES
+from common.s3.s3_utils import gen_csv_chunks_s3
 from common.pandas import df_utils
 from common.pandas.df_utils import gen_split_df_by_mem
 from featurizer.sql.models.data_source_metadata import DataSourceMetadata
+from featurizer.storage.data_store_adapter.block_format import BlockFormat, BLOCK_FORMAT_EXTRAS_KEY, \
+    block_format_from_extras
 from featurizer.storage.data_store_adapter.data_store_adapter import DataStoreAdapter
 from featurizer.storage.data_store_adapter.local_data_store_adapter import LocalDataStoreAdapter
 from featurizer.storage.data_store_adapter.remote_data_store_adapter import RemoteDataStoreAdapter
@@ -34,73 +39,203 @@ def load_split_catalog_store_df(
     date_str: str, # TODO date -> day
     db_actor: DbActor,
     data_store_adapter: DataStoreAdapter,
-    callback: Optional[Callable] = None
+    callback: Optional[Callable] = None,
+    streaming_chunk_size_kb: Optional[int] = None,
+    stages_config: Optional[IngestStagesConfig] = None
 ) -> Dict:
     path = input_item[DataSourceBlockMetadata.path.name]
     data_source_definition = input_item[DataSourceBlockMetadata.data_source_definition.name]
-    t = time.time()
-    remote_data_store_adapter = RemoteDataStoreAdapter()
-    df = remote_data_store_adapter.load_df(path)
-    callback({'name': 'load_finished', 'time': time.time() - t})
-    t = time.time()
 
     def split_callback(i, t):
         callback({'name': 'split_finished', 'time': t})
 
-    if data_source_definition == CryptotickL2BookIncrementalData.__name__:
-        processed_df = preprocess_l2_inc_df(df, date_str)
-        gen = gen_split_l2_inc_df_and_pad_with_snapshot(processed_df, chunk_size_kb, split_callback)
-    elif data_source_definition == TradesData.__name__:
-        processed_df = preprocess_trades_df(df)
-        gen = gen_split_df_by_mem(processed_df, chunk_size_kb, split_callback)
+    streaming = streaming_chunk_size_kb is not None and data_source_definition == CryptotickL2BookIncrementalData.__name__
+    t = time.time()
+    if streaming:
+        # raw csv is read, parsed and split chunk by chunk, so loading and preprocessing happen while splitting
+        # load time is only known after the last chunk is read, preprocessing time is reported per split
+        raw_chunks = gen_csv_chunks_s3(path, streaming_chunk_size_kb, column_types=CRYPTOTICK_CSV_COLUMN_TYPES)
+        raw_chunks = _gen_timed(raw_chunks, lambda load_time: callback({'name': 'load_finished', 'time': load_time}))
+        gen = gen_split_l2_inc_chunks_and_pad_with_snapshot(raw_chunks, date_str, chunk_size_kb, split_callback)
     else:
-        raise ValueError(f'Unknown data_source_definition: {data_source_definition}')
+        remote_data_store_adapter = RemoteDataStoreAdapter()
+        df = remote_data_store_adapter.load_df(path)
+        callback({'name': 'load_finished', 'time': time.time() - t})
+        t = time.time()
 
-    callback({'name': 'preproc_finished', 'time': time.time() - t})
-    metadata_items = []
-    split_id = 0
-    num_splits = 0
+        if data_source_definition == CryptotickL2BookIncrementalData.__name__:
+            processed_df = preprocess_l2_inc_df(df, date_str)
+            gen = gen_split_l2_inc_df_and_pad_with_snapshot(processed_df, chunk_size_kb, split_callback)
+        elif data_source_definition == TradesData.__name__:
+            processed_df = preprocess_trades_df(df)
+            gen = gen_split_df_by_mem(processed_df, chunk_size_kb, split_callback)
+        else:
+            raise ValueError(f'Unknown data_source_definition: {data_source_definition}')
 
-    STORE_PARALLELISM = 10
-    executor = concurrent.futures.ThreadPoolExecutor(max_workers=STORE_PARALLELISM)
-    store_futures = []
+        callback({'name': 'preproc_finished', 'time': time.time() - t})
 
-    for split in gen:
-        item_split = input_item.copy()
+    def commit_batch(batch: List[DataSourceBlockMetadata]) -> Dict:
+        return ray.get(db_actor.store_block_metadata_batch.remote(batch))
 
-        # additional info to be passed to catalog item
-        compaction = f'{chunk_size_kb}kb' if chunk_size_kb < 1024 else f'{round(chunk_size_kb / 1024, 2)}mb'
-        item_split[DataSourceBlockMetadata.compaction.name] = compaction
-        item_split[DataSourceBlockMetadata.extras.name] = {
-            'source_path': item_split[DataSourceBlockMetadata.path.name],
-            'split_id': split_id,
-        }
+    return run_ingest_stages(gen, input_item, chunk_size_kb, data_store_adapter, commit_batch, callback, stages_config)
 
-        # remove raw source path so it is constructed by SqlAlchemy default value when making catalog item
-        del item_split[DataSourceBlockMetadata.path.name]
 
+# passes items through, calls on_done with total time spent producing them once gen is exhausted
+def _gen_timed(gen: Iterator, on_done: Callable[[float], None]) -> Generator:
+    total = 0.0
+    it = iter(gen)
+    while True:
+        t = time.time()
+        try:
+            item = next(it)
+        except StopIteration:
+            total += time.time() - t
+            break
+        total += time.time() - t
+        yield item
+    on_done(total)
+
+
+_STAGE_DONE = object()
+
+
+# Runs split -> hash/metadata -> store -> batched db commit as a pipeline, so hashing of next splits overlaps
+# with storing previous ones. Splitting happens on the calling thread, every other stage has its own worker pool
+# and bounded input queue (so splits in flight are bounded in memory).
+# Metadata is committed in batches as soon as blocks are stored, total number of splits is known only after splitting
+# is done, so the last batch is always held until then and only items of the last batch carry 'num_splits',
+# committing it writes num_splits to all stored rows of the file (see FeaturizerSqlClient.store_block_metadata_batch
+# and filter_cryptotick_batch)
+def run_ingest_stages(
+    splits: Iterator[pd.DataFrame],
+    input_item: InputItem,
+    chunk_size_kb: int,
+    data_store_adapter: DataStoreAdapter,
+    commit_batch: Callable[[List[DataSourceBlockMetadata]], Dict],
+    callback: Callable,
+    stages_config: Optional[IngestStagesConfig] = None
+) -> Dict:
+    stages_config = IngestStagesConfig() if stages_config is None else stages_config
+    errors = []
+    metadata_queue = queue.Queue(maxsize=stages_config.queue_size)
+    store_queue = queue.Queue(maxsize=stages_config.queue_size)
+    commit_queue = queue.Queue(maxsize=stages_config.queue_size)
+
+    def make_metadata(split_id_and_split: Tuple[int, pd.DataFrame]) -> Tuple[DataSourceBlockMetadata, pd.DataFrame]:
+        split_id, split = split_id_and_split
+        t = time.time()
+        item_split = make_split_input_item(input_item, split_id, chunk_size_kb)
         data_source_block_metadata = make_data_source_block_metadata(split, item_split, data_store_adapter)
-        store_futures.append(
-            executor.submit(functools.partial(store_df, df=split, path=data_source_block_metadata.path, data_store_adapter=data_store_adapter, callback=callback))
-        )
+        callback({'name': 'hash_finished', 'time': time.time() - t})
+        return data_source_block_metadata, split
 
-        metadata_items.append(data_source_block_metadata)
-        split_id += 1
-        num_splits += 1
+    def store(metadata_and_split: Tuple[DataSourceBlockMetadata, pd.DataFrame]) -> DataSourceBlockMetadata:
+        data_source_block_metadata, split = metadata_and_split
+        block_format = block_format_from_extras(data_source_block_metadata.extras)
+        store_df(split, data_source_block_metadata.path, data_store_adapter, callback, block_format)
+        return data_source_block_metadata
 
-    for metadata_item in metadata_items:
-        metadata_item.extras['num_splits'] = num_splits
+    # items not yet committed, single worker so no locking needed
+    pending = []
+
+    def commit_if_needed(data_source_block_metadata: DataSourceBlockMetadata):
+        pending.append(data_source_block_metadata)
+        # keep at least one item for the final commit
+        if len(pending) > stages_config.db_commit_batch_size:
+            t = time.time()
+            commit_batch(pending[:stages_config.db_commit_batch_size])
+            del pending[:stages_config.db_commit_batch_size]
+            callback({'name': 'commit_finished', 'time': time.time() - t})
 
-    concurrent.futures.wait(store_futures)
+    stages = [
+        (make_metadata, metadata_queue, store_queue, stages_config.metadata_parallelism),
+        (store, store_queue, commit_queue, stages_config.store_parallelism),
+        (commit_if_needed, commit_queue, None, 1),
+    ]
+    workers = [_start_stage_workers(func, in_queue, out_queue, num_workers, errors) for func, in_queue, out_queue, num_workers in stages]
+
+    num_splits = 0
+    try:
+        for split in splits:
+            if len(errors) > 0:
+                break
+            metadata_queue.put((num_splits, split))
+            num_splits += 1
+    finally:
+        # stages are stopped in order so every stage drains its input before the next one is notified
+        for (_, in_queue, _, _), stage_workers in zip(stages, workers):
+            in_queue.put(_STAGE_DONE)
+            for worker in stage_workers:
+                worker.join()
+
+    if len(errors) > 0:
+        raise errors[0]
+
+    for metadata_item in pending:
+        metadata_item.extras['num_splits'] = num_splits
     t = time.time()
-    res = ray.get(db_actor.store_block_metadata_batch.remote(metadata_items))
+    res = commit_batch(pending) if len(pending) > 0 else {}
     callback({'name': 'write_finished', 'time': time.time() - t})
     return res
 
 
-def store_df(df: pd.DataFrame, path: str, data_store_adapter: DataStoreAdapter, callback: Callable):
+# runs func on items of in_queue in num_workers threads, passing results to out_queue.
+# After first failure workers keep draining in_queue without processing, so upstream never blocks on a full queue
+def _start_stage_workers(
+    func: Callable,
+    in_queue: queue.Queue,
+    out_queue: Optional[queue.Queue],
+    num_workers: int,
+    errors: List[Exception]
+) -> List[threading.Thread]:
+    def work():
+        while True:
+            item = in_queue.get()
+            if item is _STAGE_DONE:
+                # let other workers of the stage see it
+                in_queue.put(_STAGE_DONE)
+                return
+            if len(errors) > 0:
+                continue
+            try:
+                res = func(item)
+            except Exception as e:
+                errors.append(e)
+                continue
+            if out_queue is not None:
+                out_queue.put(res)
+
+    workers = [threading.Thread(target=work, daemon=True) for _ in range(num_workers)]
+    for worker in workers:
+        worker.start()
+    return workers
+
+
+def make_split_input_item(input_item: InputItem, split_id: int, chunk_size_kb: int) -> InputItem:
+    item_split = input_item.copy()
+
+    # additional info to be passed to catalog item
+    compaction = f'{chunk_size_kb}kb' if chunk_size_kb < 1024 else f'{round(chunk_size_kb / 1024, 2)}mb'
+    item_split[DataSourceBlockMetadata.compaction.name] = compaction
+    item_split[DataSourceBlockMetadata.extras.name] = {
+        'source_path': item_split[DataSourceBlockMetadata.path.name],
+        'split_id': split_id,
+    }
+
+    # remove raw source path so it is constructed by SqlAlchemy default value when making catalog item
+    del item_split[DataSourceBlockMetadata.path.name]
+    return item_split
+
+
+def store_df(
+    df: pd.DataFrame,
+    path: str,
+    data_store_adapter: DataStoreAdapter,
+    callback: Callable,
+    block_format: Optional[BlockFormat] = None
+):
     t = time.time()
-    data_store_adapter.store_df(path, df)
+    data_store_adapter.store_df(path, df, block_format=block_format)
     callback({'name': 'store_finished', 'time': time.time() - t})
 
 
@@ -161,6 +296,12 @@ def make_data_source_block_metadata(df: pd.DataFrame, input_item: InputItem, dat
     df_hash = df_utils.hash_df(df)
     block_metadata_params[DataSourceBlockMetadata.hash.name] = df_hash
 
+    # format is recorded so readers don't need to guess it from path
+    block_format = data_store_adapter.block_format(block_metadata_params[DataSourceBlockMetadata.data_source_definition.name])
+    extras = dict(block_metadata_params.get(DataSourceBlockMetadata.extras.name) or {})
+    extras[BLOCK_FORMAT_EXTRAS_KEY] = block_format.to_dict()
+    block_metadata_params[DataSourceBlockMetadata.extras.name] = extras
+
     res = DataSourceBlockMetadata(**block_metadata_params)
     if res.path is None:
         res.path = data_store_adapter.make_data_source_block_path(res)
@@ -1,27 +1,52 @@
 import functools
+import os
+import tempfile
 import unittest
 from threading import Thread
 
 import awswrangler as wr
 import boto3.session
+import numpy as np
+import pandas as pd
 import ray
 
 from featurizer.data_definitions.common.l2_book_incremental.cryptotick.cryptotick_l2_book_incremental import \
     CryptotickL2BookIncrementalData
-from featurizer.data_ingest.config import FeaturizerDataSourceFiles, FeaturizerDataIngestConfig, DataProviderName
+from featurizer.data_definitions.common.trades.trades import TradesData
+from featurizer.data_ingest.config import FeaturizerDataSourceFiles, FeaturizerDataIngestConfig, DataProviderName, \
+    IngestStagesConfig
 from featurizer.data_ingest.models import InputItemBatch
 from featurizer.data_ingest.utils.cryptotick_utils import process_cryptotick_timestamps
 from featurizer.sql.client import FeaturizerSqlClient
 from featurizer.sql.db_actor import create_db_actor
 from featurizer.data_ingest.utils.cryptotick_utils import cryptotick_input_items, CRYPTOTICK_RAW_BUCKET_NAME
 from featurizer.data_ingest.pipelines.cryptotick.pipeline import CatalogCryptotickPipeline, poll_to_tqdm
+from featurizer.data_ingest.pipelines.cryptotick.tasks import run_ingest_stages
+from featurizer.sql.models.data_source_block_metadata import build_data_source_block_path
+from featurizer.storage.data_store_adapter.local_data_store_adapter import LocalDataStoreAdapter
 from featurizer.data_definitions.common.l2_book_incremental.cryptotick.utils import starts_with_snapshot, remove_snap, \
     get_snapshot_depth, mock_processed_cryptotick_df, \
     gen_split_l2_inc_df_and_pad_with_snapshot
-from common.pandas.df_utils import concat
+from common.pandas.df_utils import concat, gen_split_df_by_mem
 from common.s3.s3_utils import list_files_and_sizes_kb, load_df_s3, store_df_s3
 
 
+class _TmpDirDataStoreAdapter(LocalDataStoreAdapter):
+
+    def __init__(self, prefix: str, fail_on_store: bool = False):
+        super().__init__()
+        self.prefix = prefix
+        self.fail_on_store = fail_on_store
+
+    def store_df(self, path: str, df: pd.DataFrame, block_format=None, **kwargs):
+        if self.fail_on_store:
+            raise ValueError('Store failed')
+        super().store_df(path, df, block_format=block_format, **kwargs)
+
+    def make_data_source_block_path(self, item) -> str:
+        return build_data_source_block_path(item=item, prefix=self.prefix)
+
+
 class TestCatalogCryptotickPipeline(unittest.TestCase):
 
     def _store_test_df_to_s3(self):
@@ -121,6 +146,71 @@ class TestCatalogCryptotickPipeline(unittest.TestCase):
         concated = concat(splits_to_concat)
         assert processed_df.equals(concated)
 
+    def test_run_ingest_stages(self):
+        num_rows = 10000
+        start_ts = 1675209600 # 2023-02-01
+        rng = np.random.default_rng(0)
+        df = pd.DataFrame({
+            'timestamp': start_ts + np.arange(num_rows) * 0.5,
+            'receipt_timestamp': start_ts + np.arange(num_rows) * 0.5 + 0.01,
+            'side': rng.choice(np.array(['BUY', 'SELL'], dtype=object), size=num_rows),
+            'amount': rng.uniform(0.001, 5, size=num_rows),
+            'price': rng.uniform(20000, 25000, size=num_rows),
+            'id': [str(i) for i in range(num_rows)],
+        })
+        input_item = {
+            'path': 's3://svoe-cryptotick-data/trades/20230201/BINANCE_SPOT_BTC_USDT.csv.gz',
+            'owner_id': '0',
+            'key': 'test-key',
+            'data_source_definition': TradesData.__name__,
+            'size_kb': 100,
+            'day': '2023-02-01',
+            'params': {}
+        }
+        chunk_size_kb = 50
+        stages_config = IngestStagesConfig(metadata_parallelism=2, store_parallelism=3, queue_size=1, db_commit_batch_size=2)
+        expected_splits = list(gen_split_df_by_mem(df, chunk_size_kb))
+        self.assertGreater(len(expected_splits), 4)
+
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            committed_batches = []
+            events = []
+            res = run_ingest_stages(
+                gen_split_df_by_mem(df, chunk_size_kb), input_item, chunk_size_kb,
+                _TmpDirDataStoreAdapter(f'{tmp_dir}/'), committed_batches.append, events.append, stages_config
+            )
+            self.assertIsNone(res)
+            committed = [item for batch in committed_batches for item in batch]
+            self.assertEqual(len(committed), len(expected_splits))
+            self.assertTrue(all(len(batch) <= stages_config.db_commit_batch_size for batch in committed_batches))
+            # only the last batch is committed after splitting is done
+            self.assertTrue(all(item.extras['num_splits'] == len(expected_splits) for item in committed_batches[-1]))
+            self.assertTrue(all('num_splits' not in item.extras for batch in committed_batches[:-1] for item in batch))
+
+            by_split_id = {item.extras['split_id']: item for item in committed}
+            self.assertEqual(sorted(by_split_id.keys()), list(range(len(expected_splits))))
+            for split_id, split in enumerate(expected_splits):
+                item = by_split_id[split_id]
+                self.assertEqual(item.num_rows, len(split))
+                self.assertEqual(item.extras['source_path'], input_item['path'])
+                self.assertTrue(os.path.exists(item.path))
+                pd.testing.assert_frame_equal(LocalDataStoreAdapter().load_df(item.path).reset_index(drop=True), split.reset_index(drop=True))
+
+            event_names = [e['name'] for e in events]
+            self.assertEqual(event_names.count('hash_finished'), len(expected_splits))
+            self.assertEqual(event_names.count('store_finished'), len(expected_splits))
+            self.assertEqual(event_names.count('commit_finished'), len(committed_batches) - 1)
+            self.assertEqual(event_names[-1], 'write_finished')
+
+            # failure in a stage is raised without deadlocking upstream stages
+            committed_batches = []
+            with self.assertRaises(ValueError):
+                run_ingest_stages(
+                    gen_split_df_by_mem(df, chunk_size_kb), input_item, chunk_size_kb,
+                    _TmpDirDataStoreAdapter(f'{tmp_dir}/', fail_on_store=True), committed_batches.append, events.append, stages_config
+                )
+            self.assertEqual(len(committed_batches), 0)
+
     # TODO asserts, write mock data
     def test_db_client(self):
         client = FeaturizerSqlClient()
@@ -131,6 +221,7 @@ class TestCatalogCryptotickPipeline(unittest.TestCase):
 if __name__ == '__main__':
     t = TestCatalogCryptotickPipeline()
     t.test_pipeline()
+    # t.test_run_ingest_stages()
     # t.test_split_trades_df()
     # t._store_test_df_to_s3()
     # t.test_split_l2_inc_df_and_pad_with_snapshot()
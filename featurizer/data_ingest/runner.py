@@ -25,7 +25,9 @@ class FeaturizerDataIngestPipelineRunner:
             if config.provider_name == DataProviderName.CRYPTOTICK:
                 pipeline = CatalogCryptotickPipeline.options(name='CatalogCryptotickPipeline').remote(
                     max_executing_tasks=config.max_executing_tasks,
-                    db_actor=db_actor
+                    db_actor=db_actor,
+                    streaming_chunk_size_kb=config.streaming_chunk_size_kb,
+                    stages_config=config.stages
                 )
             else:
                 raise ValueError(f'Unsupported data provider {config.provider_name}')
@@ -1,13 +1,15 @@
 import dataclasses
-from typing import List, Optional
+from typing import List, Optional, Iterable, Generator
 
 import ciso8601
+import numpy as np
 import pandas as pd
+import pyarrow as pa
 
 from featurizer.data_ingest.config import FeaturizerDataIngestConfig
 from featurizer.data_ingest.models import InputItemBatch, InputItem
 
-from common.pandas.df_utils import is_ts_sorted
+from common.pandas.df_utils import is_ts_sorted, concat
 from featurizer.data_definitions.common.l2_book_incremental.cryptotick.cryptotick_l2_book_incremental import \
     CryptotickL2BookIncrementalData
 from featurizer.features.feature_tree.feature_tree import Feature
@@ -17,6 +19,18 @@ from backtester.models.instrument import Instrument
 
 CRYPTOTICK_RAW_BUCKET_NAME = 'svoe-cryptotick-data'
 
+# columns which streaming csv reader may infer differently between chunks
+CRYPTOTICK_CSV_COLUMN_TYPES = {
+    'time_exchange': pa.string(),
+    'time_coinapi': pa.string(),
+    'update_type': pa.string(),
+    'order_id': pa.string(),
+}
+
+# raw cryptotick rows are not sorted, when streaming we assume a row can not be late
+# by more than this number of rows
+DEFAULT_REORDER_WINDOW_ROWS = 100000
+
 
 def cryptotick_input_items(config: FeaturizerDataIngestConfig) -> List[InputItemBatch]:
     batch_size = config.batch_size
@@ -99,7 +113,7 @@ def _parse_s3_key(path: str, size_kb, data_source_definition) -> Optional[InputI
     return input_item
 
 
-def process_cryptotick_timestamps(df: pd.DataFrame, date_str: Optional[str] = None) -> pd.DataFrame:
+def parse_cryptotick_timestamps(df: pd.DataFrame, date_str: Optional[str] = None) -> pd.DataFrame:
     if date_str is not None:
         # certain data_types from cryptotick (e.g. L2 book) do not include date into time_exchange column (only hours/m/s...)
         # so it needs to be passed from upstream
@@ -108,18 +122,153 @@ def process_cryptotick_timestamps(df: pd.DataFrame, date_str: Optional[str] = No
     else:
         datetime_str = ''
 
-    def _to_ts(s):
-        return ciso8601.parse_datetime(f'{datetime_str}{s}Z').timestamp()
+    df['timestamp'] = parse_cryptotick_time_column(df['time_exchange'], datetime_str)
+    df['receipt_timestamp'] = parse_cryptotick_time_column(df['time_coinapi'], datetime_str)
+    df = df.drop(columns=['time_exchange', 'time_coinapi'])
+
+    return df
+
 
-    df['timestamp'] = df['time_exchange'].map(lambda x: _to_ts(x))
-    df['receipt_timestamp'] = df['time_coinapi'].map(lambda x: _to_ts(x))
+def process_cryptotick_timestamps(df: pd.DataFrame, date_str: Optional[str] = None) -> pd.DataFrame:
+    df = parse_cryptotick_timestamps(df, date_str)
 
     # for some reason raw cryptotick dates are not sorted
-    # don't use inplace=True as it harms perf https://sourcery.ai/blog/pandas-inplace/
-    df = df.sort_values(by=['timestamp'], ignore_index=True)
+    order = np.argsort(df['timestamp'].to_numpy(), kind='stable')
+    df = df.take(order).reset_index(drop=True)
     if not is_ts_sorted(df):
         raise ValueError('Unable to sort df by timestamp')
 
-    df = df.drop(columns=['time_exchange', 'time_coinapi'])
-
     return df
+
+
+def _parse_ts(datetime_str: str, s: str) -> float:
+    return ciso8601.parse_datetime(f'{datetime_str}{s}Z').timestamp()
+
+
+# Parses time column to float epoch seconds, same as ciso8601.parse_datetime(f'{datetime_str}{s}Z').timestamp() per row.
+# Values are expected to be HH:MM:SS[.f+] (datetime_str is 'yyyy-mm-ddT') or yyyy-mm-ddTHH:MM:SS[.f+] (datetime_str is ''),
+# all of the same length. Fields are read from fixed positions of a byte matrix, fraction is truncated to microseconds
+# like ciso8601 does. Anything else falls back to per-row parsing
+def parse_cryptotick_time_column(values: pd.Series, datetime_str: str = '') -> np.ndarray:
+    res = _parse_time_column_fixed_width(values, datetime_str)
+    if res is None:
+        res = values.map(lambda x: _parse_ts(datetime_str, x)).to_numpy(dtype=np.float64)
+    return res
+
+
+_TIME_LEN = 8 # HH:MM:SS
+_DATE_LEN = 11 # yyyy-mm-ddT
+_US_DIGITS = 6
+
+
+# (num_values, width) uint8 view of string values, None if values have different lengths or nulls
+def _fixed_width_bytes(values: pd.Series) -> Optional[np.ndarray]:
+    try:
+        arr = pa.array(values)
+    except (pa.ArrowInvalid, pa.ArrowTypeError):
+        return None
+    if isinstance(arr, pa.ChunkedArray):
+        arr = arr.combine_chunks()
+    if arr.null_count > 0:
+        return None
+    if pa.types.is_large_string(arr.type):
+        offsets_dtype = np.int64
+    elif pa.types.is_string(arr.type):
+        offsets_dtype = np.int32
+    else:
+        return None
+    offsets = np.frombuffer(arr.buffers()[1], dtype=offsets_dtype)[arr.offset: arr.offset + len(arr) + 1]
+    lengths = np.diff(offsets)
+    width = int(lengths[0])
+    if width == 0 or (lengths != width).any():
+        return None
+    data = np.frombuffer(arr.buffers()[2], dtype=np.uint8)[offsets[0]: offsets[-1]]
+    return data.reshape(len(arr), width)
+
+
+def _parse_time_column_fixed_width(values: pd.Series, datetime_str: str) -> Optional[np.ndarray]:
+    if len(values) == 0:
+        return np.empty(0, dtype=np.float64)
+    mat = _fixed_width_bytes(values)
+    if mat is None:
+        return None
+    width = mat.shape[1]
+
+    has_date = datetime_str == ''
+    offset = _DATE_LEN if has_date else 0
+    num_frac_digits = width - offset - _TIME_LEN - 1
+    if width != offset + _TIME_LEN and num_frac_digits < 1:
+        return None
+
+    separators = {offset + 2: ':', offset + 5: ':'}
+    if has_date:
+        separators.update({4: '-', 7: '-', 10: 'T'})
+    if num_frac_digits > 0:
+        separators[offset + _TIME_LEN] = '.'
+    for pos, sep in separators.items():
+        if not (mat[:, pos] == ord(sep)).all():
+            return None
+    digit_cols = [i for i in range(width) if i not in separators]
+    digits = mat[:, digit_cols].astype(np.int64) - ord('0')
+    if ((digits < 0) | (digits > 9)).any():
+        return None
+    digits_by_pos = dict(zip(digit_cols, range(len(digit_cols))))
+
+    def field(start: int, length: int) -> np.ndarray:
+        res = np.zeros(len(mat), dtype=np.int64)
+        for i in range(start, start + length):
+            res = res * 10 + digits[:, digits_by_pos[i]]
+        return res
+
+    hours = field(offset, 2)
+    minutes = field(offset + 3, 2)
+    seconds = field(offset + 6, 2)
+    if (hours > 23).any() or (minutes > 59).any() or (seconds > 59).any():
+        return None
+    num_us_digits = min(num_frac_digits, _US_DIGITS)
+    micros = field(offset + _TIME_LEN + 1, num_us_digits) * 10 ** (_US_DIGITS - num_us_digits) if num_us_digits > 0 else 0
+
+    try:
+        if has_date:
+            # few distinct dates per file, convert each once
+            dates, inverse = np.unique(np.ascontiguousarray(mat[:, :10]).view('S10').ravel(), return_inverse=True)
+            days = np.array([np.datetime64(d.decode(), 'D') for d in dates]).astype(np.int64)[inverse]
+        else:
+            days = np.datetime64(datetime_str[:10], 'D').astype(np.int64)
+    except ValueError:
+        return None
+
+    total_us = ((days * 86400 + hours * 3600 + minutes * 60 + seconds) * 10 ** _US_DIGITS + micros)
+    # int / int division, same as datetime.timestamp()
+    return total_us / 10 ** _US_DIGITS
+
+
+# Streaming version of process_cryptotick_timestamps: parses raw chunks and yields ts-sorted chunks.
+# Rows with timestamps at or after the smallest timestamp among the last reorder_window_rows rows of a chunk
+# may still be followed by earlier rows, so they are carried over to the next chunk. Rows with the same timestamp
+# are never split between yielded chunks and keep their original order
+def gen_sorted_cryptotick_chunks(
+    raw_chunks: Iterable[pd.DataFrame],
+    date_str: Optional[str] = None,
+    reorder_window_rows: int = DEFAULT_REORDER_WINDOW_ROWS
+) -> Generator[pd.DataFrame, None, None]:
+    carry = None
+    last_ts = None
+    for chunk in raw_chunks:
+        chunk = parse_cryptotick_timestamps(chunk, date_str)
+        watermark = chunk['timestamp'].iloc[-reorder_window_rows:].min()
+        buf = chunk if carry is None else concat([carry, chunk])
+        buf = buf.sort_values(by=['timestamp'], kind='stable', ignore_index=True)
+        num_ready = int(np.searchsorted(buf['timestamp'].to_numpy(), watermark, side='left'))
+        ready = buf.iloc[:num_ready].reset_index(drop=True)
+        carry = buf.iloc[num_ready:].reset_index(drop=True)
+        if len(ready) > 0:
+            if last_ts is not None and ready['timestamp'].iloc[0] <= last_ts:
+                raise ValueError(f'Rows are out of order by more than {reorder_window_rows} rows, increase reorder window')
+            last_ts = ready['timestamp'].iloc[-1]
+            yield ready
+
+    if carry is not None and len(carry) > 0:
+        if last_ts is not None and carry['timestamp'].iloc[0] <= last_ts:
+            raise ValueError(f'Rows are out of order by more than {reorder_window_rows} rows, increase reorder window')
+        yield carry
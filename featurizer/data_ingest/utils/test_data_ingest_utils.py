@@ -1,10 +1,19 @@
+import os
+import tempfile
 import unittest
 
+import ciso8601
 import numpy as np
-
-from featurizer.data_definitions.common.l2_book_incremental.cryptotick.utils import preprocess_l2_inc_df
-from featurizer.featurizer_utils.testing_utils import mock_l2_book_delta_data_and_meta, mock_trades_data_and_meta
-from common.pandas.df_utils import gen_split_df_by_mem, get_size_kb, concat
+import pandas as pd
+
+from featurizer.data_definitions.common.l2_book_incremental.cryptotick.utils import preprocess_l2_inc_df, \
+    gen_split_l2_inc_chunks_and_pad_with_snapshot, run_l2_snapshot_stream, prepend_snap, process_l2_inc_columns, \
+    gen_split_l2_inc_df_and_pad_with_snapshot
+from featurizer.data_ingest.utils.cryptotick_utils import CRYPTOTICK_CSV_COLUMN_TYPES, parse_cryptotick_timestamps, \
+    parse_cryptotick_time_column, process_cryptotick_timestamps
+from featurizer.featurizer_utils.testing_utils import mock_l2_book_delta_data_and_meta, mock_trades_data_and_meta, \
+    mock_processed_l2_inc_df
+from common.pandas.df_utils import gen_split_df_by_mem, get_size_kb, concat, gen_csv_chunks, estimate_row_size_bytes
 from common.s3.s3_utils import load_df_s3
 
 
@@ -76,9 +85,123 @@ class TestDataIngestUtils(unittest.TestCase):
 
         print(f'Avg Trades split size:{np.mean(trades_split_sizes)}')
 
+    def test_split_df_by_mem(self):
+        df = mock_processed_l2_inc_df(50000, seed=5)
+        df['side'] = df['side'].astype(object)
+        row_size_bytes = get_size_kb(df) * 1024 / len(df)
+        assert abs(estimate_row_size_bytes(df) - row_size_bytes) / row_size_bytes < 0.05
+
+        split_size_kb = 300
+        splits = list(gen_split_df_by_mem(df, split_size_kb))
+        assert len(splits) > 2
+        for i in range(1, len(splits)):
+            assert splits[i - 1].iloc[-1]['timestamp'] != splits[i].iloc[0]['timestamp']
+            # last split is the leftover
+            assert get_size_kb(splits[i - 1]) >= split_size_kb * 0.9
+        assert concat(splits).equals(df)
+
+    def test_cryptotick_l2_split_pad_with_snapshot(self):
+        processed = mock_processed_l2_inc_df(20000, seed=4)
+        splits = list(gen_split_l2_inc_df_and_pad_with_snapshot(processed, 200, lambda i, t: None))
+        assert len(splits) > 2
+
+        # reference: book is rebuilt from prev padded split for every split
+        expected = []
+        for split in gen_split_df_by_mem(processed, 200):
+            if len(expected) > 0:
+                split = prepend_snap(split, run_l2_snapshot_stream(expected[-1]))
+            expected.append(split)
+
+        assert len(splits) == len(expected)
+        for split, expected_split in zip(splits, expected):
+            pd.testing.assert_frame_equal(split, expected_split)
+
+    def test_cryptotick_l2_streaming_split(self):
+        date_str = '01-02-2023'
+        processed = mock_processed_l2_inc_df(20000, seed=3)
+        # raw cryptotick format, rows are locally out of order, rows with same ts keep their order
+        rng = np.random.default_rng(3)
+        group_ids = np.unique(processed['timestamp'].to_numpy(), return_inverse=True)[1]
+        noise = rng.uniform(0, 0.05, size=group_ids.max() + 1)[group_ids]
+        raw = processed.iloc[np.argsort(processed['timestamp'].to_numpy() + noise, kind='stable')]
+
+        def to_time_str(ts):
+            # HH:MM:SS.fffffff
+            return pd.to_datetime(ts, unit='s').dt.strftime('%H:%M:%S.%f') + '0'
+
+        raw = pd.DataFrame({
+            'time_exchange': to_time_str(raw['timestamp']),
+            'time_coinapi': to_time_str(raw['receipt_timestamp']),
+            'update_type': raw['update_type'],
+            'is_buy': (raw['side'] == 'bid').astype(int),
+            'entry_px': raw['price'],
+            'entry_sx': raw['size'],
+            'order_id': None,
+        })
+        expected = parse_cryptotick_timestamps(raw.copy(), date_str).sort_values(by=['timestamp'], kind='stable', ignore_index=True)
+        expected = process_l2_inc_columns(expected)
+
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            path = os.path.join(tmp_dir, 'raw.csv.gz')
+            raw.to_csv(path, sep=';', index=False)
+            raw_chunks = gen_csv_chunks(path, 64, ';', CRYPTOTICK_CSV_COLUMN_TYPES)
+            splits = list(gen_split_l2_inc_chunks_and_pad_with_snapshot(raw_chunks, date_str, 200, reorder_window_rows=1000))
+
+        assert len(splits) > 2
+        start = 0
+        prev_split = None
+        for split in splits:
+            if prev_split is None:
+                num_snap_rows = 0
+            else:
+                num_snap_rows = int(((split['update_type'] == 'SNAPSHOT') & (split['timestamp'] == split['timestamp'].iloc[0])).sum())
+            num_rows = len(split) - num_snap_rows
+            expected_split = expected.iloc[start: start + num_rows].reset_index(drop=True)
+            if prev_split is not None:
+                # same as gen_split_l2_inc_df_and_pad_with_snapshot: snapshot of the book at the end of prev split
+                expected_split = prepend_snap(expected_split, run_l2_snapshot_stream(prev_split))
+            pd.testing.assert_frame_equal(split[expected_split.columns], expected_split, check_dtype=False)
+            start += num_rows
+            prev_split = split
+        assert start == len(expected)
+
+    def test_parse_cryptotick_time_column(self):
+        rng = np.random.default_rng(0)
+        micros = rng.integers(0, 86400 * 10 ** 6, size=10000)
+        times = pd.to_datetime(micros, unit='us').strftime('%H:%M:%S.%f') + pd.Series(rng.integers(0, 10, size=len(micros))).astype(str)
+        dates = pd.Series(rng.choice(['2023-02-01', '2023-02-02', '2024-02-29'], size=len(micros)))
+
+        def per_row(values: pd.Series, datetime_str: str) -> np.ndarray:
+            return values.map(lambda x: ciso8601.parse_datetime(f'{datetime_str}{x}Z').timestamp()).to_numpy()
+
+        cases = [
+            (pd.Series(times), '2023-02-01T'),
+            (dates + 'T' + times, ''),
+            # no fraction
+            (pd.Series(times.str.slice(0, 8)), '2023-02-01T'),
+            # object dtype, variable length falls back to per row parsing
+            (pd.Series(['00:00:01.5', '00:00:01.25', '23:59:59.9999999'], dtype=object), '2023-02-01T'),
+        ]
+        for values, datetime_str in cases:
+            res = parse_cryptotick_time_column(values, datetime_str)
+            assert np.array_equal(res, per_row(values, datetime_str))
+
+        with self.assertRaises(ValueError):
+            parse_cryptotick_time_column(pd.Series(['25:00:00.0000000']), '2023-02-01T')
+
+        # sort is stable for equal timestamps
+        df = pd.DataFrame({'time_exchange': ['00:00:02.0', '00:00:01.0', '00:00:02.0', '00:00:01.0'], 'id': [0, 1, 2, 3]})
+        df['time_coinapi'] = df['time_exchange']
+        df = process_cryptotick_timestamps(df, '01-02-2023')
+        assert df['id'].tolist() == [1, 3, 0, 2]
+
 
 if __name__ == '__main__':
     # unittest.main()
     t = TestDataIngestUtils()
     t.test_cryptofeed_df_split()
-    t.test_cryptotick_df_split()
\ No newline at end of file
+    t.test_cryptotick_df_split()
+    t.test_cryptotick_l2_streaming_split()
+    t.test_parse_cryptotick_time_column()
+    t.test_cryptotick_l2_split_pad_with_snapshot()
+    t.test_split_df_by_mem()
@@ -1,24 +1,20 @@
 from dataclasses import dataclass
-from typing import Dict, List, Tuple, Optional, Type
+from typing import Dict, List, Tuple, Optional, Type, Iterator
 
 import ciso8601
 import streamz
-from intervaltree import Interval
 from streamz import Stream
 
 from common.time.utils import split_time_range_between_ts, ts_to_str_date
-from featurizer.blocks.blocks import BlockRangeMeta, BlockRange, ranges_to_interval_dict, get_overlaps, \
-    prune_overlaps, meta_to_interval
-from featurizer.task_graph.tasks import merge_blocks
 from featurizer.config import FeaturizerConfig
-from featurizer.features.feature_tree.feature_tree import construct_feature, Feature, construct_stream_tree
+from featurizer.feature_stream.windowed_data_stream import stream_data_ranges, DEFAULT_PREFETCH_WINDOWS
+from featurizer.features.feature_tree.feature_tree import construct_feature, Feature, construct_stream_tree, \
+    upstream_columns
 from featurizer.storage.data_store_adapter.data_store_adapter import DataStoreAdapter
 from featurizer.storage.data_store_adapter.local_data_store_adapter import LocalDataStoreAdapter
 from featurizer.storage.featurizer_storage import FeaturizerStorage
 import featurizer.data_definitions.data_definition as data_def
 
-import concurrent.futures
-
 from backtester.models.instrument import Instrument
 
 # free data https://www.cryptoarchive.com.au/faq
@@ -35,7 +31,13 @@ class FeatureStreamGenerator():
 
     NUM_IO_THREADS = 16
 
-    def __init__(self, featurizer_config: FeaturizerConfig, data_store_adapter: DataStoreAdapter = LocalDataStoreAdapter(), price_sampling_period: str = '1s'):
+    def __init__(
+        self,
+        featurizer_config: FeaturizerConfig,
+        data_store_adapter: DataStoreAdapter = LocalDataStoreAdapter(),
+        price_sampling_period: str = '1s',
+        prefetch_windows: int = DEFAULT_PREFETCH_WINDOWS
+    ):
         self._price_sampling_period = price_sampling_period
         self._data_store_adapter = data_store_adapter
 
@@ -99,99 +101,31 @@ class FeatureStreamGenerator():
         storage = FeaturizerStorage()
         data_ranges_meta = storage.get_data_sources_meta(self.features, start_date=featurizer_config.start_date, end_date=featurizer_config.end_date)
         # TODO indicate if data ranges are empty
-        data_ranges = self.load_data_ranges(data_ranges_meta)
-        self.input_data_events: List[Tuple[Feature, data_def.Event]] = self.merge_data_ranges(data_ranges)
-        self.cur_input_event_index = 0
+        # blocks are loaded, preprocessed and merged lazily, only prefetch_windows windows ahead are kept in memory
+        self.input_data_events: Iterator[Tuple[Feature, data_def.Event]] = stream_data_ranges(
+            data_ranges_meta, self._data_store_adapter,
+            # only columns consumed by features are loaded
+            columns_per_feature=upstream_columns(self.features),
+            prefetch_windows=prefetch_windows,
+            num_io_threads=self.NUM_IO_THREADS
+        )
+        # one event lookahead so we can group events with same ts and check has_next without materializing
+        self._next_input_event: Optional[Tuple[Feature, data_def.Event]] = next(self.input_data_events, None)
 
         self._sampled_mid_prices: Dict[Instrument, List[Tuple[float, float]]] = {}
         self._last_sampled_ts = None
 
-    # TODO util this?
-    def load_data_ranges(self, ranges_meta_per_data: Dict[Feature, List[BlockRangeMeta]]) -> Dict[Interval, Dict[Feature, BlockRange]]:
-        ranges_meta_dict_per_data = {}
-        for data in ranges_meta_per_data:
-            meta = ranges_meta_per_data[data]
-            ranges_meta_dict_per_data[data] = ranges_to_interval_dict(meta)
-
-        range_meta_intervals: Dict[Interval, Dict[Feature, BlockRangeMeta]] = prune_overlaps(get_overlaps(ranges_meta_dict_per_data))
-
-        # count number of blocks
-        num_blocks = 0
-        for interval in range_meta_intervals:
-            for feature in range_meta_intervals[interval]:
-                num_blocks += len(range_meta_intervals[interval][feature])
-
-        # init data_ranges with empty lists. They will be populated later
-        data_ranges = {}
-        for interval in range_meta_intervals:
-            for feature in range_meta_intervals[interval]:
-                if interval not in data_ranges:
-                    data_ranges[interval] = {}
-                data_ranges[interval][feature] = [None] * len(range_meta_intervals[interval][feature])
-
-        executor_futures = {}
-
-        def _load_and_store_block(cur_block_id: int, path: str):
-            print(f'Started loading block {cur_block_id}/{num_blocks}')
-            df = self._data_store_adapter.load_df(path)
-            print(f'Finished loading block {cur_block_id}/{num_blocks}')
-            return df
-
-        with concurrent.futures.ThreadPoolExecutor(max_workers=self.NUM_IO_THREADS) as executor:
-            block_id = 1
-            for interval in range_meta_intervals:
-                for feature in range_meta_intervals[interval]:
-                    for block_position in range(len(range_meta_intervals[interval][feature])):
-                        block_meta = range_meta_intervals[interval][feature][block_position]
-                        if feature.data_definition.is_synthetic():
-                            data_ranges[interval][feature][block_position] = feature.data_definition.gen_synthetic_events(
-                                interval=meta_to_interval(block_meta),
-                                params=feature.params
-                            )
-                        else:
-                            path = block_meta['path']
-                            key = (interval, feature, block_position)
-                            executor_futures[key] = executor.submit(_load_and_store_block, cur_block_id=block_id, path=path)
-                            block_id += 1
-
-        for key in executor_futures:
-            executor_future = executor_futures[key]
-            interval, feature, block_position = key
-            block = executor_future.result()
-
-            # data_ranges dict already constructed above
-            # TODO preproc only if needed
-            preproc_block = feature.data_definition.preprocess(block)
-            data_ranges[interval][feature][block_position] = preproc_block
-
-        return data_ranges
-
-    def merge_data_ranges(self, data_ranges: Dict[Interval, Dict[Feature, BlockRange]]) -> List[Tuple[Feature, data_def.Event]]:
-        # return {i: merge_blocks(b) for (i, b) in data_ranges}
-        merged_per_data: Dict[Interval, List[Tuple[Feature, data_def.Event]]] = {}
-        for interval in data_ranges:
-            merged_per_data[interval] = merge_blocks(data_ranges[interval])
-
-        res = []
-        sorted_intervals = sorted(merged_per_data.keys())
-        for interval in sorted_intervals:
-            res.extend(merged_per_data[interval])
-        return res
-
     def _pop_input_events(self) -> List[Tuple[Feature, data_def.Event]]:
-        res = []
-        data, input_event = self.input_data_events[self.cur_input_event_index]
-        timestamp = input_event['timestamp']
-        res.append((data, input_event))
-        self.cur_input_event_index += 1
+        res = [self._next_input_event]
+        timestamp = self._next_input_event[1]['timestamp']
+        self._next_input_event = next(self.input_data_events, None)
 
         # group events with same ts
-        while self.cur_input_event_index < len(self.input_data_events):
-            next_data, next_input_event = self.input_data_events[self.cur_input_event_index]
+        while self._next_input_event is not None:
             # TODO float comparison
-            if timestamp == next_input_event['timestamp']:
-                res.append((next_data, next_input_event))
-                self.cur_input_event_index += 1
+            if timestamp == self._next_input_event[1]['timestamp']:
+                res.append(self._next_input_event)
+                self._next_input_event = next(self.input_data_events, None)
             else:
                 break
 
@@ -220,7 +154,7 @@ class FeatureStreamGenerator():
         return self.cur_out_event
 
     def has_next(self) -> bool:
-        return self.cur_input_event_index < len(self.input_data_events)
+        return self._next_input_event is not None
 
     def get_cur_mid_prices(self) -> Dict[Instrument, float]:
         return FeatureStreamGenerator.get_mid_prices_from_event(self.cur_out_event)
@@ -233,15 +167,16 @@ class FeatureStreamGenerator():
         mid_prices = {}
 
         for feature in data_event.feature_values:
-            mid_price = None
-            for col in data_event.feature_values[feature]:
-                if col == 'mid_price':
-                    mid_price = data_event.feature_values[feature][col]
-                    instrument = FeatureStreamGenerator.get_instrument_for_feature(feature)
-                    mid_prices[instrument] = mid_price
-                    break
-            if mid_price is None:
-                raise ValueError('DataGenerator event should contain mid_price field for all data/instrument inputs')
+            values = data_event.feature_values[feature]
+            if 'mid_price' in values:
+                mid_price = values['mid_price']
+            elif 'bid_px_0' in values and 'ask_px_0' in values:
+                # l2 snapshots, mid of top of book
+                mid_price = (values['bid_px_0'] + values['ask_px_0']) / 2
+            else:
+                raise ValueError('DataGenerator event should contain mid_price field or top of book for all data/instrument inputs')
+            instrument = FeatureStreamGenerator.get_instrument_for_feature(feature)
+            mid_prices[instrument] = mid_price
 
         return mid_prices
 
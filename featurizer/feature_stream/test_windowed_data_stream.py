@@ -0,0 +1,102 @@
+import os
+import tempfile
+import threading
+import unittest
+from typing import List
+from unittest import mock
+
+import numpy as np
+import pandas as pd
+
+from featurizer.blocks.blocks import mock_meta, make_ranges
+from featurizer.blocks.preprocessed_block_cache import PreprocessedBlockCache
+from featurizer.data_definitions.common.trades.trades import TradesData
+from featurizer.feature_stream.windowed_data_stream import stream_data_ranges
+from featurizer.features.feature_tree.feature_tree import Feature
+from featurizer.storage.data_store_adapter.local_data_store_adapter import LocalDataStoreAdapter
+
+
+# stands for sources which blocks start with a snapshot (e.g. l2 incremental), these need whole blocks
+class _SnapshotTradesData(TradesData):
+
+    @classmethod
+    def preprocess_impl(cls, df: pd.DataFrame) -> pd.DataFrame:
+        return df
+
+
+class _RecordingDataStoreAdapter(LocalDataStoreAdapter):
+
+    def __init__(self):
+        super().__init__()
+        self.loaded_paths = []
+        self.lock = threading.Lock()
+
+    def load_df(self, path: str, **kwargs) -> pd.DataFrame:
+        with self.lock:
+            self.loaded_paths.append(path)
+        return super().load_df(path, **kwargs)
+
+
+class TestWindowedDataStream(unittest.TestCase):
+
+    def _store_blocks(self, tmp_dir: str, name: str, block_starts: List[float], block_size_s: float, rows_per_block: int):
+        metas = []
+        for i, start in enumerate(block_starts):
+            ts = np.round(np.linspace(start, start + block_size_s, rows_per_block, endpoint=False), 3)
+            df = pd.DataFrame({
+                'timestamp': ts,
+                'receipt_timestamp': ts + 0.001,
+                'side': ['BUY'] * rows_per_block,
+                'amount': np.full(rows_per_block, 1.0),
+                'price': np.arange(rows_per_block, dtype=float) + i * rows_per_block,
+            })
+            path = os.path.join(tmp_dir, f'{name}-{i}.parquet.gz')
+            LocalDataStoreAdapter().store_df(path, df)
+            metas.append(mock_meta(ts[0], ts[-1], {'path': path}))
+        return metas
+
+    def test_stream_data_ranges(self):
+        trades_a = Feature([], _SnapshotTradesData, {'symbol': 'A'})
+        trades_b = Feature([], TradesData, {'symbol': 'B'})
+        with tempfile.TemporaryDirectory() as tmp_dir, mock.patch(
+            'featurizer.data_definitions.data_definition.get_preprocessed_block_cache',
+            return_value=PreprocessedBlockCache(cache_dir=os.path.join(tmp_dir, 'cache'))
+        ):
+            # blocks of different sources don't share boundaries
+            metas_a = self._store_blocks(tmp_dir, 'a', [i * 10 for i in range(20)], 10, 50)
+            metas_b = self._store_blocks(tmp_dir, 'b', [3 + i * 7 for i in range(28)], 7, 30)
+            ranges_meta = {trades_a: make_ranges(metas_a), trades_b: make_ranges(metas_b)}
+
+            adapter = _RecordingDataStoreAdapter()
+            events = stream_data_ranges(ranges_meta, adapter, prefetch_windows=2, num_io_threads=2)
+            first = next(events)
+            # only first windows are loaded before first event
+            self.assertLessEqual(len(adapter.loaded_paths), 6)
+            res = [first] + list(events)
+
+            # same events as merging whole range at once, within overlap of both sources
+            lower = max(metas_a[0]['start_ts'], metas_b[0]['start_ts'])
+            upper = min(metas_a[-1]['end_ts'], metas_b[-1]['end_ts'])
+            expected = []
+            for feature, metas in [(trades_a, metas_a), (trades_b, metas_b)]:
+                df = pd.concat([LocalDataStoreAdapter().load_df(m['path']) for m in metas])
+                if feature == trades_a:
+                    # first block of a source which needs preprocessing is not cut at range start
+                    df = df[df['timestamp'] <= upper]
+                else:
+                    df = df[(df['timestamp'] >= lower) & (df['timestamp'] <= upper)]
+                expected.extend((feature.key, ts, price) for ts, price in zip(df['timestamp'], df['price']))
+            actual = [(feature.key, event['timestamp'], event['price']) for feature, event in res]
+            self.assertEqual(sorted(actual), sorted(expected))
+            # leading (snapshot) rows of the first block are kept
+            first_a = [event for feature, event in res if feature == trades_a][:3]
+            self.assertEqual([event['timestamp'] for event in first_a], [0, 0.2, 0.4])
+            self.assertLess(first_a[-1]['timestamp'], lower)
+            self.assertTrue(all(res[i][1]['timestamp'] <= res[i + 1][1]['timestamp'] for i in range(len(res) - 1)))
+            # every block is read once
+            self.assertEqual(len(adapter.loaded_paths), len(set(adapter.loaded_paths)))
+
+
+if __name__ == '__main__':
+    t = TestWindowedDataStream()
+    t.test_stream_data_ranges()
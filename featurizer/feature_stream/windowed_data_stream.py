@@ -0,0 +1,153 @@
+import concurrent.futures
+from dataclasses import dataclass
+from typing import Dict, List, Tuple, Optional, Iterator
+
+import numpy as np
+from portion import Interval
+
+from featurizer.blocks.blocks import BlockRangeMeta, BlockMeta, Block, ranges_to_interval_index, get_overlaps, \
+    prune_overlaps, meta_to_interval, data_block_key
+from featurizer.data_definitions.data_definition import Event
+from featurizer.featurizer_utils.featurizer_utils import merge_blocks
+from featurizer.features.feature_tree.feature_tree import Feature
+from featurizer.storage.data_store_adapter.block_format import block_format_from_meta
+from featurizer.storage.data_store_adapter.data_store_adapter import DataStoreAdapter
+
+# number of windows ahead of the consumed one which blocks are loaded and preprocessed for
+DEFAULT_PREFETCH_WINDOWS = 4
+DEFAULT_NUM_IO_THREADS = 16
+
+
+@dataclass
+class _WindowBlock:
+    feature: Feature
+    meta: BlockMeta
+    # pruned range interval the block is read for
+    range_interval: Interval
+    # index of the first window the block is used in
+    first_window: int = 0
+    # index of the last window the block is used in, block is dropped after it
+    last_window: int = 0
+
+
+@dataclass
+class _Window:
+    lower: float
+    upper: float
+    # last window of a range interval includes its upper bound
+    closed_upper: bool
+    block_ids: List[int]
+
+
+# Lazily streams merged (feature, event) tuples of data blocks over given ranges. Each range interval is split
+# into windows on block start timestamps, so a window overlaps at most a couple of blocks per data source. Blocks
+# of the next prefetch_windows windows are loaded and preprocessed in background threads, events of the current
+# window are merged from slices of its blocks and blocks are dropped once their last window is consumed,
+# so memory is bounded by the prefetch window rather than the whole date range. Blocks which need preprocessing
+# are never cut at the front (e.g. l2 blocks start with a snapshot the book is rebuilt from), rows before
+# the range interval are emitted in the first window of the block
+def stream_data_ranges(
+    ranges_meta_per_data: Dict[Feature, List[BlockRangeMeta]],
+    data_store_adapter: DataStoreAdapter,
+    columns_per_feature: Optional[Dict[Feature, Optional[List[str]]]] = None,
+    prefetch_windows: int = DEFAULT_PREFETCH_WINDOWS,
+    num_io_threads: int = DEFAULT_NUM_IO_THREADS
+) -> Iterator[Tuple[Feature, Event]]:
+    if prefetch_windows < 0:
+        raise ValueError('prefetch_windows should be non-negative')
+    columns_per_feature = {} if columns_per_feature is None else columns_per_feature
+    blocks, windows = _make_windows(ranges_meta_per_data)
+
+    def _load_block(block_id: int) -> Tuple[Block, np.ndarray]:
+        block = blocks[block_id]
+        feature = block.feature
+        data_definition = feature.data_definition
+        print(f'Started loading block {block_id + 1}/{len(blocks)}')
+        if data_definition.is_synthetic():
+            df = data_definition.gen_synthetic_events(interval=meta_to_interval(block.meta), params=feature.params)
+        else:
+            block_key = data_block_key(block.meta)
+            df = data_definition.get_preprocessed_from_cache(block_key) if data_definition.needs_preprocessing() else None
+            if df is None:
+                columns = None
+                ts_range = None
+                # preprocessing needs raw columns and full blocks (e.g. l2 blocks start with snapshot)
+                if not data_definition.needs_preprocessing():
+                    columns = columns_per_feature.get(feature)
+                    block_interval = meta_to_interval(block.meta)
+                    # events outside of the range interval are never emitted, so they are not read
+                    if block_interval.lower < block.range_interval.lower or block_interval.upper > block.range_interval.upper:
+                        ts_range = (block.range_interval.lower, block.range_interval.upper)
+                df = data_store_adapter.load_df(block.meta['path'], block_format=block_format_from_meta(block.meta), columns=columns, ts_range=ts_range)
+                df = data_definition.preprocess(df, block_key)
+        print(f'Finished loading block {block_id + 1}/{len(blocks)}')
+        return df, df['timestamp'].to_numpy()
+
+    executor = concurrent.futures.ThreadPoolExecutor(max_workers=num_io_threads)
+    futures: Dict[int, concurrent.futures.Future] = {}
+    submitted_windows = 0
+    try:
+        for window_id, window in enumerate(windows):
+            # keep loads for the current and next prefetch_windows windows in flight
+            while submitted_windows < len(windows) and submitted_windows <= window_id + prefetch_windows:
+                for block_id in windows[submitted_windows].block_ids:
+                    if block_id not in futures:
+                        futures[block_id] = executor.submit(_load_block, block_id)
+                submitted_windows += 1
+
+            window_blocks = {}
+            for block_id in window.block_ids:
+                df, timestamps = futures[block_id].result()
+                block = blocks[block_id]
+                if block.first_window == window_id and block.feature.data_definition.needs_preprocessing():
+                    start = 0
+                else:
+                    start = int(np.searchsorted(timestamps, window.lower, side='left'))
+                end = int(np.searchsorted(timestamps, window.upper, side='right' if window.closed_upper else 'left'))
+                if end > start:
+                    window_blocks.setdefault(block.feature, []).append(df.iloc[start: end])
+
+            if len(window_blocks) > 0:
+                yield from merge_blocks(window_blocks)
+
+            for block_id in window.block_ids:
+                if blocks[block_id].last_window == window_id:
+                    del futures[block_id]
+    finally:
+        executor.shutdown(wait=False, cancel_futures=True)
+
+
+def _make_windows(ranges_meta_per_data: Dict[Feature, List[BlockRangeMeta]]) -> Tuple[List[_WindowBlock], List[_Window]]:
+    ranges_meta_dict_per_data = {data: ranges_to_interval_index(meta) for data, meta in ranges_meta_per_data.items()}
+    range_meta_intervals: Dict[Interval, Dict[Feature, BlockRangeMeta]] = prune_overlaps(get_overlaps(ranges_meta_dict_per_data))
+
+    blocks = []
+    windows = []
+    for range_interval in sorted(range_meta_intervals, key=lambda i: i.lower):
+        range_blocks = []
+        for feature, block_range_meta in range_meta_intervals[range_interval].items():
+            for block_meta in block_range_meta:
+                range_blocks.append((meta_to_interval(block_meta), _WindowBlock(feature, block_meta, range_interval)))
+        range_blocks.sort(key=lambda b: b[0].lower)
+
+        bounds = sorted({max(block_interval.lower, range_interval.lower) for block_interval, _ in range_blocks} | {range_interval.lower})
+        bounds = [b for b in bounds if b <= range_interval.upper]
+        active = []
+        next_block = 0
+        for i, lower in enumerate(bounds):
+            is_last = i == len(bounds) - 1
+            upper = range_interval.upper if is_last else bounds[i + 1]
+            # blocks starting at next bound belong to next window
+            window_id = len(windows)
+            while next_block < len(range_blocks) and (range_blocks[next_block][0].lower < upper or (is_last and range_blocks[next_block][0].lower <= upper)):
+                active.append((range_blocks[next_block][0], len(blocks)))
+                range_blocks[next_block][1].first_window = window_id
+                blocks.append(range_blocks[next_block][1])
+                next_block += 1
+            # blocks ending before window are done
+            active = [(block_interval, block_id) for block_interval, block_id in active if block_interval.upper >= lower]
+            for _, block_id in active:
+                blocks[block_id].last_window = window_id
+            windows.append(_Window(lower=lower, upper=upper, closed_upper=is_last, block_ids=[block_id for _, block_id in active]))
+
+    return blocks, windows
@@ -1,9 +1,12 @@
 from __future__ import annotations
+
+import pandas as pd
 from streamz import Stream
 from typing import Dict, List, Tuple, Union, Type, Any, Optional
 from portion import IntervalDict
 
 from featurizer.blocks.blocks import BlockMeta
+from featurizer.blocks.interval_index import IntervalIndex
 from featurizer.data_definitions.data_definition import DataDefinition
 from featurizer.featurizer_utils.definitions_loader import DefinitionsLoader
 
@@ -22,6 +25,23 @@ class FeatureDefinition(DataDefinition):
     def stream(cls, dep_upstreams: Dict['Feature', Stream], feature_params: Dict) -> Union[Stream, Tuple[Stream, Any]]:
         raise NotImplemented
 
+    # optional vectorized counterpart of stream(): takes full ts-sorted dataframe per dependency
+    # and returns the same rows stream() would emit for them. Used instead of stream() for offline
+    # featurization when implemented
+    @classmethod
+    def batch(cls, dep_dfs: Dict['Feature', pd.DataFrame], feature_params: Dict) -> pd.DataFrame:
+        raise NotImplementedError
+
+    @classmethod
+    def has_batch(cls) -> bool:
+        return cls.batch.__func__ is not FeatureDefinition.batch.__func__
+
+    # columns this feature reads from upstream blocks of given definition, None means all columns.
+    # Used to project blocks on load, 'timestamp' and 'receipt_timestamp' are always loaded
+    @classmethod
+    def dep_upstream_columns(cls, dep_definition: Type[DataDefinition]) -> Optional[List[str]]:
+        return None
+
     # TODO make dep_schema part of feature_params
     @classmethod
     def dep_upstream_schema(cls, dep_schema: str = Optional[None]) -> List[Union[str, Type[DataDefinition]]]:
@@ -61,7 +81,7 @@ class FeatureDefinition(DataDefinition):
 
     # TODO we assume no 'holes' in data, use ranges: List[BlockRangeMeta] with holes
     @classmethod
-    def group_dep_ranges(cls, feature: 'Feature', dep_ranges: Dict['Feature', List[BlockMeta]]) -> IntervalDict: # TODO typehint Block/BlockRange/BlockMeta/BlockRangeMeta
+    def group_dep_ranges(cls, feature: 'Feature', dep_ranges: Dict['Feature', List[BlockMeta]]) -> Union[IntervalIndex, IntervalDict]: # TODO typehint Block/BlockRange/BlockMeta/BlockRangeMeta
         # logic to group input data into atomic blocks for bulk processing
         # TODO this should be identity mapping by default?
         raise NotImplemented
@@ -1,12 +1,15 @@
 from typing import List, Dict, Optional, Tuple, Type
 
+import numpy as np
+import pandas as pd
 from portion import IntervalDict, closed
 from streamz import Stream
-from order_book import OrderBook
+from frozendict import frozendict
 from featurizer.data_definitions.data_definition import DataDefinition, Event, EventSchema
 from featurizer.data_definitions.common.l2_book_incremental.cryptotick.cryptotick_l2_book_incremental import \
     CryptotickL2BookIncrementalData
-from featurizer.features.definitions.l2_book.l2_snapshot_fd.utils import _State, cryptofeed_update_state, cryptotick_update_state
+from featurizer.features.definitions.l2_book.l2_snapshot_fd.utils import _State, cryptofeed_update_state, \
+    cryptotick_update_state, ArrayOrderBook
 from featurizer.features.feature_tree.feature_tree import Feature
 from featurizer.features.definitions.feature_definition import FeatureDefinition
 import common.streamz.stream_utils as su
@@ -17,19 +20,41 @@ import toolz
 
 from common.time.utils import convert_str_to_seconds, round_float
 
+# shared object so padded snapshots compare equal (nan != nan, but dict comparison checks identity first)
+_NAN = float('nan')
+
+
+@functools.lru_cache(maxsize=None)
+def snapshot_columns(depth: int) -> Tuple[str, ...]:
+    return ('timestamp', 'receipt_timestamp') + \
+        tuple(f'bid_px_{i}' for i in range(depth)) + tuple(f'bid_sz_{i}' for i in range(depth)) + \
+        tuple(f'ask_px_{i}' for i in range(depth)) + tuple(f'ask_sz_{i}' for i in range(depth))
+
+
+# (price column, size column) of a level of a snapshot side ('bid' or 'ask'), 0 is best.
+# Levels are walked lazily by consumers, so snapshot depth does not need to be known
+@functools.lru_cache(maxsize=None)
+def level_column(level: int, side: str) -> Tuple[str, str]:
+    return f'{side}_px_{level}', f'{side}_sz_{level}'
+
+
 
 class L2SnapshotFD(FeatureDefinition):
 
     DEFAULT_DEPTH = 25
 
+    # snapshots are flat fixed-width rows (width depends on 'depth' param), levels are best-first,
+    # missing levels are NaN. Full book snapshots (depth == -1) have variable width, only timestamps are fixed
+    @classmethod
+    def event_schema(cls, feature_params: Optional[Dict] = None) -> EventSchema:
+        depth = cls._depth(feature_params)
+        return {col: float for col in snapshot_columns(max(depth, 0))}
+
     @classmethod
-    def event_schema(cls) -> EventSchema:
-        return {
-            'timestamp': float,
-            'receipt_timestamp': float,
-            'bids': Tuple[Tuple[float, float], ...], # price, size
-            'asks': Tuple[Tuple[float, float], ...] # price, size
-        }
+    def _depth(cls, feature_params: Optional[Dict]) -> int:
+        if feature_params is None:
+            return cls.DEFAULT_DEPTH
+        return feature_params.get('depth', cls.DEFAULT_DEPTH)
 
     @classmethod
     def stream(cls, upstreams: Dict[Feature, Stream], feature_params: Dict) -> Tuple[Stream, _State]:
@@ -37,14 +62,14 @@ class L2SnapshotFD(FeatureDefinition):
         state = _State(
             timestamp=-1,
             receipt_timestamp=-1,
-            order_book=OrderBook(),
+            order_book=ArrayOrderBook(),
             data_inconsistencies={},
         )
         if feature_params is None:
             feature_params = {}
 
         # TODO dep_schema -> source
-        depth = feature_params.get('depth', cls.DEFAULT_DEPTH)
+        depth = cls._depth(feature_params)
         dep_schema = feature_params.get('dep_schema', None)
         sampling = feature_params.get('sampling', 'raw')
 
@@ -62,8 +87,6 @@ class L2SnapshotFD(FeatureDefinition):
             raise ValueError(f'Unsupported dep_schema: {dep_schema}')
 
         # TODO sampling and event construction should be abstracted out
-        # calling cls._state_snapshot(state, depth) on every event is very heavy,
-        # 300x slowdown (383.938503742218s vs 1.4724829196929932s for run_stream on 5Gb dataframe)
         if sampling == 'raw':
             return state, None if skip_event else cls._state_snapshot(state, depth)
         elif sampling == 'skip_all':
@@ -78,32 +101,35 @@ class L2SnapshotFD(FeatureDefinition):
 
     @classmethod
     def _state_snapshot(cls, state: _State, depth: int) -> Event:
-        bids = []
-        asks = []
+        bids = state.order_book.bids
+        asks = state.order_book.asks
         if depth == -1: # indicates full book
-            depth = min(len(state.order_book.bids), len(state.order_book.asks))
-        else:
-            depth = min(depth, min(len(state.order_book.bids), len(state.order_book.asks)))
-
-        for level in range(depth):
-            for side in ['bid', 'ask']:
-                if side == 'bid':
-                    orders = state.order_book.bids
-                else:
-                    orders = state.order_book.asks
-                price, size = None, None
-                if level < len(orders):
-                    price = orders.index(level)[0]
-                    size = orders[price]
-                if side == 'bid':
-                    bids.append((price, size))
-                else:
-                    asks.append((price, size))
-
-        bids = tuple(bids)
-        asks = tuple(asks)
-
-        return cls.construct_event(state.timestamp, state.receipt_timestamp, bids, asks)
+            depth = max(len(bids), len(asks))
+        bid_prices, bid_sizes = bids.top(depth)
+        ask_prices, ask_sizes = asks.top(depth)
+        bid_pad = [_NAN] * (depth - len(bid_prices))
+        ask_pad = [_NAN] * (depth - len(ask_prices))
+        values = [state.timestamp, state.receipt_timestamp] + bid_prices + bid_pad + bid_sizes + bid_pad + \
+            ask_prices + ask_pad + ask_sizes + ask_pad
+        return frozendict(zip(snapshot_columns(depth), values))
+
+    # (price, size) levels of a snapshot side ('bid' or 'ask'), best first
+    @classmethod
+    def snapshot_levels(cls, snap: Event, side: str) -> List[Tuple[float, float]]:
+        levels = []
+        i = 0
+        while f'{side}_px_{i}' in snap:
+            price = snap[f'{side}_px_{i}']
+            if price != price: # nan padding
+                break
+            levels.append((price, snap[f'{side}_sz_{i}']))
+            i += 1
+        return levels
+
+    # best (bid_price, ask_price) arrays for a df of snapshots produced by this definition
+    @classmethod
+    def top_of_book(cls, df: pd.DataFrame) -> Tuple[np.ndarray, np.ndarray]:
+        return df['bid_px_0'].to_numpy(dtype=np.float64), df['ask_px_0'].to_numpy(dtype=np.float64)
 
     # TODO test this
     @classmethod
@@ -0,0 +1,73 @@
+import math
+import random
+import unittest
+
+from streamz import Stream
+
+from featurizer.data_definitions.common.l2_book_incremental.cryptofeed.cryptofeed_l2_book_incremental import \
+    CryptofeedL2BookIncrementalData
+from featurizer.features.definitions.l2_book.l2_snapshot_fd.l2_snapshot_fd import L2SnapshotFD
+from featurizer.features.feature_tree.feature_tree import Feature
+
+
+def mock_cryptofeed_deltas(num_events: int, seed: int = 0):
+    rng = random.Random(seed)
+    events = []
+    prices = {'bid': set(), 'ask': set()}
+    for i in range(num_events):
+        delta = i > 0
+        orders = []
+        for _ in range(rng.randint(1, 5) if delta else 40):
+            side = rng.choice(['bid', 'ask'])
+            price = round(100 + rng.randint(1, 30) * 0.5, 2) if side == 'ask' else round(100 - rng.randint(0, 29) * 0.5, 2)
+            if delta and rng.random() < 0.3 and len(prices[side]) > 0:
+                price = rng.choice(sorted(prices[side]))
+                orders.append((side, price, 0.0))
+                prices[side].discard(price)
+            else:
+                orders.append((side, price, round(rng.uniform(0.1, 5), 3)))
+                prices[side].add(price)
+        events.append({'timestamp': float(i), 'receipt_timestamp': float(i), 'delta': delta, 'orders': orders})
+    return events
+
+
+class TestL2SnapshotFD(unittest.TestCase):
+
+    def test_snapshots(self):
+        depth = 10
+        data = Feature([], CryptofeedL2BookIncrementalData, {})
+        source = Stream()
+        stream, _ = L2SnapshotFD.stream({data: source}, {'dep_schema': 'cryptofeed', 'depth': depth})
+        res = []
+        stream.sink(res.append)
+
+        # reference book as plain dicts
+        book = {'bid': {}, 'ask': {}}
+        expected = []
+        for event in mock_cryptofeed_deltas(500):
+            if not event['delta']:
+                book = {'bid': {}, 'ask': {}}
+            for side, price, size in event['orders']:
+                if size == 0.0:
+                    book[side].pop(price, None)
+                else:
+                    book[side][price] = size
+            bids = sorted(book['bid'].items(), reverse=True)[:depth]
+            asks = sorted(book['ask'].items())[:depth]
+            expected.append((event['timestamp'], bids, asks))
+            source.emit(event)
+
+        assert len(res) == len(expected)
+        schema = L2SnapshotFD.event_schema({'dep_schema': 'cryptofeed', 'depth': depth})
+        for snap, (ts, bids, asks) in zip(res, expected):
+            assert snap['timestamp'] == ts
+            assert list(snap.keys()) == list(schema.keys())
+            assert L2SnapshotFD.snapshot_levels(snap, 'bid') == bids
+            assert L2SnapshotFD.snapshot_levels(snap, 'ask') == asks
+            if len(bids) < depth:
+                assert math.isnan(snap[f'bid_px_{len(bids)}'])
+
+
+if __name__ == '__main__':
+    t = TestL2SnapshotFD()
+    t.test_snapshots()
@@ -1,16 +1,83 @@
+from bisect import bisect_left
 from dataclasses import dataclass
-from typing import Dict, Optional, Tuple
-
-from order_book import OrderBook
+from typing import Dict, Optional, Tuple, List, Iterable
 
 from featurizer.data_definitions.data_definition import Event
 
 
+class BookSide:
+    # price levels are kept in sorted price/size lists with the best level last: most updates happen close to
+    # the top of the book, so inserts/deletes only shift a few elements and top-N levels is an O(N) slice.
+    # Asks are stored with negated prices to keep a single ascending order for both sides
+
+    def __init__(self, is_bid: bool):
+        self._sign = 1.0 if is_bid else -1.0
+        self.keys: List[float] = []
+        self.sizes: List[float] = []
+
+    def _find(self, price: float) -> Tuple[int, bool]:
+        key = self._sign * price
+        i = bisect_left(self.keys, key)
+        return i, i < len(self.keys) and self.keys[i] == key
+
+    def __len__(self) -> int:
+        return len(self.keys)
+
+    def __contains__(self, price: float) -> bool:
+        return self._find(price)[1]
+
+    def __getitem__(self, price: float) -> float:
+        i, found = self._find(price)
+        if not found:
+            raise KeyError(price)
+        return self.sizes[i]
+
+    def __setitem__(self, price: float, size: float):
+        i, found = self._find(price)
+        if found:
+            self.sizes[i] = size
+        else:
+            self.keys.insert(i, self._sign * price)
+            self.sizes.insert(i, size)
+
+    def __delitem__(self, price: float):
+        i, found = self._find(price)
+        if not found:
+            raise KeyError(price)
+        del self.keys[i]
+        del self.sizes[i]
+
+    # best-first prices and sizes of top depth levels
+    def top(self, depth: int) -> Tuple[List[float], List[float]]:
+        n = min(depth, len(self.keys))
+        if n <= 0:
+            return [], []
+        keys = self.keys[-1:-n - 1:-1]
+        sizes = self.sizes[-1:-n - 1:-1]
+        if self._sign < 0:
+            keys = [-k for k in keys]
+        return keys, sizes
+
+
+class ArrayOrderBook:
+
+    def __init__(self):
+        self.bids = BookSide(is_bid=True)
+        self.asks = BookSide(is_bid=False)
+
+    def __getitem__(self, side: str) -> BookSide:
+        if side == 'bid':
+            return self.bids
+        if side == 'ask':
+            return self.asks
+        raise ValueError(f'Unknown side: {side}')
+
+
 @dataclass
 class _State:
     timestamp: float
     receipt_timestamp: float
-    order_book: OrderBook
+    order_book: ArrayOrderBook
     data_inconsistencies: Dict
     depth: Optional[int] = None
     inited: bool = False
@@ -19,31 +86,59 @@ class _State:
 
 
 def cryptotick_update_state(state: _State, event: Event, depth: Optional[int] = None) -> Tuple[_State, bool]:
+    return cryptotick_apply_update(
+        state, event['timestamp'], event['receipt_timestamp'], event['update_type'], event['orders']
+    )
+
+
+# same as cryptotick_update_state for event i of offset-indexed events, skips building event dicts
+def cryptotick_update_state_from_arrays(
+    state: _State,
+    timestamps: List[float],
+    receipt_timestamps: List[float],
+    update_types: List[str],
+    offsets: List[int],
+    sides: List[str],
+    prices: List[float],
+    sizes: List[float],
+    i: int
+) -> Tuple[_State, bool]:
+    start, end = offsets[i], offsets[i + 1]
+    orders = zip(sides[start:end], prices[start:end], sizes[start:end])
+    return cryptotick_apply_update(state, timestamps[i], receipt_timestamps[i], update_types[i], orders)
+
+
+def cryptotick_apply_update(
+    state: _State,
+    timestamp: float,
+    receipt_timestamp: float,
+    update_type: str,
+    orders: Iterable[Tuple[str, float, float]]
+) -> Tuple[_State, bool]:
     # see https://www.cryptotick.com/Faq
-    update_type = event['update_type']
     if update_type != 'SNAPSHOT' and not state.inited:
         # bool indicates skip event
         return state, True
     if update_type == 'SNAPSHOT':
         # reset order book
         state.inited = True
-        state.order_book = OrderBook()
+        state.order_book = ArrayOrderBook()
         state.ob_count += 1
     if update_type == 'ADD' or update_type == 'SNAPSHOT':
-        for side, price, size in event['orders']:
+        for side, price, size in orders:
             if price in state.order_book[side]:
                 state.order_book[side][price] += size
             else:
                 state.order_book[side][price] = size
     elif update_type == 'SET':
-        for side, price, size in event['orders']:
+        for side, price, size in orders:
             state.order_book[side][price] = size
             if state.order_book[side][price] == 0.0:
                 del state.order_book[side][price]
     elif update_type == 'SUB':
         # TODO proper log data inconsistency
         no_keys_for_sub_event = 0
-        for side, price, size in event['orders']:
+        for side, price, size in orders:
             if price not in state.order_book[side]:
                 no_keys_for_sub_event += 1
             else:
@@ -57,8 +152,8 @@ def cryptotick_update_state(state: _State, event: Event, depth: Optional[int] =
     else:
         raise ValueError(f'Unknown update_type: {update_type}')
 
-    state.timestamp = event['timestamp']
-    state.receipt_timestamp = event['receipt_timestamp']
+    state.timestamp = timestamp
+    state.receipt_timestamp = receipt_timestamp
 
     return state, False
 
@@ -70,7 +165,7 @@ def cryptofeed_update_state(state: _State, event: Event, depth: Optional[int] =
     if not event['delta']:
         # reset order book
         state.inited = True
-        state.order_book = OrderBook()
+        state.order_book = ArrayOrderBook()
         state.ob_count += 1
     for side, price, size in event['orders']:
         if size == 0.0:
@@ -1,5 +1,7 @@
 from typing import List, Dict, Optional, Tuple, Type
 
+import numpy as np
+import pandas as pd
 from portion import IntervalDict, closed
 from streamz import Stream
 
@@ -45,12 +47,18 @@ class OHLCVFD(FeatureDefinition):
     def dep_upstream_schema(cls, dep_schema: str = Optional[None]) -> List[Type[DataDefinition]]:
         return [TradesData]
 
+    @classmethod
+    def dep_upstream_columns(cls, dep_definition: Type[DataDefinition]) -> Optional[List[str]]:
+        return ['side', 'amount', 'price']
+
     @classmethod
     def stream(cls, upstreams: Dict[Feature, Stream], feature_params: Dict) -> Stream:
         state = _State(last_ts=None, ohlcv=None)
         # TODO validate supported windows (only s, m, h)
         # TODO figure out default setting
-        window = feature_params.get('window', '1m')
+        window = '1m'
+        if feature_params is not None and 'window' in feature_params:
+            window = feature_params['window']
         update = functools.partial(cls._update_state, window=window)
         trades_upstream = toolz.first(upstreams.values())
         acc = trades_upstream.accumulate(update, returns_state=True, start=state)
@@ -69,7 +77,7 @@ class OHLCVFD(FeatureDefinition):
             # skip
             return state, None
 
-        side, amount, price, trade_id = event['side'], event['amount'], event['price'], event['trade_id']
+        side, amount, price = event['side'], event['amount'], event['price']
         if state.ohlcv is None:
             state.ohlcv = dict(zip(cls.event_schema().keys(), [timestamp, receipt_timestamp, price, price, price, price, 0, 0, 0]))
         if state.last_ts is None:
@@ -83,7 +91,7 @@ class OHLCVFD(FeatureDefinition):
             state.ohlcv['low'] = price
         state.ohlcv['vwap'] += price * amount
 
-        state.ohlcv['num_trades'] += len(event['trades'])
+        state.ohlcv['num_trades'] += 1
 
         # TODO fix here?
         if timestamp - state.last_ts > convert_str_to_seconds(window):
@@ -100,6 +108,70 @@ class OHLCVFD(FeatureDefinition):
         else:
             return state, None
 
+    @classmethod
+    def batch(cls, dep_dfs: Dict[Feature, pd.DataFrame], feature_params: Dict) -> pd.DataFrame:
+        trades = toolz.first(dep_dfs.values())
+        window = '1m'
+        if feature_params is not None and 'window' in feature_params:
+            window = feature_params['window']
+        window_s = convert_str_to_seconds(window)
+        columns = list(cls.event_schema().keys())
+        if len(trades) == 0:
+            return pd.DataFrame(columns=columns)
+
+        timestamps = trades['timestamp'].to_numpy(dtype=np.float64)
+        # same as in stream(): skip events before window-based starting point
+        start_ts = get_sampling_bucket_ts(timestamps[0], window, return_bucket_start=False)
+        first = int(np.searchsorted(timestamps, start_ts, side='left'))
+
+        # bar is closed by the first event which is more than window_s away from previous closing event
+        # (or from the first event for the first bar), closing event is included in the bar
+        next_close = cls._next_beyond_window(timestamps, window_s)
+        bar_ends = []
+        i = first
+        while i < len(timestamps):
+            i = next_close[i]
+            if i < len(timestamps):
+                bar_ends.append(i)
+        if len(bar_ends) == 0:
+            return pd.DataFrame(columns=columns)
+
+        bar_ends = np.array(bar_ends, dtype=np.int64)
+        bar_starts = np.concatenate(([first], bar_ends[:-1] + 1))
+        offsets = bar_starts - first
+        prices = trades['price'].to_numpy(dtype=np.float64)
+        amounts = trades['amount'].to_numpy(dtype=np.float64)
+        bar_prices = prices[first: bar_ends[-1] + 1]
+        bar_amounts = amounts[first: bar_ends[-1] + 1]
+        volume = np.add.reduceat(bar_amounts, offsets)
+        return pd.DataFrame({
+            'timestamp': timestamps[bar_starts],
+            'receipt_timestamp': trades['receipt_timestamp'].to_numpy()[bar_starts],
+            'open': prices[bar_starts],
+            'high': np.maximum.reduceat(bar_prices, offsets),
+            'low': np.minimum.reduceat(bar_prices, offsets),
+            'close': prices[bar_ends],
+            'volume': volume,
+            'vwap': np.add.reduceat(bar_prices * bar_amounts, offsets) / volume,
+            'num_trades': bar_ends - bar_starts + 1
+        })
+
+    # for each event i returns index of the first event k such that ts[k] - ts[i] > window_s (len(ts) if none)
+    @classmethod
+    def _next_beyond_window(cls, timestamps: np.ndarray, window_s: float) -> np.ndarray:
+        n = len(timestamps)
+        idx = np.arange(n)
+        res = np.searchsorted(timestamps, timestamps + window_s, side='right')
+        # adjust for float rounding so the predicate is exactly the one used in stream()
+        while True:
+            prev = np.maximum(res - 1, 0)
+            move_left = (res - 1 > idx) & (timestamps[prev] - timestamps > window_s)
+            nxt = np.minimum(res, n - 1)
+            move_right = (res < n) & ~(timestamps[nxt] - timestamps > window_s)
+            if not move_left.any() and not move_right.any():
+                return res
+            res = res - move_left + move_right
+
     # TODO write tests and fix this, this is wrong
     @classmethod
     def group_dep_ranges(
@@ -1,11 +1,13 @@
 from typing import List, Type, Dict, Optional
+
+import pandas as pd
 from streamz import Stream
 from featurizer.features.definitions.feature_definition import FeatureDefinition
 from featurizer.data_definitions.data_definition import DataDefinition, EventSchema
 from featurizer.features.definitions.l2_book.l2_snapshot_fd.l2_snapshot_fd import L2SnapshotFD
 from featurizer.features.feature_tree.feature_tree import Feature
 from featurizer.blocks.blocks import BlockMeta, identity_grouping
-from portion import IntervalDict
+from featurizer.blocks.interval_index import IntervalIndex
 import toolz
 
 
@@ -26,19 +28,34 @@ class MidPriceFD(FeatureDefinition):
             lambda snap: cls.construct_event(
                 snap['timestamp'],
                 snap['receipt_timestamp'],
-                (snap['bids'][0][0] + snap['asks'][0][0]) / 2,
+                (snap['bid_px_0'] + snap['ask_px_0']) / 2,
             )
         )
 
+    @classmethod
+    def batch(cls, dep_dfs: Dict[Feature, pd.DataFrame], feature_params: Dict) -> pd.DataFrame:
+        snaps = toolz.first(dep_dfs.values())
+        best_bids, best_asks = L2SnapshotFD.top_of_book(snaps)
+        return pd.DataFrame({
+            'timestamp': snaps['timestamp'].to_numpy(),
+            'receipt_timestamp': snaps['receipt_timestamp'].to_numpy(),
+            'mid_price': (best_bids + best_asks) / 2
+        })
+
     @classmethod
     def dep_upstream_schema(cls, dep_schema: str = Optional[None]) -> List[Type[DataDefinition]]:
         return [L2SnapshotFD]
 
+    # top of book only
+    @classmethod
+    def dep_upstream_columns(cls, dep_definition: Type[DataDefinition]) -> Optional[List[str]]:
+        return ['bid_px_0', 'ask_px_0']
+
     @classmethod
     def group_dep_ranges(
         cls,
         feature: Feature,
         dep_ranges: Dict[Feature, List[BlockMeta]]
-    ) -> IntervalDict:
+    ) -> IntervalIndex:
         ranges = list(dep_ranges.values())[0]
         return identity_grouping(ranges)
@@ -1,6 +1,8 @@
 from typing import List, Dict, Optional, Type
 
-from portion import IntervalDict
+import numpy as np
+import pandas as pd
+from featurizer.blocks.interval_index import IntervalIndex
 from streamz import Stream
 
 from featurizer.blocks.blocks import BlockMeta, identity_grouping
@@ -29,18 +31,33 @@ class RelativeBidAskSpreadFD(FeatureDefinition):
         return mid_price_upstream.map(lambda snap: cls.construct_event(
             snap['timestamp'],
             snap['receipt_timestamp'],
-            2 * math.fabs((snap['bids'][0][0] - snap['asks'][0][0]))/(snap['bids'][0][0] + snap['asks'][0][0])
+            2 * math.fabs((snap['bid_px_0'] - snap['ask_px_0']))/(snap['bid_px_0'] + snap['ask_px_0'])
         ))
 
+    @classmethod
+    def batch(cls, dep_dfs: Dict[Feature, pd.DataFrame], feature_params: Dict) -> pd.DataFrame:
+        snaps = toolz.first(dep_dfs.values())
+        best_bids, best_asks = L2SnapshotFD.top_of_book(snaps)
+        return pd.DataFrame({
+            'timestamp': snaps['timestamp'].to_numpy(),
+            'receipt_timestamp': snaps['receipt_timestamp'].to_numpy(),
+            'spread': 2 * np.abs(best_bids - best_asks) / (best_bids + best_asks)
+        })
+
     @classmethod
     def dep_upstream_schema(cls, dep_schema: str = Optional[None]) -> List[Type[DataDefinition]]:
         return [L2SnapshotFD]
 
+    # top of book only
+    @classmethod
+    def dep_upstream_columns(cls, dep_definition: Type[DataDefinition]) -> Optional[List[str]]:
+        return ['bid_px_0', 'ask_px_0']
+
     @classmethod
     def group_dep_ranges(
         cls,
         feature: Feature,
         dep_ranges: Dict[Feature, List[BlockMeta]]
-    ) -> IntervalDict:
+    ) -> IntervalIndex:
         ranges = list(dep_ranges.values())[0]
         return identity_grouping(ranges)
@@ -0,0 +1,100 @@
+import unittest
+from typing import Dict, Type, Optional
+
+import numpy as np
+import pandas as pd
+
+from featurizer.data_definitions.common.trades.trades import TradesData
+from featurizer.features.definitions.feature_definition import FeatureDefinition
+from featurizer.features.definitions.l2_book.l2_snapshot_fd.l2_snapshot_fd import L2SnapshotFD
+from featurizer.features.definitions.ohlcv.ohlcv_fd.ohlcv_fd import OHLCVFD
+from featurizer.features.definitions.price.mid_price_fd.mid_price_fd import MidPriceFD
+from featurizer.features.definitions.spread.relative_bid_ask_spread_fd.relative_bid_ask_spread_fd import \
+    RelativeBidAskSpreadFD
+from featurizer.features.definitions.transforms.diff.diff import Diff
+from featurizer.features.definitions.tvi.trade_volume_imb_fd.trade_volume_imb_fd import TradeVolumeImbFD
+from featurizer.features.definitions.volatility.volatility_stddev_fd.volatility_stddev_fd import VolatilityStddevFD
+from featurizer.features.feature_tree.feature_tree import Feature
+from featurizer.featurizer_utils.featurizer_utils import run_feature_stream, run_feature_batch
+
+
+def mock_timestamps(num_events: int, seed: int) -> np.ndarray:
+    rng = np.random.default_rng(seed)
+    # bursts of equal timestamps and gaps longer than default windows
+    deltas = rng.choice([0.0, 0.05, 0.5, 1.3, 7.0, 70.0], size=num_events, p=[0.15, 0.3, 0.3, 0.15, 0.08, 0.02])
+    return np.round(1675209600.0 + np.cumsum(deltas), 3)
+
+
+def mock_l2_snapshots(num_events: int, seed: int = 1) -> pd.DataFrame:
+    rng = np.random.default_rng(seed)
+    timestamps = mock_timestamps(num_events, seed)
+    mid = 1000 + np.cumsum(rng.normal(0, 0.5, size=num_events))
+    half_spread = rng.uniform(0.01, 0.5, size=num_events)
+    return pd.DataFrame({
+        'timestamp': timestamps,
+        'receipt_timestamp': timestamps + 0.001,
+        'bid_px_0': np.round(mid - half_spread, 2),
+        'bid_px_1': np.round(mid - half_spread - 0.1, 2),
+        'bid_sz_0': 1.0,
+        'bid_sz_1': 2.0,
+        'ask_px_0': np.round(mid + half_spread, 2),
+        'ask_px_1': np.round(mid + half_spread + 0.1, 2),
+        'ask_sz_0': 1.5,
+        'ask_sz_1': 2.5,
+    })
+
+
+def mock_trades(num_events: int, seed: int = 2) -> pd.DataFrame:
+    rng = np.random.default_rng(seed)
+    timestamps = mock_timestamps(num_events, seed)
+    return pd.DataFrame({
+        'timestamp': timestamps,
+        'receipt_timestamp': timestamps + 0.001,
+        'side': rng.choice(['BUY', 'SELL'], size=num_events, p=[0.7, 0.3]),
+        'amount': np.round(rng.uniform(0.1, 10, size=num_events), 3),
+        'price': np.round(1000 + np.cumsum(rng.normal(0, 0.5, size=num_events)), 2),
+        'id': [str(i) for i in range(num_events)],
+        'trade_id': [str(i) for i in range(num_events)]
+    })
+
+
+class TestFeatureDefinitionsBatch(unittest.TestCase):
+
+    def _assert_parity(self, fd: Type[FeatureDefinition], dep: Feature, dep_blocks, params: Optional[Dict]):
+        assert fd.has_batch()
+        feature = Feature([dep], fd, params)
+        deps = {dep: dep_blocks}
+        streamed = run_feature_stream(feature, deps)
+        batched = run_feature_batch(feature, deps)
+        assert len(streamed) > 0
+        assert list(streamed.columns) == list(batched.columns)
+        pd.testing.assert_frame_equal(streamed, batched, check_dtype=False, rtol=1e-9, atol=1e-9)
+
+    def test_l2_snapshot_based(self):
+        snaps = mock_l2_snapshots(3000)
+        snap_blocks = [snaps.iloc[:1000].reset_index(drop=True), snaps.iloc[1000:].reset_index(drop=True)]
+        l2_snapshot = Feature([], L2SnapshotFD, {})
+        self._assert_parity(MidPriceFD, l2_snapshot, snap_blocks, {})
+        self._assert_parity(RelativeBidAskSpreadFD, l2_snapshot, snap_blocks, {})
+
+        mid_price = Feature([l2_snapshot], MidPriceFD, {})
+        mid_prices = MidPriceFD.batch({l2_snapshot: snaps}, {})
+        for window in ['1s', '1m']:
+            self._assert_parity(VolatilityStddevFD, mid_price, [mid_prices], {'window': window})
+            self._assert_parity(Diff, mid_price, [mid_prices], {'window': window})
+
+    def test_trades_based(self):
+        trades = mock_trades(5000)
+        trades_data = Feature([], TradesData, {})
+        trades_blocks = [trades.iloc[:2500].reset_index(drop=True), trades.iloc[2500:].reset_index(drop=True)]
+        # None params fall back to defaults
+        for params in [{'window': '1m'}, {'window': '10s', 'sampling': '1m'}, None]:
+            self._assert_parity(TradeVolumeImbFD, trades_data, trades_blocks, params)
+        for params in [{'window': '1m'}, {'window': '5s'}, None]:
+            self._assert_parity(OHLCVFD, trades_data, trades_blocks, params)
+
+
+if __name__ == '__main__':
+    t = TestFeatureDefinitionsBatch()
+    t.test_l2_snapshot_based()
+    t.test_trades_based()
@@ -1,10 +1,11 @@
 from typing import Optional, List, Type, Dict, Deque
 
+import pandas as pd
 import toolz
-from portion import IntervalDict
+from featurizer.blocks.interval_index import IntervalIndex
 from streamz import Stream
 
-from common.streamz.stream_utils import lookback_apply
+from common.streamz.stream_utils import lookback_apply, lookback_window_starts
 from featurizer.blocks.blocks import BlockMeta, windowed_grouping
 from featurizer.data_definitions.data_definition import EventSchema, DataDefinition, Event
 from featurizer.features.definitions.feature_definition import FeatureDefinition
@@ -25,6 +26,11 @@ class Diff(FeatureDefinition):
     def dep_upstream_schema(cls, dep_schema: str = Optional[None]) -> List[Type[DataDefinition]]:
         return [FeatureDefinition]
 
+    # single value column of the dependency
+    @classmethod
+    def dep_upstream_columns(cls, dep_definition: Type[DataDefinition]) -> Optional[List[str]]:
+        return [c for c in dep_definition.event_schema() if c not in ['timestamp', 'receipt_timestamp']]
+
     @classmethod
     def stream(cls, upstreams: Dict[Feature, Stream], feature_params: Dict) -> Stream:
         upstream = toolz.first(upstreams.values())
@@ -34,12 +40,30 @@ class Diff(FeatureDefinition):
         # TODO sampling
         return lookback_apply(upstream, window, cls._diff_percent)
 
+    @classmethod
+    def batch(cls, dep_dfs: Dict[Feature, pd.DataFrame], feature_params: Dict) -> pd.DataFrame:
+        df = toolz.first(dep_dfs.values())
+        window = '1m' # TODO figure out default setting
+        if feature_params is not None and 'window' in feature_params:
+            window = feature_params['window']
+        keys = [c for c in df.columns if c not in ['timestamp', 'receipt_timestamp']]
+        if len(keys) != 1:
+            raise ValueError(f'Dependent feature element schema contain multiple values, should be 1')
+        timestamps = df['timestamp'].to_numpy()
+        values = df[keys[0]].to_numpy()
+        first_values = values[lookback_window_starts(timestamps, window)]
+        return pd.DataFrame({
+            'timestamp': timestamps,
+            'receipt_timestamp': df['receipt_timestamp'].to_numpy(),
+            'val': (values - first_values) / first_values
+        })
+
     @classmethod
     def group_dep_ranges(
         cls,
         feature: Feature,
         dep_ranges: Dict[Feature, List[BlockMeta]]
-    ) -> IntervalDict:
+    ) -> IntervalIndex:
         ranges = list(dep_ranges.values())[0]
         window = '1m'  # TODO figure out default setting
         if feature.params is not None and 'window' in feature.params:
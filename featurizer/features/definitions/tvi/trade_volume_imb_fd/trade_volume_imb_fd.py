@@ -1,9 +1,11 @@
 import functools
 from collections import deque
-from dataclasses import dataclass
-from typing import List, Dict, Optional, Type, Tuple
+from dataclasses import dataclass, field
+from typing import List, Dict, Optional, Type, Tuple, Deque
 
-from portion import IntervalDict
+import numpy as np
+import pandas as pd
+from featurizer.blocks.interval_index import IntervalIndex
 from streamz import Stream
 import common.streamz.stream_utils as su
 
@@ -15,15 +17,15 @@ from featurizer.features.feature_tree.feature_tree import Feature
 
 import toolz
 
-from common.time.utils import convert_str_to_seconds, get_sampling_bucket_ts
+from common.time.utils import convert_str_to_seconds, get_sampling_bucket_ts, get_sampling_buckets_ts
 
 
 @dataclass
 class _State:
-    last_sampling_bucket_ts = -1
-    queue = deque()
-    sell_vol = 0
-    buy_vol = 0
+    last_sampling_bucket_ts: float = -1
+    queue: Deque = field(default_factory=deque)
+    sell_vol: float = 0
+    buy_vol: float = 0
 
 
 class TradeVolumeImbFD(FeatureDefinition):
@@ -43,23 +45,74 @@ class TradeVolumeImbFD(FeatureDefinition):
         window = '1m'  # TODO figure out default setting
         if feature_params is not None and 'window' in feature_params:
             window = feature_params['window']
-        sampling = feature_params.get('sampling', 'raw')
+        sampling = 'raw'
+        if feature_params is not None and 'sampling' in feature_params:
+            sampling = feature_params['sampling']
         state = _State()
         window_s = convert_str_to_seconds(window)
         update = functools.partial(cls._update_state, sampling=sampling, window_s=window_s)
         acc = trades_upstream.accumulate(update, returns_state=True, start=state)
         return su.filter_none(acc).unique(maxsize=1)
 
+    @classmethod
+    def batch(cls, dep_dfs: Dict[Feature, pd.DataFrame], feature_params: Dict) -> pd.DataFrame:
+        trades = toolz.first(dep_dfs.values())
+        window = '1m'  # TODO figure out default setting
+        if feature_params is not None and 'window' in feature_params:
+            window = feature_params['window']
+        sampling = 'raw'
+        if feature_params is not None and 'sampling' in feature_params:
+            sampling = feature_params['sampling']
+
+        timestamps = trades['timestamp'].to_numpy(dtype=np.float64)
+        receipt_timestamps = trades['receipt_timestamp'].to_numpy(dtype=np.float64)
+        vols = trades['price'].to_numpy(dtype=np.float64) * trades['amount'].to_numpy(dtype=np.float64)
+        is_buy = (trades['side'] == 'BUY').to_numpy()
+        buy_sums = np.concatenate(([0.0], np.cumsum(np.where(is_buy, vols, 0.0))))
+        sell_sums = np.concatenate(([0.0], np.cumsum(np.where(is_buy, 0.0, vols))))
+        starts = su.lookback_window_starts(timestamps, window)
+        ends = np.arange(1, len(timestamps) + 1)
+        buy_vols = buy_sums[ends] - buy_sums[starts]
+        sell_vols = sell_sums[ends] - sell_sums[starts]
+        with np.errstate(divide='ignore', invalid='ignore'):
+            tvi = 2 * (buy_vols - sell_vols) / (buy_vols + sell_vols)
+
+        if sampling == 'raw':
+            dt_ts = np.full(len(timestamps), -1.0)
+            mask = np.ones(len(timestamps), dtype=bool)
+        else:
+            # first event in each sampling bucket
+            dt_ts = get_sampling_buckets_ts(timestamps, sampling)
+            mask = np.concatenate(([True], dt_ts[1:] != dt_ts[:-1])) if len(dt_ts) > 0 else np.empty(0, dtype=bool)
+
+        res = pd.DataFrame({
+            'timestamp': timestamps[mask],
+            'receipt_timestamp': receipt_timestamps[mask],
+            'tvi': tvi[mask],
+            'dt_ts': dt_ts[mask],
+        })
+
+        # same as unique(maxsize=1) in stream(): drop rows equal to the previous one
+        if len(res) > 1:
+            values = res.to_numpy()
+            dup = np.concatenate(([False], (values[1:] == values[:-1]).all(axis=1)))
+            res = res[~dup].reset_index(drop=True)
+        return res
+
     @classmethod
     def dep_upstream_schema(cls, dep_schema: str = Optional[None]) -> List[Type[DataDefinition]]:
         return [TradesData]
 
+    @classmethod
+    def dep_upstream_columns(cls, dep_definition: Type[DataDefinition]) -> Optional[List[str]]:
+        return ['side', 'amount', 'price']
+
     @classmethod
     def group_dep_ranges(
         cls,
         feature: Feature,
         dep_ranges: Dict[Feature, List[BlockMeta]]
-    ) -> IntervalDict:
+    ) -> IntervalIndex:
         ranges = list(dep_ranges.values())[0]
         window = '1m'  # TODO figure out default setting
         if feature.params is not None and 'window' in feature.params:
@@ -1,15 +1,25 @@
 from typing import List, Dict, Type, Deque, Optional
+
+import pandas as pd
 from streamz import Stream
 from featurizer.features.definitions.feature_definition import FeatureDefinition
 from featurizer.data_definitions.data_definition import DataDefinition, Event, EventSchema
 from featurizer.features.definitions.price.mid_price_fd.mid_price_fd import MidPriceFD
 from featurizer.features.feature_tree.feature_tree import Feature
 from featurizer.blocks.blocks import BlockMeta, windowed_grouping
-from common.streamz.stream_utils import lookback_apply
-from portion import IntervalDict
+from common.streamz.stream_utils import lookback_apply, lookback_window_starts
+from featurizer.blocks.interval_index import IntervalIndex
 
 import numpy as np
 import toolz
+from pandas.api.indexers import BaseIndexer
+
+
+# rolling window bounds for batch mode, same windows as lookback_apply in stream mode
+class _LookbackIndexer(BaseIndexer):
+
+    def get_window_bounds(self, num_values=0, min_periods=None, center=None, closed=None, step=None):
+        return self.starts.astype(np.int64), np.arange(1, num_values + 1, dtype=np.int64)
 
 
 class VolatilityStddevFD(FeatureDefinition):
@@ -26,6 +36,10 @@ class VolatilityStddevFD(FeatureDefinition):
     def dep_upstream_schema(cls, dep_schema: str = Optional[None]) -> List[Type[DataDefinition]]:
         return [MidPriceFD]
 
+    @classmethod
+    def dep_upstream_columns(cls, dep_definition: Type[DataDefinition]) -> Optional[List[str]]:
+        return ['mid_price']
+
     @classmethod
     def stream(cls, upstreams: Dict[Feature, Stream], feature_params: Dict) -> Stream:
         mid_price_upstream = toolz.first(upstreams.values())
@@ -36,12 +50,29 @@ class VolatilityStddevFD(FeatureDefinition):
         # TODO sampling
         return lookback_apply(mid_price_upstream, window, cls._prices_to_volatility)
 
+    @classmethod
+    def batch(cls, dep_dfs: Dict[Feature, pd.DataFrame], feature_params: Dict) -> pd.DataFrame:
+        mid_prices = toolz.first(dep_dfs.values())
+        window = '1m' # TODO figure out default setting
+        if feature_params is not None and 'window' in feature_params:
+            window = feature_params['window']
+        timestamps = mid_prices['timestamp'].to_numpy(dtype=np.float64)
+        prices = mid_prices['mid_price'].to_numpy(dtype=np.float64)
+        starts = lookback_window_starts(timestamps, window)
+        # pandas rolling var is an online (add/remove) algorithm, numerically stable for long series
+        volatility = pd.Series(prices).rolling(_LookbackIndexer(starts=starts), min_periods=1).std(ddof=0).to_numpy()
+        return pd.DataFrame({
+            'timestamp': timestamps,
+            'receipt_timestamp': mid_prices['receipt_timestamp'].to_numpy(),
+            'volatility': volatility
+        })
+
     @classmethod
     def group_dep_ranges(
         cls,
         feature: Feature,
         dep_ranges: Dict[Feature, List[BlockMeta]]
-    ) -> IntervalDict:
+    ) -> IntervalIndex:
         ranges = list(dep_ranges.values())[0]
         window = '1m'  # TODO figure out default setting
         if feature.params is not None and 'window' in feature.params:
@@ -52,5 +83,5 @@ class VolatilityStddevFD(FeatureDefinition):
     def _prices_to_volatility(cls, prices: Deque) -> Event:
         last_price = prices[-1]
         p = [price['mid_price'] for price in prices]
-        stddev = float(np.std(p, dtype=np.float32))
+        stddev = float(np.std(p))
         return cls.construct_event(last_price['timestamp'], last_price['receipt_timestamp'], stddev)
@@ -286,6 +286,28 @@ def postorder(node: Feature, callback: Callable):
     callback(node)
 
 
+# Columns each dependency in the trees of given features is read with: union of columns its parents
+# declare via dep_upstream_columns, None if any parent needs all columns. Given features themselves
+# are outputs, so they always get all columns
+def upstream_columns(features: List[Feature]) -> Dict[Feature, Optional[List[str]]]:
+    res = {feature: None for feature in features}
+
+    def callback(node: Feature):
+        for child in node.children:
+            cols = node.data_definition.dep_upstream_columns(child.data_definition)
+            if child not in res:
+                res[child] = None if cols is None else ['timestamp', 'receipt_timestamp'] + list(cols)
+            elif res[child] is not None:
+                if cols is None:
+                    res[child] = None
+                else:
+                    res[child] += [c for c in cols if c not in res[child]]
+
+    for feature in features:
+        postorder(feature, callback)
+    return res
+
+
 def inorder(node: Feature, callback: Callable):
     if node.children is None or len(node.children) == 0:
         callback(node)
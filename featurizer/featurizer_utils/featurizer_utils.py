@@ -1,38 +1,123 @@
-import heapq
-import time
-from typing import Dict, List, Tuple
+from typing import Dict, List, Tuple, Iterator, Optional
 
-from featurizer.blocks.blocks import BlockRange
-from featurizer.data_definitions.data_definition import Event, df_to_events
+import numpy as np
+import pandas as pd
+from portion import Interval
+from streamz import Stream
+
+from featurizer.blocks.blocks import BlockRange, Block
+from featurizer.data_definitions.data_definition import Event
 from featurizer.features.feature_tree.feature_tree import Feature
+from common.pandas.df_utils import is_ts_sorted, concat
+from common.streamz.stream_utils import run_named_events_stream
+
+MERGE_ITER_CHUNK_SIZE = 64 * 1024
+
+
+# computes global ordering of rows for a list of ts-sorted timestamp columns
+# returns (source_ids, row_ids), where source_ids[i] is the position of the column in the input list and
+# row_ids[i] is the row position inside that column.
+# Ties are resolved by source position first and row position second, which is the same
+# ordering repeated heapq.merge over the same sources produces
+def merge_order(timestamps: List[np.ndarray]) -> Tuple[np.ndarray, np.ndarray]:
+    lens = np.fromiter((len(ts) for ts in timestamps), dtype=np.int64, count=len(timestamps))
+    if lens.sum() == 0:
+        return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64)
+    source_ids = np.repeat(np.arange(len(timestamps), dtype=np.int64), lens)
+    offsets = np.concatenate(([0], np.cumsum(lens)[:-1]))
+    concated = np.concatenate(timestamps)
+
+    # stable sort keeps source/row order for equal timestamps, concatenated sorted runs are detected by timsort
+    order = np.argsort(concated, kind='stable')
+    sorted_source_ids = source_ids[order]
+    row_ids = order - offsets[sorted_source_ids]
+    return sorted_source_ids, row_ids
+
+
+class _LazyBlockRows:
+    # converts block columns to Python lists only when the first row of the block is requested
+
+    def __init__(self, block: Block):
+        self.block = block
+        self.columns = None
+        self.values = None
+
+    def row(self, i: int) -> Event:
+        if self.values is None:
+            self.columns = list(self.block.columns)
+            self.values = [self.block[c].tolist() for c in self.columns]
+        return {c: v[i] for c, v in zip(self.columns, self.values)}
 
 
-# TODO util this
 # TODO we assume no 'holes' here
-# TODO use merge_ordered
-# TODO this is slow
 def merge_blocks(
     blocks: Dict[Feature, BlockRange]
-) -> List[Tuple[Feature, Event]]:
-    # TODO if only one feature, map directly
-    merged = None
-    features = list(blocks.keys())
-    for i in range(0, len(features)):
-        feature = features[i]
-        block_range = blocks[feature]
-        named_events = []
-        for block in block_range:
-            t = time.time()
-            events = df_to_events(block)
-            named = []
-            for e in events:
-                named.append((feature, e))
-            named_events = list(heapq.merge(named_events, named, key=lambda named_event: named_event[1]['timestamp']))
-
-        if i == 0:
-            merged = named_events
-        else:
-            # TODO explore heapdict
-            merged = list(heapq.merge(merged, named_events, key=lambda named_event: named_event[1]['timestamp']))
-
-    return merged
\ No newline at end of file
+) -> Iterator[Tuple[Feature, Event]]:
+    features = []
+    flat_blocks = []
+    for feature in blocks:
+        for block in blocks[feature]:
+            if not is_ts_sorted(block):
+                raise ValueError('Unable to parse df with unsorted timestamps')
+            features.append(feature)
+            flat_blocks.append(block)
+
+    source_ids, row_ids = merge_order([block['timestamp'].to_numpy() for block in flat_blocks])
+    return _iter_named_events(features, flat_blocks, source_ids, row_ids)
+
+
+def _iter_named_events(
+    features: List[Feature],
+    blocks: List[Block],
+    source_ids: np.ndarray,
+    row_ids: np.ndarray
+) -> Iterator[Tuple[Feature, Event]]:
+    rows = [_LazyBlockRows(block) for block in blocks]
+    # convert order arrays in chunks so we don't hold Python ints for the whole range at once
+    for start in range(0, len(source_ids), MERGE_ITER_CHUNK_SIZE):
+        end = start + MERGE_ITER_CHUNK_SIZE
+        for source_id, row_id in zip(source_ids[start:end].tolist(), row_ids[start:end].tolist()):
+            yield features[source_id], rows[source_id].row(row_id)
+
+
+# event-by-event execution: merges dep blocks and pushes events through feature stream graph
+def run_feature_stream(
+    feature: Feature,
+    deps: Dict[Feature, BlockRange],
+    interval: Optional[Interval] = None
+) -> pd.DataFrame:
+    merged = merge_blocks(deps)
+    upstreams = {dep_feature: Stream() for dep_feature in deps.keys()}
+
+    # TODO unify feature_definition.stream return type
+    s = feature.data_definition.stream(upstreams, feature.params)
+    if isinstance(s, Tuple):
+        out_stream = s[0]
+    else:
+        out_stream = s
+    return run_named_events_stream(merged, upstreams, out_stream, interval)
+
+
+# vectorized execution: each dep is passed to FeatureDefinition.batch as a single ts-sorted df
+def run_feature_batch(
+    feature: Feature,
+    deps: Dict[Feature, BlockRange],
+    interval: Optional[Interval] = None
+) -> pd.DataFrame:
+    dep_dfs = {}
+    for dep_feature in deps:
+        for block in deps[dep_feature]:
+            if not is_ts_sorted(block):
+                raise ValueError('Unable to parse df with unsorted timestamps')
+        dep_df = concat(deps[dep_feature]) if len(deps[dep_feature]) > 0 else pd.DataFrame(columns=['timestamp'])
+        if not is_ts_sorted(dep_df):
+            # same order merge_blocks produces for overlapping blocks
+            dep_df = dep_df.sort_values('timestamp', kind='stable', ignore_index=True)
+        dep_dfs[dep_feature] = dep_df
+
+    df = feature.data_definition.batch(dep_dfs, feature.params)
+    if interval is not None and len(df) > 0:
+        ts = df['timestamp']
+        df = df[(ts >= interval.lower) & (ts <= interval.upper)]
+    return df.reset_index(drop=True)
+
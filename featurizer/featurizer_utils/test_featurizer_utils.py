@@ -0,0 +1,47 @@
+import heapq
+import unittest
+
+from featurizer.data_definitions.data_definition import df_to_events
+from featurizer.features.definitions.feature_definition import FeatureDefinition
+from featurizer.features.feature_tree.feature_tree import Feature
+from featurizer.featurizer_utils.featurizer_utils import merge_blocks
+from featurizer.featurizer_utils.testing_utils import mock_ts_df
+
+
+class TestFeaturizerUtils(unittest.TestCase):
+
+    def test_merge_blocks(self):
+        feature_a = Feature([], FeatureDefinition, {'name': 'a'})
+        feature_b = Feature([], FeatureDefinition, {'name': 'b'})
+        blocks = {
+            feature_a: [
+                mock_ts_df([1, 3, 3, 5], 'a', ['a0', 'a1', 'a2', 'a3']),
+                mock_ts_df([5, 6, 9], 'a', ['a4', 'a5', 'a6']),
+            ],
+            feature_b: [
+                mock_ts_df([0, 3, 5], 'b', ['b0', 'b1', 'b2']),
+                mock_ts_df([7, 9, 9, 10], 'b', ['b3', 'b4', 'b5', 'b6']),
+            ]
+        }
+
+        # reference implementation: repeated heapq.merge of per-block events
+        expected = []
+        for feature in blocks:
+            named_events = []
+            for block in blocks[feature]:
+                named = [(feature, e) for e in df_to_events(block)]
+                named_events = list(heapq.merge(named_events, named, key=lambda named_event: named_event[1]['timestamp']))
+            expected = list(heapq.merge(expected, named_events, key=lambda named_event: named_event[1]['timestamp']))
+
+        merged = list(merge_blocks(blocks))
+        assert merged == expected
+
+    def test_merge_blocks_empty(self):
+        feature = Feature([], FeatureDefinition, {})
+        assert list(merge_blocks({feature: []})) == []
+
+
+if __name__ == '__main__':
+    t = TestFeaturizerUtils()
+    t.test_merge_blocks()
+    t.test_merge_blocks_empty()
@@ -1,11 +1,15 @@
+from collections import OrderedDict
 from typing import Dict, List, Tuple, Optional
 
+import numpy as np
 import pandas as pd
 import ray
 
 from common.s3.s3_utils import load_dfs_s3
 from featurizer.blocks.blocks import BlockRangeMeta, BlockRange, mock_meta
 from featurizer.data_definitions.common.l2_book_incremental.cryptofeed.cryptofeed_l2_book_incremental import CryptofeedL2BookIncrementalData
+from featurizer.data_definitions.common.l2_book_incremental.cryptotick.cryptotick_l2_book_incremental import \
+    CryptotickL2BookIncrementalData
 from featurizer.data_definitions.common.trades.trades import TradesData
 from featurizer.features.definitions.feature_definition import FeatureDefinition
 from featurizer.features.feature_tree.feature_tree import Feature
@@ -118,3 +122,48 @@ def mock_l2_book_delta_data_and_meta() -> Tuple[Dict[Feature, BlockRange], Dict[
     data_params = {} # TODO mock
     data = Feature([], CryptofeedL2BookIncrementalData, data_params)
     return {data: block_range}, {data: block_range_meta}
+
+
+# synthetic processed cryptotick l2_inc df (see preprocess_l2_inc_df): snapshot followed by small ADD/SET/SUB groups,
+# some timestamps are shared between update types
+def mock_processed_l2_inc_df(num_rows: int, seed: int = 0, snapshot_size: int = 1000) -> pd.DataFrame:
+    rng = np.random.default_rng(seed)
+    num_updates = num_rows - snapshot_size
+    ts_deltas = rng.choice([0.0, 0.001, 0.01, 0.1], size=num_updates, p=[0.6, 0.2, 0.15, 0.05])
+    update_ts = 1675209600.0 + 1.0 + np.cumsum(ts_deltas)
+    timestamps = np.concatenate((np.full(snapshot_size, 1675209600.0), update_ts))
+    update_types = np.concatenate((
+        np.full(snapshot_size, 'SNAPSHOT', dtype=object),
+        rng.choice(np.array(['ADD', 'SET', 'SUB'], dtype=object), size=num_updates)
+    ))
+    sides = rng.choice(np.array(['bid', 'ask'], dtype=object), size=num_rows)
+    offsets = rng.integers(0, 500, size=num_rows) * 0.01
+    prices = np.round(np.where(sides == 'bid', 23000.0 - offsets, 23000.01 + offsets), 2)
+    return pd.DataFrame({
+        'timestamp': timestamps,
+        'receipt_timestamp': timestamps + 0.0001,
+        'update_type': update_types,
+        'side': sides,
+        'price': prices,
+        'size': np.round(rng.uniform(0.001, 5, size=num_rows), 4),
+    })
+
+
+# previous groupby-based implementation, kept as reference for equivalence tests and benchmark (see featurizer/perf/cryptotick_l2_preprocess_perf.py)
+def preprocess_impl_grouped(df: pd.DataFrame) -> pd.DataFrame:
+    grouped = df.groupby(['timestamp', 'update_type'])
+    dfs = [grouped.get_group(x) for x in grouped.groups]
+    dfs = sorted(dfs, key=lambda df: df['timestamp'].iloc[0], reverse=False)
+    events = []
+    for i in range(len(dfs)):
+        df = dfs[i]
+        timestamp = df.iloc[0]['timestamp']
+        receipt_timestamp = df.iloc[0]['receipt_timestamp']
+        update_type = df.iloc[0]['update_type']
+        df_dict = df.to_dict(orient='index', into=OrderedDict)
+        orders = []
+        for v in df_dict.values():
+            orders.append((v['side'], v['price'], v['size']))
+        events.append(CryptotickL2BookIncrementalData.construct_event(timestamp, receipt_timestamp, update_type, orders))
+
+    return pd.DataFrame(events)
@@ -0,0 +1,103 @@
+import json
+import os
+import sys
+import tempfile
+import time
+from dataclasses import dataclass, asdict, field
+from typing import Dict, List, Optional
+
+import pandas as pd
+
+from featurizer.perf.featurizer_benchmark import BenchmarkConfig, mock_l2_inc_blocks, mock_trades_blocks, \
+    BENCHMARK_RESULTS_DIR, _git_commit
+from featurizer.storage.data_store_adapter.block_format import BlockFormat, PARQUET, ARROW_IPC, DEFAULT_BLOCK_FORMAT
+from featurizer.storage.data_store_adapter.local_data_store_adapter import LocalDataStoreAdapter
+
+LOW_CARDINALITY_COLUMNS = ('side', 'update_type')
+
+FORMATS = {
+    'parquet-gzip': DEFAULT_BLOCK_FORMAT,
+    'parquet-zstd': BlockFormat(PARQUET, 'zstd', LOW_CARDINALITY_COLUMNS),
+    'parquet-lz4': BlockFormat(PARQUET, 'lz4', LOW_CARDINALITY_COLUMNS),
+    'parquet-snappy': BlockFormat(PARQUET, 'snappy', LOW_CARDINALITY_COLUMNS),
+    'arrow': BlockFormat(ARROW_IPC, None, LOW_CARDINALITY_COLUMNS),
+    'arrow-lz4': BlockFormat(ARROW_IPC, 'lz4', LOW_CARDINALITY_COLUMNS),
+    'arrow-zstd': BlockFormat(ARROW_IPC, 'zstd', LOW_CARDINALITY_COLUMNS),
+}
+
+
+@dataclass
+class FormatResult:
+    size_bytes: int = 0
+    store_s: float = 0.0
+    # best of repeats, first read after store is served from page cache for all formats
+    load_s: float = 0.0
+
+
+@dataclass
+class BlockFormatBenchmarkResult:
+    commit: Optional[str]
+    started_at: float
+    repeats: int
+    # block name -> format name -> result
+    blocks: Dict[str, Dict[str, FormatResult]] = field(default_factory=dict)
+
+
+# Stores each block in every format from FORMATS via LocalDataStoreAdapter and compares file size,
+# store time and load latency. Uses synthetic l2 inc and trades blocks unless paths to real
+# (gzip parquet) blocks are passed
+def run_block_format_benchmark(
+    blocks: Optional[Dict[str, pd.DataFrame]] = None,
+    repeats: int = 3,
+    output_path: Optional[str] = None
+) -> BlockFormatBenchmarkResult:
+    if blocks is None:
+        config = BenchmarkConfig(rows_per_block=100000, num_blocks=1)
+        l2_blocks = mock_l2_inc_blocks(config)
+        blocks = {'l2_inc': l2_blocks[0], 'trades': mock_trades_blocks(config, l2_blocks)[0]}
+
+    result = BlockFormatBenchmarkResult(commit=_git_commit(), started_at=time.time(), repeats=repeats)
+    adapter = LocalDataStoreAdapter()
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        for block_name, df in blocks.items():
+            result.blocks[block_name] = {}
+            for format_name, block_format in FORMATS.items():
+                path = os.path.join(tmp_dir, f'{block_name}{block_format.extension()}')
+                res = FormatResult()
+                t = time.time()
+                adapter.store_df(path, df, block_format=block_format)
+                res.store_s = time.time() - t
+                res.size_bytes = os.path.getsize(path)
+                load_times = []
+                for _ in range(repeats):
+                    t = time.time()
+                    adapter.load_df(path, block_format=block_format)
+                    load_times.append(time.time() - t)
+                res.load_s = min(load_times)
+                result.blocks[block_name][format_name] = res
+
+    if output_path is None:
+        os.makedirs(BENCHMARK_RESULTS_DIR, exist_ok=True)
+        output_path = os.path.join(BENCHMARK_RESULTS_DIR, f'block-format-{result.commit or "unknown"}-{int(result.started_at)}.json')
+    with open(output_path, 'w') as f:
+        json.dump(asdict(result), f, indent=2)
+    _print_table(result)
+    print(f'Benchmark results written to {output_path}')
+    return result
+
+
+def _print_table(result: BlockFormatBenchmarkResult):
+    for block_name, per_format in result.blocks.items():
+        print(block_name)
+        for format_name, res in per_format.items():
+            print(f'  {format_name:<16} size={res.size_bytes / 1024:>10.1f}kb store={res.store_s:.4f}s load={res.load_s:.4f}s')
+
+
+def _load_blocks(paths: List[str]) -> Dict[str, pd.DataFrame]:
+    adapter = LocalDataStoreAdapter()
+    return {os.path.basename(path): adapter.load_df(path) for path in paths}
+
+
+if __name__ == '__main__':
+    # python -m featurizer.perf.block_format_benchmark [block.parquet.gz ...]
+    run_block_format_benchmark(_load_blocks(sys.argv[1:]) if len(sys.argv) > 1 else None)
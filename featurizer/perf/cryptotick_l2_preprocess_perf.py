@@ -0,0 +1,23 @@
+import time
+from typing import Dict
+
+from featurizer.data_definitions.common.l2_book_incremental.cryptotick.cryptotick_l2_book_incremental import \
+    CryptotickL2BookIncrementalData
+from featurizer.featurizer_utils.testing_utils import mock_processed_l2_inc_df, preprocess_impl_grouped
+
+
+def run_preprocess_perf(num_rows: int = 50000) -> Dict[str, float]:
+    df = mock_processed_l2_inc_df(num_rows)
+    t = time.time()
+    preprocess_impl_grouped(df)
+    grouped_s = time.time() - t
+    t = time.time()
+    CryptotickL2BookIncrementalData.preprocess_impl(df)
+    vectorized_s = time.time() - t
+    res = {'num_rows': num_rows, 'grouped_s': grouped_s, 'vectorized_s': vectorized_s, 'speedup': grouped_s / vectorized_s}
+    print(res)
+    return res
+
+
+if __name__ == '__main__':
+    run_preprocess_perf()
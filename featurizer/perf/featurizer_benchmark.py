@@ -0,0 +1,242 @@
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+from contextlib import contextmanager
+from dataclasses import dataclass, asdict, field
+from typing import Dict, List, Optional
+
+import numpy as np
+import pandas as pd
+from portion import closed
+
+from featurizer.blocks.blocks import Block, point_in_time_join
+from featurizer.data_definitions.common.l2_book_incremental.cryptotick.cryptotick_l2_book_incremental import \
+    CryptotickL2BookIncrementalData
+from featurizer.data_definitions.common.trades.trades import TradesData
+from featurizer.features.definitions.l2_book.l2_snapshot_fd.l2_snapshot_fd import L2SnapshotFD
+from featurizer.features.definitions.price.mid_price_fd.mid_price_fd import MidPriceFD
+from featurizer.features.definitions.tvi.trade_volume_imb_fd.trade_volume_imb_fd import TradeVolumeImbFD
+from featurizer.features.definitions.volatility.volatility_stddev_fd.volatility_stddev_fd import VolatilityStddevFD
+from featurizer.features.feature_tree.feature_tree import Feature
+from featurizer.featurizer_utils.featurizer_utils import merge_blocks, run_feature_stream, run_feature_batch
+from featurizer.featurizer_utils.testing_utils import mock_processed_l2_inc_df
+from featurizer.storage.data_store_adapter.local_data_store_adapter import LocalDataStoreAdapter
+
+BENCHMARK_RESULTS_DIR = '/tmp/svoe/benchmarks'
+MAX_FEATURE_TREE_DEPTH = 3
+
+STAGES = ['store_data', 'load', 'preprocess', 'merge_blocks', 'stream_run', 'batch_run', 'join', 'store']
+
+
+@dataclass
+class BenchmarkConfig:
+    rows_per_block: int = 20000
+    num_blocks: int = 4
+    # 1 - l2 snapshots and tvi, 2 - adds mid price, 3 - adds volatility
+    feature_tree_depth: int = MAX_FEATURE_TREE_DEPTH
+    l2_depth: int = 10
+    seed: int = 0
+
+
+@dataclass
+class BenchmarkResult:
+    config: BenchmarkConfig
+    commit: Optional[str]
+    started_at: float
+    # stage -> total seconds
+    stages: Dict[str, float] = field(default_factory=lambda: {stage: 0.0 for stage in STAGES})
+    # feature -> stage -> seconds
+    features: Dict[str, Dict[str, float]] = field(default_factory=dict)
+    # feature or data source -> number of rows produced
+    rows: Dict[str, int] = field(default_factory=dict)
+
+
+class _Timer:
+
+    def __init__(self, result: BenchmarkResult):
+        self.result = result
+
+    @contextmanager
+    def stage(self, stage: str, feature: Optional[Feature] = None):
+        t = time.time()
+        yield
+        elapsed = time.time() - t
+        self.result.stages[stage] += elapsed
+        if feature is not None:
+            per_feature = self.result.features.setdefault(str(feature), {})
+            per_feature[stage] = per_feature.get(stage, 0.0) + elapsed
+
+
+# raw cryptotick l2 inc rows (after timestamp parsing), split into blocks on timestamp change
+# so that no (timestamp, update_type) group spans two blocks
+def mock_l2_inc_blocks(config: BenchmarkConfig) -> List[Block]:
+    df = mock_processed_l2_inc_df(config.rows_per_block * config.num_blocks, seed=config.seed)
+    return _split_on_ts_change(df, config.num_blocks)
+
+
+# trades covering the same time range as l2 blocks, split on the same block boundaries
+def mock_trades_blocks(config: BenchmarkConfig, l2_blocks: List[Block]) -> List[Block]:
+    rng = np.random.default_rng(config.seed + 1)
+    num_rows = config.rows_per_block * config.num_blocks
+    start_ts = l2_blocks[0]['timestamp'].iloc[0]
+    end_ts = l2_blocks[-1]['timestamp'].iloc[-1]
+    timestamps = np.sort(np.round(rng.uniform(start_ts, end_ts, size=num_rows), 3))
+    df = pd.DataFrame({
+        'timestamp': timestamps,
+        'receipt_timestamp': timestamps + 0.0001,
+        'side': rng.choice(np.array(['BUY', 'SELL'], dtype=object), size=num_rows),
+        'amount': np.round(rng.uniform(0.001, 5, size=num_rows), 4),
+        'price': np.round(23000 + np.cumsum(rng.normal(0, 0.5, size=num_rows)), 2),
+        'id': [str(i) for i in range(num_rows)],
+    })
+    block_starts = [block['timestamp'].iloc[0] for block in l2_blocks[1:]]
+    bounds = [0] + np.searchsorted(timestamps, block_starts, side='left').tolist() + [num_rows]
+    return [df.iloc[bounds[i]: bounds[i + 1]].reset_index(drop=True) for i in range(len(l2_blocks))]
+
+
+def _split_on_ts_change(df: pd.DataFrame, num_blocks: int) -> List[Block]:
+    timestamps = df['timestamp'].to_numpy()
+    bounds = [0]
+    for i in range(1, num_blocks):
+        # first row of the next timestamp after even split point
+        split = int(np.searchsorted(timestamps, timestamps[i * len(df) // num_blocks], side='left'))
+        bounds.append(max(split, bounds[-1]))
+    bounds.append(len(df))
+    return [df.iloc[bounds[i]: bounds[i + 1]].reset_index(drop=True) for i in range(num_blocks) if bounds[i] < bounds[i + 1]]
+
+
+def build_features(config: BenchmarkConfig) -> Dict[str, Feature]:
+    if not 1 <= config.feature_tree_depth <= MAX_FEATURE_TREE_DEPTH:
+        raise ValueError(f'feature_tree_depth should be between 1 and {MAX_FEATURE_TREE_DEPTH}')
+    l2_data = Feature([], CryptotickL2BookIncrementalData, {})
+    trades_data = Feature([], TradesData, {})
+    # in dependency order
+    features = {
+        'l2_inc': l2_data,
+        'trades': trades_data,
+        'l2_snapshot': Feature([l2_data], L2SnapshotFD, {'dep_schema': 'cryptotick', 'depth': config.l2_depth}),
+        'tvi': Feature([trades_data], TradeVolumeImbFD, {'window': '1m', 'sampling': '1s'}),
+    }
+    if config.feature_tree_depth >= 2:
+        features['mid_price'] = Feature([features['l2_snapshot']], MidPriceFD, {})
+    if config.feature_tree_depth >= 3:
+        features['volatility'] = Feature([features['mid_price']], VolatilityStddevFD, {'window': '1m', 'sampling': '1s'})
+    return features
+
+
+# Runs featurization of synthetic blocks locally in a single process, timing each stage separately:
+# store/load raw blocks via LocalDataStoreAdapter, preprocess, merge_blocks, feature calculation
+# (stream and batch), point-in-time join per block interval and storing feature blocks.
+# Results are written to json so runs can be compared between commits
+def run_featurizer_benchmark(
+    config: Optional[BenchmarkConfig] = None,
+    output_path: Optional[str] = None,
+    store_dir: Optional[str] = None
+) -> BenchmarkResult:
+    config = BenchmarkConfig() if config is None else config
+    result = BenchmarkResult(config=config, commit=_git_commit(), started_at=time.time())
+    timer = _Timer(result)
+    features = build_features(config)
+    data_store_adapter = LocalDataStoreAdapter()
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        store_dir = tmp_dir if store_dir is None else store_dir
+
+        l2_blocks = mock_l2_inc_blocks(config)
+        raw_blocks = {features['l2_inc']: l2_blocks, features['trades']: mock_trades_blocks(config, l2_blocks)}
+        paths = {}
+        for data_feature, blocks in raw_blocks.items():
+            result.rows[str(data_feature)] = sum(len(b) for b in blocks)
+            paths[data_feature] = []
+            with timer.stage('store_data', data_feature):
+                for i, block in enumerate(blocks):
+                    path = os.path.join(store_dir, 'data', data_feature.data_definition.__name__, f'{i}.parquet.gz')
+                    data_store_adapter.store_df(path, block)
+                    paths[data_feature].append(path)
+
+        # ts range of each block, used as join intervals
+        intervals = []
+        for i, block in enumerate(l2_blocks):
+            end_ts = l2_blocks[i + 1]['timestamp'].iloc[0] if i + 1 < len(l2_blocks) else block['timestamp'].iloc[-1]
+            intervals.append(closed(block['timestamp'].iloc[0], end_ts))
+        del raw_blocks, l2_blocks
+
+        results: Dict[Feature, List[Block]] = {}
+        for data_feature in paths:
+            with timer.stage('load', data_feature):
+                blocks = [data_store_adapter.load_df(path) for path in paths[data_feature]]
+            data_def = data_feature.data_definition
+            # bypass preprocessed blocks cache so runs are comparable
+            with timer.stage('preprocess', data_feature):
+                results[data_feature] = [data_def.preprocess_impl(block) if data_def.needs_preprocessing() else block for block in blocks]
+
+        for name, feature in features.items():
+            if feature.data_definition.is_data_source():
+                continue
+            deps = {dep: results[dep] for dep in feature.children}
+            with timer.stage('merge_blocks', feature):
+                for _ in merge_blocks(deps):
+                    pass
+            with timer.stage('stream_run', feature):
+                df = run_feature_stream(feature, deps)
+            if feature.data_definition.has_batch():
+                with timer.stage('batch_run', feature):
+                    run_feature_batch(feature, deps)
+            result.rows[str(feature)] = len(df)
+            results[feature] = _split_by_intervals(df, intervals)
+
+        # label first, same as point_in_time_join_block
+        to_join = [f for f in features.values() if not f.data_definition.is_data_source()][::-1]
+        with timer.stage('join'):
+            joined_rows = 0
+            for i, interval in enumerate(intervals):
+                sources = []
+                for feature in to_join:
+                    prev_tail = results[feature][i - 1].tail(1) if i > 0 else None
+                    sources.append((results[feature][i], prev_tail, str(feature)))
+                joined_rows += len(point_in_time_join(sources, interval.lower, interval.upper))
+        result.rows['joined'] = joined_rows
+
+        for feature in to_join:
+            with timer.stage('store', feature):
+                for i, block in enumerate(results[feature]):
+                    path = os.path.join(store_dir, 'features', feature.data_definition.__name__, f'{i}.parquet.gz')
+                    data_store_adapter.store_df(path, block)
+
+    if output_path is None:
+        os.makedirs(BENCHMARK_RESULTS_DIR, exist_ok=True)
+        output_path = os.path.join(BENCHMARK_RESULTS_DIR, f'featurizer-{result.commit or "unknown"}-{int(result.started_at)}.json')
+    with open(output_path, 'w') as f:
+        json.dump(asdict(result), f, indent=2)
+    print(json.dumps(result.stages, indent=2))
+    print(f'Benchmark results written to {output_path}')
+    return result
+
+
+# join intervals are adjacent (each ends where the next begins), so blocks are cut half-open [lower, upper),
+# only the last block includes its upper bound. Each row ends up in exactly one block
+def _split_by_intervals(df: pd.DataFrame, intervals) -> List[Block]:
+    timestamps = df['timestamp'].to_numpy()
+    res = []
+    for i, interval in enumerate(intervals):
+        start = np.searchsorted(timestamps, interval.lower, side='left')
+        end = np.searchsorted(timestamps, interval.upper, side='right' if i == len(intervals) - 1 else 'left')
+        res.append(df.iloc[start: end].reset_index(drop=True))
+    assert sum(len(block) for block in res) == len(df)
+    return res
+
+
+def _git_commit() -> Optional[str]:
+    try:
+        return subprocess.check_output(
+            ['git', 'rev-parse', '--short', 'HEAD'], cwd=os.path.dirname(__file__), stderr=subprocess.DEVNULL
+        ).decode().strip()
+    except (subprocess.CalledProcessError, FileNotFoundError):
+        return None
+
+
+if __name__ == '__main__':
+    run_featurizer_benchmark(output_path=sys.argv[1] if len(sys.argv) > 1 else None)
@@ -0,0 +1,104 @@
+import json
+import os
+import sys
+import tempfile
+import time
+from dataclasses import dataclass, asdict, field
+from typing import Dict, List, Optional
+
+from featurizer.blocks.blocks import mock_meta, make_ranges, BlockRangeMeta
+from featurizer.data_definitions.common.trades.trades import TradesData
+from featurizer.features.definitions.transforms.diff.diff import Diff
+from featurizer.features.definitions.tvi.trade_volume_imb_fd.trade_volume_imb_fd import TradeVolumeImbFD
+from featurizer.features.feature_tree.feature_tree import Feature
+from featurizer.perf.featurizer_benchmark import BENCHMARK_RESULTS_DIR, _git_commit
+from featurizer.task_graph.builder import build_feature_label_set_task_graph
+from featurizer.task_graph.range_plan import plan_feature_set_ranges
+
+BLOCK_SIZE_S = 60
+
+
+@dataclass
+class TaskGraphBenchmarkRun:
+    num_blocks: int
+    num_features: int
+    # range planning only
+    plan_s: float
+    plan_us_per_block_feature: float
+    # planning and node binding (dominated by Ray's DAGNode arg scanning)
+    build_s: float
+    # with range plans persisted by previous run
+    rebuild_s: float
+
+
+@dataclass
+class TaskGraphBenchmarkResult:
+    commit: Optional[str]
+    started_at: float
+    runs: List[TaskGraphBenchmarkRun] = field(default_factory=list)
+
+
+# features sharing one tvi subtree, so shared subtree planning is exercised
+def build_features(num_features: int) -> List[Feature]:
+    trades = Feature([], TradesData, {})
+    tvi = Feature([trades], TradeVolumeImbFD, {'window': '1m', 'sampling': '1s'})
+    features = [tvi]
+    for i in range(1, num_features):
+        features.append(Feature([tvi], Diff, {'window': f'{i}m'}))
+    return features
+
+
+def mock_data_ranges_meta(features: List[Feature], num_blocks: int) -> Dict[Feature, List[BlockRangeMeta]]:
+    metas = [
+        mock_meta(i * BLOCK_SIZE_S, (i + 1) * BLOCK_SIZE_S - 0.1, {'path': f'block-{i}', 'hash': f'block-{i}'})
+        for i in range(num_blocks)
+    ]
+    return {data_feature: make_ranges(metas) for data_feature in features[0].get_data_sources()}
+
+
+# Plans ranges and builds feature set + join task graph for mock 1 minute blocks over growing number of blocks
+# and features, planning time per block per feature should stay flat. Second build over the same data reads
+# persisted range plans
+def run_task_graph_benchmark(
+    num_blocks: Optional[List[int]] = None,
+    num_features: Optional[List[int]] = None,
+    output_path: Optional[str] = None
+) -> TaskGraphBenchmarkResult:
+    num_blocks = [1440, 2880, 5760] if num_blocks is None else num_blocks
+    num_features = [1, 2, 4] if num_features is None else num_features
+    result = TaskGraphBenchmarkResult(commit=_git_commit(), started_at=time.time())
+    with tempfile.TemporaryDirectory() as plans_dir:
+        for n_features in num_features:
+            for n_blocks in num_blocks:
+                features = build_features(n_features)
+                data_ranges_meta = mock_data_ranges_meta(features, n_blocks)
+                t = time.time()
+                plan_feature_set_ranges(features, data_ranges_meta)
+                plan_s = time.time() - t
+                times = []
+                for _ in range(2):
+                    t = time.time()
+                    build_feature_label_set_task_graph(
+                        features=list(features), label=None, label_lookahead=None, data_ranges_meta=data_ranges_meta,
+                        obj_ref_cache={}, range_plans_dir=plans_dir
+                    )
+                    times.append(time.time() - t)
+                run = TaskGraphBenchmarkRun(
+                    num_blocks=n_blocks, num_features=n_features, plan_s=plan_s,
+                    plan_us_per_block_feature=plan_s / (n_blocks * n_features) * 1e6, build_s=times[0], rebuild_s=times[1]
+                )
+                print(f'blocks={n_blocks:<6} features={n_features:<3} plan={run.plan_s:.3f}s '
+                      f'({run.plan_us_per_block_feature:.1f}us per block x feature) build={run.build_s:.3f}s rebuild={run.rebuild_s:.3f}s')
+                result.runs.append(run)
+
+    if output_path is None:
+        os.makedirs(BENCHMARK_RESULTS_DIR, exist_ok=True)
+        output_path = os.path.join(BENCHMARK_RESULTS_DIR, f'task-graph-{result.commit or "unknown"}-{int(result.started_at)}.json')
+    with open(output_path, 'w') as f:
+        json.dump(asdict(result), f, indent=2)
+    print(f'Benchmark results written to {output_path}')
+    return result
+
+
+if __name__ == '__main__':
+    run_task_graph_benchmark(output_path=sys.argv[1] if len(sys.argv) > 1 else None)
@@ -75,6 +75,8 @@ class Featurizer:
                 stored_feature_blocks_meta=stored_features_meta,
                 result_owner=cache_actor
             )
+            # actor was created before the graph was built, pass planned consumers per block
+            ray.get(cache_actor.update_cache.remote(cache))
 
             # TODO first two values are weird outliers for some reason, why?
             # df = df.tail(-2)
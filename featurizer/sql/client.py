@@ -1,15 +1,24 @@
 from typing import Optional, Dict, List
+
+from sqlalchemy import select, func, exists, delete, Column
+
 from common.db.sql_client import SqlClient, Session
 from featurizer.data_ingest.models import InputItemBatch
 
 
 from featurizer.sql.feature_def.models import FeatureDefinitionDB
-from featurizer.sql.models.data_source_block_metadata import DataSourceBlockMetadata
+from featurizer.sql.models.data_source_block_metadata import DataSourceBlockMetadata, SOURCE_PATH_EXPR, \
+    NUM_SPLITS_EXPR
 from featurizer.sql.models.data_source_metadata import DataSourceMetadata
 from featurizer.sql.models.feature_block_metadata import FeatureBlockMetadata
 from featurizer.sql.models.feature_metadata import FeatureMetadata
 
 
+# columns returned as block metadata, ORM bookkeeping timestamps are not needed by consumers
+def _block_meta_columns(model) -> List[Column]:
+    return [c for c in model.__table__.columns if c.name not in ['created_at', 'updated_at']]
+
+
 class FeaturizerSqlClient(SqlClient):
     def __init__(self):
         super(FeaturizerSqlClient, self).__init__()
@@ -18,54 +27,70 @@ class FeaturizerSqlClient(SqlClient):
     def store_block_metadata_batch(self, batch: List[DataSourceBlockMetadata | FeatureBlockMetadata]):
         # check for existing hashes
         hashes = [i.hash for i in batch]
-        session = Session()
-        if isinstance(batch[0], DataSourceBlockMetadata):
-            existing = session.query(DataSourceBlockMetadata).filter(DataSourceBlockMetadata.hash.in_(hashes)).all()
-        else:
-            existing = session.query(FeatureBlockMetadata).filter(FeatureBlockMetadata.hash.in_(hashes)).all()
-
-        existing_hashes = [i.hash for i in existing]
-        # filter existing
-        batch = [i for i in batch if i.hash not in existing_hashes]
-        # TODO what if primary key exists? Override?
-        session.bulk_save_objects(batch)
-
-        # TODO try catch and handle
-        # 1) connection issues
-        # 2) duplicate entries
-        session.commit()
-        print(f'Written {len(batch)} index items to Db')
+        model = DataSourceBlockMetadata if isinstance(batch[0], DataSourceBlockMetadata) else FeatureBlockMetadata
+        with Session() as session:
+            existing_hashes = set(session.scalars(select(model.hash).where(model.hash.in_(hashes))))
+            # filter existing
+            new_items = [i for i in batch if i.hash not in existing_hashes]
+            # TODO what if primary key exists? Override?
+            session.bulk_save_objects(new_items)
+            if model is DataSourceBlockMetadata:
+                self._set_num_splits(session, batch)
+
+            # TODO try catch and handle
+            # 1) connection issues
+            # 2) duplicate entries
+            session.commit()
+        print(f'Written {len(new_items)} index items to Db')
         return # TODO return result?
 
+    # final ingest batch carries num_splits of the source file. Its rows may have been committed by a previous
+    # (interrupted) run and skipped above, so num_splits is written to all stored rows of the file
+    @staticmethod
+    def _set_num_splits(session, batch: List[DataSourceBlockMetadata]):
+        num_splits = {}
+        for item in batch:
+            if item.extras is not None and 'num_splits' in item.extras:
+                num_splits[item.extras['source_path']] = item.extras['num_splits']
+        if len(num_splits) == 0:
+            return
+        session.flush()
+        rows = session.scalars(select(DataSourceBlockMetadata).where(SOURCE_PATH_EXPR.in_(list(num_splits.keys()))))
+        for row in rows:
+            source_path = row.extras['source_path']
+            if row.extras.get('num_splits') != num_splits[source_path]:
+                # new dict so JSON column change is detected
+                row.extras = {**row.extras, 'num_splits': num_splits[source_path]}
+
     def filter_cryptotick_batch(self, batch: InputItemBatch) -> InputItemBatch:
         items = batch.items
         paths = [item[DataSourceBlockMetadata.path.name] for item in items]
-        session = Session()
-        query_in = DataSourceBlockMetadata.extras['source_path'].in_(paths)
-        select_in_db = session.query(DataSourceBlockMetadata).filter(query_in)
-        rows = select_in_db.all()
-        if len(rows) == 0:
+        # number of stored splits and expected num_splits per source file, uses source path index
+        q = select(SOURCE_PATH_EXPR, func.count(), func.max(NUM_SPLITS_EXPR))\
+            .where(SOURCE_PATH_EXPR.in_(paths))\
+            .group_by(SOURCE_PATH_EXPR)
+        with Session() as session:
+            stored = {source_path: (num_rows, num_splits) for source_path, num_rows, num_splits in session.execute(q)}
+        if len(stored) == 0:
             return batch
         non_exist = []
         for item in items:
-            # check if for given item num_splits == num returned rows
-            rows_for_item = list(filter(lambda row: row.extras['source_path'] == item[DataSourceBlockMetadata.path.name], rows))
-            if len(rows_for_item) == 0:
-                non_exist.append(item)
-                continue
             # TODO verify split ids?
-            num_splits = rows_for_item[0].extras['num_splits']
-            if len(rows_for_item) != num_splits:
+            # metadata is committed in batches while the file is ingested, num_splits is written only with the last batch,
+            # so a file is complete only if its rows carry it and number of rows matches it
+            num_rows, num_splits = stored.get(item[DataSourceBlockMetadata.path.name], (0, None))
+            if num_splits is None or num_rows != num_splits:
                 non_exist.append(item)
 
         print(f'Checked db for items: {len(non_exist)} not in DB')
         return InputItemBatch(batch.batch_id, non_exist)
 
     def select_all_TEST(self):
-        session = Session()
-        return session.query(DataSourceBlockMetadata).all()
+        with Session() as session:
+            return session.query(DataSourceBlockMetadata).all()
 
     # api methods
+    # returns block metadata dicts sorted by start_ts, selects only table columns so no ORM objects are built
     def select_data_source_metadata(
         self,
         keys: List[str],
@@ -74,29 +99,23 @@ class FeaturizerSqlClient(SqlClient):
         start_day: Optional[str] = None,
         end_day: Optional[str] = None
     ) -> List[Dict]:
-        args = {}
+        q = select(*_block_meta_columns(DataSourceBlockMetadata)).where(DataSourceBlockMetadata.key.in_(keys))
         if compaction is not None:
-            args[DataSourceBlockMetadata.compaction.name] = compaction
+            q = q.where(DataSourceBlockMetadata.compaction == compaction)
         if extras is not None:
-            args[DataSourceBlockMetadata.extras.name] = extras
-
-        session = Session()
-        q = session.query(DataSourceBlockMetadata).filter(DataSourceBlockMetadata.key.in_(keys)).filter_by(**args)
+            q = q.where(DataSourceBlockMetadata.extras == extras)
         if start_day is not None:
-            q = q.filter(DataSourceBlockMetadata.day >= start_day)
+            q = q.where(DataSourceBlockMetadata.day >= start_day)
         if end_day is not None:
-            q = q.filter(DataSourceBlockMetadata.day <= end_day)
-        res = q.order_by(DataSourceBlockMetadata.start_ts).all()
-        # TODO this adds unnecessary sqlalchemy fields, remove to reduce memory footprint
-        return [r.__dict__ for r in res]
+            q = q.where(DataSourceBlockMetadata.day <= end_day)
+        q = q.order_by(DataSourceBlockMetadata.start_ts)
+        with Session() as session:
+            return [row._asdict() for row in session.execute(q)]
 
     def feature_block_exists(self, item: FeatureBlockMetadata) -> bool:
-        session = Session()
-        q = session.query(FeatureBlockMetadata).filter(FeatureBlockMetadata.hash == item.hash)
-        res = session.query(q.exists()).all()
-        if len(res) == 0:
-            return False
-        return res[0][0]
+        q = select(exists().where(FeatureBlockMetadata.hash == item.hash))
+        with Session() as session:
+            return bool(session.scalar(q))
 
     def select_feature_blocks_metadata(
         self,
@@ -104,34 +123,29 @@ class FeaturizerSqlClient(SqlClient):
         start_day: Optional[str] = None,
         end_day: Optional[str] = None
     ) -> List[Dict]:
-        session = Session()
-        f = session.query(FeatureBlockMetadata).filter(FeatureBlockMetadata.key.in_(feature_keys))
+        q = select(*_block_meta_columns(FeatureBlockMetadata)).where(FeatureBlockMetadata.key.in_(feature_keys))
         if start_day is not None:
-            f = f.filter(FeatureBlockMetadata.day >= start_day)
+            q = q.where(FeatureBlockMetadata.day >= start_day)
         if end_day is not None:
-            f = f.filter(FeatureBlockMetadata.day <= end_day)
-        res = f.order_by(FeatureBlockMetadata.start_ts).all()
-        # TODO this adds unnecessary sqlalchemy fields, remove to reduce memory footprint
-        return [r.__dict__ for r in res]
+            q = q.where(FeatureBlockMetadata.day <= end_day)
+        q = q.order_by(FeatureBlockMetadata.start_ts)
+        with Session() as session:
+            return [row._asdict() for row in session.execute(q)]
 
     def store_metadata_if_needed(self, items: List[DataSourceMetadata | FeatureMetadata]) -> int:
-        session = Session()
         keys = [i.key for i in items]
-        if isinstance(items[0], DataSourceMetadata):
-            existing = session.query(DataSourceMetadata).filter(DataSourceMetadata.key.in_(keys)).all()
-        else:
-            existing = session.query(FeatureMetadata).filter(FeatureMetadata.key.in_(keys)).all()
-
-        existing_keys = [i.key for i in existing]
-        batch = [i for i in items if i.key not in existing_keys]
-        if len(batch) == 0:
-            return 0
-
-        # TODO try catch and handle
-        # 1) connection issues
-        # 2) duplicate entries
-        session.bulk_save_objects(batch)
-        session.commit()
+        model = DataSourceMetadata if isinstance(items[0], DataSourceMetadata) else FeatureMetadata
+        with Session() as session:
+            existing_keys = set(session.scalars(select(model.key).where(model.key.in_(keys))))
+            batch = [i for i in items if i.key not in existing_keys]
+            if len(batch) == 0:
+                return 0
+
+            # TODO try catch and handle
+            # 1) connection issues
+            # 2) duplicate entries
+            session.bulk_save_objects(batch)
+            session.commit()
 
         # return number of stored items
         return len(batch)
@@ -141,18 +155,18 @@ class FeaturizerSqlClient(SqlClient):
         self,
         feature_keys: List[str]
     ):
-        session = Session()
-        session.query(FeatureMetadata).filter(FeatureMetadata.key.in_(feature_keys)).delete()
-        session.query(FeatureBlockMetadata).filter(FeatureBlockMetadata.key.in_(feature_keys)).delete()
-        session.commit()
+        with Session() as session:
+            session.execute(delete(FeatureMetadata).where(FeatureMetadata.key.in_(feature_keys)))
+            session.execute(delete(FeatureBlockMetadata).where(FeatureBlockMetadata.key.in_(feature_keys)))
+            session.commit()
 
     def write_feature_def(
         self,
         item: FeatureDefinitionDB
     ):
-        session = Session()
-        session.add(item)
-        session.commit()
+        with Session() as session:
+            session.add(item)
+            session.commit()
 
     def get_feature_def(
         self,
@@ -161,5 +175,5 @@ class FeaturizerSqlClient(SqlClient):
         feature_definition: str,
         version: str,
     ) -> FeatureDefinitionDB:
-        session = Session()
-        return session.query(FeatureDefinitionDB).get((owner_id, feature_group, feature_definition, version))
+        with Session() as session:
+            return session.get(FeatureDefinitionDB, (owner_id, feature_group, feature_definition, version))
@@ -1,4 +1,5 @@
-from sqlalchemy import Column, String, JSON, DateTime, func, Integer
+from sqlalchemy import Column, String, JSON, DateTime, func, Integer, Index, cast
+from sqlalchemy.sql.elements import Grouping
 
 from common.db.base import Base
 
@@ -7,6 +8,10 @@ DEFAULT_COMPACTION = 'raw'
 
 class DataSourceBlockMetadata(Base):
     __tablename__ = 'data_source_blocks_metadata'
+    __table_args__ = (
+        # blocks are selected by key and day range, ordered by start_ts
+        Index('ix_data_source_blocks_key_day_start_ts', 'key', 'day', 'start_ts'),
+    )
     created_at = Column(DateTime(timezone=True), server_default=func.now())
     updated_at = Column(DateTime(timezone=True), onupdate=func.now())
 
@@ -39,7 +44,15 @@ class DataSourceBlockMetadata(Base):
             setattr(self, DataSourceBlockMetadata.compaction.name, DEFAULT_COMPACTION)
 
 
-def build_data_source_block_path(item: DataSourceBlockMetadata, prefix: str) -> str:
+# raw file block was split from, indexed so ingest can look up already cataloged files.
+# Queries should filter on this exact expression for the index to be used
+SOURCE_PATH_EXPR = cast(DataSourceBlockMetadata.extras['source_path'].as_string(), String(512))
+NUM_SPLITS_EXPR = DataSourceBlockMetadata.extras['num_splits'].as_integer()
+# functional index expressions need own parentheses in MySQL
+Index('ix_data_source_blocks_source_path', Grouping(SOURCE_PATH_EXPR))
+
+
+def build_data_source_block_path(item: DataSourceBlockMetadata, prefix: str, extension: str = '.parquet.gz') -> str:
     res = prefix
     for field in [
         DataSourceBlockMetadata.owner_id.name,
@@ -51,5 +64,5 @@ def build_data_source_block_path(item: DataSourceBlockMetadata, prefix: str) ->
         v = item.__dict__[field]
         if v is not None and len(v) > 0:
             res += f'{v}/'
-    res += f'{int(item.__dict__[DataSourceBlockMetadata.start_ts.name])}-{item.__dict__[DataSourceBlockMetadata.hash.name]}.parquet.gz'
+    res += f'{int(item.__dict__[DataSourceBlockMetadata.start_ts.name])}-{item.__dict__[DataSourceBlockMetadata.hash.name]}{extension}'
     return res
@@ -1,4 +1,4 @@
-from sqlalchemy import Column, String, JSON, DateTime, func, Integer
+from sqlalchemy import Column, String, JSON, DateTime, func, Integer, Index
 
 from common.db.base import Base
 
@@ -7,6 +7,10 @@ DEFAULT_COMPACTION = 'raw'
 
 class FeatureBlockMetadata(Base):
     __tablename__ = 'feature_blocks_metadata'
+    __table_args__ = (
+        # blocks are selected by key and day range, ordered by start_ts
+        Index('ix_feature_blocks_key_day_start_ts', 'key', 'day', 'start_ts'),
+    )
     created_at = Column(DateTime(timezone=True), server_default=func.now())
     updated_at = Column(DateTime(timezone=True), onupdate=func.now())
 
@@ -39,7 +43,7 @@ class FeatureBlockMetadata(Base):
             setattr(self, FeatureBlockMetadata.compaction.name, DEFAULT_COMPACTION)
 
 
-def build_feature_block_path(item: FeatureBlockMetadata, prefix: str) -> str:
+def build_feature_block_path(item: FeatureBlockMetadata, prefix: str, extension: str = '.parquet.gz') -> str:
     res = prefix
     for field in [
         FeatureBlockMetadata.owner_id.name,
@@ -51,5 +55,5 @@ def build_feature_block_path(item: FeatureBlockMetadata, prefix: str) -> str:
         v = item.__dict__[field]
         if v is not None and len(v) > 0:
             res += f'{v}/'
-    res += f'{int(item.__dict__[FeatureBlockMetadata.start_ts.name])}-{item.__dict__[FeatureBlockMetadata.hash.name]}.parquet.gz'
+    res += f'{int(item.__dict__[FeatureBlockMetadata.start_ts.name])}-{item.__dict__[FeatureBlockMetadata.hash.name]}{extension}'
     return res
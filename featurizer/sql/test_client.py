@@ -1,4 +1,104 @@
+import unittest
+
+from sqlalchemy import create_engine, text, select, func
+from sqlalchemy.pool import StaticPool
+
+from common.db.base import Base
+from common.db.sql_client import SqlClient, Session
+from featurizer.data_ingest.models import InputItemBatch
 from featurizer.sql.client import FeaturizerSqlClient
+from featurizer.sql.models.data_source_block_metadata import DataSourceBlockMetadata, SOURCE_PATH_EXPR
+from featurizer.sql.models.feature_block_metadata import FeatureBlockMetadata
+
+
+class TestFeaturizerSqlClient(unittest.TestCase):
+
+    def setUp(self):
+        # in-memory db shared by all pooled sessions
+        engine = create_engine('sqlite://', poolclass=StaticPool)
+        SqlClient.engine_instance = engine
+        Session.configure(bind=engine)
+        Base.metadata.create_all(engine)
+        self.engine = engine
+        self.client = FeaturizerSqlClient()
+
+    def tearDown(self):
+        SqlClient.engine_instance = None
+        self.engine.dispose()
+
+    def _block(self, key: str, start_ts: int, source_path: str, split_id: int, num_splits: int) -> DataSourceBlockMetadata:
+        extras = {'source_path': source_path, 'split_id': split_id}
+        if num_splits is not None:
+            extras['num_splits'] = num_splits
+        return DataSourceBlockMetadata(
+            owner_id='0', key=key, data_source_definition='def', start_ts=str(start_ts), end_ts=str(start_ts + 1),
+            day='2023-02-01', path=f'{key}/{start_ts}', hash=f'{key}-{start_ts}', extras=extras
+        )
+
+    def test_filter_cryptotick_batch(self):
+        self.client.store_block_metadata_batch([
+            # complete file, only last committed batch has num_splits
+            self._block('k', 0, 'complete', 0, None),
+            self._block('k', 1, 'complete', 1, 2),
+            # interrupted ingest
+            self._block('k', 2, 'no_num_splits', 0, None),
+            self._block('k', 3, 'missing_split', 0, 2),
+        ])
+        # already stored hashes are skipped
+        self.client.store_block_metadata_batch([self._block('k', 0, 'complete', 0, None)])
+        batch = InputItemBatch(0, [{'path': p} for p in ['complete', 'no_num_splits', 'missing_split', 'new']])
+        filtered = self.client.filter_cryptotick_batch(batch)
+        self.assertEqual([i['path'] for i in filtered.items], ['no_num_splits', 'missing_split', 'new'])
+
+    def test_num_splits_after_retry(self):
+        # interrupted ingest committed first splits without num_splits
+        self.client.store_block_metadata_batch([self._block('k', i, 'retried', i, None) for i in [0, 1]])
+        batch = InputItemBatch(0, [{'path': 'retried'}])
+        self.assertEqual(len(self.client.filter_cryptotick_batch(batch).items), 1)
+
+        # retry produces same hashes, final batch (with num_splits) holds only rows stored by the first run
+        self.client.store_block_metadata_batch([self._block('k', i, 'retried', i, None) for i in [2, 3]])
+        self.client.store_block_metadata_batch([self._block('k', i, 'retried', i, 4) for i in [0, 1]])
+        self.assertEqual(len(self.client.filter_cryptotick_batch(batch).items), 0)
+        res = self.client.select_data_source_metadata(['k'])
+        self.assertEqual([r['extras']['num_splits'] for r in res], [4, 4, 4, 4])
+
+    def test_select_blocks_metadata(self):
+        self.client.store_block_metadata_batch([self._block('k', ts, f'p{ts}', 0, 1) for ts in [3, 1, 2]] + [self._block('other', 0, 'o', 0, 1)])
+        res = self.client.select_data_source_metadata(['k'], start_day='2023-02-01', end_day='2023-02-01')
+        self.assertEqual([r['start_ts'] for r in res], ['1', '2', '3'])
+        self.assertEqual(res[0]['extras'], {'source_path': 'p1', 'split_id': 0, 'num_splits': 1})
+        self.assertNotIn('created_at', res[0])
+        self.assertEqual(self.client.select_data_source_metadata(['k'], start_day='2023-02-02'), [])
+
+        feature_block = FeatureBlockMetadata(
+            owner_id='0', key='f', feature_definition='fd', start_ts='0', end_ts='1', day='2023-02-01', path='f/0', hash='f-0'
+        )
+        self.assertFalse(self.client.feature_block_exists(feature_block))
+        self.client.store_block_metadata_batch([feature_block])
+        self.assertTrue(self.client.feature_block_exists(feature_block))
+        self.assertEqual([r['path'] for r in self.client.select_feature_blocks_metadata(['f'])], ['f/0'])
+        self.client.delete_feature_metadata(['f'])
+        self.assertEqual(self.client.select_feature_blocks_metadata(['f']), [])
+
+    def test_queries_use_indexes(self):
+        with self.engine.connect() as conn:
+            for q, index in [
+                ("SELECT * FROM data_source_blocks_metadata WHERE key IN ('k') AND day >= '2023-02-01' ORDER BY start_ts",
+                 'ix_data_source_blocks_key_day_start_ts'),
+                ("SELECT * FROM feature_blocks_metadata WHERE key IN ('k') ORDER BY start_ts",
+                 'ix_feature_blocks_key_day_start_ts'),
+            ]:
+                plan = ' '.join(str(r) for r in conn.execute(text(f'EXPLAIN QUERY PLAN {q}')))
+                self.assertIn(index, plan)
+
+            # source path lookup compiled by the client
+            q = select(SOURCE_PATH_EXPR, func.count()).where(SOURCE_PATH_EXPR.in_(['p'])).group_by(SOURCE_PATH_EXPR)
+            compiled = q.compile(self.engine, compile_kwargs={'literal_binds': True})
+            plan = ' '.join(str(r) for r in conn.execute(text(f'EXPLAIN QUERY PLAN {compiled}')))
+            self.assertIn('ix_data_source_blocks_source_path', plan)
+
 
-c = FeaturizerSqlClient()
-print(c.select_all_TEST())
\ No newline at end of file
+if __name__ == '__main__':
+    c = FeaturizerSqlClient()
+    print(c.select_all_TEST())
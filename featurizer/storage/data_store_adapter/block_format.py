@@ -0,0 +1,124 @@
+from dataclasses import dataclass
+from typing import Optional, Tuple, Dict, Any, Union, BinaryIO, List
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
+
+PARQUET = 'parquet'
+ARROW_IPC = 'arrow'
+
+# file format -> supported codecs (None means uncompressed)
+SUPPORTED_COMPRESSION = {
+    PARQUET: [None, 'gzip', 'zstd', 'lz4', 'snappy'],
+    ARROW_IPC: [None, 'zstd', 'lz4'],
+}
+
+_COMPRESSION_EXT = {None: '', 'gzip': '.gz', 'zstd': '.zst', 'lz4': '.lz4', 'snappy': '.snappy'}
+
+# key in block metadata extras the format is recorded under
+BLOCK_FORMAT_EXTRAS_KEY = 'block_format'
+
+
+# How a block is serialized: file format, codec and columns to dictionary encode (low cardinality
+# string columns like 'side' or 'update_type'). Readers take the format from block metadata
+@dataclass(frozen=True)
+class BlockFormat:
+    file_format: str = PARQUET
+    compression: Optional[str] = 'gzip'
+    dictionary_columns: Tuple[str, ...] = ()
+
+    def __post_init__(self):
+        if self.file_format not in SUPPORTED_COMPRESSION:
+            raise ValueError(f'Unsupported block file format: {self.file_format}')
+        if self.compression not in SUPPORTED_COMPRESSION[self.file_format]:
+            raise ValueError(f'Unsupported compression {self.compression} for {self.file_format}')
+        # keep hashable when constructed from lists (e.g. from metadata json)
+        object.__setattr__(self, 'dictionary_columns', tuple(self.dictionary_columns))
+
+    def extension(self) -> str:
+        return f'.{self.file_format}{_COMPRESSION_EXT[self.compression]}'
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            'file_format': self.file_format,
+            'compression': self.compression,
+            'dictionary_columns': list(self.dictionary_columns),
+        }
+
+    @classmethod
+    def from_dict(cls, d: Dict[str, Any]) -> 'BlockFormat':
+        return BlockFormat(
+            file_format=d['file_format'],
+            compression=d.get('compression'),
+            dictionary_columns=tuple(d.get('dictionary_columns', ())),
+        )
+
+
+# blocks stored before formats were recorded are gzip parquet
+DEFAULT_BLOCK_FORMAT = BlockFormat()
+
+
+def block_format_from_extras(extras: Optional[Dict]) -> BlockFormat:
+    if extras is None or BLOCK_FORMAT_EXTRAS_KEY not in extras:
+        return DEFAULT_BLOCK_FORMAT
+    return BlockFormat.from_dict(extras[BLOCK_FORMAT_EXTRAS_KEY])
+
+
+# block metadata as returned by FeaturizerSqlClient selects
+def block_format_from_meta(meta: Dict) -> BlockFormat:
+    return block_format_from_extras(meta.get('extras'))
+
+
+def write_block(df: pd.DataFrame, sink: Union[str, BinaryIO], block_format: BlockFormat):
+    table = pa.Table.from_pandas(df)
+    dictionary_columns = [c for c in block_format.dictionary_columns if c in df.columns]
+    if block_format.file_format == PARQUET:
+        # parquet dictionary encodes pages only, readers get original dtypes back
+        use_dictionary = dictionary_columns if len(block_format.dictionary_columns) > 0 else True
+        pq.write_table(table, sink, compression=block_format.compression or 'none', use_dictionary=use_dictionary)
+        return
+
+    for c in dictionary_columns:
+        i = table.schema.get_field_index(c)
+        table = table.set_column(i, c, pc.dictionary_encode(table.column(i)))
+    options = pa.ipc.IpcWriteOptions(compression=block_format.compression)
+    with pa.ipc.new_file(sink, table.schema, options=options) as writer:
+        writer.write_table(table)
+
+
+# columns and ts_range (closed interval on 'timestamp') are pushed down into the reader: parquet skips
+# row groups by their statistics and reads only projected column chunks, Arrow IPC reads only projected
+# columns of memory-mapped record batches and slices rows (blocks are ts sorted)
+def read_block(
+    source: Union[str, BinaryIO],
+    block_format: BlockFormat,
+    columns: Optional[List[str]] = None,
+    ts_range: Optional[Tuple[float, float]] = None
+) -> pd.DataFrame:
+    if block_format.file_format == PARQUET:
+        filters = None
+        if ts_range is not None:
+            filters = [('timestamp', '>=', ts_range[0]), ('timestamp', '<=', ts_range[1])]
+        return pq.read_table(source, columns=columns, filters=filters).to_pandas()
+
+    if isinstance(source, str):
+        # local files are memory-mapped, uncompressed buffers are not copied on read
+        with pa.memory_map(source, 'r') as f:
+            table = pa.ipc.open_file(f).read_all()
+    else:
+        table = pa.ipc.open_file(source).read_all()
+    if ts_range is not None:
+        timestamps = table.column('timestamp').to_numpy()
+        start = int(np.searchsorted(timestamps, ts_range[0], side='left'))
+        end = int(np.searchsorted(timestamps, ts_range[1], side='right'))
+        table = table.slice(start, end - start)
+    if columns is not None:
+        table = table.select(columns)
+    # decode dictionary columns so readers get same dtypes as stored
+    for i, field in enumerate(table.schema):
+        if pa.types.is_dictionary(field.type):
+            table = table.set_column(i, field.name, table.column(i).cast(field.type.value_type))
+    return table.to_pandas(split_blocks=True)
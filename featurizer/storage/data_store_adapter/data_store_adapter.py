@@ -1,15 +1,42 @@
+from typing import Optional, Dict, List, Tuple
+
 import pandas as pd
 
 from featurizer.sql.models.data_source_block_metadata import DataSourceBlockMetadata
 from featurizer.sql.models.feature_block_metadata import FeatureBlockMetadata
+from featurizer.storage.data_store_adapter.block_format import BlockFormat, DEFAULT_BLOCK_FORMAT
 
 
 class DataStoreAdapter:
 
-    def load_df(self, path: str, **kwargs) -> pd.DataFrame:
+    # block_formats maps feature key or data/feature definition name to format of blocks stored for it,
+    # feature key takes precedence over definition name
+    def __init__(
+        self,
+        block_formats: Optional[Dict[str, BlockFormat]] = None,
+        default_block_format: BlockFormat = DEFAULT_BLOCK_FORMAT
+    ):
+        self.block_formats = {} if block_formats is None else block_formats
+        self.default_block_format = default_block_format
+
+    def block_format(self, definition_name: str, feature_key: Optional[str] = None) -> BlockFormat:
+        if feature_key is not None and feature_key in self.block_formats:
+            return self.block_formats[feature_key]
+        return self.block_formats.get(definition_name, self.default_block_format)
+
+    # columns projects block columns, ts_range is a closed interval on block timestamps,
+    # both are pushed down into the reader when supported by block format
+    def load_df(
+        self,
+        path: str,
+        block_format: Optional[BlockFormat] = None,
+        columns: Optional[List[str]] = None,
+        ts_range: Optional[Tuple[float, float]] = None,
+        **kwargs
+    ) -> pd.DataFrame:
         raise NotImplementedError
 
-    def store_df(self, path: str, df: pd.DataFrame, **kwargs):
+    def store_df(self, path: str, df: pd.DataFrame, block_format: Optional[BlockFormat] = None, **kwargs):
         raise NotImplementedError
 
     def make_feature_block_path(self, item: FeatureBlockMetadata) -> str:
@@ -17,4 +44,3 @@ class DataStoreAdapter:
 
     def make_data_source_block_path(self, item: DataSourceBlockMetadata) -> str:
         raise NotImplementedError
-
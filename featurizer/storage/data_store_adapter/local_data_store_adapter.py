@@ -1,10 +1,13 @@
 import os
+from typing import Optional, List, Tuple
 
 import pandas as pd
 
 from common.pandas.df_utils import load_df_local, store_df_local
 from featurizer.sql.models.data_source_block_metadata import DataSourceBlockMetadata, build_data_source_block_path
 from featurizer.sql.models.feature_block_metadata import build_feature_block_path, FeatureBlockMetadata
+from featurizer.storage.data_store_adapter.block_format import BlockFormat, read_block, write_block, \
+    block_format_from_extras, DEFAULT_BLOCK_FORMAT
 from featurizer.storage.data_store_adapter.data_store_adapter import DataStoreAdapter
 from featurizer.storage.data_store_adapter.remote_data_store_adapter import SVOE_S3_FEATURE_CATALOG_BLOCK_PATH_PREFIX, \
     SVOE_S3_DATA_CATALOG_BLOCK_PATH_PREFIX
@@ -16,7 +19,14 @@ LOCAL_DATA_CATALOG_BLOCK_PATH_PREFIX = f'{LOCAL_DATA_BLOCKS_DIR}/cataloged_data/
 
 class LocalDataStoreAdapter(DataStoreAdapter):
 
-    def load_df(self, path: str, **kwargs) -> pd.DataFrame:
+    def load_df(
+        self,
+        path: str,
+        block_format: Optional[BlockFormat] = None,
+        columns: Optional[List[str]] = None,
+        ts_range: Optional[Tuple[float, float]] = None,
+        **kwargs
+    ) -> pd.DataFrame:
         # TODO add warning?
         # in case we use index from remote store for local, paths should be the same,
         # but the prefix is different
@@ -31,15 +41,23 @@ class LocalDataStoreAdapter(DataStoreAdapter):
             p = path.removeprefix(SVOE_S3_FEATURE_CATALOG_BLOCK_PATH_PREFIX)
             path = f'{LOCAL_FEATURE_CATALOG_BLOCK_PATH_PREFIX}{p}'
 
-        return load_df_local(path)
+        if block_format is None and columns is None and ts_range is None:
+            return load_df_local(path)
+        block_format = DEFAULT_BLOCK_FORMAT if block_format is None else block_format
+        return read_block(path, block_format, columns=columns, ts_range=ts_range)
 
-    def store_df(self, path: str, df: pd.DataFrame, **kwargs):
+    def store_df(self, path: str, df: pd.DataFrame, block_format: Optional[BlockFormat] = None, **kwargs):
         dirname = os.path.dirname(path)
         os.makedirs(dirname, exist_ok=True)
-        store_df_local(path=path, df=df)
+        if block_format is None:
+            store_df_local(path=path, df=df)
+        else:
+            write_block(df, path, block_format)
 
     def make_feature_block_path(self, item: FeatureBlockMetadata) -> str:
-        return build_feature_block_path(item=item, prefix=LOCAL_FEATURE_CATALOG_BLOCK_PATH_PREFIX)
+        extension = block_format_from_extras(item.extras).extension()
+        return build_feature_block_path(item=item, prefix=LOCAL_FEATURE_CATALOG_BLOCK_PATH_PREFIX, extension=extension)
 
     def make_data_source_block_path(self, item: DataSourceBlockMetadata) -> str:
-        return build_data_source_block_path(item=item, prefix=LOCAL_DATA_CATALOG_BLOCK_PATH_PREFIX)
+        extension = block_format_from_extras(item.extras).extension()
+        return build_data_source_block_path(item=item, prefix=LOCAL_DATA_CATALOG_BLOCK_PATH_PREFIX, extension=extension)
@@ -1,8 +1,13 @@
+from typing import Optional, List, Tuple
+
 import pandas as pd
+import s3fs
 
 from common.s3.s3_utils import load_df_s3, store_df_s3
 from featurizer.sql.models.data_source_block_metadata import DataSourceBlockMetadata, build_data_source_block_path
 from featurizer.sql.models.feature_block_metadata import FeatureBlockMetadata, build_feature_block_path
+from featurizer.storage.data_store_adapter.block_format import BlockFormat, read_block, write_block, \
+    block_format_from_extras, DEFAULT_BLOCK_FORMAT
 from featurizer.storage.data_store_adapter.data_store_adapter import DataStoreAdapter
 
 SVOE_S3_FEATURE_CATALOG_BUCKET = 'svoe-feature-catalog-data'
@@ -14,15 +19,34 @@ SVOE_S3_DATA_CATALOG_BLOCK_PATH_PREFIX = f's3://{SVOE_S3_CATALOGED_DATA_BUCKET}/
 
 class RemoteDataStoreAdapter(DataStoreAdapter):
 
-    def load_df(self, path: str, **kwargs) -> pd.DataFrame:
-        return load_df_s3(path)
-
-    def store_df(self, path: str, df: pd.DataFrame, **kwargs):
-        store_df_s3(path=path, df=df)
+    def load_df(
+        self,
+        path: str,
+        block_format: Optional[BlockFormat] = None,
+        columns: Optional[List[str]] = None,
+        ts_range: Optional[Tuple[float, float]] = None,
+        **kwargs
+    ) -> pd.DataFrame:
+        if block_format is None and columns is None and ts_range is None:
+            return load_df_s3(path)
+        block_format = DEFAULT_BLOCK_FORMAT if block_format is None else block_format
+        s3 = s3fs.S3FileSystem()
+        with s3.open(path, 'rb') as f:
+            return read_block(f, block_format, columns=columns, ts_range=ts_range)
+
+    def store_df(self, path: str, df: pd.DataFrame, block_format: Optional[BlockFormat] = None, **kwargs):
+        if block_format is None:
+            store_df_s3(path=path, df=df)
+            return
+        s3 = s3fs.S3FileSystem()
+        with s3.open(path, 'wb') as f:
+            write_block(df, f, block_format)
 
     def make_feature_block_path(self, item: FeatureBlockMetadata) -> str:
-        return build_feature_block_path(item=item, prefix=SVOE_S3_FEATURE_CATALOG_BLOCK_PATH_PREFIX)
+        extension = block_format_from_extras(item.extras).extension()
+        return build_feature_block_path(item=item, prefix=SVOE_S3_FEATURE_CATALOG_BLOCK_PATH_PREFIX, extension=extension)
 
     def make_data_source_block_path(self, item: DataSourceBlockMetadata) -> str:
-        return build_data_source_block_path(item=item, prefix=SVOE_S3_DATA_CATALOG_BLOCK_PATH_PREFIX)
+        extension = block_format_from_extras(item.extras).extension()
+        return build_data_source_block_path(item=item, prefix=SVOE_S3_DATA_CATALOG_BLOCK_PATH_PREFIX, extension=extension)
 
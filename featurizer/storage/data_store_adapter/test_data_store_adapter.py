@@ -0,0 +1,128 @@
+import os
+import tempfile
+import unittest
+
+import numpy as np
+import pandas as pd
+
+from featurizer.data_definitions.common.l2_book_incremental.cryptotick.cryptotick_l2_book_incremental import \
+    CryptotickL2BookIncrementalData
+from featurizer.data_definitions.common.trades.trades import TradesData
+from featurizer.features.definitions.l2_book.l2_snapshot_fd.l2_snapshot_fd import L2SnapshotFD
+from featurizer.features.definitions.ohlcv.ohlcv_fd.ohlcv_fd import OHLCVFD
+from featurizer.features.definitions.price.mid_price_fd.mid_price_fd import MidPriceFD
+from featurizer.features.definitions.volatility.volatility_stddev_fd.volatility_stddev_fd import VolatilityStddevFD
+from featurizer.features.definitions.tvi.trade_volume_imb_fd.trade_volume_imb_fd import TradeVolumeImbFD
+from featurizer.features.feature_tree.feature_tree import Feature, upstream_columns
+from featurizer.sql.models.data_source_block_metadata import DataSourceBlockMetadata
+from featurizer.storage.data_store_adapter.block_format import BlockFormat, PARQUET, ARROW_IPC, SUPPORTED_COMPRESSION, \
+    DEFAULT_BLOCK_FORMAT, BLOCK_FORMAT_EXTRAS_KEY, block_format_from_meta
+from featurizer.storage.data_store_adapter.local_data_store_adapter import LocalDataStoreAdapter
+
+
+class TestDataStoreAdapter(unittest.TestCase):
+
+    def _mock_df(self, num_rows: int = 1000) -> pd.DataFrame:
+        rng = np.random.default_rng(0)
+        ts = 1675209600 + np.arange(num_rows) * 0.1
+        return pd.DataFrame({
+            'timestamp': ts,
+            'receipt_timestamp': ts + 0.01,
+            'update_type': rng.choice(np.array(['SNAPSHOT', 'ADD', 'SUB', 'SET'], dtype=object), size=num_rows),
+            'side': rng.choice(np.array(['bid', 'ask'], dtype=object), size=num_rows),
+            'price': rng.uniform(20000, 25000, size=num_rows),
+            'size': rng.uniform(0, 5, size=num_rows),
+        })
+
+    def test_store_load_block_formats(self):
+        df = self._mock_df()
+        adapter = LocalDataStoreAdapter()
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            for file_format in [PARQUET, ARROW_IPC]:
+                for compression in SUPPORTED_COMPRESSION[file_format]:
+                    for dictionary_columns in [(), ('side', 'update_type')]:
+                        block_format = BlockFormat(file_format, compression, dictionary_columns)
+                        path = os.path.join(tmp_dir, f'{len(dictionary_columns)}-block{block_format.extension()}')
+                        adapter.store_df(path, df, block_format=block_format)
+                        loaded = adapter.load_df(path, block_format=block_format)
+                        pd.testing.assert_frame_equal(loaded, df)
+
+            # blocks without recorded format are read as gzip parquet
+            path = os.path.join(tmp_dir, 'legacy.parquet.gz')
+            adapter.store_df(path, df)
+            pd.testing.assert_frame_equal(adapter.load_df(path, block_format=DEFAULT_BLOCK_FORMAT), df)
+
+        with self.assertRaises(ValueError):
+            BlockFormat(ARROW_IPC, 'gzip')
+
+    def test_load_projection_and_ts_range(self):
+        df = self._mock_df()
+        adapter = LocalDataStoreAdapter()
+        columns = ['timestamp', 'receipt_timestamp', 'side', 'price']
+        ts_range = (df['timestamp'].iloc[100], df['timestamp'].iloc[300])
+        expected = df.iloc[100: 301][columns].reset_index(drop=True)
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            for block_format in [DEFAULT_BLOCK_FORMAT, BlockFormat(PARQUET, 'zstd'), BlockFormat(ARROW_IPC, None, ('side',))]:
+                path = os.path.join(tmp_dir, f'block{block_format.extension()}')
+                adapter.store_df(path, df, block_format=block_format)
+                loaded = adapter.load_df(path, block_format=block_format, columns=columns, ts_range=ts_range)
+                pd.testing.assert_frame_equal(loaded.reset_index(drop=True), expected)
+                self.assertEqual(list(adapter.load_df(path, block_format=block_format, columns=columns).columns), columns)
+
+            # legacy blocks without format
+            path = os.path.join(tmp_dir, 'legacy.parquet.gz')
+            adapter.store_df(path, df)
+            loaded = adapter.load_df(path, columns=columns, ts_range=ts_range)
+            pd.testing.assert_frame_equal(loaded.reset_index(drop=True), expected)
+
+    def test_upstream_columns(self):
+        trades = Feature([], TradesData, {})
+        tvi = Feature([trades], TradeVolumeImbFD, {'window': '1m', 'sampling': '1s'})
+        self.assertEqual(upstream_columns([tvi]), {
+            tvi: None,
+            trades: ['timestamp', 'receipt_timestamp', 'side', 'amount', 'price'],
+        })
+        ohlcv = Feature([trades], OHLCVFD, {'window': '1m'})
+        self.assertEqual(upstream_columns([tvi, ohlcv])[trades], ['timestamp', 'receipt_timestamp', 'side', 'amount', 'price'])
+        # requested features are outputs
+        self.assertIsNone(upstream_columns([tvi, trades])[trades])
+
+        l2_inc = Feature([], CryptotickL2BookIncrementalData, {})
+        l2_snap = Feature([l2_inc], L2SnapshotFD, {'depth': 10})
+        mid_price = Feature([l2_snap], MidPriceFD, {})
+        volatility = Feature([mid_price], VolatilityStddevFD, {'window': '1m'})
+        self.assertEqual(upstream_columns([volatility]), {
+            volatility: None,
+            mid_price: ['timestamp', 'receipt_timestamp', 'mid_price'],
+            l2_snap: ['timestamp', 'receipt_timestamp', 'bid_px_0', 'ask_px_0'],
+            # raw l2 columns are all needed for preprocessing
+            l2_inc: None,
+        })
+
+    def test_block_format_policy(self):
+        hot = BlockFormat(ARROW_IPC, None, ('side', 'update_type'))
+        zstd = BlockFormat(PARQUET, 'zstd')
+        adapter = LocalDataStoreAdapter(block_formats={'CryptotickL2BookIncrementalData': zstd, 'feature-key': hot})
+        self.assertEqual(adapter.block_format('CryptotickL2BookIncrementalData'), zstd)
+        self.assertEqual(adapter.block_format('CryptotickL2BookIncrementalData', 'feature-key'), hot)
+        self.assertEqual(adapter.block_format('TradesData'), DEFAULT_BLOCK_FORMAT)
+
+        # format round trips through metadata and defines path extension
+        item = DataSourceBlockMetadata(
+            owner_id='0', key='key', data_source_definition='CryptotickL2BookIncrementalData',
+            start_ts=1675209600, end_ts=1675209700, day='2023-02-01', hash='hash',
+            extras={BLOCK_FORMAT_EXTRAS_KEY: hot.to_dict()}
+        )
+        self.assertEqual(block_format_from_meta({'extras': item.extras}), hot)
+        self.assertEqual(block_format_from_meta({'extras': {}}), DEFAULT_BLOCK_FORMAT)
+        self.assertTrue(adapter.make_data_source_block_path(item).endswith('/1675209600-hash.arrow'))
+        item.extras = None
+        self.assertTrue(adapter.make_data_source_block_path(item).endswith('/1675209600-hash.parquet.gz'))
+
+
+if __name__ == '__main__':
+    t = TestDataStoreAdapter()
+    t.test_store_load_block_formats()
+    t.test_block_format_policy()
+    t.test_load_projection_and_ts_range()
+    t.test_upstream_columns()
@@ -121,11 +121,7 @@ class FeaturizerStorage:
         raw_data = self.client.select_feature_blocks_metadata(feature_keys, start_day=start_day, end_day=end_day)
 
         groups = {}
-        def _feature_by_key(key):
-            for f in features:
-                if f.key == key:
-                    return f
-            return None
+        features_by_key = {f.key: f for f in features}
 
         start_ts = None if start_date is None else date_str_to_ts(start_date)
         end_ts = None if end_date is None else date_str_to_ts(end_date)
@@ -141,7 +137,7 @@ class FeaturizerStorage:
 
             # hacky fix for float precision
             interval = closed(round_float(_start_ts), round_float(_end_ts))
-            feature = _feature_by_key(feature_key)
+            feature = features_by_key.get(feature_key)
             if feature in groups:
                 if interval in groups[feature]:
                     raise ValueError('FeatureBlockMetadata entry duplicate interval')
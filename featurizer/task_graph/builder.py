@@ -5,15 +5,19 @@ import ray
 from ray.dag import DAGNode
 from ray.types import ObjectRef
 
-from featurizer.features.feature_tree.feature_tree import Feature, postorder
-from featurizer.blocks.blocks import meta_to_interval, interval_to_meta, get_overlaps, BlockRangeMeta, \
-    prune_overlaps, range_meta_to_interval, ranges_to_interval_dict, BlockMeta, overlaps_keys, is_sorted_intervals, \
-    intervals_almost_equal
-from portion import Interval, IntervalDict, closed
+from featurizer.features.feature_tree.feature_tree import Feature, postorder, upstream_columns
+from featurizer.blocks.blocks import meta_to_interval, get_overlaps, BlockRangeMeta, prune_overlaps, \
+    range_meta_to_interval, BlockMeta, is_sorted_intervals, data_block_key, block_memory_bytes
+from featurizer.blocks.interval_index import IntervalIndex
+from featurizer.task_graph.range_plan import RangePlans, plan_feature_ranges, plan_feature_set_ranges, \
+    load_or_plan_feature_set_ranges
+from portion import Interval, closed
 
 from featurizer.task_graph.tasks import calculate_feature, load_if_needed, bind_and_cache, context, \
-    lookahead_shift_blocks, point_in_time_join_block, load_and_preprocess, gen_synth_events
+    lookahead_shift_blocks, point_in_time_join_block, block_tail, load_and_preprocess, gen_synth_events, with_memory, \
+    memory_request
 from common.time.utils import convert_str_to_seconds
+from featurizer.storage.data_store_adapter.block_format import block_format_from_meta
 from featurizer.storage.data_store_adapter.data_store_adapter import DataStoreAdapter
 from featurizer.storage.data_store_adapter.local_data_store_adapter import LocalDataStoreAdapter
 from featurizer.storage.data_store_adapter.remote_data_store_adapter import RemoteDataStoreAdapter
@@ -22,6 +26,29 @@ from featurizer.storage.data_store_adapter.remote_data_store_adapter import Remo
 # TODO re: cache https://discuss.ray.io/t/best-way-to-share-memory-for-ray-tasks/3759
 # https://sourcegraph.com/github.com/ray-project/ray@master/-/blob/python/ray/tests/test_object_assign_owner.py?subtree=true
 
+# estimated in-memory size (bytes) of each block produced by the graph, per feature per block interval
+MemoryEstimates = Dict[Feature, Dict[Interval, float]]
+
+# max bounds diff (seconds) for a stored feature block to be reused for a block in the graph
+ALMOST_EQUAL_INTERVAL_DIFF = 0.15
+
+# tasks which ray.get all dep blocks hold inputs, concatenated/merged copies and output at the same time
+TASK_MEMORY_OVERHEAD_FACTOR = 3
+
+
+def _set_memory_estimate(memory_estimates: Optional[MemoryEstimates], feature: Feature, interval: Interval, size: float):
+    if memory_estimates is None:
+        return
+    if feature not in memory_estimates:
+        memory_estimates[feature] = {}
+    memory_estimates[feature][interval] = size
+
+
+def _get_memory_estimate(memory_estimates: Optional[MemoryEstimates], feature: Feature, interval: Interval) -> float:
+    if memory_estimates is None or feature not in memory_estimates:
+        return 0
+    return memory_estimates[feature].get(interval, 0)
+
 
 def build_feature_task_graph(
     dag: Dict[Feature, Dict[Interval, Dict[Interval, DAGNode]]], # DAGNodes per feature per range
@@ -30,11 +57,22 @@ def build_feature_task_graph(
     obj_ref_cache: Dict[str, Dict[Interval, Tuple[int, Optional[ObjectRef]]]],
     features_to_store: Optional[List[Feature]] = None,
     stored_feature_blocks_meta: Optional[Dict[Feature, Dict[Interval, BlockMeta]]] = None,
-    data_store_adapter: DataStoreAdapter = LocalDataStoreAdapter()
+    data_store_adapter: DataStoreAdapter = LocalDataStoreAdapter(),
+    memory_estimates: Optional[MemoryEstimates] = None,
+    columns_per_feature: Optional[Dict[Feature, Optional[List[str]]]] = None,
+    range_plans: Optional[RangePlans] = None
 ) -> Dict[Feature, Dict[Interval, Dict[Interval, DAGNode]]]:
-    features_ranges_meta = {}
+    # blocks are loaded with columns consumers need, see upstream_columns
+    columns_per_feature = {} if columns_per_feature is None else columns_per_feature
+    # block intervals and their deps are planned once per feature, nodes are bound here
+    range_plans = plan_feature_ranges(feature, data_ranges_meta, {} if range_plans is None else range_plans)
+    # features shared by multiple branches of this tree are bound once
+    bound = set()
 
     def tree_traversal_callback(feature: Feature):
+        if feature.key in bound:
+            return
+        bound.add(feature.key)
         if feature.data_definition.is_data_source():
             # leafs
             # TODO decouple derived feature_ranges_meta and input data ranges meta
@@ -46,15 +84,16 @@ def build_feature_task_graph(
                 nodes = {}
                 for block_meta in block_range_meta:
                     interval = meta_to_interval(block_meta)
+                    _set_memory_estimate(memory_estimates, feature, interval, block_memory_bytes(block_meta))
                     ctx = context(feature.key, interval)
                     if feature.data_definition.is_synthetic():
                         node = bind_and_cache(gen_synth_events, obj_ref_cache, ctx, interval=interval, synth_data_def=feature.data_definition, params=feature.params)
                     else:
                         path = block_meta['path']
-                        # TODO call load_and_preprocess only if data_def needs preproc, otherwise call load_if_needed
-                        # this will save workers
-                        # node = bind_and_cache(load_if_needed, obj_ref_cache, ctx, path=path, is_feature=False)
-                        node = bind_and_cache(load_and_preprocess, obj_ref_cache, ctx, path=path, data_def=feature.data_definition, data_store_adapter=data_store_adapter, is_feature=False)
+                        # preprocessing needs raw columns, preprocessed blocks are not projected
+                        columns = None if feature.data_definition.needs_preprocessing() else columns_per_feature.get(feature)
+                        node = bind_and_cache(load_and_preprocess, obj_ref_cache, ctx, path=path, data_def=feature.data_definition, data_store_adapter=data_store_adapter, is_feature=False, block_key=data_block_key(block_meta),
+                                              block_format=block_format_from_meta(block_meta), columns=columns)
 
                     # TODO validate no overlapping intervals here
                     nodes[interval] = node
@@ -63,61 +102,47 @@ def build_feature_task_graph(
                 dag[feature][range_interval] = nodes
             return
 
-        ranges_per_dep_feature = {}
-        for dep_feature in feature.children:
-            meta = data_ranges_meta[dep_feature] if dep_feature.data_definition.is_data_source() else features_ranges_meta[dep_feature]
-            ranges_per_dep_feature[dep_feature] = ranges_to_interval_dict(meta)
-
-        range_intervals = prune_overlaps(get_overlaps(ranges_per_dep_feature))
-        # print(range_intervals)
-        # raise
-        for range_interval in range_intervals:
-            range_meta_per_dep_feature = range_intervals[range_interval]
-
-            grouped_ranges_by_dep_feature = {}
-            for dep_feature in feature.children:
-                dep_ranges = range_meta_per_dep_feature[dep_feature]
-                # TODO this should be in Feature class
-                grouped_ranges_by_dep_feature[dep_feature] = feature.data_definition.group_dep_ranges(dep_ranges, feature, dep_feature)
-
-            overlaps = get_overlaps(grouped_ranges_by_dep_feature)
-            block_range_meta = []
+        plan = range_plans[feature.key]
+        deps_by_key = {dep_feature.key: dep_feature for dep_feature in feature.children}
+        stored_blocks_index = None
+        if stored_feature_blocks_meta is not None and feature in stored_feature_blocks_meta:
+            stored_blocks_index = _stored_blocks_index(stored_feature_blocks_meta[feature])
+        if feature not in dag:
+            dag[feature] = {}
+        for range_interval, blocks in plan.ranges.items():
             nodes = {}
-            for interval, overlap in overlaps.items():
+            for interval, dep_intervals_per_key in blocks.items():
                 # TODO add size_kb/memory_size_kb to proper size memory usage for aggregate tasks downstream
-                result_meta = interval_to_meta(interval)
-                block_range_meta.append(result_meta)
-                if feature not in dag:
-                    dag[feature] = {}
-
-                # TODO use overlap to fetch results of dep delayed funcs
                 dep_nodes = {}
-                for dep_feature in overlap:
+                deps_memory = 0
+                for dep_key, dep_intervals in dep_intervals_per_key.items():
+                    dep_feature = deps_by_key[dep_key]
                     ds = []
-                    for dep_block_meta in overlap[dep_feature]:
-                        dep_interval = meta_to_interval(dep_block_meta)
-                        # print(dep_block_meta)
-                        # print(dep_interval)
-                        # print(dag[dep_feature][])
-                        # raise
+                    for dep_interval in dep_intervals:
                         dep_node = dag[dep_feature][range_interval][dep_interval]
                         ds.append(dep_node)
+                        deps_memory += _get_memory_estimate(memory_estimates, dep_feature, dep_interval)
                     dep_nodes[dep_feature] = ds
+                # output size is unknown before calculation, assume it is not bigger than inputs
+                _set_memory_estimate(memory_estimates, feature, interval, deps_memory)
+                # reserved by the task calculating the block, not by calculate_feature itself
+                calc_memory = memory_request(TASK_MEMORY_OVERHEAD_FACTOR * deps_memory)
 
                 ctx = context(feature.key, interval)
-                if stored_feature_blocks_meta is not None and feature in stored_feature_blocks_meta:
-                    almost_equal_interval = None
-                    for i in stored_feature_blocks_meta[feature]:
-                        if intervals_almost_equal(i, interval):
-                            if almost_equal_interval is not None:
-                                # TODO warning?
-                                raise ValueError(f'[{feature}] More than one almost equal interval')
-                            almost_equal_interval = i
-                    if almost_equal_interval is not None:
+                if stored_blocks_index is not None:
+                    almost_equal = stored_blocks_index.almost_equal(interval, ALMOST_EQUAL_INTERVAL_DIFF)
+                    if len(almost_equal) > 1:
+                        # TODO warning?
+                        raise ValueError(f'[{feature}] More than one almost equal interval')
+                    if len(almost_equal) == 1:
                         # load cached block
-                        path = stored_feature_blocks_meta[feature][almost_equal_interval]['path']
+                        stored_block_meta = almost_equal[0][1]
+                        path = stored_block_meta['path']
+                        _set_memory_estimate(memory_estimates, feature, interval, block_memory_bytes(stored_block_meta))
                         node = bind_and_cache(load_if_needed, obj_ref_cache, ctx, path=path,
-                                              data_store_adapter=data_store_adapter, is_feature=True)
+                                              data_store_adapter=data_store_adapter, is_feature=True,
+                                              block_format=block_format_from_meta(stored_block_meta),
+                                              columns=columns_per_feature.get(feature))
                     else:
                         # TODO warning
                         print(f'[{feature}] Feature is cached but no intervals match, possibly malformed feature')
@@ -125,49 +150,68 @@ def build_feature_task_graph(
                         store = features_to_store is not None and feature in features_to_store
                         node = bind_and_cache(calculate_feature, obj_ref_cache, ctx, feature=feature,
                                               dep_refs=dep_nodes, interval=interval,
-                                              data_store_adapter=data_store_adapter, store=store)
+                                              data_store_adapter=data_store_adapter, store=store, memory=calc_memory)
                 else:
                     # calc block
                     store = features_to_store is not None and feature in features_to_store
                     node = bind_and_cache(calculate_feature, obj_ref_cache, ctx, feature=feature, dep_refs=dep_nodes,
-                                          interval=interval, data_store_adapter=data_store_adapter, store=store)
+                                          interval=interval, data_store_adapter=data_store_adapter, store=store,
+                                          memory=calc_memory)
 
                 # TODO validate interval is within range_interval
                 nodes[interval] = node
 
             # TODO check if range_interval intersects with existing keys/intervals
             dag[feature][range_interval] = nodes
-            # TODO check if duplicate feature
-            if feature not in features_ranges_meta:
-                features_ranges_meta[feature] = [block_range_meta]
-            else:
-                features_ranges_meta[feature].append(block_range_meta)
 
     postorder(feature, tree_traversal_callback)
 
     return dag
 
 
+def _stored_blocks_index(stored_blocks_meta: Dict[Interval, BlockMeta]) -> IntervalIndex:
+    return IntervalIndex(sorted(stored_blocks_meta.items(), key=lambda e: (e[0].lower, e[0].upper)))
+
+
 def build_feature_set_task_graph(
     features: List[Feature],
     data_ranges_meta: Dict[Feature, List[BlockRangeMeta]],
     obj_ref_cache: Dict[str, Dict[Interval, Tuple[int, Optional[ObjectRef]]]],
     features_to_store: Optional[List[Feature]] = None,
     stored_feature_blocks_meta: Optional[Dict[Feature, Dict[Interval, BlockMeta]]] = None,
+    memory_estimates: Optional[MemoryEstimates] = None,
+    range_plans_dir: Optional[str] = None
 ) -> Dict[Feature, Dict[Interval, Dict[Interval, DAGNode]]]:
     dag = {}
+    # blocks are shared between trees of all features, so projections are computed over whole feature set
+    columns_per_feature = upstream_columns(features)
+    # plans of shared subtrees are reused by all features, persisted plans skip planning on re-runs over same data
+    if range_plans_dir is not None:
+        range_plans = load_or_plan_feature_set_ranges(features, data_ranges_meta, range_plans_dir)
+    else:
+        range_plans = plan_feature_set_ranges(features, data_ranges_meta)
     for feature in features:
         dag = build_feature_task_graph(
             dag, feature, data_ranges_meta, obj_ref_cache,
             features_to_store=features_to_store,
-            stored_feature_blocks_meta=stored_feature_blocks_meta
+            stored_feature_blocks_meta=stored_feature_blocks_meta,
+            memory_estimates=memory_estimates,
+            columns_per_feature=columns_per_feature,
+            range_plans=range_plans
         )
 
     return dag
 
 
-def build_lookahead_graph(feature_graph: Dict[Interval, Dict[Interval, DAGNode]], lookahead: str) -> Dict[Interval, Dict[Interval, DAGNode]]:
+def build_lookahead_graph(
+    feature_graph: Dict[Interval, Dict[Interval, DAGNode]],
+    lookahead: str,
+    block_memory_estimates: Optional[Dict[Interval, float]] = None,
+    shifted_memory_estimates: Optional[Dict[Interval, float]] = None
+) -> Dict[Interval, Dict[Interval, DAGNode]]:
     lookahead_s = convert_str_to_seconds(lookahead)
+    if block_memory_estimates is None:
+        block_memory_estimates = {}
     res = {}
     for range_interval in feature_graph:
         shifted_nodes = {}
@@ -182,21 +226,28 @@ def build_lookahead_graph(feature_graph: Dict[Interval, Dict[Interval, DAGNode]]
         for i in range(len(intervals)):
             interval = intervals[i]
             group = [nodes[i]]
+            group_memory = block_memory_estimates.get(interval, 0)
             end = min(interval.upper + lookahead_s, intervals[-1].upper)
             for j in range(i + 1, len(intervals)):
                 if intervals[j].upper <= end or (intervals[j].lower <= end <= intervals[j].upper):
                     group.append(nodes[j])
+                    group_memory += block_memory_estimates.get(intervals[j], 0)
                 else:
                     break
+            shift_func = with_memory(lookahead_shift_blocks, TASK_MEMORY_OVERHEAD_FACTOR * group_memory)
             if i < len(intervals) - 1:
-                shifted_node = lookahead_shift_blocks.bind(group, interval, lookahead)
+                shifted_node = shift_func.bind(group, interval, lookahead)
                 shifted_nodes[interval] = shifted_node
             else:
                 # truncate last interval
                 if interval.upper - lookahead_s > interval.lower:
                     interval = closed(interval.lower, interval.upper - lookahead_s)
-                    shifted_node = lookahead_shift_blocks.bind(group, interval, lookahead)
+                    shifted_node = shift_func.bind(group, interval, lookahead)
                     shifted_nodes[interval] = shifted_node
+                else:
+                    continue
+            if shifted_memory_estimates is not None:
+                shifted_memory_estimates[interval] = block_memory_estimates.get(intervals[i], 0)
         res[range_interval] = shifted_nodes
 
     return res
@@ -206,22 +257,23 @@ def point_in_time_join_dag(
     dag: Dict[Feature, Dict[Interval, Dict[Interval, DAGNode]]],
     features_to_join: List[Feature],
     label_feature: Optional[Feature],
-    result_owner: Optional[ray.actor.ActorHandle] = None
+    result_owner: Optional[ray.actor.ActorHandle] = None,
+    memory_estimates: Optional[MemoryEstimates] = None
 ) -> Dict[Interval, Dict[Interval, DAGNode]]:
     # get range overlaps first
     ranges_per_feature = {}
     for feature in features_to_join:
         if feature not in dag:
             raise ValueError(f'Feature {feature} not found in dag')
-        ranges_dict = IntervalDict()
-        for range_interval in dag[feature]:
+        ranges_dict = IntervalIndex()
+        for range_interval in sorted(dag[feature], key=lambda i: i.lower):
             range_and_node_list = []
             range_dict = dag[feature][range_interval]
 
             # TODO make sure range_list is ts sorted
             for interval in range_dict:
                 range_and_node_list.append((interval, range_dict[interval]))
-            if overlaps_keys(range_interval, ranges_dict):
+            if ranges_dict.overlaps(range_interval):
                 raise ValueError(f'Overlapping intervals: for {range_interval}')
             ranges_dict[range_interval] = range_and_node_list
         ranges_per_feature[feature] = ranges_dict
@@ -233,29 +285,36 @@ def point_in_time_join_dag(
         nodes_per_feature = overlapped_range_intervals[range_interval]
 
         nodes_per_feature_per_interval = {}
+        # node identity -> estimated size of its output block
+        memory_per_node = {}
         for feature in nodes_per_feature:
-            nodes_per_interval = IntervalDict()
+            nodes_per_interval = IntervalIndex()
             for interval_node_tuple in nodes_per_feature[feature]:
                 interval = interval_node_tuple[0]
                 node = interval_node_tuple[1]
                 nodes_per_interval[interval] = node
+                memory_per_node[id(node)] = _get_memory_estimate(memory_estimates, feature, interval)
             nodes_per_feature_per_interval[feature] = nodes_per_interval
 
         overlaps = get_overlaps(nodes_per_feature_per_interval)
+        # node identity -> node producing last row of its block, shared between joins using the same prev node
+        tail_nodes = {}
+        # node identity -> prev node of the same feature, linked in a single pass over ts sorted nodes
+        prev_nodes = {}
+        for feature in nodes_per_feature_per_interval:
+            nodes = nodes_per_feature_per_interval[feature].values()
+            for prev_node, node in zip(nodes, nodes[1:]):
+                prev_nodes[id(node)] = prev_node
 
         def get_prev_nodes(cur_nodes_per_feature: Dict[Feature, ObjectRef]) -> Dict[Feature, ObjectRef]:
             res = {}
             for feature in cur_nodes_per_feature:
-                # TODO here we assume they are ts sorted
-                nodes = list(nodes_per_feature_per_interval[feature].values())
-                prev_node = None
-                cur_node = cur_nodes_per_feature[feature]
-                for i in range(len(nodes)):
-                    if nodes[i] == cur_node and i > 0:
-                        prev_node = nodes[i - 1]
-
+                prev_node = prev_nodes.get(id(cur_nodes_per_feature[feature]))
                 if prev_node is not None:
-                    res[feature] = prev_node
+                    # join only needs the last row of prev block, don't pass the whole block
+                    if id(prev_node) not in tail_nodes:
+                        tail_nodes[id(prev_node)] = block_tail.bind(prev_node)
+                    res[feature] = tail_nodes[id(prev_node)]
 
             return res
 
@@ -265,8 +324,10 @@ def point_in_time_join_dag(
             # we need to know prev values for join
             # in case one value is at the start of current block and another is in the end of prev block
             prev_interval_nodes = get_prev_nodes(nodes_per_feature)
-            # TODO set resource spec here
-            join_node = point_in_time_join_block.bind(interval, nodes_per_feature, prev_interval_nodes, label_feature, result_owner)
+            # prev nodes are single row tails, their size is negligible
+            join_memory = sum(memory_per_node[id(node)] for node in nodes_per_feature.values())
+            join_func = with_memory(point_in_time_join_block, TASK_MEMORY_OVERHEAD_FACTOR * join_memory)
+            join_node = join_func.bind(interval, nodes_per_feature, prev_interval_nodes, label_feature, result_owner)
             joined_nodes[interval] = join_node
 
         res[range_interval] = joined_nodes
@@ -283,24 +344,34 @@ def build_feature_label_set_task_graph(
     obj_ref_cache: Dict[str, Dict[Interval, Tuple[int, Optional[ObjectRef]]]],
     features_to_store: Optional[List[Feature]] = None,
     stored_feature_blocks_meta: Optional[Dict[Feature, Dict[Interval, BlockMeta]]] = None,
-    result_owner: Optional[ray.actor.ActorHandle] = None
+    result_owner: Optional[ray.actor.ActorHandle] = None,
+    range_plans_dir: Optional[str] = None
 ) -> Dict[Interval, Dict[Interval, DAGNode]]:
+    memory_estimates = {}
     dag = build_feature_set_task_graph(
         features=features,
         data_ranges_meta=data_ranges_meta,
         obj_ref_cache=obj_ref_cache,
         features_to_store=features_to_store,
-        stored_feature_blocks_meta=stored_feature_blocks_meta
+        stored_feature_blocks_meta=stored_feature_blocks_meta,
+        memory_estimates=memory_estimates,
+        range_plans_dir=range_plans_dir
     )
     label_feature = None
     if label is not None:
-        lookahead_dag = build_lookahead_graph(dag[label], label_lookahead)
         label_feature = Feature.make_label(label)
+        label_memory_estimates = {}
+        lookahead_dag = build_lookahead_graph(
+            dag[label], label_lookahead,
+            block_memory_estimates=memory_estimates.get(label, {}),
+            shifted_memory_estimates=label_memory_estimates
+        )
         print(label_feature)
         print(lookahead_dag)
         dag[label_feature] = lookahead_dag
+        memory_estimates[label_feature] = label_memory_estimates
         features.append(label_feature)
 
     # for k in dag.keys():
     #     print(k, k.key, k._is_label, k.name)
-    return point_in_time_join_dag(dag, features, label_feature, result_owner=result_owner)
+    return point_in_time_join_dag(dag, features, label_feature, result_owner=result_owner, memory_estimates=memory_estimates)
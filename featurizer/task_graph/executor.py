@@ -1,4 +1,6 @@
-from typing import List, Dict, Tuple, Any
+import time
+from dataclasses import dataclass, field
+from typing import List, Dict, Tuple, Any, Optional, Set
 
 import ray
 from intervaltree import Interval
@@ -10,22 +12,28 @@ from featurizer.features.feature_tree.feature_tree import Feature
 
 import ray.internal
 
-
-def execute_graph(dag: Dict[Interval, Dict[Interval, DAGNode]], parallelism: int = 12) -> List[ObjectRef]:
-    refs_by_interval = {}
-
-    cur_range_index = 0
-    num_ranges = len(dag)
+# each root node (join task) reserves this much CPU from scheduler budget
+DEFAULT_TASK_CPUS = 1.0
+# allow more root tasks than CPUs so upstream load/preprocess tasks of next blocks overlap with calculations
+DEFAULT_CPU_OVERSUBSCRIPTION = 2.0
+# fraction of cluster memory available to in-flight tasks
+DEFAULT_MEMORY_FRACTION = 0.8
+PROGRESS_REPORT_INTERVAL_S = 5
+
+
+def execute_graph(
+    dag: Dict[Interval, Dict[Interval, DAGNode]],
+    parallelism: Optional[int] = None,
+    cpu_budget: Optional[float] = None,
+    memory_budget: Optional[float] = None
+) -> List[ObjectRef]:
+    # all ranges are scheduled at once, scheduler keeps range order when admitting tasks
+    keyed_nodes = []
     for range_interval in dag:
-        # we create new list of nodes for each range so we can print progress
-        # alternatively we can flatten whole graph and execute it
-        keyed_nodes = []
         for interval in dag[range_interval]:
             keyed_nodes.append((interval, dag[range_interval][interval]))
-        print(f'Executing {cur_range_index + 1}/{num_ranges} range: {range_interval}')
-        refs = execute_flattened_nodes(keyed_nodes, parallelism)
-        refs_by_interval.update(refs)
-        cur_range_index += 1
+    print(f'Executing {len(keyed_nodes)} tasks in {len(dag)} ranges')
+    refs_by_interval = execute_flattened_nodes(keyed_nodes, parallelism, cpu_budget=cpu_budget, memory_budget=memory_budget)
 
     # sort resulting refs by interval
     srt = dict(sorted(refs_by_interval.items()))
@@ -38,65 +46,155 @@ def execute_graph(dag: Dict[Interval, Dict[Interval, DAGNode]], parallelism: int
     result_refs = ray.get(res)
     return result_refs
 
-# executes
-def execute_flattened_nodes(nodes: List[Tuple[Any, DAGNode]], parallelism: int) -> Dict[Any, List[ObjectRef]]:
-    results_refs_per_key = {}
-    executing_refs_per_key = {}
 
-    def flatten(refs):
-        res = []
-        for k in refs:
-            res.extend(refs[k])
-        return res
-
-    def get_key_by_ref(ref, d):
-        for k in d:
-            if ref in d[k]:
-                return k
-        return None
-
-    i = 0
-    # TODO merge this with Scheduler in PipelineRunner
-    while i < len(nodes):
-        _key = nodes[i][0]
-        node = nodes[i][1]
-        num_executing_tasks = 0
-        for k in executing_refs_per_key:
-            num_executing_tasks += len(executing_refs_per_key[k])
-        if num_executing_tasks < parallelism:
-            print(f'Scheduled {i + 1}/{len(nodes)} dags')
-            if _key in executing_refs_per_key:
-                executing_refs_per_key[_key].append(node.execute())
-            else:
-                executing_refs_per_key[_key] = [node.execute()]
-            i += 1
+def execute_flattened_nodes(
+    nodes: List[Tuple[Any, DAGNode]],
+    parallelism: Optional[int] = None,
+    cpu_budget: Optional[float] = None,
+    memory_budget: Optional[float] = None
+) -> Dict[Any, List[ObjectRef]]:
+    scheduler = DagScheduler(parallelism=parallelism, cpu_budget=cpu_budget, memory_budget=memory_budget)
+    return scheduler.run(nodes)
+
+
+# sum of Ray memory resource requests of all tasks in the node's subgraph, including memory nodes pass
+# to tasks they submit (memory kwarg, e.g. calculate_feature).
+# Nodes are deduplicated by identity, pass the same visited set for multiple roots so subgraphs shared
+# between them (e.g. prev blocks for join, shared deps) are counted once, for the first root which needs them
+def dag_memory(node: DAGNode, visited: Optional[Set[int]] = None) -> float:
+    res = 0
+    if visited is None:
+        visited = set()
+    stack = [node]
+    while len(stack) > 0:
+        cur = stack.pop()
+        if id(cur) in visited:
+            continue
+        visited.add(id(cur))
+        res += cur.get_options().get('memory', 0) or 0
+        res += cur.get_kwargs().get('memory', 0) or 0
+        stack.extend(cur._get_all_child_nodes())
+    return res
 
-        ready, _ = ray.wait(flatten(executing_refs_per_key), num_returns=1, fetch_local=False, timeout=0.001)
 
-        for ref in ready:
-            key = get_key_by_ref(ref, executing_refs_per_key)
-            if key in results_refs_per_key:
-                results_refs_per_key[key].append(ref)
-            else:
-                results_refs_per_key[key] = [ref]
-
-            executing_refs_per_key[key].remove(ref)
-
-    # all scheduled, wait for completion
-    while len(flatten(executing_refs_per_key)) > 0:
-        ready, remaining = ray.wait(flatten(executing_refs_per_key), num_returns=len(flatten(executing_refs_per_key)), fetch_local=False,
-                                    timeout=0.001)
-        for ref in ready:
-            feature = get_key_by_ref(ref, executing_refs_per_key)
-            if feature in results_refs_per_key:
-                results_refs_per_key[feature].append(ref)
+@dataclass
+class _Task:
+    key: Any
+    node: DAGNode
+    position: int
+    cpus: float = DEFAULT_TASK_CPUS
+    memory: float = 0
+    submitted_at: Optional[float] = None
+
+
+@dataclass
+class ExecutionStats:
+    num_tasks: int = 0
+    num_finished: int = 0
+    started_at: float = field(default_factory=time.time)
+    task_durations: List[float] = field(default_factory=list)
+
+    def throughput(self) -> float:
+        elapsed = time.time() - self.started_at
+        return self.num_finished / elapsed if elapsed > 0 else 0.0
+
+    def report(self, num_running: int) -> str:
+        throughput = self.throughput()
+        eta = (self.num_tasks - self.num_finished) / throughput if throughput > 0 else float('inf')
+        avg_duration = sum(self.task_durations) / len(self.task_durations) if len(self.task_durations) > 0 else 0.0
+        return f'Finished {self.num_finished}/{self.num_tasks} tasks, running: {num_running}, ' \
+               f'throughput: {throughput:.2f} tasks/s, avg task time: {avg_duration:.2f}s, ' \
+               f'elapsed: {time.time() - self.started_at:.1f}s, eta: {eta:.1f}s'
+
+
+# Event-driven scheduler for root DAG nodes: submits nodes in order while they fit into CPU/memory budgets
+# and blocks on ray.wait until some of the in-flight tasks finish
+# TODO merge this with Scheduler in PipelineRunner
+class DagScheduler:
+
+    def __init__(
+        self,
+        parallelism: Optional[int] = None,
+        cpu_budget: Optional[float] = None,
+        memory_budget: Optional[float] = None
+    ):
+        # parallelism is an optional hard cap on number of in-flight tasks
+        self.parallelism = parallelism
+        cluster_resources = ray.cluster_resources() if ray.is_initialized() else {}
+        if cpu_budget is None:
+            cpu_budget = cluster_resources.get('CPU', 1.0) * DEFAULT_CPU_OVERSUBSCRIPTION
+        if memory_budget is None:
+            memory_budget = cluster_resources.get('memory', float('inf')) * DEFAULT_MEMORY_FRACTION
+        self.cpu_budget = cpu_budget
+        self.memory_budget = memory_budget
+        self.used_cpus = 0.0
+        self.used_memory = 0.0
+        self.in_flight: Dict[ObjectRef, _Task] = {}
+        self.stats = ExecutionStats()
+
+    def run(self, nodes: List[Tuple[Any, DAGNode]]) -> Dict[Any, List[ObjectRef]]:
+        # roots are admitted in order, so shared subgraph memory is attributed to the first root using it
+        visited = set()
+        pending = [
+            _Task(key=nodes[i][0], node=nodes[i][1], position=i, memory=dag_memory(nodes[i][1], visited))
+            for i in range(len(nodes))
+        ]
+        return self.run_tasks(pending)
+
+    def run_tasks(self, tasks: List[_Task]) -> Dict[Any, List[ObjectRef]]:
+        self.stats = ExecutionStats(num_tasks=len(tasks))
+        results: Dict[int, Tuple[Any, ObjectRef]] = {}
+        next_task_index = 0
+        last_report_ts = time.time()
+        while next_task_index < len(tasks) or len(self.in_flight) > 0:
+            while next_task_index < len(tasks) and self._can_admit(tasks[next_task_index]):
+                self._submit(tasks[next_task_index])
+                next_task_index += 1
+
+            # block until at least one task is done, then collect everything else which is ready
+            ready, remaining = ray.wait(list(self.in_flight.keys()), num_returns=1, fetch_local=False)
+            if len(remaining) > 0:
+                more_ready, _ = ray.wait(remaining, num_returns=len(remaining), fetch_local=False, timeout=0)
+                ready.extend(more_ready)
+            for ref in ready:
+                task = self._release(ref)
+                results[task.position] = (task.key, ref)
+
+            if time.time() - last_report_ts > PROGRESS_REPORT_INTERVAL_S or len(results) == len(tasks):
+                print(f'[DagScheduler] {self.stats.report(len(self.in_flight))}')
+                last_report_ts = time.time()
+
+        res = {}
+        for position in sorted(results.keys()):
+            key, ref = results[position]
+            if key in res:
+                res[key].append(ref)
             else:
-                results_refs_per_key[feature] = [ref]
-
-            executing_refs_per_key[feature].remove(ref)
+                res[key] = [ref]
+        return res
 
-    # return {feature: ray.get(results_refs_per_key[feature]) for feature in results_refs_per_key}
-    return results_refs_per_key
+    def _can_admit(self, task: _Task) -> bool:
+        # always admit if nothing is running, otherwise an oversized task would never be scheduled
+        if len(self.in_flight) == 0:
+            return True
+        if self.parallelism is not None and len(self.in_flight) >= self.parallelism:
+            return False
+        return self.used_cpus + task.cpus <= self.cpu_budget and self.used_memory + task.memory <= self.memory_budget
+
+    def _submit(self, task: _Task):
+        task.submitted_at = time.time()
+        ref = task.node.execute()
+        self.in_flight[ref] = task
+        self.used_cpus += task.cpus
+        self.used_memory += task.memory
+
+    def _release(self, ref: ObjectRef) -> _Task:
+        task = self.in_flight.pop(ref)
+        self.used_cpus -= task.cpus
+        self.used_memory -= task.memory
+        self.stats.num_finished += 1
+        self.stats.task_durations.append(time.time() - task.submitted_at)
+        return task
 
 
 def flatten_feature_set_task_graph_NOT_USED(
@@ -0,0 +1,124 @@
+import os
+import pickle
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional
+
+import joblib
+from portion import Interval
+
+from featurizer.blocks.blocks import BlockRangeMeta, ranges_to_interval_index, prune_overlaps, get_overlaps, \
+    meta_to_interval, interval_to_meta
+from featurizer.features.feature_tree.feature_tree import Feature, postorder
+
+RANGE_PLANS_DIR = '/tmp/svoe/range_plans'
+# bump when planner logic or FeatureRangePlan layout changes, so persisted plans are not reused
+RANGE_PLAN_FORMAT_VERSION = '1'
+
+
+# Block intervals of a derived feature per range interval and, for each block, intervals of dep blocks
+# (per dep feature key) it is calculated from. Plans depend only on data ranges metadata and feature definitions,
+# so the plan of a subtree shared by multiple features (e.g. l2 snapshots) is computed once
+@dataclass
+class FeatureRangePlan:
+    # range interval -> block interval -> dep feature key -> dep block intervals
+    ranges: Dict[Interval, Dict[Interval, Dict[str, List[Interval]]]] = field(default_factory=dict)
+
+    # block ranges of the feature as metadata, input for planning its parents
+    def block_ranges_meta(self) -> List[BlockRangeMeta]:
+        return [[interval_to_meta(interval) for interval in blocks] for blocks in self.ranges.values()]
+
+
+# feature key -> plan
+RangePlans = Dict[str, FeatureRangePlan]
+
+
+# plans all derived features in the tree of given feature, features already in plans are skipped
+def plan_feature_ranges(
+    feature: Feature,
+    data_ranges_meta: Dict[Feature, List[BlockRangeMeta]],
+    plans: RangePlans
+) -> RangePlans:
+
+    def tree_traversal_callback(feature: Feature):
+        if feature.data_definition.is_data_source() or feature.key in plans:
+            return
+
+        ranges_per_dep_feature = {}
+        for dep_feature in feature.children:
+            if dep_feature.data_definition.is_data_source():
+                meta = data_ranges_meta[dep_feature]
+            else:
+                meta = plans[dep_feature.key].block_ranges_meta()
+            ranges_per_dep_feature[dep_feature] = ranges_to_interval_index(meta)
+
+        plan = FeatureRangePlan()
+        range_intervals = prune_overlaps(get_overlaps(ranges_per_dep_feature))
+        for range_interval in range_intervals:
+            range_meta_per_dep_feature = range_intervals[range_interval]
+
+            grouped_ranges_by_dep_feature = {}
+            for dep_feature in feature.children:
+                dep_ranges = range_meta_per_dep_feature[dep_feature]
+                grouped_ranges_by_dep_feature[dep_feature] = feature.data_definition.group_dep_ranges(feature, {dep_feature: dep_ranges})
+
+            overlaps = get_overlaps(grouped_ranges_by_dep_feature)
+            blocks = {}
+            for interval, overlap in overlaps.items():
+                blocks[interval] = {
+                    dep_feature.key: [meta_to_interval(dep_block_meta) for dep_block_meta in overlap[dep_feature]]
+                    for dep_feature in overlap
+                }
+            plan.ranges[range_interval] = blocks
+
+        plans[feature.key] = plan
+
+    postorder(feature, tree_traversal_callback)
+    return plans
+
+
+def plan_feature_set_ranges(
+    features: List[Feature],
+    data_ranges_meta: Dict[Feature, List[BlockRangeMeta]],
+    plans: Optional[RangePlans] = None
+) -> RangePlans:
+    plans = {} if plans is None else plans
+    for feature in features:
+        plan_feature_ranges(feature, data_ranges_meta, plans)
+    return plans
+
+
+# identifies plans of given features over given data blocks, re-runs over the same dates get the same key.
+# Definition versions and plan format are part of the key, so changed grouping logic invalidates persisted plans
+def range_plans_key(features: List[Feature], data_ranges_meta: Dict[Feature, List[BlockRangeMeta]]) -> str:
+    data_ranges = []
+    for data_feature in sorted(data_ranges_meta, key=lambda f: f.key):
+        intervals = [[(i.lower, i.upper) for i in map(meta_to_interval, block_range_meta)] for block_range_meta in data_ranges_meta[data_feature]]
+        data_ranges.append((data_feature.key, intervals))
+
+    versions = {}
+
+    def callback(node: Feature):
+        versions[node.key] = node.data_definition.version()
+
+    for feature in features:
+        postorder(feature, callback)
+    return joblib.hash([RANGE_PLAN_FORMAT_VERSION, sorted(f.key for f in features), sorted(versions.items()), data_ranges])
+
+
+def load_or_plan_feature_set_ranges(
+    features: List[Feature],
+    data_ranges_meta: Dict[Feature, List[BlockRangeMeta]],
+    plans_dir: str = RANGE_PLANS_DIR
+) -> RangePlans:
+    path = os.path.join(plans_dir, f'{range_plans_key(features, data_ranges_meta)}.pkl')
+    if os.path.isfile(path):
+        with open(path, 'rb') as f:
+            return pickle.load(f)
+    plans = plan_feature_set_ranges(features, data_ranges_meta)
+    os.makedirs(plans_dir, exist_ok=True)
+    # write to temp file first so concurrent runs never read partial plans
+    tmp_path = f'{path}.{os.getpid()}.tmp'
+    with open(tmp_path, 'wb') as f:
+        pickle.dump(plans, f, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(tmp_path, path)
+    return plans
@@ -9,19 +9,19 @@ import ray
 from portion import Interval
 from ray.dag import DAGNode
 from ray.types import ObjectRef
-from streamz import Stream
 
 from featurizer.actors.cache_actor import get_cache_actor
-from featurizer.blocks.blocks import Block, lookahead_shift, merge_asof_multi
+from featurizer.blocks.blocks import Block, lookahead_shift, point_in_time_join
 from featurizer.data_definitions.data_source_definition import DataSourceDefinition
 from featurizer.data_definitions.synthetic_data_source_definition import SyntheticDataSourceDefinition
 from featurizer.features.feature_tree.feature_tree import Feature
-from featurizer.featurizer_utils.featurizer_utils import merge_blocks
+from featurizer.featurizer_utils.featurizer_utils import merge_blocks, run_feature_batch, run_feature_stream
 from featurizer.sql.db_actor import get_db_actor
 from common.pandas import df_utils
-from common.streamz.stream_utils import run_named_events_stream
-from common.pandas.df_utils import is_ts_sorted, concat, sub_df_ts, prefix_cols
+from common.pandas.df_utils import is_ts_sorted, concat, sub_df_ts
 from featurizer.sql.models.feature_block_metadata import FeatureBlockMetadata
+from featurizer.storage.data_store_adapter.block_format import BlockFormat, BLOCK_FORMAT_EXTRAS_KEY, \
+    block_format_from_extras
 from featurizer.storage.data_store_adapter.data_store_adapter import DataStoreAdapter
 
 
@@ -51,65 +51,133 @@ def bind_and_cache(
     return node
 
 
-def _get_from_cache(context: Dict[str, Any]) -> Tuple[Optional[pd.DataFrame], bool]:
-    cache_actor = get_cache_actor()
+_max_node_memory: Optional[float] = None
 
-    # this call decreases obj ref counter
-    obj_ref, should_cache = ray.get(cache_actor.check_cache.remote(context))
-    if obj_ref is None:
-        return None, should_cache
-    try:
-        return ray.get(obj_ref), should_cache
-    except Exception as e:
-        # we may have ownership problems
-        print(f'Unable to get cached obj by ref: {e}')
-        return None, should_cache
 
+# largest memory any single node can provide, requests above it would make tasks unschedulable
+def _get_max_node_memory() -> Optional[float]:
+    global _max_node_memory
+    if _max_node_memory is None and ray.is_initialized():
+        node_memory = [node['Resources'].get('memory', 0) for node in ray.nodes() if node.get('Alive', False)]
+        if len(node_memory) > 0:
+            _max_node_memory = max(node_memory)
+    return _max_node_memory
 
-# TODO cache task ref rather than obj itself so we dont't wait for it to be ready and avoid re-calculating same task
-def _cache(obj: Any, context: Dict[str, Any]):
-    cache_actor = get_cache_actor()
-    obj_ref = ray.put(obj, _owner=cache_actor)
-    # pass obj_ref wrapped in list to avoid de-referencing
-    ray.get(cache_actor.cache_obj_ref.remote([obj_ref], context))
-    print('Cached obj')
 
+# Ray memory resource request for estimated heap memory, capped by node memory, None if estimate is unknown
+def memory_request(memory: float) -> Optional[int]:
+    if memory <= 0:
+        return None
+    max_memory = _get_max_node_memory()
+    if max_memory is not None:
+        memory = min(memory, max_memory)
+    return int(memory)
 
-@ray.remote(num_cpus=0.001)
-def load_if_needed(
+
+# reserves estimated heap memory for the task via Ray's memory resource, no-op if estimate is unknown
+def with_memory(func: ray.remote_function.RemoteFunction, memory: float) -> ray.remote_function.RemoteFunction:
+    memory = memory_request(memory)
+    if memory is None:
+        return func
+    return func.options(memory=memory)
+
+
+# Blocks consumed by multiple nodes are computed once through the cache actor, which submits the task and caches its ref.
+# If block has a single consumer left it is computed in the calling task, or in a separate remote_func task if
+# local_func is None (e.g. so memory is reserved for the computation rather than for the calling task)
+def _get_or_compute(
     context: Dict[str, Any],
+    remote_func: ray.remote_function.RemoteFunction,
+    local_func,
+    memory: Optional[int] = None,
+    **kwargs
+) -> Block:
+    cache_actor = get_cache_actor()
+    # this call decreases consumers counter
+    obj_ref, is_new = ray.get(cache_actor.get_or_submit.remote(context, remote_func, kwargs, memory))
+    if obj_ref is None:
+        if local_func is not None:
+            return local_func(**kwargs)
+        func = remote_func if memory is None else remote_func.options(memory=memory)
+        return ray.get(func.remote(**kwargs))
+    df = ray.get(obj_ref[0])
+    if is_new:
+        cache_actor.record_size.remote(context, int(df.memory_usage(index=True, deep=True).sum()))
+    return df
+
+
+def _load_block(
     data_store_adapter: DataStoreAdapter,
     path: str,
     is_feature: bool = False,
+    block_format: Optional[BlockFormat] = None,
+    columns: Optional[List[str]] = None
 ) -> Block:
     s = 'feature' if is_feature else 'data'
-    df, should_cache = _get_from_cache(context)
-    if df is not None:
-        print(f'[Cached] Loading {s} block started')
-        return df
     print(f'Loading {s} block started')
     t = time.time()
-    df = data_store_adapter.load_df(path)
+    df = data_store_adapter.load_df(path, block_format=block_format, columns=columns)
     if not is_ts_sorted(df):
         raise ValueError('[Data] df is not ts sorted')
-    if should_cache:
-        _cache(df, context)
     print(f'Loading {s} block finished {time.time() - t}s')
     return df
 
 
+_load_block_remote = ray.remote(num_cpus=0.001)(_load_block)
+
+
+@ray.remote(num_cpus=0.001)
+def load_if_needed(
+    context: Dict[str, Any],
+    data_store_adapter: DataStoreAdapter,
+    path: str,
+    is_feature: bool = False,
+    block_format: Optional[BlockFormat] = None,
+    columns: Optional[List[str]] = None
+) -> Block:
+    return _get_or_compute(
+        context, _load_block_remote, _load_block,
+        data_store_adapter=data_store_adapter, path=path, is_feature=is_feature, block_format=block_format,
+        columns=columns
+    )
+
+
 @ray.remote(num_cpus=0.9)
 def preprocess_data_block(
     block: Block,
-    data_def: Type[DataSourceDefinition]
+    data_def: Type[DataSourceDefinition],
+    block_key: Optional[str] = None
 ) -> Block:
-    # TODO similar caching to load_if_needed ?
     t = time.time()
-    res = data_def.preprocess(block)
+    res = data_def.preprocess(block, block_key)
     print(f'[{data_def}] Preprocessing data block finished {time.time() - t}s')
     return res
 
 
+def _load_and_preprocess(
+    path: str,
+    data_def: Type[DataSourceDefinition],
+    data_store_adapter: DataStoreAdapter,
+    is_feature: bool = False,
+    block_key: Optional[str] = None,
+    block_format: Optional[BlockFormat] = None,
+    columns: Optional[List[str]] = None
+) -> Block:
+    # preprocessed block is cached locally, no need to load raw block
+    if block_key is not None and data_def.needs_preprocessing():
+        preproc_block = data_def.get_preprocessed_from_cache(block_key)
+        if preproc_block is not None:
+            return preproc_block
+    block = ray.get(_load_block_remote.remote(data_store_adapter=data_store_adapter, path=path, is_feature=is_feature, block_format=block_format, columns=columns))
+    if not data_def.needs_preprocessing():
+        return block
+    preproc_block = ray.get(preprocess_data_block.remote(block=block, data_def=data_def, block_key=block_key))
+    return preproc_block
+
+
+_load_and_preprocess_remote = ray.remote(num_cpus=0.001)(_load_and_preprocess)
+
+
 @ray.remote(num_cpus=0.001)
 def load_and_preprocess(
     context: Dict[str, Any],
@@ -117,10 +185,15 @@ def load_and_preprocess(
     data_def: Type[DataSourceDefinition],
     data_store_adapter: DataStoreAdapter,
     is_feature: bool = False,
+    block_key: Optional[str] = None,
+    block_format: Optional[BlockFormat] = None,
+    columns: Optional[List[str]] = None
 ) -> Block:
-    block = ray.get(load_if_needed.remote(context=context, data_store_adapter=data_store_adapter, path=path, is_feature=is_feature))
-    preproc_block = ray.get(preprocess_data_block.remote(block=block, data_def=data_def))
-    return preproc_block
+    return _get_or_compute(
+        context, _load_and_preprocess_remote, _load_and_preprocess,
+        path=path, data_def=data_def, data_store_adapter=data_store_adapter, is_feature=is_feature, block_key=block_key,
+        block_format=block_format, columns=columns
+    )
 
 
 @ray.remote(num_cpus=0.9)
@@ -146,19 +219,13 @@ def gen_synth_events(
 # https://github.com/topics/discrete-event-simulation?l=python&o=desc&s=forks
 # https://docs.python.org/3/library/tkinter.html
 # TODO this should be in Feature class ?
-@ray.remote(num_cpus=0.9)
-def calculate_feature(
-    context: Dict[str, Any],
+def _calculate_feature(
     feature: Feature,
     dep_refs: Dict[Feature, List[ObjectRef[Block]]],
     interval: Interval,
     data_store_adapter: DataStoreAdapter,
     store: bool
 ) -> Block:
-    df, should_cache = _get_from_cache(context)
-    if df is not None:
-        print(f'[{feature}][Cached] Calc feature finished')
-        return df
     print(f'[{feature}] Calc feature block started')
     # TODO add mem tracking
     # this loads blocks for all dep features from shared object store to workers heap
@@ -175,30 +242,15 @@ def calculate_feature(
         deps[dep_feature] = dep_blocks
         start = start + len(dep_block_refs[i])
     t = time.time()
-    merged = merge_blocks(deps)
-    print(f'[{feature}] Merged in {time.time() - t}s')
-
-    # TODO use construct_stream_tree in Feature class
-    # construct upstreams
-    upstreams = {dep_feature: Stream() for dep_feature in deps.keys()}
-
-    # TODO unify feature_definition.stream return type
-    s = feature.data_definition.stream(upstreams, feature.params)
-    if isinstance(s, Tuple):
-        out_stream = s[0]
-        state = s[1]
+    if feature.data_definition.has_batch():
+        df = run_feature_batch(feature, deps, interval)
+        print(f'[{feature}] Batch run in {time.time() - t}s')
     else:
-        out_stream = s
-
-    t = time.time()
-    df = run_named_events_stream(merged, upstreams, out_stream, interval)
-
-    print(f'[{feature}] Events run in {time.time() - t}s')
+        df = run_feature_stream(feature, deps, interval)
+        print(f'[{feature}] Events run in {time.time() - t}s')
 
     if not is_ts_sorted(df):
         raise ValueError('[Feature] df is not ts sorted')
-    if should_cache:
-        _cache(df, context)
     print(f'[{feature}] Calc feature block finished {time.time() - t}s')
     if store:
         # TODO make a separate actor pool for S3 IO and batchify store operation
@@ -208,7 +260,8 @@ def calculate_feature(
         exists = ray.get(db_actor.feature_block_exists.remote(metadata_item))
         if not exists:
             # TODO this will block, we need to asyncify, using IO actor pool mentioned above?
-            data_store_adapter.store_df(metadata_item.path, df)
+            block_format = block_format_from_extras(metadata_item.extras)
+            data_store_adapter.store_df(metadata_item.path, df, block_format=block_format)
             write_res = ray.get(db_actor.store_block_metadata_batch.remote([metadata_item]))
             print(f'[{feature}] Store feature block finished {time.time() - t}s')
         else:
@@ -217,7 +270,33 @@ def calculate_feature(
     return df
 
 
-# TODO set memory consumption
+_calculate_feature_remote = ray.remote(num_cpus=0.9)(_calculate_feature)
+
+
+# feature is always calculated in a separate task which reserves memory (estimated from deps size, see memory_request),
+# this task only resolves the cached ref and waits on it
+@ray.remote(num_cpus=0.001)
+def calculate_feature(
+    context: Dict[str, Any],
+    feature: Feature,
+    dep_refs: Dict[Feature, List[ObjectRef[Block]]],
+    interval: Interval,
+    data_store_adapter: DataStoreAdapter,
+    store: bool,
+    memory: Optional[int] = None
+) -> Block:
+    return _get_or_compute(
+        context, _calculate_feature_remote, None, memory=memory,
+        feature=feature, dep_refs=dep_refs, interval=interval, data_store_adapter=data_store_adapter, store=store
+    )
+
+
+# last row of a block, the join only needs it from previous block to fill values preceding the current block
+@ray.remote
+def block_tail(block: Block) -> Block:
+    return block.tail(1)
+
+
 # TODO move to tasks?
 @ray.remote
 def point_in_time_join_block(
@@ -227,36 +306,30 @@ def point_in_time_join_block(
     label_feature: Optional[Feature],
     result_owner: Optional[ray.actor.ActorHandle] = None
 ) -> ObjectRef[pd.DataFrame]: # TODO is it the same as pd.DataFrame
-    # TODO this loads all dfs at once,
-    # TODO can we do it iteratively so gc has time to collect old dfs to reduce mem footprint? (tradeoff speed/memory)
     print('Join started')
-    concated = {}
-    for feature in blocks_refs_per_feature:
-        block_refs = [prev_block_ref_per_feature[feature]] if feature in prev_block_ref_per_feature else []
-        block_refs.append(blocks_refs_per_feature[feature])
-
-        # TODO have single ray.get
-        blocks = ray.get(block_refs)
-        concated[feature] = concat(blocks)
-
+    # make sure label is first so that we can use it's ts as join keys, result blocks and features are in same order
+    features = list(blocks_refs_per_feature.keys())
     if label_feature is not None:
-        dfs = [prefix_cols(concated[label_feature], str(label_feature))] # make sure label is first so that we can use it's ts as join keys
-    else:
-        dfs = []
-
-    # make result blocks and features same order
-    for feature in concated:
-        if label_feature is not None and feature == label_feature:
-            # it's already there
-            continue
-        dfs.append(prefix_cols(concated[feature], str(feature)))
+        features.remove(label_feature)
+        features.insert(0, label_feature)
+
+    prev_features = [feature for feature in features if feature in prev_block_ref_per_feature]
+    refs = [blocks_refs_per_feature[feature] for feature in features] + \
+        [prev_block_ref_per_feature[feature] for feature in prev_features]
+    blocks = ray.get(refs)
+    prev_blocks = dict(zip(prev_features, blocks[len(features):]))
+
+    sources = []
+    for feature, block in zip(features, blocks):
+        prev_tail = prev_blocks.get(feature)
+        if prev_tail is not None:
+            # prev ref may be a whole block if graph was not built with block_tail
+            prev_tail = prev_tail.tail(1)
+        sources.append((block, prev_tail, str(feature)))
 
     t = time.time()
-    merged = merge_asof_multi(dfs)
-
-    print(f'Join finished, merged {len(dfs)} blocks in {time.time() - t}s')
-    res = sub_df_ts(merged, interval.lower, interval.upper)
-    # return res
+    res = point_in_time_join(sources, interval.lower, interval.upper)
+    print(f'Join finished, merged {len(sources)} blocks in {time.time() - t}s')
     if result_owner is not None:
         ref = ray.put(res, _owner=result_owner)
     else:
@@ -312,6 +385,8 @@ def make_feature_block_metadata(feature: Feature, df: pd.DataFrame, interval: In
     })
     df_hash = df_utils.hash_df(df)
     metadata_params[FeatureBlockMetadata.hash.name] = df_hash
+    block_format = data_store_adapter.block_format(feature.data_definition.__name__, feature.key)
+    metadata_params[FeatureBlockMetadata.extras.name] = {BLOCK_FORMAT_EXTRAS_KEY: block_format.to_dict()}
 
     res = FeatureBlockMetadata(**metadata_params)
     if res.path is None:
@@ -0,0 +1,109 @@
+import time
+import unittest
+from typing import Optional
+
+import ray
+from portion import closed
+
+from featurizer.task_graph.executor import DagScheduler, execute_flattened_nodes, _Task, dag_memory
+from featurizer.task_graph.tasks import with_memory
+
+
+@ray.remote
+def _mock_load(i: int) -> int:
+    time.sleep(0.01)
+    return i
+
+
+@ray.remote
+def _mock_join(a: int, b: int, memory: Optional[int] = None) -> int:
+    return a + b
+
+
+class _RecordingScheduler(DagScheduler):
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.max_in_flight = 0
+        self.max_used_memory = 0
+
+    def _submit(self, task: _Task):
+        super()._submit(task)
+        self.max_in_flight = max(self.max_in_flight, len(self.in_flight))
+        self.max_used_memory = max(self.max_used_memory, self.used_memory)
+
+
+class TestExecutor(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        ray.init(num_cpus=2, include_dashboard=False, log_to_driver=False, ignore_reinit_error=True)
+
+    @classmethod
+    def tearDownClass(cls):
+        ray.shutdown()
+
+    def _mock_nodes(self, num_nodes: int):
+        return [(closed(i, i + 1), _mock_join.bind(_mock_load.bind(i), _mock_load.bind(i))) for i in range(num_nodes)]
+
+    def test_execute_flattened_nodes(self):
+        nodes = self._mock_nodes(20)
+        res = execute_flattened_nodes(nodes)
+        assert list(res.keys()) == [key for key, _ in nodes]
+        assert [ray.get(refs[0]) for refs in res.values()] == [2 * i for i in range(20)]
+
+    def test_budgets(self):
+        scheduler = _RecordingScheduler(cpu_budget=3, memory_budget=float('inf'))
+        scheduler.run(self._mock_nodes(10))
+        assert scheduler.max_in_flight == 3
+        assert scheduler.stats.num_finished == 10
+
+        scheduler = _RecordingScheduler(cpu_budget=100, memory_budget=250)
+        tasks = [_Task(key=key, node=node, position=i, memory=100) for i, (key, node) in enumerate(self._mock_nodes(10))]
+        res = scheduler.run_tasks(tasks)
+        assert len(res) == 10
+        assert scheduler.max_in_flight == 2
+        assert scheduler.max_used_memory == 200
+
+        # oversized task is still executed when nothing else is running
+        scheduler = _RecordingScheduler(cpu_budget=100, memory_budget=50)
+        tasks = [_Task(key=key, node=node, position=i, memory=100) for i, (key, node) in enumerate(self._mock_nodes(3))]
+        assert len(scheduler.run_tasks(tasks)) == 3
+        assert scheduler.max_in_flight == 1
+
+    def test_dag_memory(self):
+        load = with_memory(_mock_load, 100)
+        shared = load.bind(0)
+        node = with_memory(_mock_join, 1000).bind(shared, with_memory(_mock_join, 10).bind(shared, load.bind(1)))
+        assert dag_memory(node) == 1000 + 10 + 100 + 100
+        assert dag_memory(_mock_load.bind(0)) == 0
+        assert with_memory(_mock_load, 0) is _mock_load
+        # memory reserved by the task a node submits
+        assert dag_memory(_mock_join.bind(shared, memory=50)) == 50 + 100
+        scheduler = _RecordingScheduler(cpu_budget=100, memory_budget=1500)
+        scheduler.run([(closed(i, i + 1), node) for i in range(3)])
+        assert scheduler.max_used_memory == 1210
+
+    def test_dag_memory_shared_between_roots(self):
+        load = with_memory(_mock_load, 100)
+        join = with_memory(_mock_join, 10)
+        shared = load.bind(0)
+        roots = [join.bind(shared, load.bind(i)) for i in range(1, 4)]
+        visited = set()
+        assert [dag_memory(root, visited) for root in roots] == [210, 110, 110]
+
+        scheduler = _RecordingScheduler(cpu_budget=100, memory_budget=1000)
+        res = scheduler.run([(closed(i, i + 1), root) for i, root in enumerate(roots)])
+        assert [ray.get(refs[0]) for refs in res.values()] == [1, 2, 3]
+        assert scheduler.max_in_flight == 3
+        assert scheduler.max_used_memory == 210 + 110 + 110
+
+
+if __name__ == '__main__':
+    t = TestExecutor()
+    TestExecutor.setUpClass()
+    t.test_execute_flattened_nodes()
+    t.test_budgets()
+    t.test_dag_memory()
+    t.test_dag_memory_shared_between_roots()
+    TestExecutor.tearDownClass()
@@ -0,0 +1,64 @@
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+from portion import closed
+
+from featurizer.features.definitions.tvi.trade_volume_imb_fd.trade_volume_imb_fd import TradeVolumeImbFD
+from featurizer.perf.task_graph_benchmark import build_features, mock_data_ranges_meta
+from featurizer.task_graph.builder import build_feature_set_task_graph, point_in_time_join_dag
+from featurizer.task_graph.range_plan import plan_feature_set_ranges, load_or_plan_feature_set_ranges, \
+    range_plans_key
+
+
+class TestRangePlan(unittest.TestCase):
+
+    def test_shared_subtree_planned_once(self):
+        features = build_features(3)
+        tvi = features[0]
+        data_ranges_meta = mock_data_ranges_meta(features, 10)
+        with mock.patch.object(TradeVolumeImbFD, 'group_dep_ranges', wraps=TradeVolumeImbFD.group_dep_ranges) as group_dep_ranges:
+            plans = plan_feature_set_ranges(features, data_ranges_meta)
+            self.assertEqual(group_dep_ranges.call_count, 1)
+        self.assertEqual(set(plans.keys()), {f.key for f in features})
+
+        # diff with 2m window depends on current and 2 prev tvi blocks
+        diff_blocks = list(plans[features[2].key].ranges.values())[0]
+        self.assertEqual(diff_blocks[closed(180, 239.9)][tvi.key], [closed(180, 239.9), closed(120, 179.9), closed(60, 119.9)])
+
+        cache = {}
+        dag = build_feature_set_task_graph(features, data_ranges_meta, cache)
+        range_interval = list(dag[tvi].keys())[0]
+        self.assertEqual(len(dag[tvi][range_interval]), 10)
+        # shared tvi nodes are bound for each feature tree, same as before plans were memoized
+        self.assertEqual(cache[tvi.key][closed(0, 59.9)][0], 3)
+
+        joined = point_in_time_join_dag(dag, features, None)
+        self.assertEqual(len(joined[range_interval]), 10)
+
+    def test_persisted_plans(self):
+        features = build_features(2)
+        data_ranges_meta = mock_data_ranges_meta(features, 10)
+        with tempfile.TemporaryDirectory() as plans_dir:
+            plans = load_or_plan_feature_set_ranges(features, data_ranges_meta, plans_dir)
+            path = os.path.join(plans_dir, f'{range_plans_key(features, data_ranges_meta)}.pkl')
+            self.assertTrue(os.path.isfile(path))
+            with mock.patch('featurizer.task_graph.range_plan.plan_feature_set_ranges') as plan:
+                self.assertEqual(load_or_plan_feature_set_ranges(features, data_ranges_meta, plans_dir), plans)
+                plan.assert_not_called()
+            # different dates are planned separately
+            other_key = range_plans_key(features, mock_data_ranges_meta(features, 11))
+            self.assertNotEqual(other_key, range_plans_key(features, data_ranges_meta))
+            # changed definition or plan format invalidates persisted plans
+            key = range_plans_key(features, data_ranges_meta)
+            with mock.patch.object(TradeVolumeImbFD, 'version', return_value='2'):
+                self.assertNotEqual(range_plans_key(features, data_ranges_meta), key)
+            with mock.patch('featurizer.task_graph.range_plan.RANGE_PLAN_FORMAT_VERSION', '2'):
+                self.assertNotEqual(range_plans_key(features, data_ranges_meta), key)
+
+
+if __name__ == '__main__':
+    t = TestRangePlan()
+    t.test_shared_subtree_planned_once()
+    t.test_persisted_plans()
@@ -99,10 +99,8 @@ class TestFeaturizerTaskGraph(unittest.TestCase):
         merged_events = merge_blocks({data: [df]})
         online_res = common.streamz.stream_utils.run_named_events_stream(merged_events, sources, stream)
         print(online_res)
-        print(online_res['asks'].iloc[1000])
-        print(len(online_res['asks'].iloc[1000]))
-        print(online_res['bids'].iloc[1000])
-        print(len(online_res['bids'].iloc[1000]))
+        print(online_res[[c for c in online_res.columns if c.startswith('ask_')]].iloc[1000])
+        print(online_res[[c for c in online_res.columns if c.startswith('bid_')]].iloc[1000])
 
 
     def test_cryptotick_midprice_feature_offline(self):